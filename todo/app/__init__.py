@@ -3,18 +3,43 @@
 import logging
 import os
 from config import config as Config
-from flask import Flask, render_template, request
-from flask_compress import Compress
+from flask import Flask, Response, render_template, request
 from flask_cors import CORS
 from flask_login import LoginManager
 from flask_sqlalchemy import SQLAlchemy
 from flask_wtf import CSRFProtect
 
+from .admission import AdmissionControl
+from .assets import StaticAssets
+from .availability import AvailabilityFilter
+from .compression import AdaptiveCompress
+from .group_commit import GroupCommit
+from .idempotency import Idempotency
+from .prepared import PreparedStatements
+from .profiling import RequestProfiler
+from .sharding import TaskShardRouter
+from .shells import PageShells
+from .templating import init_templating
+from .tokens import SignedTokens
+from .tracing import Tracing
+from .warmup import init_warmup
+
 # Initialize core extensions
 db = SQLAlchemy()
 csrf = CSRFProtect()
-compress = Compress()
+compress = AdaptiveCompress()
 login_manager = LoginManager()
+assets = StaticAssets()
+task_shards = TaskShardRouter()
+group_commit = GroupCommit()
+admission = AdmissionControl()
+idempotency = Idempotency()
+profiler = RequestProfiler()
+tracing = Tracing()
+prepared_statements = PreparedStatements()
+availability = AvailabilityFilter()
+page_shells = PageShells()
+tokens = SignedTokens()
 
 # Set up Flask-Login
 login_manager.session_protection = "secure"
@@ -45,29 +70,55 @@ def create_app(config_name: str = None) -> Flask:
     # Register error handlers
     register_error_handlers(app)
 
+    # Set up template caching
+    init_templating(app)
+
+    # Warm-up settings; the serving entry points run it (`app.warmup.warm_up`)
+    init_warmup(app)
+
     return app
 
 def initialize_extensions(app: Flask) -> None:
     """Initialize Flask extensions."""
     db.init_app(app)
+    prepared_statements.init_app(app)
+    # Opens the request's trace before the other hooks run
+    tracing.init_app(app)
     login_manager.init_app(app)
     csrf.init_app(app)
     compress.init_app(app)
+    assets.init_app(app)
+    task_shards.init_app(app)
+    group_commit.init_app(app)
+    idempotency.init_app(app)
+    availability.init_app(app)
+    page_shells.init_app(app)
+    tokens.init_app(app)
+    profiler.init_app(app)
     CORS(app, resources={r"/*": {"origins": app.config["ALLOWED_ORIGINS"]}})
+    # Wraps the WSGI app, so it goes last
+    admission.init_app(app)
 
 
 def register_blueprints(app: Flask) -> None:
     """Register Flask blueprints."""
     from .blueprints.account import account as accounts
+    from .blueprints.admin import admin
     from .blueprints.tasks import tasks
     blueprints = [
         (accounts, "/user"),
         (tasks, "/tasks"),
+        (admin, "/admin"),
     ]
 
     for blueprint, url_prefix in blueprints:
         app.register_blueprint(blueprint, url_prefix=url_prefix)
 
+    @app.route("/healthz")
+    def healthz():
+        """Liveness for load balancers: answers without touching the database or the session."""
+        return Response("ok\n", mimetype="text/plain")
+
 def register_error_handlers(app: Flask) -> None:
     """Register error handlers for the Flask app."""
     @app.errorhandler(403)
@@ -0,0 +1,266 @@
+import heapq
+import itertools
+import logging
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional
+
+from flask import Flask
+from sqlalchemy.pool import QueuePool
+from werkzeug.exceptions import HTTPException
+from werkzeug.wrappers import Response
+from werkzeug.wsgi import ClosingIterator
+
+# Logger configuration
+logger = logging.getLogger(__name__)
+
+# Admission priorities, most important first. Critical requests are never
+# queued or shed.
+CRITICAL, HIGH, NORMAL, LOW = "critical", "high", "normal", "low"
+_PRIORITY_ORDER = {CRITICAL: 0, HIGH: 1, NORMAL: 2, LOW: 3}
+
+DEFAULT_ADMISSION_PRIORITIES: Dict[str, str] = {
+    "static": CRITICAL,
+    # Shedding health checks would take an overloaded worker out of rotation
+    "healthz": CRITICAL,
+    "account.login": HIGH,
+    "account.logout": HIGH,
+    "tasks.export_tasks": LOW,
+}
+
+# How long queued requests of each priority may wait for a slot, in ms
+DEFAULT_ADMISSION_QUEUE_TIMEOUTS_MS: Dict[str, float] = {HIGH: 1000, NORMAL: 500, LOW: 100}
+
+
+class PoolWaitTracker(object):
+    """Connection pool checkout waits over a sliding window, per worker."""
+
+    def __init__(self, window: float = 2.0):
+        self.window = window
+        self._samples: "deque[tuple]" = deque()
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float) -> None:
+        now = time.monotonic()
+        with self._lock:
+            self._samples.append((now, seconds))
+            self._trim(now)
+
+    def mean(self) -> float:
+        with self._lock:
+            self._trim(time.monotonic())
+            if not self._samples:
+                return 0.0
+            return sum(wait for _, wait in self._samples) / len(self._samples)
+
+    def _trim(self, now: float) -> None:
+        while self._samples and self._samples[0][0] < now - self.window:
+            self._samples.popleft()
+
+
+def track_pool_waits(engine, tracker: PoolWaitTracker) -> bool:
+    """
+    Makes `engine`'s pool report how long each checkout waited.
+
+    The pool's class is swapped for a subclass timing `_do_get`, the hook
+    pool implementations block in, so the timing also survives
+    `engine.dispose()`. Pools that never wait (SQLite's static and
+    per-thread pools) are left alone; returns whether the pool is tracked.
+    """
+    pool = engine.pool
+    if not isinstance(pool, QueuePool) or getattr(pool, "_wait_tracker", None) is not None:
+        return False
+
+    class TimedPool(pool.__class__):
+        _wait_tracker = tracker
+
+        def _do_get(self):
+            started = time.perf_counter()
+            try:
+                return super()._do_get()
+            finally:
+                self._wait_tracker.record(time.perf_counter() - started)
+
+    TimedPool.__name__ = f"Timed{pool.__class__.__name__}"
+    pool.__class__ = TimedPool
+    return True
+
+
+class Overloaded(Exception):
+    """Raised when a request is refused a slot."""
+
+
+class _Waiter(object):
+    __slots__ = ("rank", "event", "admitted", "shed")
+
+    def __init__(self, rank: int):
+        self.rank = rank
+        self.event = threading.Event()
+        self.admitted = False
+        self.shed = False
+
+
+class AdmissionController(object):
+    """
+    Caps concurrent requests per worker and queues the overflow.
+
+    Up to `max_in_flight` requests run at once; while recent pool waits
+    average more than `max_pool_wait` seconds the cap drops by
+    `congested_fraction`, so fewer requests compete for a slow database.
+    Up to `queue_size` more wait, best priority first, each until its
+    deadline. When the queue is full a newcomer displaces the worst-placed
+    waiter of lower priority, or is refused at once.
+    """
+
+    def __init__(self, max_in_flight: int, queue_size: int, max_pool_wait: float,
+                 congested_fraction: float = 0.5, pool_waits: Optional[PoolWaitTracker] = None):
+        self.max_in_flight = max_in_flight
+        self.queue_size = queue_size
+        self.max_pool_wait = max_pool_wait
+        self.congested_fraction = congested_fraction
+        self.pool_waits = pool_waits or PoolWaitTracker()
+        self.in_flight = 0
+        self._queue: list = []
+        self._sequence = itertools.count()
+        self._lock = threading.Lock()
+        self.stats = dict.fromkeys(("admitted", "queued", "rejected", "timed_out", "shed"), 0)
+
+    @property
+    def limit(self) -> int:
+        if self.max_pool_wait and self.pool_waits.mean() > self.max_pool_wait:
+            return max(1, int(self.max_in_flight * self.congested_fraction))
+        return self.max_in_flight
+
+    def acquire(self, priority: str, timeout: float) -> None:
+        """Takes a slot, waiting up to `timeout` seconds; raises Overloaded otherwise."""
+        if priority == CRITICAL:
+            with self._lock:
+                self.in_flight += 1
+            return
+        waiter = _Waiter(_PRIORITY_ORDER[priority])
+        with self._lock:
+            if not self._queue and self.in_flight < self.limit:
+                self.in_flight += 1
+                self.stats["admitted"] += 1
+                return
+            if len(self._queue) >= self.queue_size and not self._shed_for(waiter):
+                self.stats["rejected"] += 1
+                raise Overloaded()
+            heapq.heappush(self._queue, (waiter.rank, next(self._sequence), waiter))
+            self.stats["queued"] += 1
+            # The cap may have risen since the last release
+            self._admit_waiters()
+
+        waiter.event.wait(timeout)
+        with self._lock:
+            if waiter.admitted:
+                self.stats["admitted"] += 1
+                return
+            if not waiter.shed:
+                self._queue = [entry for entry in self._queue if entry[2] is not waiter]
+                heapq.heapify(self._queue)
+                self.stats["timed_out"] += 1
+        raise Overloaded()
+
+    def release(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+            self._admit_waiters()
+
+    def _admit_waiters(self) -> None:
+        while self._queue and self.in_flight < self.limit:
+            _, _, waiter = heapq.heappop(self._queue)
+            waiter.admitted = True
+            self.in_flight += 1
+            waiter.event.set()
+
+    def _shed_for(self, newcomer: _Waiter) -> bool:
+        # Drop the most recent of the least important waiters, if it ranks below the newcomer
+        if not self._queue:
+            return False
+        worst = max(self._queue, key=lambda entry: (entry[0], entry[1]))
+        if worst[0] <= newcomer.rank:
+            return False
+        self._queue.remove(worst)
+        heapq.heapify(self._queue)
+        worst[2].shed = True
+        worst[2].event.set()
+        self.stats["shed"] += 1
+        return True
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            data = dict(self.stats)
+            data.update(in_flight=self.in_flight, queued_now=len(self._queue), limit=self.limit)
+        data["pool_wait_ms"] = round(self.pool_waits.mean() * 1000, 3)
+        return data
+
+
+class AdmissionMiddleware(object):
+    """WSGI middleware admitting requests through an `AdmissionController`."""
+
+    def __init__(self, app: Flask, wsgi_app, controller: AdmissionController):
+        self.app = app
+        self.wsgi_app = wsgi_app
+        self.controller = controller
+
+    def _priority(self, environ) -> str:
+        try:
+            endpoint, _ = self.app.url_map.bind_to_environ(environ).match()
+        except HTTPException:
+            return NORMAL
+        return self.app.config["ADMISSION_PRIORITIES"].get(endpoint, NORMAL)
+
+    def __call__(self, environ, start_response):
+        priority = self._priority(environ)
+        timeout = self.app.config["ADMISSION_QUEUE_TIMEOUTS_MS"].get(priority, 0) / 1000.0
+        try:
+            self.controller.acquire(priority, timeout)
+        except Overloaded:
+            response = Response(
+                "The service is overloaded, please retry shortly.\n",
+                status=503,
+                mimetype="text/plain",
+                headers={"Retry-After": str(self.app.config["ADMISSION_RETRY_AFTER"])},
+            )
+            return response(environ, start_response)
+        try:
+            app_iter = self.wsgi_app(environ, start_response)
+        except BaseException:
+            self.controller.release()
+            raise
+        # Hold the slot until the body is sent, which matters for streamed exports
+        return ClosingIterator(app_iter, [self.controller.release])
+
+
+class AdmissionControl(object):
+    """Flask extension installing `AdmissionMiddleware` when `ADMISSION_CONTROL` is on."""
+
+    def __init__(self, app: Optional[Flask] = None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        app.config.setdefault("ADMISSION_CONTROL", False)
+        app.config.setdefault("ADMISSION_MAX_IN_FLIGHT", 64)
+        app.config.setdefault("ADMISSION_QUEUE_SIZE", 128)
+        app.config.setdefault("ADMISSION_MAX_POOL_WAIT_MS", 100)
+        app.config.setdefault("ADMISSION_RETRY_AFTER", 1)
+        app.config.setdefault("ADMISSION_PRIORITIES", DEFAULT_ADMISSION_PRIORITIES)
+        app.config.setdefault("ADMISSION_QUEUE_TIMEOUTS_MS", DEFAULT_ADMISSION_QUEUE_TIMEOUTS_MS)
+        if not app.config["ADMISSION_CONTROL"]:
+            return
+
+        controller = AdmissionController(
+            app.config["ADMISSION_MAX_IN_FLIGHT"],
+            app.config["ADMISSION_QUEUE_SIZE"],
+            app.config["ADMISSION_MAX_POOL_WAIT_MS"] / 1000.0,
+        )
+        from app import db
+
+        with app.app_context():
+            for engine in db.engines.values():
+                track_pool_waits(engine, controller.pool_waits)
+        app.extensions["admission"] = controller
+        app.wsgi_app = AdmissionMiddleware(app, app.wsgi_app, controller)
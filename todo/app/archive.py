@@ -0,0 +1,451 @@
+import functools
+import gzip
+import json
+import logging
+import os
+from datetime import date, datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import and_, delete, func, select, text, tuple_
+from sqlalchemy.engine import Engine
+
+from .partitioning import (DEFAULT_PARTITION, TASK_TABLE, add_months, is_partitioned, month_start, partition_name,
+                           partitions, supports_partitioning)
+
+# Logger configuration
+logger = logging.getLogger(__name__)
+
+ARCHIVE_SCHEMA = "archive"
+
+# The task columns kept in the archive, in `TaskRow` order
+_ARCHIVED_COLUMNS = ("id", "content", "date_posted", "due_at", "remind_at", "rank")
+_DATETIME_COLUMNS = ("date_posted", "due_at", "remind_at")
+
+
+def _tables():
+    from app import task_shards
+
+    tables = task_shards.shard_metadata().tables
+    return tables["task"], tables["task_tags"]
+
+
+def _month_filter(table, month: date):
+    return and_(table.c.date_posted >= month, table.c.date_posted < add_months(month, 1))
+
+
+def _partitioned(engine: Engine) -> bool:
+    if not supports_partitioning(engine):
+        return False
+    with engine.connect() as conn:
+        return is_partitioned(conn)
+
+
+def _attached(engine: Engine, name: str) -> bool:
+    with engine.connect() as conn:
+        return conn.execute(text("SELECT to_regclass(:name) IS NOT NULL"), {"name": name}).scalar()
+
+
+def archivable_months(engine: Engine, cutoff: date) -> List[date]:
+    """Months before `cutoff` still holding tasks in `engine`'s task table, oldest first."""
+    if _partitioned(engine):
+        with engine.connect() as conn:
+            months = {month for month in partitions(conn) if month < cutoff}
+            if conn.execute(text("SELECT to_regclass(:name) IS NOT NULL"), {"name": DEFAULT_PARTITION}).scalar():
+                months.update(map(month_start, conn.execute(
+                    text(f"SELECT DISTINCT date_trunc('month', date_posted) FROM {DEFAULT_PARTITION}"
+                         f" WHERE date_posted < :cutoff"),
+                    {"cutoff": cutoff},
+                ).scalars()))
+        return sorted(months)
+    task, _ = _tables()
+    months = []
+    with engine.connect() as conn:
+        oldest = conn.execute(
+            select(task.c.date_posted).where(task.c.date_posted < cutoff).order_by(task.c.date_posted).limit(1)
+        ).scalar()
+        month = month_start(oldest) if oldest else cutoff
+        while month < cutoff:
+            if conn.execute(select(task.c.id).where(_month_filter(task, month)).limit(1)).first():
+                months.append(month)
+            month = add_months(month, 1)
+    return months
+
+
+# Writing archives --------------------------------------------------------------
+
+
+def _serialise(row, tags: List[str]) -> str:
+    data = {name: getattr(row, name) for name in _ARCHIVED_COLUMNS}
+    for name in _DATETIME_COLUMNS:
+        if data[name] is not None:
+            data[name] = data[name].isoformat()
+    data["tags"] = tags
+    return json.dumps(data) + "\n"
+
+
+def _write_file(engine: Engine, month: date, path: str, batch_size: int, skip: Set[int] = frozenset()) -> Set[int]:
+    """
+    Writes the month's tasks, but for the ids in `skip`, as gzipped NDJSON,
+    one gzip member per user, and a `<path>.index.json` of each user's
+    member offset and length, so reading one user back decompresses only
+    their tasks. Returns the ids written.
+    """
+    task, tags = _tables()
+    index: Dict[str, List[int]] = {}
+    written, last = set(), (0, 0)
+    partial = f"{path}.partial"
+    with open(partial, "wb") as out, engine.connect() as conn:
+        user_id, lines = None, []
+
+        def flush():
+            if lines:
+                offset = out.tell()
+                out.write(gzip.compress("".join(lines).encode()))
+                index[str(user_id)] = [offset, out.tell() - offset]
+
+        while True:
+            rows = conn.execute(
+                select(task.c.user_id, *[task.c[name] for name in _ARCHIVED_COLUMNS])
+                .where(_month_filter(task, month), tuple_(task.c.user_id, task.c.id) > tuple_(*last))
+                .order_by(task.c.user_id, task.c.id)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            last = (rows[-1].user_id, rows[-1].id)
+            rows = [row for row in rows if row.id not in skip]
+            names: Dict[int, List[str]] = {}
+            for task_id, tag in conn.execute(
+                select(tags.c.task_id, tags.c.tag)
+                .where(tags.c.task_id.in_([row.id for row in rows]))
+                .order_by(tags.c.task_id, tags.c.tag)
+            ):
+                names.setdefault(task_id, []).append(tag)
+            for row in rows:
+                if row.user_id != user_id:
+                    flush()
+                    user_id, lines = row.user_id, []
+                lines.append(_serialise(row, names.get(row.id, [])))
+            written.update(row.id for row in rows)
+        flush()
+    with open(f"{path}.index.json", "w") as out:
+        json.dump(index, out)
+    # Only a complete file gets the final name
+    os.replace(partial, path)
+    return written
+
+
+def _file_ids(path: str) -> Set[int]:
+    """Ids of the tasks in an archive file, read a member at a time."""
+    ids = set()
+    with open(path, "rb") as archive:
+        for offset, length in _index_for(path).values():
+            archive.seek(offset)
+            ids.update(json.loads(line)["id"] for line in gzip.decompress(archive.read(length)).decode().splitlines())
+    return ids
+
+
+def _remove_month(engine: Engine, month: date, archived: Set[int], batch_size: int) -> bool:
+    """
+    Drops the month's archived tasks from the hot table, and returns whether
+    the month is now empty. Only ids in `archived` go: tasks that arrived
+    after the archive was written, say with a shard move, wait for another
+    file. A partition holding only archived tasks is dropped whole, otherwise
+    tasks are deleted in short chunks.
+    """
+    task, tags = _tables()
+    name = partition_name(month)
+    if _partitioned(engine) and _attached(engine, name):
+        with engine.begin() as conn:
+            # Holds off writes to the partition until it is dropped
+            conn.execute(text(f"LOCK TABLE {name} IN SHARE MODE"))
+            last_id = 0
+            while True:
+                ids = conn.execute(
+                    text(f"SELECT id FROM {name} WHERE id > :last_id ORDER BY id LIMIT :limit"),
+                    {"last_id": last_id, "limit": batch_size},
+                ).scalars().all()
+                if not ids:
+                    break
+                if not archived.issuperset(ids):
+                    return False
+                last_id = ids[-1]
+            conn.execute(text(f"DELETE FROM task_tags USING {name} WHERE task_tags.task_id = {name}.id"))
+            conn.execute(text(f"ALTER TABLE {TASK_TABLE} DETACH PARTITION {name}"))
+            conn.execute(text(f"DROP TABLE {name}"))
+        return True
+    ids = sorted(archived)
+    for start in range(0, len(ids), batch_size):
+        with engine.begin() as conn:
+            chunk = select(task.c.id).where(task.c.id.in_(ids[start:start + batch_size]), _month_filter(task, month))
+            conn.execute(delete(tags).where(tags.c.task_id.in_(chunk)))
+            conn.execute(delete(task).where(task.c.id.in_(ids[start:start + batch_size]), _month_filter(task, month)))
+    with engine.connect() as conn:
+        return conn.execute(select(task.c.id).where(_month_filter(task, month)).limit(1)).first() is None
+
+
+def _move_to_schema(engine: Engine, month: date) -> int:
+    # Detaches the month's partition into the archive schema, its tags alongside
+    name = partition_name(month)
+    archived = f"{ARCHIVE_SCHEMA}.{name}"
+    with engine.begin() as conn:
+        if conn.execute(text("SELECT to_regclass(:name) IS NOT NULL"), {"name": name}).scalar():
+            conn.execute(text(f"CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA}"))
+            conn.execute(text(
+                f"CREATE TABLE {ARCHIVE_SCHEMA}.task_tags_{name} AS"
+                f" SELECT task_tags.* FROM task_tags JOIN {name} ON task_tags.task_id = {name}.id"
+            ))
+            conn.execute(text(f"CREATE INDEX ON {ARCHIVE_SCHEMA}.task_tags_{name} (task_id)"))
+            conn.execute(text(f"DELETE FROM task_tags USING {name} WHERE task_tags.task_id = {name}.id"))
+            conn.execute(text(f"ALTER TABLE {TASK_TABLE} DETACH PARTITION {name}"))
+            conn.execute(text(f"ALTER TABLE {name} SET SCHEMA {ARCHIVE_SCHEMA}"))
+        return conn.execute(text(f"SELECT COUNT(*) FROM {archived}")).scalar()
+
+
+def archive_month(shard: Optional[str], month: date, mode: str, directory: str, batch_size: int = 1000):
+    """
+    Moves one month of tasks on `shard` out of the `task` table and records
+    it in `task_archives`; returns the newest record for the month.
+
+    "file" archives write gzipped NDJSON under `directory` and work on any
+    database; "schema" archives detach the month's Postgres partition into
+    the `archive` schema. Either way the archive is registered before the
+    hot rows go, so rerunning after a crash finishes the job. A file
+    archive only ever deletes the tasks its files hold; tasks posted in an
+    archived month later on get a further file for that month.
+    """
+    from app import db, task_shards
+    from app.models import TaskArchive
+
+    engine = task_shards.engine(shard)
+    if mode == TaskArchive.SCHEMA:
+        archive = TaskArchive.query.filter_by(shard=shard, month=month).first()
+        if not _partitioned(engine):
+            raise ValueError("Schema archives need a partitioned Postgres task table (manage.py partition-tasks).")
+        if archive is None:
+            archive = TaskArchive(shard=shard, month=month, kind=TaskArchive.SCHEMA,
+                                  location=f"{ARCHIVE_SCHEMA}.{partition_name(month)}")
+            db.session.add(archive)
+            db.session.commit()
+        archive.rows = _move_to_schema(engine, month)
+        db.session.commit()
+        return archive
+
+    archives = TaskArchive.query.filter_by(shard=shard, month=month).order_by(TaskArchive.id).all()
+    archived = set()
+    for archive in archives:
+        archived |= _file_ids(archive.location)
+    while not archives or not _remove_month(engine, month, archived, batch_size):
+        os.makedirs(directory, exist_ok=True)
+        # The same name on a rerun, so a file written before a crash is replaced
+        suffix = f".{len(archives)}" if archives else ""
+        path = os.path.join(directory, f"{shard or 'main'}_{partition_name(month)}{suffix}.ndjson.gz")
+        ids = _write_file(engine, month, path, batch_size, skip=archived)
+        if ids or not archives:
+            archive = TaskArchive(shard=shard, month=month, kind=TaskArchive.FILE, location=path, rows=len(ids))
+            db.session.add(archive)
+            db.session.commit()
+            archives.append(archive)
+            archived |= ids
+    logger.info(f"Archived {len(archived)} tasks of {month:%Y-%m} from {shard or 'the main database'}.")
+    return archives[-1]
+
+
+def archive_tasks(cutoff: date, mode: str, directory: str, batch_size: int = 1000) -> List:
+    """Archives every month before `cutoff` on every database; returns the new archives."""
+    from app import task_shards
+
+    archived = []
+    for shard in [None] + (task_shards.ring.nodes if task_shards.enabled else []):
+        for month in archivable_months(task_shards.engine(shard), cutoff):
+            archived.append(archive_month(shard, month, mode, directory, batch_size))
+    return archived
+
+
+# Reading archives back ---------------------------------------------------------
+
+
+@functools.lru_cache(maxsize=64)
+def _file_index(path: str, mtime: float) -> Dict[str, List[int]]:
+    with open(f"{path}.index.json") as index:
+        return json.load(index)
+
+
+def _index_for(path: str) -> Dict[str, List[int]]:
+    # Keyed by mtime, so a rewritten index is read again
+    return _file_index(path, os.path.getmtime(f"{path}.index.json"))
+
+
+def _parse(line: str) -> tuple:
+    data = json.loads(line)
+    for name in _DATETIME_COLUMNS:
+        if data[name] is not None:
+            data[name] = datetime.fromisoformat(data[name])
+    return tuple(data[name] for name in _ARCHIVED_COLUMNS) + (data["tags"],)
+
+
+def _read_file(path: str, user_id: int) -> List[tuple]:
+    entry = _index_for(path).get(str(user_id))
+    if entry is None:
+        return []
+    offset, length = entry
+    with open(path, "rb") as archive:
+        archive.seek(offset)
+        lines = gzip.decompress(archive.read(length)).decode().splitlines()
+    return [_parse(line) for line in lines]
+
+
+def _read_schema(engine: Engine, location: str, user_id: int) -> List[tuple]:
+    schema, name = location.split(".")
+    with engine.connect() as conn:
+        rows = conn.execute(
+            text(f"SELECT {', '.join(_ARCHIVED_COLUMNS)} FROM {location} WHERE user_id = :user_id"),
+            {"user_id": user_id},
+        ).all()
+        names: Dict[int, List[str]] = {}
+        if rows:
+            for task_id, tag in conn.execute(
+                text(f"SELECT task_id, tag FROM {schema}.task_tags_{name}"
+                     f" WHERE user_id = :user_id ORDER BY task_id, tag"),
+                {"user_id": user_id},
+            ):
+                names.setdefault(task_id, []).append(tag)
+    return [tuple(row) + (names.get(row.id, []),) for row in rows]
+
+
+def archived_months(before: Optional[date] = None) -> List[date]:
+    """Archived months, newest first, optionally only those before `before`."""
+    from app import db
+    from app.models import TaskArchive
+
+    query = select(TaskArchive.month).distinct().order_by(TaskArchive.month.desc())
+    if before is not None:
+        query = query.where(TaskArchive.month < before)
+    return db.session.execute(query).scalars().all()
+
+
+def unarchived_months(session, user_id: int, since: date, before: Optional[date] = None) -> List[date]:
+    """
+    Months before `since` (and `before`) still holding the user's tasks in
+    the hot table, newest first: tasks past the cutoff that archive-tasks
+    has not moved yet.
+    """
+    from app.models import Task
+
+    months = []
+    oldest = session.execute(
+        select(func.min(Task.date_posted)).where(Task.user_id == user_id, Task.date_posted < since)
+    ).scalar()
+    month = month_start(oldest) if oldest else since
+    limit = min(since, before) if before is not None else since
+    while month < limit:
+        if session.execute(
+            select(Task.id).where(Task.user_id == user_id, _month_filter(Task.__table__, month)).limit(1)
+        ).first():
+            months.append(month)
+        month = add_months(month, 1)
+    return months[::-1]
+
+
+def _unarchived_tasks(session, user_id: int, month: date) -> List[tuple]:
+    # The user's hot rows from one month, shaped like archived ones
+    from app.models import Task, TaskTag
+
+    task, tags = Task.__table__, TaskTag.__table__
+    rows = session.execute(
+        select(*[task.c[name] for name in _ARCHIVED_COLUMNS])
+        .where(task.c.user_id == user_id, _month_filter(task, month))
+    ).all()
+    names: Dict[int, List[str]] = {}
+    if rows:
+        for task_id, tag in session.execute(
+            select(tags.c.task_id, tags.c.tag)
+            .where(tags.c.task_id.in_([row.id for row in rows]))
+            .order_by(tags.c.task_id, tags.c.tag)
+        ):
+            names.setdefault(task_id, []).append(tag)
+    return [tuple(row) + (names.get(row.id, []),) for row in rows]
+
+
+def load_archived_tasks(user_id: int, month: date, session=None) -> List[tuple]:
+    """
+    A user's archived tasks from one month, as `TaskRow` argument tuples in
+    posting order. Files are read through their index; archive tables by
+    `user_id`. With `session`, the user's tasks from that month still in the
+    hot table are included, so tasks past the cutoff read the same before
+    and after archive-tasks runs.
+    """
+    from app import task_shards
+    from app.models import TaskArchive
+
+    rows = _unarchived_tasks(session, user_id, month) if session is not None else []
+    hot = {row[0] for row in rows}
+    for archive in TaskArchive.query.filter_by(month=month):
+        if archive.kind == TaskArchive.FILE:
+            archived = _read_file(archive.location, user_id)
+        else:
+            archived = _read_schema(task_shards.engine(archive.shard), archive.location, user_id)
+        # A rerun may not have deleted every archived row yet
+        rows.extend(row for row in archived if row[0] not in hot)
+    return sorted(rows, key=lambda row: (row[2], row[0]))
+
+
+def archive_page(user_id: int, before: Optional[date] = None, max_months: int = 12, session=None,
+                 since: Optional[datetime] = None) -> Tuple[Optional[date], List[tuple], Optional[date]]:
+    """
+    The newest archived month before `before` holding any of the user's
+    tasks, looking at up to `max_months` months: returns that month (None if
+    none was found), its tasks, and the cursor to scroll back from, or None
+    once every archive has been looked at.
+
+    With `session` and `since`, months before `since` whose tasks are still
+    in the hot table count as archived too.
+    """
+    months = set(archived_months(before))
+    if session is not None and since is not None:
+        months.update(unarchived_months(session, user_id, month_start(since), before))
+    months = sorted(months, reverse=True)
+    for month in months[:max_months]:
+        rows = load_archived_tasks(user_id, month, session)
+        if rows:
+            return month, rows, (month if month != months[-1] else None)
+    cursor = months[max_months - 1] if len(months) > max_months else None
+    return None, [], cursor
+
+
+# Forgetting users ----------------------------------------------------------------
+
+
+def _drop_file_member(path: str, user_id: int) -> None:
+    # Members are independent gzip streams, so the file is rewritten by
+    # copying every other user's bytes
+    index = _index_for(path)
+    if str(user_id) not in index:
+        return
+    new_index = {}
+    partial = f"{path}.partial"
+    with open(path, "rb") as source, open(partial, "wb") as out:
+        for key, (offset, length) in sorted(index.items(), key=lambda item: item[1][0]):
+            if key == str(user_id):
+                continue
+            source.seek(offset)
+            new_index[key] = [out.tell(), length]
+            out.write(source.read(length))
+    os.replace(partial, path)
+    with open(f"{path}.index.json", "w") as out:
+        json.dump(new_index, out)
+
+
+def forget_user(user_id: int) -> None:
+    """Removes a user's tasks from every archive."""
+    from app import task_shards
+    from app.models import TaskArchive
+
+    for archive in TaskArchive.query.all():
+        if archive.kind == TaskArchive.FILE:
+            _drop_file_member(archive.location, user_id)
+            continue
+        schema, name = archive.location.split(".")
+        with task_shards.engine(archive.shard).begin() as conn:
+            conn.execute(text(f"DELETE FROM {schema}.task_tags_{name} WHERE user_id = :user_id"), {"user_id": user_id})
+            conn.execute(text(f"DELETE FROM {archive.location} WHERE user_id = :user_id"), {"user_id": user_id})
@@ -0,0 +1,152 @@
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import shutil
+from typing import Dict, Optional
+
+import brotli
+from flask import Flask, abort, current_app, request, send_file, send_from_directory
+
+# Logger configuration
+logger = logging.getLogger(__name__)
+
+# File types worth shipping as precompressed variants
+_COMPRESSIBLE_EXTENSIONS = {".css", ".js", ".map", ".svg", ".json", ".txt", ".html"}
+
+# Encodings written by `build_assets`, in server preference order
+_PRECOMPRESSED = (("br", ".br"), ("gzip", ".gz"))
+
+_MANIFEST_NAME = "manifest.json"
+
+
+def _fingerprint(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(65536), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+
+def build_assets(source_dir: str, output_dir: str) -> Dict[str, str]:
+    """
+    Copies every static file into `output_dir` under a content-hashed name,
+    writes Brotli and gzip variants next to compressible ones and returns
+    the manifest mapping original names to fingerprinted names.
+    """
+    output_dir = os.path.abspath(output_dir)
+    if os.path.isdir(output_dir):
+        shutil.rmtree(output_dir)
+    os.makedirs(output_dir)
+
+    manifest = {}
+    for root, dirs, files in os.walk(source_dir):
+        # Never fingerprint a previous build nested inside the static folder
+        dirs[:] = [d for d in dirs if os.path.abspath(os.path.join(root, d)) != output_dir]
+        for name in sorted(files):
+            source = os.path.join(root, name)
+            relative = os.path.relpath(source, source_dir).replace(os.sep, "/")
+            stem, ext = os.path.splitext(relative)
+            fingerprinted = f"{stem}.{_fingerprint(source)}{ext}"
+
+            target = os.path.join(output_dir, fingerprinted)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copyfile(source, target)
+            manifest[relative] = fingerprinted
+
+            if ext.lower() not in _COMPRESSIBLE_EXTENSIONS:
+                continue
+            with open(source, "rb") as fh:
+                data = fh.read()
+            variants = {
+                ".br": brotli.compress(data, quality=11),
+                ".gz": gzip.compress(data, compresslevel=9, mtime=0),
+            }
+            for suffix, payload in variants.items():
+                if len(payload) < len(data):
+                    with open(target + suffix, "wb") as fh:
+                        fh.write(payload)
+
+    with open(os.path.join(output_dir, _MANIFEST_NAME), "w") as fh:
+        json.dump(manifest, fh, indent=2, sort_keys=True)
+    logger.info(f"Built {len(manifest)} static assets into {output_dir}")
+    return manifest
+
+
+class StaticAssets(object):
+    """
+    Serves fingerprinted, precompressed static files produced by
+    `manage.py build-assets`.
+
+    `url_for("static", filename=...)` resolves to the fingerprinted name when
+    a manifest exists, and the `static` endpoint answers with the matching
+    `.br`/`.gz` file through `send_file`, so servers exposing
+    `wsgi.file_wrapper` (gunicorn) or `USE_X_SENDFILE` hand the file to the
+    kernel instead of compressing it per request.
+    """
+
+    def __init__(self, app: Optional[Flask] = None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        app.config.setdefault("ASSETS_BUILD_DIR", "build")
+        app.config.setdefault("ASSETS_MAX_AGE", 31536000)
+        self.load_manifest(app)
+
+        app.url_defaults(self._fingerprint_url)
+        if app.has_static_folder:
+            app.view_functions["static"] = self.send_static_file
+
+    def load_manifest(self, app: Flask) -> None:
+        """(Re)reads the build manifest; missing or debug builds serve raw files."""
+        manifest = {}
+        path = os.path.join(self._build_dir(app), _MANIFEST_NAME)
+        if not app.config.get("ASSETS_DEBUG") and os.path.isfile(path):
+            with open(path) as fh:
+                manifest = json.load(fh)
+        elif not app.config.get("ASSETS_DEBUG"):
+            logger.info("No static asset manifest found; run `manage.py build-assets`.")
+        app.extensions["assets"] = {
+            "manifest": manifest,
+            "built": {f"{app.config['ASSETS_BUILD_DIR']}/{name}" for name in manifest.values()},
+        }
+
+    @staticmethod
+    def _build_dir(app: Flask) -> str:
+        return os.path.join(app.static_folder, app.config["ASSETS_BUILD_DIR"])
+
+    @staticmethod
+    def _fingerprint_url(endpoint: str, values: dict) -> None:
+        if endpoint != "static" or "filename" not in values:
+            return
+        manifest = current_app.extensions["assets"]["manifest"]
+        fingerprinted = manifest.get(values["filename"])
+        if fingerprinted:
+            values["filename"] = f"{current_app.config['ASSETS_BUILD_DIR']}/{fingerprinted}"
+
+    @staticmethod
+    def send_static_file(filename: str):
+        app = current_app
+        if filename not in app.extensions["assets"]["built"]:
+            return send_from_directory(app.static_folder, filename, max_age=app.get_send_file_max_age(filename))
+
+        path = os.path.join(app.static_folder, filename)
+        mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        encoding = None
+        for candidate, suffix in _PRECOMPRESSED:
+            if request.accept_encodings[candidate] and os.path.isfile(path + suffix):
+                encoding, path = candidate, path + suffix
+                break
+        if not os.path.isfile(path):
+            abort(404)
+
+        response = send_file(path, mimetype=mimetype, max_age=app.config["ASSETS_MAX_AGE"], conditional=True)
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+        response.headers["Vary"] = "Accept-Encoding"
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
@@ -0,0 +1,424 @@
+import hashlib
+import hmac
+import json
+import logging
+import re
+from contextlib import asynccontextmanager
+from datetime import datetime
+from http.cookies import SimpleCookie
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+from flask import Flask
+from itsdangerous import BadData, URLSafeTimedSerializer
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from .partitioning import live_since
+from .sharding import SHARD_BIND_PREFIX
+
+# Logger configuration
+logger = logging.getLogger(__name__)
+
+# The asyncio driver used for each dialect
+_ASYNC_DRIVERS = {"sqlite": "aiosqlite", "postgresql": "asyncpg"}
+
+# Largest request body read, in bytes
+_MAX_BODY = 64 * 1024
+
+_TASK_PATH = re.compile(r"^/api/tasks(?:/(\d+))?$")
+
+
+def async_database_url(url: str) -> str:
+    """`url` with its driver swapped for the dialect's asyncio one."""
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend not in _ASYNC_DRIVERS:
+        raise ValueError(f"No asyncio driver known for {backend} databases.")
+    return parsed.set(drivername=f"{backend}+{_ASYNC_DRIVERS[backend]}").render_as_string(hide_password=False)
+
+
+def session_identifier(remote_addr: Optional[str], user_agent: Optional[str]) -> str:
+    """Flask-Login's session protection identifier, built as `flask_login.utils._create_identifier` does."""
+    address = remote_addr.encode("utf-8").split(b",")[0].strip() if remote_addr is not None else None
+    agent = user_agent.encode("utf-8") if user_agent is not None else None
+    return hashlib.sha512(f"{address}|{agent}".encode("utf8")).hexdigest()
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, payload: dict, headers: Tuple[Tuple[bytes, bytes], ...] = ()):
+        super().__init__(status, payload)
+        self.status = status
+        self.payload = payload
+        self.headers = headers
+
+
+class _Request(object):
+    __slots__ = ("method", "path", "args", "headers", "body", "remote_addr")
+
+    def __init__(self, scope: dict, body: bytes):
+        self.method = scope["method"]
+        self.path = scope["path"]
+        self.args = {key: values[-1] for key, values in parse_qs(scope["query_string"].decode("latin-1")).items()}
+        headers: Dict[str, str] = {}
+        for name, value in scope["headers"]:
+            name, value = name.decode("latin-1"), value.decode("latin-1")
+            # HTTP/2 clients may split cookies over several headers
+            headers[name] = f"{headers[name]}; {value}" if name == "cookie" and name in headers else value
+        self.headers = headers
+        self.body = body
+        self.remote_addr = (scope.get("client") or (None,))[0]
+
+    def json(self) -> dict:
+        try:
+            data = json.loads(self.body or b"{}")
+        except ValueError:
+            raise HTTPError(400, {"error": "The body is not valid JSON."})
+        if not isinstance(data, dict):
+            raise HTTPError(400, {"error": "The body must be a JSON object."})
+        return data
+
+
+def _parse_datetime(value) -> Optional[datetime]:
+    if value in (None, ""):
+        return None
+    if not isinstance(value, str):
+        raise ValueError("Not a date and time.")
+    return datetime.fromisoformat(value)
+
+
+def task_fields(data: dict, partial: bool = False) -> Tuple[dict, Optional[List[str]], Dict[str, List[str]]]:
+    """
+    Validates a JSON task body as `TaskForm` validates the HTML form.
+    Returns the column values, the tags (None when not given) and the errors.
+    """
+    from app.blueprints.tasks.utils import MAX_TAGS, parse_tags
+    from app.models import Task, TaskTag
+
+    values, tags, errors = {}, None, {}
+    if "task_name" in data or not partial:
+        content = data.get("task_name")
+        if not isinstance(content, str) or not content.strip():
+            errors["task_name"] = ["This field is required."]
+        elif len(content) > Task.content.type.length:
+            errors["task_name"] = [f"Field cannot be longer than {Task.content.type.length} characters."]
+        else:
+            values["content"] = content
+    for field in ("due_at", "remind_at"):
+        if field in data:
+            try:
+                values[field] = _parse_datetime(data[field])
+            except ValueError:
+                errors[field] = ["Not a valid datetime value."]
+    if "tags" in data:
+        raw = data["tags"]
+        tags = parse_tags(", ".join(map(str, raw)) if isinstance(raw, list) else raw)
+        if len(tags) > MAX_TAGS:
+            errors["tags"] = [f"A task can have at most {MAX_TAGS} tags."]
+        elif any(len(tag) > TaskTag.MAX_LENGTH for tag in tags):
+            errors["tags"] = [f"Tags must be at most {TaskTag.MAX_LENGTH} characters long."]
+    return values, tags, errors
+
+
+class AsyncTaskAPI(object):
+    """
+    The task JSON API as an ASGI app on SQLAlchemy's asyncio engine, for
+    serving next to the Flask app (see `asgi.py`). Concurrency comes from
+    the event loop and the asyncio database driver, not from monkey
+    patching.
+
+    It shares the `Task` and `User` models, the task shards, the outbox and
+    the keyset paging with the Flask views, and signs visitors in from the
+    Flask session cookie (checking the CSRF header on writes, as the Flask
+    app does), so a browser signed in to one is signed in to both.
+
+    Requests outside ASYNC_API_PREFIX go to `fallback`, another ASGI app,
+    when one is given, and get a 404 otherwise.
+
+    Routes, under ASYNC_API_PREFIX:
+        GET    /api/tasks            a page of tasks (`after`, `tags`, `match`)
+        POST   /api/tasks            create a task
+        GET    /api/tasks/<id>       one task
+        PATCH  /api/tasks/<id>       update a task
+        DELETE /api/tasks/<id>       delete a task
+    """
+
+    def __init__(self, flask_app: Flask, database_url: Optional[str] = None, fallback=None):
+        from app import login_manager
+
+        config = flask_app.config
+        self.fallback = fallback
+        self.prefix = config["ASYNC_API_PREFIX"].rstrip("/")
+        self.per_page = config["TASKS_PER_PAGE"]
+        self.archive_after_months = config["TASK_ARCHIVE_AFTER_MONTHS"]
+        url = database_url or config.get("ASYNC_DATABASE_URL") or async_database_url(config["SQLALCHEMY_DATABASE_URI"])
+        self.engines = {None: create_async_engine(url)}
+        for shard, shard_url in (config.get("SQLALCHEMY_BINDS") or {}).items():
+            if shard.startswith(SHARD_BIND_PREFIX):
+                self.engines[shard] = create_async_engine(async_database_url(shard_url))
+        self.sessions = {
+            shard: async_sessionmaker(engine, expire_on_commit=False) for shard, engine in self.engines.items()
+        }
+
+        self.cookie_name = config["SESSION_COOKIE_NAME"]
+        self.cookie_max_age = int(flask_app.permanent_session_lifetime.total_seconds())
+        self.cookie_serializer = flask_app.session_interface.get_signing_serializer(flask_app)
+        self.session_protection = config.get("SESSION_PROTECTION", login_manager.session_protection)
+        self.csrf_methods = set(config.get("WTF_CSRF_METHODS") or ("POST", "PUT", "PATCH", "DELETE"))
+        self.csrf_serializer = None
+        if config.get("WTF_CSRF_ENABLED", True):
+            self.csrf_serializer = URLSafeTimedSerializer(
+                config.get("WTF_CSRF_SECRET_KEY") or flask_app.secret_key, salt="wtf-csrf-token"
+            )
+        self.csrf_field = config.get("WTF_CSRF_FIELD_NAME", "csrf_token")
+        self.csrf_time_limit = config.get("WTF_CSRF_TIME_LIMIT", 3600)
+
+    async def __call__(self, scope: dict, receive, send) -> None:
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http" or not scope["path"].startswith(self.prefix + "/"):
+            if self.fallback is not None:
+                await self.fallback(scope, receive, send)
+            elif scope["type"] == "http":
+                await self._respond(send, 404, {"error": "Not found."})
+            return
+        status, payload, headers = 200, None, ()
+        try:
+            body = await self._read_body(receive)
+            status, payload = await self.dispatch(_Request(scope, body))
+        except HTTPError as error:
+            status, payload, headers = error.status, error.payload, error.headers
+        except Exception:
+            logger.exception("Async task API request failed.")
+            status, payload = 500, {"error": "Internal server error."}
+        await self._respond(send, status, payload, headers)
+
+    async def _lifespan(self, receive, send) -> None:
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.dispose()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def dispose(self) -> None:
+        for engine in self.engines.values():
+            await engine.dispose()
+
+    @staticmethod
+    async def _read_body(receive) -> bytes:
+        chunks, size = [], 0
+        while True:
+            message = await receive()
+            chunk = message.get("body", b"")
+            size += len(chunk)
+            if size > _MAX_BODY:
+                raise HTTPError(413, {"error": "The body is too large."})
+            chunks.append(chunk)
+            if not message.get("more_body"):
+                return b"".join(chunks)
+
+    @staticmethod
+    async def _respond(send, status: int, payload: Optional[dict], headers=()) -> None:
+        body = b"" if payload is None else json.dumps(payload).encode()
+        response_headers = [(b"content-length", str(len(body)).encode()), *headers]
+        if payload is not None:
+            response_headers.append((b"content-type", b"application/json"))
+        await send({"type": "http.response.start", "status": status, "headers": response_headers})
+        await send({"type": "http.response.body", "body": body})
+
+    # Authentication ----------------------------------------------------------
+
+    def flask_session(self, request: _Request) -> dict:
+        """The Flask session the request's cookie carries; empty when missing or badly signed."""
+        cookie = SimpleCookie()
+        try:
+            cookie.load(request.headers.get("cookie", ""))
+        except Exception:
+            return {}
+        morsel = cookie.get(self.cookie_name)
+        if morsel is None:
+            return {}
+        try:
+            return self.cookie_serializer.loads(morsel.value, max_age=self.cookie_max_age)
+        except BadData:
+            return {}
+
+    def _check_csrf(self, request: _Request, session: dict) -> None:
+        if self.csrf_serializer is None or request.method not in self.csrf_methods:
+            return
+        token = request.headers.get("x-csrftoken") or request.headers.get("x-csrf-token")
+        try:
+            signed = self.csrf_serializer.loads(token, max_age=self.csrf_time_limit) if token else None
+        except BadData:
+            signed = None
+        if signed is None or self.csrf_field not in session or not hmac.compare_digest(session[self.csrf_field], signed):
+            raise HTTPError(400, {"error": "The CSRF token is missing or invalid."})
+
+    async def current_user(self, request: _Request):
+        """The signed-in user's (id, task_shard); 401 without one, as Flask-Login would find none."""
+        from app.models import User
+
+        session = self.flask_session(request)
+        user_id = session.get("_user_id")
+        if user_id is not None and self.session_protection == "strong" and not session.get("_permanent"):
+            identifier = session_identifier(
+                request.headers.get("x-forwarded-for", request.remote_addr), request.headers.get("user-agent")
+            )
+            if identifier != session.get("_id"):
+                user_id = None
+        if user_id is None:
+            raise HTTPError(401, {"error": "Sign in first."})
+        async with self.sessions[None]() as db_session:
+            user = (await db_session.execute(
+                select(User.id, User.task_shard).where(User.id == int(user_id), User.deleting_at.is_(None))
+            )).first()
+        if user is None:
+            raise HTTPError(401, {"error": "Sign in first."})
+        self._check_csrf(request, session)
+        return user
+
+    @asynccontextmanager
+    async def _writable(self, user):
+        """
+        A session on the user's shard for writes, and the position of the
+        event the write queues; refuses while their tasks are being moved
+        and keeps the user's row locked until the block ends, as
+        `writable_session_for` does. The main transaction, holding the
+        position, commits after the shard's.
+        """
+        from app.models import TaskShardMove, User
+        from app.outbox import next_seq
+
+        if len(self.engines) == 1:
+            async with self.sessions[None]() as session:
+                yield session, await session.run_sync(next_seq, user.id)
+            return
+        async with self.sessions[None]() as db_session, db_session.begin():
+            shard, moving = (await db_session.execute(
+                select(User.task_shard, TaskShardMove.user_id)
+                .outerjoin(TaskShardMove, TaskShardMove.user_id == User.id)
+                .where(User.id == user.id)
+                .with_for_update(key_share=True, of=User.__table__)
+            )).one()
+            if moving is not None or shard != user.task_shard:
+                raise HTTPError(503, {"error": "Your tasks are being moved, please try again in a moment."},
+                                ((b"retry-after", b"1"),))
+            user_seq = await db_session.run_sync(next_seq, user.id)
+            async with self.sessions[shard]() as session:
+                yield session, user_seq
+
+    # Routes ------------------------------------------------------------------
+
+    async def dispatch(self, request: _Request) -> Tuple[int, Optional[dict]]:
+        match = _TASK_PATH.match(request.path[len(self.prefix):])
+        if match is None:
+            raise HTTPError(404, {"error": "Not found."})
+        task_id = int(match.group(1)) if match.group(1) else None
+        handlers = {"GET": self.get_task, "PATCH": self.update_task, "DELETE": self.delete_task} if task_id \
+            else {"GET": self.list_tasks, "POST": self.create_task}
+        handler = handlers.get(request.method)
+        if handler is None:
+            raise HTTPError(405, {"error": "Method not allowed."}, ((b"allow", ", ".join(handlers).encode()),))
+        user = await self.current_user(request)
+        return await (handler(request, user, task_id) if task_id else handler(request, user))
+
+    def _since(self) -> datetime:
+        # Tasks older than the archive cutoff are left to the Flask archive view, as in the task list
+        return live_since(self.archive_after_months)
+
+    async def list_tasks(self, request: _Request, user) -> Tuple[int, dict]:
+        from app.blueprints.tasks.utils import MATCH_ALL, MATCH_ANY, MAX_TAGS, parse_tags, task_page
+
+        tags = parse_tags(request.args.get("tags"))[:MAX_TAGS]
+        match = MATCH_ANY if request.args.get("match") == MATCH_ANY else MATCH_ALL
+        async with self.sessions[user.task_shard]() as session:
+            try:
+                # The same keyset query the Flask views run, on the async connection
+                tasks, next_after = await session.run_sync(
+                    task_page, user.id, tags, match, request.args.get("after"), self.per_page, self._since()
+                )
+            except ValueError:
+                raise HTTPError(400, {"error": "Invalid cursor."})
+        return 200, {"tasks": [task.to_dict() for task in tasks], "next": next_after}
+
+    async def _own_task(self, session: AsyncSession, user, task_id: int):
+        from app.models import Task
+
+        task = (await session.execute(
+            select(Task).where(Task.id == task_id, Task.date_posted >= self._since())
+        )).scalars().first()
+        if task is None or task.user_id != user.id:
+            raise HTTPError(404, {"error": "Not found."})
+        return task
+
+    @staticmethod
+    def _task_dict(task) -> dict:
+        from app.blueprints.tasks.projections import TaskRow
+
+        return TaskRow(task.id, task.content, task.date_posted, task.due_at, task.remind_at, task.rank,
+                       task.tag_names, task.completed_at).to_dict()
+
+    async def get_task(self, request: _Request, user, task_id: int) -> Tuple[int, dict]:
+        async with self.sessions[user.task_shard]() as session:
+            return 200, self._task_dict(await self._own_task(session, user, task_id))
+
+    async def create_task(self, request: _Request, user) -> Tuple[int, dict]:
+        from app.blueprints.tasks.utils import last_rank
+        from app.models import Task
+        from app.outbox import TASK_CREATED, record, task_payload
+        from app.ranking import rank_between
+
+        values, tags, errors = task_fields(request.json())
+        if not errors and values.get("remind_at") and values.get("due_at") and values["remind_at"] > values["due_at"]:
+            errors["remind_at"] = ["The reminder must not be after the due date."]
+        if errors:
+            raise HTTPError(400, {"errors": errors})
+        async with self._writable(user) as (session, user_seq):
+            # New tasks go to the end of the user's list
+            rank = rank_between(await session.run_sync(last_rank, user.id, self._since()), None)
+            task = Task(user_id=user.id, rank=rank, tags=[], **values)
+            task.set_tags(tags or [])
+            session.add(task)
+            await session.flush()
+            record(session, user.id, TASK_CREATED, user_seq=user_seq,
+                   **task_payload(task.id, task.content, task.due_at, task.remind_at, task.tag_names))
+            await session.commit()
+            return 201, self._task_dict(task)
+
+    async def update_task(self, request: _Request, user, task_id: int) -> Tuple[int, dict]:
+        from app.outbox import TASK_UPDATED, record, task_payload
+
+        values, tags, errors = task_fields(request.json(), partial=True)
+        if errors:
+            raise HTTPError(400, {"errors": errors})
+        async with self._writable(user) as (session, user_seq):
+            task = await self._own_task(session, user, task_id)
+            remind_at, due_at = values.get("remind_at", task.remind_at), values.get("due_at", task.due_at)
+            if remind_at and due_at and remind_at > due_at:
+                raise HTTPError(400, {"errors": {"remind_at": ["The reminder must not be after the due date."]}})
+            if "remind_at" in values and values["remind_at"] != task.remind_at:
+                # A new reminder time re-arms the reminder
+                task.reminder_sent_at = None
+            for field, value in values.items():
+                setattr(task, field, value)
+            if tags is not None:
+                task.set_tags(tags)
+            record(session, user.id, TASK_UPDATED, user_seq=user_seq,
+                   **task_payload(task.id, task.content, task.due_at, task.remind_at, task.tag_names))
+            await session.commit()
+            return 200, self._task_dict(task)
+
+    async def delete_task(self, request: _Request, user, task_id: int) -> Tuple[int, None]:
+        from app.outbox import TASK_DELETED, record
+
+        async with self._writable(user) as (session, user_seq):
+            task = await self._own_task(session, user, task_id)
+            await session.delete(task)
+            record(session, user.id, TASK_DELETED, user_seq=user_seq, id=task.id)
+            await session.commit()
+        return 204, None
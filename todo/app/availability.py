@@ -0,0 +1,377 @@
+import hashlib
+import logging
+import math
+import os
+import tempfile
+import threading
+from typing import Iterable, List, Optional, Tuple
+
+from flask import Flask, current_app
+from sqlalchemy import event, func, select
+
+from .utils import get_redis
+from .warmup import warming_up
+
+# Logger configuration
+logger = logging.getLogger(__name__)
+
+FIELDS = ("username", "email")
+
+# Byte 0 of every bitmap is a header whose low bit says the filter has been
+# built; until then every lookup goes to the database
+_HEADER_BITS = 8
+_BUILT = 0x01
+
+# A rebuild that dies leaves its journal switched on for at most this long
+_JOURNAL_TTL = 60 * 60
+
+
+def filter_parameters(capacity: int, error_rate: float) -> Tuple[int, int]:
+    """Bits and hash functions for a Bloom filter of `capacity` items at `error_rate` false positives."""
+    bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+    bits += -bits % 8
+    return bits, max(1, round(bits / capacity * math.log(2)))
+
+
+def filter_item(field: str, value: str) -> str:
+    # Case-folded, so the filter can only over-report what the database has
+    return f"{field}:{value.strip().lower()}"
+
+
+def bit_positions(item: str, bits: int, hashes: int) -> List[int]:
+    """Kirsch-Mitzenmacher double hashing over one 128-bit digest."""
+    digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+    first, second = int.from_bytes(digest[:8], "big"), int.from_bytes(digest[8:], "big") | 1
+    return [_HEADER_BITS + (first + i * second) % bits for i in range(hashes)]
+
+
+def build_bitmap(items: Iterable[str], bits: int, hashes: int) -> bytearray:
+    """A built bitmap holding `items`; bit i is `0x80 >> (i % 8)` of byte i // 8, as Redis SETBIT counts."""
+    bitmap = bytearray(_HEADER_BITS // 8 + bits // 8)
+    bitmap[0] = _BUILT
+    for item in items:
+        for position in bit_positions(item, bits, hashes):
+            bitmap[position >> 3] |= 0x80 >> (position & 7)
+    return bitmap
+
+
+_ADD_SCRIPT = """
+local journaling = redis.call('EXISTS', KEYS[2]) == 1
+for _, position in ipairs(ARGV) do
+    redis.call('SETBIT', KEYS[1], position, 1)
+    if journaling then redis.call('SETBIT', KEYS[3], position, 1) end
+end
+return 0
+"""
+
+
+class RedisBitmap(object):
+    """
+    The filter as a Redis string, shared by every worker on every host.
+    While a rebuild runs, added bits also go to a journal bitmap that is
+    OR-ed into the new filter once it is swapped in.
+    """
+
+    def __init__(self, client, key: str):
+        self.client = client
+        self.key = key
+        self._add = client.register_script(_ADD_SCRIPT)
+
+    def add(self, positions: List[int]) -> None:
+        self._add(keys=[self.key, self.key + ":journaling", self.key + ":journal"], args=positions)
+
+    def start_journal(self) -> None:
+        pipeline = self.client.pipeline(transaction=True)
+        pipeline.delete(self.key + ":journal")
+        pipeline.set(self.key + ":journaling", 1, ex=_JOURNAL_TTL)
+        pipeline.execute()
+
+    def merge_journal(self) -> None:
+        # Atomic, so every add lands either in the journal or straight in the filter
+        pipeline = self.client.pipeline(transaction=True)
+        pipeline.bitop("OR", self.key, self.key, self.key + ":journal")
+        pipeline.delete(self.key + ":journal", self.key + ":journaling")
+        pipeline.execute()
+
+    def test(self, positions: List[int]) -> Optional[bool]:
+        pipeline = self.client.pipeline(transaction=False)
+        # The header's low bit is bit 7 in SETBIT numbering
+        for position in [7] + positions:
+            pipeline.getbit(self.key, position)
+        built, *found = pipeline.execute()
+        return all(found) if built else None
+
+    def replace(self, bitmap: bytes) -> None:
+        # Readers see the old filter until the new one is swapped in whole
+        self.client.set(self.key + ":building", bytes(bitmap))
+        self.client.rename(self.key + ":building", self.key)
+
+
+class SharedBitmap(object):
+    """
+    The filter in a POSIX shared-memory segment, shared by the workers on
+    one host. Bits are only ever set, so readers take no lock; writers
+    serialize on a lock file so concurrent read-modify-writes of a byte
+    cannot drop each other's bits. While a rebuild runs, added bits also go
+    to a journal segment that is OR-ed into the new filter once it is
+    swapped in.
+    """
+
+    def __init__(self, name: str, size: int):
+        import fcntl
+        from multiprocessing import resource_tracker, shared_memory
+
+        self._fcntl = fcntl
+        try:
+            self.memory = shared_memory.SharedMemory(name, create=True, size=size)
+        except FileExistsError:
+            self.memory = shared_memory.SharedMemory(name)
+        # The segment outlives worker restarts; the tracker would unlink it
+        # when the first worker that touched it exits
+        resource_tracker.unregister(self.memory._name, "shared_memory")
+        self._journal_name = f"{name}-journal"
+        self._size = size
+        self._lock_path = os.path.join(tempfile.gettempdir(), f"{name}.lock")
+        self._thread_lock = threading.Lock()
+
+    def _journal(self, create: bool = False):
+        from multiprocessing import resource_tracker, shared_memory
+
+        try:
+            journal = shared_memory.SharedMemory(self._journal_name, create=create, size=self._size if create else 0)
+        except FileNotFoundError:
+            return None
+        resource_tracker.unregister(journal._name, "shared_memory")
+        return journal
+
+    @staticmethod
+    def _drop(journal) -> None:
+        from multiprocessing import resource_tracker
+
+        journal.close()
+        resource_tracker.register(journal._name, "shared_memory")
+        journal.unlink()
+
+    def _locked(self, update) -> None:
+        with self._thread_lock, open(self._lock_path, "a") as lock:
+            self._fcntl.flock(lock, self._fcntl.LOCK_EX)
+            try:
+                update(self.memory.buf)
+            finally:
+                self._fcntl.flock(lock, self._fcntl.LOCK_UN)
+
+    def add(self, positions: List[int]) -> None:
+        def update(buf):
+            # Under the lock, so the journal cannot be merged away in between
+            journal = self._journal()
+            for target in [buf] if journal is None else [buf, journal.buf]:
+                for position in positions:
+                    target[position >> 3] |= 0x80 >> (position & 7)
+            if journal is not None:
+                journal.close()
+
+        self._locked(update)
+
+    def start_journal(self) -> None:
+        def update(buf):
+            stale = self._journal()
+            if stale is not None:
+                self._drop(stale)
+            self._journal(create=True).close()
+
+        self._locked(update)
+
+    def merge_journal(self) -> None:
+        def update(buf):
+            journal = self._journal()
+            if journal is None:
+                return
+            # The header byte stays the filter's own
+            for index in range(1, self._size):
+                buf[index] |= journal.buf[index]
+            self._drop(journal)
+
+        self._locked(update)
+
+    def test(self, positions: List[int]) -> Optional[bool]:
+        buf = self.memory.buf
+        if not buf[0] & _BUILT:
+            return None
+        return all(buf[position >> 3] & (0x80 >> (position & 7)) for position in positions)
+
+    def replace(self, bitmap: bytes) -> None:
+        def update(buf):
+            # The header goes last, so a half-copied filter is never trusted
+            buf[0] = 0
+            buf[1:len(bitmap)] = bitmap[1:]
+            buf[0] = bitmap[0]
+
+        self._locked(update)
+
+    def unlink(self) -> None:
+        from multiprocessing import resource_tracker
+
+        self.memory.close()
+        # `unlink` unregisters the segment again, which the tracker expects to know
+        resource_tracker.register(self.memory._name, "shared_memory")
+        self.memory.unlink()
+        journal = self._journal()
+        if journal is not None:
+            self._drop(journal)
+        try:
+            os.remove(self._lock_path)
+        except OSError:
+            pass
+
+
+class AvailabilityFilter(object):
+    """
+    Answers "is this username/email free?" from a Bloom filter of the ones
+    taken, only querying the database when the filter reports a possible
+    hit (or has not been built yet). Taken values are added as users are
+    flushed, before their transaction commits; `manage.py
+    rebuild-availability-filter` builds it from the users table and clears
+    out values nobody holds any more. Kept in Redis when REDIS_URL is set
+    ("auto"), else in shared memory.
+
+    The filter is advisory: a failed write can make it miss a taken value,
+    so only the live availability check trusts a miss. Form submits ask the
+    database, whose unique indexes have the last word.
+    """
+
+    def __init__(self, app: Optional[Flask] = None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        from app.models import User
+
+        app.config.setdefault("AVAILABILITY_FILTER_BACKEND", "auto")
+        app.config.setdefault("AVAILABILITY_FILTER_KEY", "todo-availability")
+        app.config.setdefault("AVAILABILITY_FILTER_CAPACITY", 1000000)
+        app.config.setdefault("AVAILABILITY_FILTER_ERROR_RATE", 0.001)
+
+        for name, listener in (("before_insert", _user_inserted), ("before_update", _user_updated)):
+            if not event.contains(User, name, listener):
+                event.listen(User, name, listener)
+
+    @property
+    def parameters(self) -> Tuple[int, int]:
+        config = current_app.config
+        return filter_parameters(config["AVAILABILITY_FILTER_CAPACITY"], config["AVAILABILITY_FILTER_ERROR_RATE"])
+
+    @property
+    def bitmap(self):
+        app = current_app._get_current_object()
+        if "availability" not in app.extensions:
+            bits, hashes = self.parameters
+            backend = app.config["AVAILABILITY_FILTER_BACKEND"]
+            client = get_redis(app) if backend in ("auto", "redis") else None
+            # Resizing starts a fresh (unbuilt) filter rather than misreading the old one
+            key = f"{app.config['AVAILABILITY_FILTER_KEY']}-{bits}-{hashes}"
+            if client is not None:
+                app.extensions["availability"] = RedisBitmap(client, key)
+            else:
+                app.extensions["availability"] = SharedBitmap(key, _HEADER_BITS // 8 + bits // 8)
+        return app.extensions["availability"]
+
+    def add(self, field: str, value: Optional[str]) -> None:
+        if value:
+            bits, hashes = self.parameters
+            self.bitmap.add(bit_positions(filter_item(field, value), bits, hashes))
+
+    def might_be_taken(self, field: str, value: str) -> Optional[bool]:
+        """False when `value` is certainly free; None when the filter cannot tell (not built, or down)."""
+        bits, hashes = self.parameters
+        try:
+            return self.bitmap.test(bit_positions(filter_item(field, value), bits, hashes))
+        except Exception:
+            logger.exception("Availability filter lookup failed; asking the database.")
+            return None
+
+    def is_available(self, field: str, value: str) -> Tuple[bool, bool]:
+        """Whether `value` is free for `field`, and whether the database had to be asked."""
+        from app import db
+        from app.models import User
+
+        if field not in FIELDS:
+            raise ValueError(f"Unknown availability field {field!r}")
+        if self.might_be_taken(field, value) is False:
+            return True, False
+        column = getattr(User, field)
+        taken = db.session.execute(select(User.id).where(column == value).limit(1)).first() is not None
+        return not taken, True
+
+    def rebuild(self, batch_size: int = 10000) -> int:
+        """
+        Rebuilds the filter from the users table; returns how many users it
+        holds. Values written while the table is read are journaled by every
+        worker and merged in after the swap, so they are not lost with the
+        old filter.
+        """
+        from app import db
+        from app.models import User
+
+        bits, hashes = self.parameters
+        self.bitmap.start_journal()
+        try:
+            count = self._rebuild(bits, hashes, batch_size)
+        finally:
+            self.bitmap.merge_journal()
+        db.session.remove()
+        if count * 2 > current_app.config["AVAILABILITY_FILTER_CAPACITY"]:
+            logger.warning(f"{count} users fill the availability filter past AVAILABILITY_FILTER_CAPACITY; "
+                           "raise it to keep false positives rare.")
+        return count
+
+    def _rebuild(self, bits: int, hashes: int, batch_size: int) -> int:
+        from app import db
+        from app.models import User
+
+        last_id = db.session.execute(select(func.max(User.id))).scalar() or 0
+        rows = db.session.execute(
+            select(User.username, User.email).where(User.id <= last_id).execution_options(yield_per=batch_size)
+        )
+        count = 0
+
+        def items():
+            nonlocal count
+            for username, email in rows:
+                count += 1
+                yield filter_item("username", username)
+                if email:
+                    yield filter_item("email", email)
+
+        bitmap = build_bitmap(items(), bits, hashes)
+        self.bitmap.replace(bitmap)
+        # Users who registered while the table was read went into the old filter
+        for username, email in db.session.execute(select(User.username, User.email).where(User.id > last_id)):
+            self.add("username", username)
+            self.add("email", email)
+            count += 1
+        return count
+
+
+def _add_taken(user, fields) -> None:
+    from app import availability
+
+    if warming_up():
+        # The scratch user is deleted again; its names would only crowd the filter
+        return
+    for field in fields:
+        try:
+            availability.add(field, getattr(user, field))
+        except Exception:
+            # The filter is advisory: submits check the database and its unique indexes
+            logger.exception(f"Could not add a {field} to the availability filter.")
+
+
+def _user_inserted(mapper, connection, user) -> None:
+    _add_taken(user, FIELDS)
+
+
+def _user_updated(mapper, connection, user) -> None:
+    from sqlalchemy import inspect
+
+    state = inspect(user)
+    _add_taken(user, [field for field in FIELDS if state.attrs[field].history.added])
@@ -0,0 +1,139 @@
+import calendar
+import logging
+import re
+from datetime import date
+from typing import List, Optional
+
+from sqlalchemy import Date, inspect, text
+from sqlalchemy.engine import Engine
+
+# Logger configuration
+logger = logging.getLogger(__name__)
+
+_TEMPORARY_COLUMN = "date_of_birth_date"
+# Clears the converted date whenever the string changes during the backfill
+_STALE_TRIGGER = "users_birth_date_stale"
+_DATE = re.compile(r"^\s*(\d{4})-(\d{1,2})-(\d{1,2})")
+
+
+def parse_birth_date(value) -> Optional[date]:
+    """
+    Reads the "YYYY-M-D" strings birth dates used to be stored as. Days past
+    the end of the month (the fake-user generator made some) are clamped;
+    anything else unreadable is None.
+    """
+    if value is None or isinstance(value, date):
+        return value
+    match = _DATE.match(str(value))
+    if match is None:
+        return None
+    year, month, day = map(int, match.groups())
+    if not 1 <= month <= 12 or day < 1:
+        return None
+    return date(year, month, min(day, calendar.monthrange(year, month)[1]))
+
+
+def needs_migration(engine: Engine) -> bool:
+    """Whether `users.date_of_birth` is still a string column."""
+    columns = {column["name"]: column["type"] for column in inspect(engine).get_columns("users")}
+    return not isinstance(columns["date_of_birth"], Date)
+
+
+def _trigger_statements(engine: Engine) -> List[str]:
+    if engine.dialect.name == "postgresql":
+        return [
+            f"CREATE OR REPLACE FUNCTION {_STALE_TRIGGER}() RETURNS trigger AS $$"
+            f" BEGIN NEW.{_TEMPORARY_COLUMN} := NULL; RETURN NEW; END $$ LANGUAGE plpgsql",
+            f"DROP TRIGGER IF EXISTS {_STALE_TRIGGER} ON users",
+            f"CREATE TRIGGER {_STALE_TRIGGER} BEFORE UPDATE OF date_of_birth ON users FOR EACH ROW"
+            f" WHEN (OLD.date_of_birth IS DISTINCT FROM NEW.date_of_birth) EXECUTE FUNCTION {_STALE_TRIGGER}()",
+        ]
+    return [
+        f"CREATE TRIGGER IF NOT EXISTS {_STALE_TRIGGER} AFTER UPDATE OF date_of_birth ON users"
+        f" BEGIN UPDATE users SET {_TEMPORARY_COLUMN} = NULL WHERE id = NEW.id; END",
+    ]
+
+
+def _drop_trigger_statements(engine: Engine) -> List[str]:
+    if engine.dialect.name == "postgresql":
+        return [f"DROP TRIGGER IF EXISTS {_STALE_TRIGGER} ON users", f"DROP FUNCTION IF EXISTS {_STALE_TRIGGER}()"]
+    return [f"DROP TRIGGER IF EXISTS {_STALE_TRIGGER}"]
+
+
+def migrate_birth_dates(engine: Engine, batch_size: int = 5000) -> int:
+    """
+    Converts `users.date_of_birth` from strings to an indexed DATE in place:
+    the dates are copied into a new column a batch (one transaction) at a
+    time, so the table is never locked for long, then the columns are
+    swapped in one short transaction. A trigger clears a copied date when
+    its user edits the string meanwhile, and the swap converts every row
+    without a date first, so no edit is lost. Safe to rerun after an
+    interruption; returns the number of rows converted.
+    """
+    if not needs_migration(engine):
+        return 0
+    columns = {column["name"] for column in inspect(engine).get_columns("users")}
+    with engine.begin() as conn:
+        if _TEMPORARY_COLUMN not in columns:
+            conn.execute(text(f"ALTER TABLE users ADD COLUMN {_TEMPORARY_COLUMN} DATE"))
+        for statement in _trigger_statements(engine):
+            conn.execute(text(statement))
+
+    def convert(conn, rows) -> List[int]:
+        values = [{"id": user_id, "raw": raw, "born": parse_birth_date(raw)} for user_id, raw in rows]
+        unreadable = [value["id"] for value in values if value["born"] is None]
+        if unreadable:
+            logger.warning(f"Users {unreadable} have unreadable birth dates; they are left empty.")
+        readable = [value for value in values if value["born"] is not None]
+        if readable:
+            # A string edited since it was read is skipped, and picked up by the swap
+            conn.execute(
+                text(f"UPDATE users SET {_TEMPORARY_COLUMN} = :born WHERE id = :id AND date_of_birth = :raw"),
+                readable,
+            )
+        return [value["id"] for value in values]
+
+    converted, last_id = set(), 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(
+                text(f"SELECT id, date_of_birth FROM users WHERE id > :last_id AND {_TEMPORARY_COLUMN} IS NULL"
+                     " ORDER BY id LIMIT :limit"),
+                {"last_id": last_id, "limit": batch_size},
+            ).all()
+            if not rows:
+                break
+            converted.update(convert(conn, rows))
+            last_id = rows[-1][0]
+
+    with engine.begin() as conn:
+        if engine.dialect.name == "postgresql":
+            # Writers wait here briefly instead of slipping in a string date
+            conn.execute(text("LOCK TABLE users IN SHARE ROW EXCLUSIVE MODE"))
+        # New users, users edited since their batch, and unreadable dates
+        rows = conn.execute(
+            text(f"SELECT id, date_of_birth FROM users WHERE {_TEMPORARY_COLUMN} IS NULL")
+        ).all()
+        converted.update(convert(conn, rows))
+        for statement in _drop_trigger_statements(engine):
+            conn.execute(text(statement))
+        conn.execute(text("ALTER TABLE users DROP COLUMN date_of_birth"))
+        conn.execute(text(f"ALTER TABLE users RENAME COLUMN {_TEMPORARY_COLUMN} TO date_of_birth"))
+    create_directory_indexes(engine)
+    return len(converted)
+
+
+def create_directory_indexes(engine: Engine) -> None:
+    """The admin directory's indexes, built without blocking writes on Postgres."""
+    postgres = engine.dialect.name == "postgresql"
+    concurrently = "CONCURRENTLY " if postgres else ""
+    statements = [f"CREATE INDEX {concurrently}IF NOT EXISTS ix_users_date_of_birth ON users (date_of_birth)"]
+    if postgres:
+        # LIKE 'prefix%' can only use a btree built with the pattern operators
+        statements += [
+            f"CREATE INDEX {concurrently}IF NOT EXISTS ix_users_email_prefix ON users (email varchar_pattern_ops)",
+            f"CREATE INDEX {concurrently}IF NOT EXISTS ix_users_username_prefix ON users (username varchar_pattern_ops)",
+        ]
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for statement in statements:
+            conn.execute(text(statement))
@@ -4,7 +4,7 @@ from app.models import User
 from flask import url_for
 from flask_wtf import FlaskForm  # ignore
 from wtforms.fields import EmailField  # ignore
-from wtforms.fields import (BooleanField, PasswordField, SelectField,
+from wtforms.fields import (BooleanField, DateField, PasswordField, SelectField,
                             StringField, SubmitField, TextAreaField)
 from wtforms.validators import InputRequired  # ignore
 from wtforms.validators import Email, EqualTo, Length, ValidationError
@@ -34,11 +34,15 @@ class RegistrationForm(FlaskForm):
         if User.query.filter_by(username=field.data).first():
             raise ValidationError("Username not available. Choose another username")
 
+    def validate_email(self, field):
+        if User.query.filter_by(email=field.data).first():
+            raise ValidationError("Email already registered.")
+
     first_name = StringField("First name", validators=[InputRequired(), Length(1, 64)])
     last_name = StringField("Last name", validators=[InputRequired(), Length(1, 64)])
     email = EmailField("Email", validators=[InputRequired(), Length(1, 64), Email()])
     sex = SelectField("Gender", choices=[("Male", "Male"), ("Female", "Female")])
-    date_of_birth = StringField("Date of birth", validators=[InputRequired(), Length(1, 64)])
+    date_of_birth = DateField("Date of birth", validators=[InputRequired()])
 
     password = PasswordField(
         "Password",
@@ -50,7 +54,7 @@ class RegistrationForm(FlaskForm):
 class UpdateDetailsForm(FlaskForm):
     first_name = StringField("First name", validators=[InputRequired(), Length(1, 64)])
     last_name = StringField("Last name", validators=[InputRequired(), Length(1, 64)])
-    date_of_birth = StringField("Date of birth", validators=[InputRequired(), Length(1, 64)])
+    date_of_birth = DateField("Date of birth", validators=[InputRequired()])
     
 
 class RequestResetPasswordForm(FlaskForm):
@@ -101,6 +105,11 @@ class ChangeEmailForm(FlaskForm):
             raise ValidationError("Email already registered.")
 
 
+class DeleteAccountForm(FlaskForm):
+    password = PasswordField("Password", validators=[InputRequired()])
+    submit = SubmitField("Delete my account")
+
+
 class ChangeUsernameForm(FlaskForm):
     username = StringField("New username", validators=[InputRequired(), Length(1, 64)])
     password = PasswordField("Password", validators=[InputRequired()])
@@ -1,15 +1,18 @@
 import logging
 from typing import Optional, List, Dict
 
-from flask import Blueprint, current_app, flash, redirect, render_template, request, url_for
+from flask import Blueprint, current_app, flash, jsonify, redirect, render_template, request, url_for
 from flask_login import current_user, login_user, login_required, logout_user
-from app import compress, db
+from sqlalchemy.exc import IntegrityError
+from app import availability, compress, db, page_shells, task_shards
 from app.blueprints.account.forms import (
-    ChangeEmailForm, ChangePasswordForm, ChangeUsernameForm, CreatePasswordForm, 
+    ChangeEmailForm, ChangePasswordForm, ChangeUsernameForm, CreatePasswordForm, DeleteAccountForm,
     LoginForm, RegistrationForm, RequestResetPasswordForm, ResetPasswordForm, 
     UpdateDetailsForm
 )
-from app.models.user import User
+from app.models.user import User, user_by_email
+from app.outbox import USER_REGISTERED, record
+from app.purge import purge_in_background, request_deletion
 from app.utils import SendEmailClient
 
 # Initialize the Blueprint
@@ -22,8 +25,20 @@ send_email = SendEmailClient()
 _ACCOUNT_MANAGE = "tasks.all_tasks"
 _ACCOUNT_INVALID_LOGIN_MESSAGE = "Invalid email or password."
 
+
+def _taken_since_validation(form) -> bool:
+    """
+    Rolls back a commit a unique index refused and validates `form` again,
+    so a username or email another request took since it validated is
+    reported on its field. False when that does not explain the error.
+    """
+    db.session.rollback()
+    return not form.validate()
+
+
 @account.route("/login", methods=["GET", "POST"])
 @compress.compressed()
+@page_shells.anonymous("login.html", LoginForm)
 def login():
     """Log in an existing user."""
     if current_user.is_authenticated:
@@ -31,8 +46,8 @@ def login():
 
     form = LoginForm()
     if form.validate_on_submit():
-        user: Optional[User] = User.query.filter_by(email=form.email.data).first()
-        if user and user.verify_password(form.password.data):
+        user: Optional[User] = user_by_email.first(db.session, email=form.email.data)
+        if user and user.is_active and user.verify_password(form.password.data):
             login_user(user, form.remember_me.data)
             flash("You are now logged in. Welcome back!", "success")
             next_page = request.args.get("next") or url_for(_ACCOUNT_MANAGE)
@@ -44,6 +59,7 @@ def login():
 
 @account.route("/register", methods=["GET", "POST"])
 @compress.compressed()
+@page_shells.anonymous("register.html", RegistrationForm)
 def register():
     """Register a new user, and send them a confirmation email."""
     if current_user.is_authenticated:
@@ -59,8 +75,16 @@ def register():
             password=form.password.data,
             date_of_birth=form.date_of_birth.data
         )
-        db.session.add(user)
-        db.session.commit()
+        try:
+            db.session.add(user)
+            db.session.flush()
+            user.task_shard = task_shards.home_shard(user.id)
+            record(db.session, user.id, USER_REGISTERED, id=user.id, username=user.username, email=user.email)
+            db.session.commit()
+        except IntegrityError:
+            if not _taken_since_validation(form):
+                raise
+            return render_template("register.html", form=form)
 
         token = user.generate_confirmation_token()
         confirm_link = url_for("account.confirm", token=token, _external=True)
@@ -88,6 +112,7 @@ def logout():
 
 @account.route("/reset-password", methods=["GET", "POST"])
 @compress.compressed()
+@page_shells.anonymous("reset_password_request.html", RequestResetPasswordForm)
 def reset_password_request():
     """Respond to existing user's request to reset their password."""
     if current_user.is_authenticated:
@@ -160,7 +185,12 @@ def change_username_request():
         if current_user.verify_password(form.password.data, first_time_change):
             current_user.username = form.username.data
             db.session.add(current_user)
-            db.session.commit()
+            try:
+                db.session.commit()
+            except IntegrityError:
+                if not _taken_since_validation(form):
+                    raise
+                return render_template("all_tasks.html", form=form)
             flash(f"Username changed to {current_user.username}.", "success")
             return redirect(url_for(_ACCOUNT_MANAGE))
         else:
@@ -226,6 +256,26 @@ def change_email(token):
 
     return redirect(url_for(_ACCOUNT_MANAGE))
 
+@account.route("/manage/delete-account", methods=["GET", "POST"])
+@login_required
+@compress.compressed()
+def delete_account():
+    """Delete the user's account; their tasks are removed in the background."""
+    form = DeleteAccountForm()
+    if form.validate_on_submit():
+        if current_user.verify_password(form.password.data):
+            user_id = current_user.id
+            request_deletion(current_user)
+            logout_user()
+            if current_app.config["USER_PURGE_IN_BACKGROUND"]:
+                purge_in_background(current_app._get_current_object(), user_id)
+            flash("Your account is being deleted.", "info")
+            return redirect(url_for("account.login"))
+        else:
+            flash(_ACCOUNT_INVALID_LOGIN_MESSAGE, "error")
+
+    return render_template("delete_account.html", form=form)
+
 @account.route("/confirm-account")
 @login_required
 @compress.compressed()
@@ -261,6 +311,16 @@ def confirm(token):
 
     return redirect(url_for(_ACCOUNT_MANAGE))
 
+@account.route("/availability")
+def check_availability():
+    """Live "is this username/email free?" check for the registration form."""
+    for field in ("username", "email"):
+        value = request.args.get(field, "").strip()
+        if value:
+            available, checked_database = availability.is_available(field, value)
+            return jsonify(field=field, value=value, available=available, checked_database=checked_database)
+    return jsonify(error="Pass a username or email to check."), 400
+
 # @account.before_app_request
 # @account.before_app_request
 # def before_request():
@@ -0,0 +1 @@
+from app.blueprints.admin.views import admin  # noqa
@@ -0,0 +1,131 @@
+from datetime import date
+from typing import List, Mapping, Optional, Tuple
+
+from app.models import User, UserRole
+from sqlalchemy import Select, select
+from sqlalchemy.orm import Session
+
+# The columns the directory shows; never the whole entity
+DIRECTORY_COLUMNS = (User.id, User.username, User.email, User.first_name, User.last_name, User.role,
+                     User.confirmed, User.date_of_birth, User.deleting_at)
+
+# Longest prefix searched for; longer ones cannot match the columns anyway
+MAX_PREFIX = 64
+
+
+class DirectoryRow(object):
+    """A read-only view of one user in the admin directory, built from a result tuple."""
+
+    __slots__ = ("id", "username", "email", "first_name", "last_name", "role", "confirmed", "date_of_birth",
+                 "deleting_at", "age")
+
+    def __init__(self, id, username, email, first_name, last_name, role, confirmed, date_of_birth, deleting_at,
+                 today: date):
+        self.id = id
+        self.username = username
+        self.email = email
+        self.first_name = first_name
+        self.last_name = last_name
+        self.role = role
+        self.confirmed = confirmed
+        self.date_of_birth = date_of_birth
+        self.deleting_at = deleting_at
+        self.age = None if date_of_birth is None else (
+            today.year - date_of_birth.year - ((today.month, today.day) < (date_of_birth.month, date_of_birth.day))
+        )
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "username": self.username,
+            "email": self.email,
+            "name": f"{self.first_name} {self.last_name}",
+            "role": self.role.value,
+            "confirmed": bool(self.confirmed),
+            "date_of_birth": self.date_of_birth.isoformat() if self.date_of_birth else None,
+            "age": self.age,
+            "deleting": self.deleting_at is not None,
+        }
+
+
+class DirectoryFilters(object):
+    """The directory's filters, read from a query string."""
+
+    __slots__ = ("role", "confirmed", "email", "username", "min_age", "max_age")
+
+    def __init__(self, role: Optional[UserRole] = None, confirmed: Optional[bool] = None, email: str = "",
+                 username: str = "", min_age: Optional[int] = None, max_age: Optional[int] = None):
+        self.role = role
+        self.confirmed = confirmed
+        self.email = email
+        self.username = username
+        self.min_age = min_age
+        self.max_age = max_age
+
+    @classmethod
+    def from_args(cls, args: Mapping[str, str]) -> "DirectoryFilters":
+        """Raises ValueError for values that are not a role, yes/no, or an age."""
+
+        def age(name) -> Optional[int]:
+            if not args.get(name):
+                return None
+            value = int(args[name])
+            if not 0 <= value <= 150:
+                raise ValueError(f"{name} out of range")
+            return value
+
+        confirmed = args.get("confirmed") or None
+        if confirmed not in (None, "yes", "no"):
+            raise ValueError("confirmed must be yes or no")
+        return cls(
+            role=UserRole(args["role"]) if args.get("role") else None,
+            confirmed=None if confirmed is None else confirmed == "yes",
+            email=args.get("email", "").strip().lower()[:MAX_PREFIX],
+            username=args.get("username", "").strip()[:MAX_PREFIX],
+            min_age=age("min_age"),
+            max_age=age("max_age"),
+        )
+
+
+def years_before(day: date, years: int) -> date:
+    # 29 February falls back to the 28th in non-leap years
+    try:
+        return day.replace(year=day.year - years)
+    except ValueError:
+        return day.replace(year=day.year - years, day=28)
+
+
+def directory_query(filters: DirectoryFilters, today: date) -> Select:
+    """Every filter as a sargable predicate: ages become a birth-date range on `ix_users_date_of_birth`."""
+    query = select(*DIRECTORY_COLUMNS)
+    if filters.role is not None:
+        query = query.where(User.role == filters.role)
+    if filters.confirmed is not None:
+        # Never-set (NULL) counts as unconfirmed
+        query = query.where(User.confirmed.is_(True) if filters.confirmed else User.confirmed.isnot(True))
+    if filters.email:
+        query = query.where(User.email.startswith(filters.email, autoescape=True))
+    if filters.username:
+        query = query.where(User.username.startswith(filters.username, autoescape=True))
+    if filters.min_age is not None:
+        # Old enough once the birthday this year has passed
+        query = query.where(User.date_of_birth <= years_before(today, filters.min_age))
+    if filters.max_age is not None:
+        query = query.where(User.date_of_birth > years_before(today, filters.max_age + 1))
+    return query
+
+
+def user_page(session: Session, filters: DirectoryFilters, after: Optional[str] = None, per_page: int = 50,
+              today: Optional[date] = None) -> Tuple[List[DirectoryRow], Optional[str]]:
+    """
+    One keyset page of the directory in id order. Returns the rows and the
+    cursor for the next page, or None on the last page. Raises ValueError
+    for a malformed cursor.
+    """
+    today = today or date.today()
+    query = directory_query(filters, today)
+    if after:
+        query = query.where(User.id > int(after))
+    rows = session.execute(query.order_by(User.id).limit(per_page + 1)).all()
+    users = [DirectoryRow(*row, today=today) for row in rows[:per_page]]
+    return users, (str(users[-1].id) if len(rows) > per_page else None)
@@ -0,0 +1,54 @@
+import functools
+
+from app import db
+from app.models import UserRole
+from flask import Blueprint, abort, current_app, jsonify, render_template, request
+from flask_login import current_user, login_required
+
+from .utils import DirectoryFilters, user_page
+
+admin = Blueprint("admin", __name__)
+
+
+def admin_required(view):
+    """Lets only administrators through; everyone else gets a 403."""
+
+    @functools.wraps(view)
+    @login_required
+    def wrapper(*args, **kwargs):
+        if not current_user.is_admin():
+            abort(403)
+        return view(*args, **kwargs)
+
+    return wrapper
+
+
+def _user_page_from_request():
+    """Reads the filters and cursor from the query string and loads that page."""
+    try:
+        filters = DirectoryFilters.from_args(request.args)
+        users, next_after = user_page(
+            db.session, filters, request.args.get("after"), current_app.config["ADMIN_USERS_PER_PAGE"]
+        )
+    except ValueError:
+        abort(400)
+    return users, next_after
+
+
+@admin.route("/users")
+@admin_required
+def users():
+    """The user directory, filtered and paginated in SQL."""
+    users, next_after = _user_page_from_request()
+    filters = {name: value for name, value in request.args.items() if name != "after"}
+    return render_template(
+        "user_directory.html", title="User Directory", users=users, next_after=next_after, filters=filters,
+        roles=list(UserRole),
+    )
+
+
+@admin.route("/api/users")
+@admin_required
+def api_users():
+    users, next_after = _user_page_from_request()
+    return jsonify(users=[user.to_dict() for user in users], next=next_after)
@@ -1,16 +1,37 @@
 # Import the User Database Model
+from app.models import TaskTag
 from flask_wtf import FlaskForm
 # Form Fields
-from wtforms import  StringField, SubmitField
+from wtforms import  DateTimeLocalField, StringField, SubmitField
 # Form Validators for Form fields
-from wtforms.validators import DataRequired
+from wtforms.validators import DataRequired, Optional, ValidationError
 
+from .utils import MAX_TAGS, parse_tags
 
+_DATETIME_FORMAT = '%Y-%m-%dT%H:%M'
 
-class TaskForm(FlaskForm):
+
+class _ScheduleMixin(object):
+    tags = StringField(label='Tags (comma separated)', validators=[Optional()])
+    due_at = DateTimeLocalField(label='Due', format=_DATETIME_FORMAT, validators=[Optional()])
+    remind_at = DateTimeLocalField(label='Remind me at', format=_DATETIME_FORMAT, validators=[Optional()])
+
+    def validate_tags(self, field):
+        tags = parse_tags(field.data)
+        if len(tags) > MAX_TAGS:
+            raise ValidationError(f'A task can have at most {MAX_TAGS} tags.')
+        if any(len(tag) > TaskTag.MAX_LENGTH for tag in tags):
+            raise ValidationError(f'Tags must be at most {TaskTag.MAX_LENGTH} characters long.')
+
+    def validate_remind_at(self, field):
+        if field.data and self.due_at.data and field.data > self.due_at.data:
+            raise ValidationError('The reminder must not be after the due date.')
+
+
+class TaskForm(_ScheduleMixin, FlaskForm):
     task_name = StringField(label='Task Description', validators=[DataRequired()])
     submit = SubmitField(label='Add Task')
 
-class UpdateTaskForm(FlaskForm):
+class UpdateTaskForm(_ScheduleMixin, FlaskForm):
     task_name = StringField(label='Update Task Description', validators=[DataRequired()])
     submit = SubmitField(label='Save Changes')
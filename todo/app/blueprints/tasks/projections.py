@@ -0,0 +1,91 @@
+from collections import defaultdict
+from typing import Dict, Iterator, List, Sequence
+
+from app.models import Task, TaskTag
+from sqlalchemy import Select, select, tuple_
+from sqlalchemy.orm import Session
+
+# The columns list views, exports and the API read; never the whole entity
+TASK_COLUMNS = (Task.id, Task.content, Task.date_posted, Task.due_at, Task.remind_at, Task.rank, Task.completed_at)
+
+
+class TaskRow(object):
+    """
+    A read-only view of one task for rendering and serialising.
+
+    Built straight from result tuples: no identity map entry, no attribute
+    instrumentation, no per-instance __dict__.
+    """
+
+    __slots__ = ("id", "content", "date_posted", "due_at", "remind_at", "rank", "tag_names", "completed_at")
+
+    def __init__(self, id, content, date_posted, due_at, remind_at, rank, tag_names=(), completed_at=None):
+        self.id = id
+        self.content = content
+        self.date_posted = date_posted
+        self.due_at = due_at
+        self.remind_at = remind_at
+        self.rank = rank
+        self.tag_names = tag_names
+        self.completed_at = completed_at
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "content": self.content,
+            "date_posted": self.date_posted.isoformat(),
+            "due_at": self.due_at.isoformat() if self.due_at else None,
+            "remind_at": self.remind_at.isoformat() if self.remind_at else None,
+            "tags": list(self.tag_names),
+            "completed_at": self.completed_at.isoformat() if self.completed_at else None,
+        }
+
+
+def task_columns() -> Select:
+    return select(*TASK_COLUMNS)
+
+
+def tag_names_for(session: Session, user_id: int, task_ids: Sequence[int]) -> Dict[int, List[str]]:
+    """Tags of the given tasks in one query, as {task_id: sorted names}."""
+    names: Dict[int, List[str]] = defaultdict(list)
+    if task_ids:
+        rows = session.execute(
+            select(TaskTag.task_id, TaskTag.tag)
+            .where(TaskTag.user_id == user_id, TaskTag.task_id.in_(task_ids))
+            .order_by(TaskTag.task_id, TaskTag.tag)
+        )
+        for task_id, tag in rows:
+            names[task_id].append(tag)
+    return names
+
+
+def load_task_rows(session: Session, user_id: int, query: Select) -> List[TaskRow]:
+    """Runs a `task_columns()` query and attaches each row's tags."""
+    rows = session.execute(query).all()
+    names = tag_names_for(session, user_id, [row.id for row in rows])
+    return [TaskRow(**row._mapping, tag_names=names.get(row.id, [])) for row in rows]
+
+
+def iter_task_rows(session: Session, user_id: int, batch_size: int = 1000) -> Iterator[TaskRow]:
+    """
+    Every task of a user: the open ones in list order, then the done ones
+    most recently completed first, each read from its own partial index in
+    keyset batches so memory stays flat however many tasks there are.
+    """
+    query = task_columns().where(Task.user_id == user_id).limit(batch_size)
+    open_query = query.where(Task.completed_at.is_(None)).order_by(Task.rank, Task.id)
+    batch = load_task_rows(session, user_id, open_query)
+    while batch:
+        yield from batch
+        last = batch[-1]
+        batch = load_task_rows(
+            session, user_id, open_query.where(tuple_(Task.rank, Task.id) > tuple_(last.rank, last.id))
+        )
+    done_query = query.where(Task.completed_at.isnot(None)).order_by(Task.completed_at.desc(), Task.id.desc())
+    batch = load_task_rows(session, user_id, done_query)
+    while batch:
+        yield from batch
+        last = batch[-1]
+        batch = load_task_rows(
+            session, user_id, done_query.where(tuple_(Task.completed_at, Task.id) < tuple_(last.completed_at, last.id))
+        )
@@ -0,0 +1,191 @@
+from datetime import datetime
+from typing import Iterable, List, Optional
+
+from app.models import Task, TaskTag
+from app.ranking import rank_between, rebalance_user
+from sqlalchemy import and_, exists, select, tuple_, union, update
+from sqlalchemy.orm import Session, aliased
+
+from .projections import load_task_rows, task_columns
+
+MATCH_ALL = "all"
+MATCH_ANY = "any"
+
+# Most tags a task may carry, and most a filter may combine
+MAX_TAGS = 10
+
+
+def parse_tags(raw: Optional[str]) -> List[str]:
+    """Turns "Work, home ,work" into ["work", "home"]: lowercased, unique, in order."""
+    tags = []
+    for name in (raw or "").split(","):
+        name = name.strip().lower()
+        if name and name not in tags:
+            tags.append(name)
+    return tags
+
+
+def tagged_task_ids(user_id: int, tags: List[str], match: str, after: int, limit: int):
+    """
+    Ids of the user's tasks carrying all (or any) of `tags`, above `after`,
+    in id order, as a select.
+
+    Both forms only walk the `task_tags` primary key (user_id, tag, task_id),
+    whose per-tag ranges are already sorted by task id, so a page costs
+    about `limit` index entries per tag however many tasks the user has.
+    """
+    if match == MATCH_ALL:
+        # Walk the first tag's range; probe the key for each other tag
+        first = aliased(TaskTag)
+        query = select(first.task_id).where(
+            first.user_id == user_id, first.tag == tags[0], first.task_id > after
+        )
+        for tag in tags[1:]:
+            other = aliased(TaskTag)
+            query = query.where(
+                exists().where(and_(other.user_id == user_id, other.tag == tag, other.task_id == first.task_id))
+            )
+        return query.order_by(first.task_id).limit(limit)
+
+    # One bounded range scan per tag, merged and trimmed to the page
+    per_tag = [
+        select(
+            select(TaskTag.task_id)
+            .where(TaskTag.user_id == user_id, TaskTag.tag == tag, TaskTag.task_id > after)
+            .order_by(TaskTag.task_id)
+            .limit(limit)
+            .subquery()
+        )
+        for tag in tags
+    ]
+    merged = union(*per_tag).subquery()
+    return select(merged.c.task_id).order_by(merged.c.task_id).limit(limit)
+
+
+def _live(query, since: Optional[datetime]):
+    # Tasks posted before `since` are left to the archive read-through
+    return query if since is None else query.where(Task.date_posted >= since)
+
+
+def task_page(session: Session, user_id: int, tags: Iterable[str] = (), match: str = MATCH_ALL,
+              after: Optional[str] = None, per_page: int = 50, since: Optional[datetime] = None):
+    """
+    One keyset page of a user's tasks posted since `since`, optionally
+    filtered by tags, as `TaskRow`s.
+
+    Unfiltered pages list the open tasks in the user's own order, (rank,
+    id), from `ix_task_open_rank`, with a "rank.id" cursor; tag filters
+    list open and done tasks by id with an id cursor.
+    Returns the tasks and the cursor for the next page, or None on the
+    last page. Raises ValueError for a malformed cursor.
+    """
+    tags = list(tags)
+    if tags:
+        last_id = int(after) if after else 0
+        ids = session.execute(tagged_task_ids(user_id, tags, match, last_id, per_page + 1)).scalars().all()
+        # The cursor follows the tag index, which still lists tasks older than `since`
+        query = _live(task_columns().where(Task.id.in_(ids[:per_page])), since).order_by(Task.id)
+        tasks = load_task_rows(session, user_id, query)
+        return tasks, (str(ids[per_page - 1]) if len(ids) > per_page else None)
+    query = _live(task_columns().where(Task.user_id == user_id, Task.completed_at.is_(None)), since)
+    if after:
+        last_rank, _, last_id = after.rpartition(".")
+        query = query.where(tuple_(Task.rank, Task.id) > tuple_(last_rank, int(last_id)))
+    query = query.order_by(Task.rank, Task.id).limit(per_page + 1)
+    tasks = load_task_rows(session, user_id, query)
+    if len(tasks) <= per_page:
+        return tasks, None
+    tasks, last = tasks[:per_page], tasks[per_page - 1]
+    return tasks, f"{last.rank}.{last.id}"
+
+
+def done_page(session: Session, user_id: int, before: Optional[str] = None, per_page: int = 50,
+              since: Optional[datetime] = None):
+    """
+    One keyset page of a user's done tasks posted since `since`, most
+    recently completed first, from `ix_task_done`. The cursor is
+    "completed_at_id"; returns the tasks and the next cursor, or None on the
+    last page. Raises ValueError for a malformed cursor.
+    """
+    query = _live(task_columns().where(Task.user_id == user_id, Task.completed_at.isnot(None)), since)
+    if before:
+        completed_at, _, last_id = before.rpartition("_")
+        query = query.where(
+            tuple_(Task.completed_at, Task.id) < tuple_(datetime.fromisoformat(completed_at), int(last_id))
+        )
+    query = query.order_by(Task.completed_at.desc(), Task.id.desc()).limit(per_page + 1)
+    tasks = load_task_rows(session, user_id, query)
+    if len(tasks) <= per_page:
+        return tasks, None
+    tasks, last = tasks[:per_page], tasks[per_page - 1]
+    return tasks, f"{last.completed_at.isoformat()}_{last.id}"
+
+
+def set_completed(session: Session, user_id: int, task_ids: Iterable[int], completed: bool,
+                  now: Optional[datetime] = None, since: Optional[datetime] = None) -> List[int]:
+    """
+    Completes (or reopens) those of `task_ids` that are the user's, posted
+    since `since` and not already in that state, in one UPDATE; returns
+    their ids. Does not commit.
+    """
+    task_ids = set(task_ids)
+    if not task_ids:
+        return []
+    table = Task.__table__
+    state = table.c.completed_at.is_(None) if completed else table.c.completed_at.isnot(None)
+    live = [] if since is None else [table.c.date_posted >= since]
+    return session.execute(
+        update(table)
+        .where(table.c.user_id == user_id, table.c.id.in_(task_ids), state, *live)
+        .values(completed_at=(now or datetime.now()) if completed else None)
+        .returning(table.c.id)
+    ).scalars().all()
+
+
+def last_rank(session: Session, user_id: int, since: Optional[datetime] = None) -> Optional[str]:
+    """The rank of the user's last open task, read from the end of `ix_task_open_rank`."""
+    return session.execute(
+        _live(select(Task.rank).where(Task.user_id == user_id, Task.completed_at.is_(None)), since)
+        .order_by(Task.rank.desc(), Task.id.desc())
+        .limit(1)
+    ).scalar()
+
+
+def _neighbour(session: Session, task: Task, anchor: Task, following: bool,
+               since: Optional[datetime]) -> Optional[Task]:
+    # The open task directly after (or before) `anchor` in list order, skipping `task`
+    key, anchor_key = tuple_(Task.rank, Task.id), tuple_(anchor.rank, anchor.id)
+    query = _live(
+        select(Task).where(Task.user_id == task.user_id, Task.completed_at.is_(None), Task.id != task.id), since
+    )
+    if following:
+        query = query.where(key > anchor_key).order_by(Task.rank, Task.id)
+    else:
+        query = query.where(key < anchor_key).order_by(Task.rank.desc(), Task.id.desc())
+    return session.execute(query.limit(1)).scalar()
+
+
+def rank_for_move(session: Session, task: Task, before: Optional[Task], after: Optional[Task],
+                  since: Optional[datetime] = None) -> str:
+    """
+    The rank placing `task` directly after `before`, or directly ahead of
+    `after` when `before` is None (the top of the list when both are).
+    Neighbours are re-read from the index, so a stale page cannot skip
+    tasks; if they share a rank the user's list is renumbered first.
+    """
+    if before is None and after is None:
+        after = session.execute(
+            _live(select(Task).where(Task.user_id == task.user_id, Task.completed_at.is_(None), Task.id != task.id),
+                  since)
+            .order_by(Task.rank, Task.id)
+            .limit(1)
+        ).scalar()
+    if before is not None:
+        after = _neighbour(session, task, before, following=True, since=since)
+    elif after is not None:
+        before = _neighbour(session, task, after, following=False, since=since)
+
+    if before is not None and after is not None and before.rank >= after.rank:
+        # Equal ranks (rows created without one) leave no key in between
+        rebalance_user(session, task.user_id)
+    return rank_between(before.rank if before else None, after.rank if after else None)
@@ -1,59 +1,369 @@
-from app import  db
+import csv
+import io
+from datetime import datetime
+
+from app import csrf, db, group_commit, idempotency, task_shards
+from app.archive import archive_page
+from app.sharding import ShardMoveInProgress
 # Import the forms
 from .forms import TaskForm, UpdateTaskForm
+from .projections import TaskRow, iter_task_rows
+from .utils import (MATCH_ALL, MATCH_ANY, MAX_TAGS, done_page, last_rank, parse_tags, rank_for_move,
+                    set_completed, task_page)
 # Import the Models
-from app.models import Task, User
-from flask import flash, redirect, render_template, request, url_for, Blueprint
+from app.models import Task, TaskTag
+from app.models.tasks import task_by_id
+from app.partitioning import live_since
+from app.outbox import (TASK_COMPLETED, TASK_CREATED, TASK_DELETED, TASK_UNCOMPLETED, TASK_UPDATED, next_seq,
+                        record, task_payload)
+from app.ranking import rank_between, rebalance_in_background, rebalance_user
+from flask import (abort, current_app, flash, jsonify, make_response, redirect, render_template, request,
+                   stream_with_context, url_for, Blueprint, Response)
 # Import 
 from flask_login import current_user, login_required
 
 tasks = Blueprint("tasks", __name__)
 
+# Most tasks one bulk complete or reopen may name
+MAX_BULK_TASKS = 500
+
+
+def _since():
+    # Tasks older than the archive cutoff are read-only and listed under /tasks/archive
+    return live_since(current_app.config['TASK_ARCHIVE_AFTER_MONTHS'])
+
+
+def _get_own_task_or_404(session, task_id):
+    """Loads one of the current user's live tasks from the shard holding them."""
+    task = task_by_id.get(session, task_id, min_date_posted=_since())
+    if task is None or task.user_id != current_user.id:
+        abort(404)
+    return task
+
+
+@tasks.errorhandler(ShardMoveInProgress)
+def shard_move_in_progress(_):
+    flash('Your tasks are being moved, please try again in a moment.', 'warning')
+    return redirect(url_for('tasks.all_tasks'))
+
+
+def _task_page_from_request():
+    """Reads the tag filter and cursor from the query string and loads that page."""
+    tags = parse_tags(request.args.get('tags'))[:MAX_TAGS]
+    match = MATCH_ANY if request.args.get('match') == MATCH_ANY else MATCH_ALL
+    after = request.args.get('after')
+    session = task_shards.session_for(current_user)
+    try:
+        tasks, next_after = task_page(
+            session, current_user.id, tags, match, after, current_app.config['TASKS_PER_PAGE'], since=_since()
+        )
+    except ValueError:
+        abort(400)
+    return tasks, next_after, tags, match
+
 
 @tasks.route("/all_tasks")
 @login_required
 def all_tasks():
-    tasks = User.query.filter_by(username=current_user.username).first().tasks
-    return render_template('all_tasks.html', title='All Tasks', tasks=tasks)
+    tasks, next_after, tags, match = _task_page_from_request()
+    return render_template(
+        'all_tasks.html', title='All Tasks', tasks=tasks, tags=tags, match=match, next_after=next_after
+    )
+
+
+@tasks.route("/api/tasks")
+@login_required
+def api_tasks():
+    tasks, next_after, _, _ = _task_page_from_request()
+    return jsonify(tasks=[task.to_dict() for task in tasks], next=next_after)
+
+
+@tasks.route("/done")
+@login_required
+def done_tasks():
+    """Completed tasks, most recent first, paged separately from the open list."""
+    session = task_shards.session_for(current_user)
+    try:
+        tasks, next_before = done_page(
+            session, current_user.id, request.args.get('before'), current_app.config['TASKS_PER_PAGE'],
+            since=_since()
+        )
+    except ValueError:
+        abort(400)
+    return render_template('done_tasks.html', title='Done Tasks', tasks=tasks, next_before=next_before)
+
+
+@tasks.route("/archive")
+@login_required
+def archived_tasks():
+    """Read-only scroll-back into archived months, newest first."""
+    try:
+        before = datetime.strptime(request.args['before'], '%Y-%m').date() if 'before' in request.args else None
+    except ValueError:
+        abort(400)
+    month, rows, older = archive_page(current_user.id, before, session=task_shards.session_for(current_user),
+                                      since=_since())
+    return render_template(
+        'archived_tasks.html', title='Archived Tasks', month=month, tasks=[TaskRow(*row) for row in rows], older=older
+    )
+
+
+@tasks.route("/export")
+@login_required
+def export_tasks():
+    """Streams all of the user's tasks as CSV, a batch at a time."""
+    session = task_shards.session_for(current_user)
+    user_id = current_user.id
+
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(['id', 'content', 'date_posted', 'due_at', 'remind_at', 'tags', 'completed_at'])
+        for count, task in enumerate(iter_task_rows(session, user_id), 1):
+            writer.writerow([task.id, task.content, task.date_posted, task.due_at or '',
+                             task.remind_at or '', ' '.join(task.tag_names), task.completed_at or ''])
+            if count % 500 == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/csv',
+        headers={'Content-Disposition': 'attachment; filename=tasks.csv'},
+    )
+
+
+def _create_task(form, respond):
+    """
+    Adds the task described by a validated `TaskForm` and returns
+    `respond(task_id)`, which is built before the commit so an
+    Idempotency-Key completes in the same transaction as the task.
+    """
+    session = task_shards.writable_session_for(current_user)
+    tags = parse_tags(form.tags.data)
+    claim = idempotency.current_claim()
+    if group_commit.enabled:
+        user_id = current_user.id
+        since = _since()
+        # Taken here, under this request's lock on the user: the batch leader
+        # runs the hooks below and must not wait on another request's user
+        user_seq = next_seq(db.session, user_id)
+        responses = []
+        values = {
+            'content': form.task_name.data,
+            'user_id': user_id,
+            'due_at': form.due_at.data,
+            'remind_at': form.remind_at.data,
+        }
+
+        # Both hooks run in the batch leader's request and transaction, so
+        # nothing here may read current_user
+        def place_last(batch_session, earlier):
+            # New tasks go to the end of the list, after this user's rows ahead in the batch
+            ranks = [row['rank'] for row in earlier if row['user_id'] == user_id and row.get('rank')]
+            values['rank'] = rank_between(ranks[-1] if ranks else last_rank(batch_session, user_id, since), None)
+
+        def add_tags_and_record(batch_session, task_id):
+            if tags:
+                batch_session.execute(
+                    TaskTag.__table__.insert(),
+                    [{'user_id': user_id, 'tag': tag, 'task_id': task_id} for tag in tags],
+                )
+            record(batch_session, user_id, TASK_CREATED, user_seq=user_seq,
+                   **task_payload(task_id, form.task_name.data, form.due_at.data, form.remind_at.data, tags))
+            # Kept from the last attempt: a failed batch is retried row by row
+            responses[:] = [make_response(respond(task_id))]
+            idempotency.complete_in(batch_session, claim, responses[0])
+
+        group_commit.insert(session, Task.__table__, values, then=add_tags_and_record, prepare=place_last)
+        db.session.commit()
+        return responses[0]
+    # New tasks go to the end of the user's list
+    rank = rank_between(last_rank(session, current_user.id, _since()), None)
+    task = Task(
+        content=form.task_name.data,
+        user_id=current_user.id,
+        due_at=form.due_at.data,
+        remind_at=form.remind_at.data,
+        rank=rank,
+    )
+    task.set_tags(tags)
+    session.add(task)
+    session.flush()
+    record(session, current_user.id, TASK_CREATED,
+           **task_payload(task.id, task.content, task.due_at, task.remind_at, tags))
+    response = make_response(respond(task.id))
+    idempotency.complete_in(session, claim, response)
+    task_shards.commit(session)
+    return response
 
 
 @tasks.route("/add_task", methods=['POST', 'GET'])
 @login_required
+@idempotency.idempotent
 def add_task():
     form = TaskForm()
     if form.validate_on_submit():
-        task = Task(content=form.task_name.data, author=current_user)
-        db.session.add(task)
-        db.session.commit()
+        response = _create_task(form, lambda task_id: redirect(url_for('tasks.add_task')))
         flash('Task Created', 'success')
-        return redirect(url_for('tasks.add_task'))
+        return response
     return render_template('add_task.html', form=form, title='Add Task')
 
 
+@tasks.route("/api/tasks", methods=['POST'])
+@csrf.exempt
+@login_required
+@idempotency.idempotent
+def api_create_task():
+    """
+    Creates a task from a JSON (or form) body; safe to retry with an
+    Idempotency-Key. JSON clients send no CSRF token: a cross-site page
+    cannot post JSON without a CORS preflight. Form bodies still need one.
+    """
+    if not request.is_json:
+        csrf.protect()
+    form = TaskForm(meta={'csrf': False})
+    if not form.validate_on_submit():
+        return jsonify(errors=form.errors), 400
+    return _create_task(form, lambda task_id: (
+        jsonify(id=task_id), 201, {'Location': url_for('tasks.update_task', task_id=task_id)}
+    ))
+
+
 @tasks.route("/all_tasks/<int:task_id>/update_task", methods=['GET', 'POST'])
 @login_required
 def update_task(task_id):
-    task = Task.query.get_or_404(task_id)
+    session = task_shards.session_for(current_user)
+    task = _get_own_task_or_404(session, task_id)
     form = UpdateTaskForm()
     if form.validate_on_submit():
-        if form.task_name.data != task.content:
-            task.content = form.task_name.data
-            db.session.commit()
+        changes = {
+            'content': form.task_name.data,
+            'due_at': form.due_at.data,
+            'remind_at': form.remind_at.data,
+        }
+        tags = parse_tags(form.tags.data)
+        if tags != task.tag_names or any(getattr(task, field) != value for field, value in changes.items()):
+            task_shards.writable_session_for(current_user)
+            if task.remind_at != changes['remind_at']:
+                # A new reminder time re-arms the reminder
+                task.reminder_sent_at = None
+            for field, value in changes.items():
+                setattr(task, field, value)
+            task.set_tags(tags)
+            record(session, current_user.id, TASK_UPDATED,
+                   **task_payload(task.id, task.content, task.due_at, task.remind_at, tags))
+            task_shards.commit(session)
             flash('Task Updated', 'success')
-            return redirect(url_for('all_tasks'))
+            return redirect(url_for('tasks.all_tasks'))
         else:
             flash('No Changes Made', 'warning')
             return redirect(url_for('tasks.all_tasks'))
     elif request.method == 'GET':
         form.task_name.data = task.content
+        form.due_at.data = task.due_at
+        form.remind_at.data = task.remind_at
+        form.tags.data = ', '.join(task.tag_names)
     return render_template('add_task.html', title='Update Task', form=form)
 
 
+@tasks.route("/all_tasks/<int:task_id>/move", methods=['POST'])
+@login_required
+def move_task(task_id):
+    """Drops a task after `before_id`, or ahead of `after_id`; writes one row."""
+    session = task_shards.writable_session_for(current_user)
+    task = _get_own_task_or_404(session, task_id)
+    neighbours = [request.form.get(name, type=int) for name in ('before_id', 'after_id')]
+    if task_id in neighbours:
+        abort(400)
+    before, after = [_get_own_task_or_404(session, id) if id else None for id in neighbours]
+    rank = rank_for_move(session, task, before, after, since=_since())
+    if len(rank) > Task.RANK_LENGTH:
+        # Too long to store: renumber now and place the task again
+        rebalance_user(session, current_user.id)
+        rank = rank_for_move(session, task, before, after, since=_since())
+    task.rank = rank
+    session.commit()
+    if len(rank) > current_app.config['TASK_RANK_MAX_LENGTH']:
+        rebalance_in_background(current_app._get_current_object(), current_user.task_shard, current_user.id)
+    return jsonify(id=task.id, rank=task.rank)
+
+
 @tasks.route("/all_tasks/<int:task_id>/delete_task")
 @login_required
 def delete_task(task_id):
-    task = Task.query.get_or_404(task_id)
-    db.session.delete(task)
-    db.session.commit()
+    session = task_shards.writable_session_for(current_user)
+    task = _get_own_task_or_404(session, task_id)
+    session.delete(task)
+    record(session, current_user.id, TASK_DELETED, id=task.id)
+    task_shards.commit(session)
     flash('Task Deleted', 'info')
     return redirect(url_for('tasks.all_tasks'))
+
+
+def _set_completed(task_ids, completed):
+    """Completes or reopens the current user's `task_ids`, queueing an event for each task that changed."""
+    session = task_shards.writable_session_for(current_user)
+    now = datetime.now()
+    changed = set_completed(session, current_user.id, task_ids, completed, now, since=_since())
+    for task_id in changed:
+        if completed:
+            record(session, current_user.id, TASK_COMPLETED, id=task_id, completed_at=now)
+        else:
+            record(session, current_user.id, TASK_UNCOMPLETED, id=task_id)
+    task_shards.commit(session)
+    return changed
+
+
+def _bulk_task_ids():
+    """The task ids a bulk action names: a JSON `ids` list, or repeated `task_ids` form fields."""
+    if request.is_json:
+        ids = (request.get_json(silent=True) or {}).get('ids')
+        if not isinstance(ids, list) or not all(isinstance(id, int) for id in ids):
+            abort(400)
+    else:
+        ids = request.form.getlist('task_ids', type=int)
+    if len(ids) > MAX_BULK_TASKS:
+        abort(400)
+    return ids
+
+
+def _completion_response(changed, message, endpoint):
+    if request.is_json:
+        return jsonify(ids=changed)
+    flash(message, 'success' if changed else 'warning')
+    return redirect(url_for(endpoint))
+
+
+@tasks.route("/all_tasks/<int:task_id>/complete", methods=['POST'])
+@login_required
+def complete_task(task_id):
+    _get_own_task_or_404(task_shards.session_for(current_user), task_id)
+    changed = _set_completed([task_id], True)
+    return _completion_response(changed, 'Task Completed' if changed else 'Task Already Done', 'tasks.all_tasks')
+
+
+@tasks.route("/all_tasks/<int:task_id>/uncomplete", methods=['POST'])
+@login_required
+def uncomplete_task(task_id):
+    _get_own_task_or_404(task_shards.session_for(current_user), task_id)
+    changed = _set_completed([task_id], False)
+    return _completion_response(changed, 'Task Reopened' if changed else 'Task Already Open', 'tasks.done_tasks')
+
+
+@tasks.route("/complete", methods=['POST'])
+@login_required
+def complete_tasks():
+    """Completes several tasks at once; ids that are not the user's or already done are skipped."""
+    changed = _set_completed(_bulk_task_ids(), True)
+    return _completion_response(changed, f'{len(changed)} Tasks Completed', 'tasks.all_tasks')
+
+
+@tasks.route("/uncomplete", methods=['POST'])
+@login_required
+def uncomplete_tasks():
+    """Reopens several tasks at once; ids that are not the user's or still open are skipped."""
+    changed = _set_completed(_bulk_task_ids(), False)
+    return _completion_response(changed, f'{len(changed)} Tasks Reopened', 'tasks.done_tasks')
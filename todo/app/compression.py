@@ -0,0 +1,218 @@
+import gzip
+import hashlib
+import logging
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import brotli
+import zstandard
+from flask import Response, current_app, request
+from flask_compress import Compress
+
+# Logger configuration
+logger = logging.getLogger(__name__)
+
+# Per content type: algorithms in server preference order mapped to
+# (level, level used while the host is busy).
+DEFAULT_COMPRESS_POLICY: Dict[str, Dict[str, Tuple[int, int]]] = {
+    "text/html": {"br": (4, 1), "gzip": (6, 1)},
+    "text/css": {"br": (5, 1), "gzip": (6, 1)},
+    "text/javascript": {"br": (5, 1), "gzip": (6, 1)},
+    "application/javascript": {"br": (5, 1), "gzip": (6, 1)},
+    "application/json": {"gzip": (6, 1), "br": (4, 1)},
+    "text/xml": {"gzip": (6, 1)},
+}
+
+# How long a load-average sample is trusted, in seconds
+_LOAD_SAMPLE_TTL = 1.0
+
+
+class _LRUCache(object):
+    """A small thread-safe LRU bounded by entry count and total bytes."""
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._data: "OrderedDict[tuple, bytes]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> Optional[bytes]:
+        with self._lock:
+            value = self._data.get(key)
+            if value is not None:
+                self._data.move_to_end(key)
+            return value
+
+    def set(self, key: tuple, value: bytes) -> None:
+        if self.max_entries <= 0 or len(value) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._data.pop(key, None)
+            if previous is not None:
+                self._size -= len(previous)
+            self._data[key] = value
+            self._size += len(value)
+            while len(self._data) > self.max_entries or self._size > self.max_bytes:
+                _, evicted = self._data.popitem(last=False)
+                self._size -= len(evicted)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._size = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class CompressionStats(object):
+    """Process-wide counters describing what compression costs and saves."""
+
+    _FIELDS = ("compressed", "skipped_small", "cache_hits", "cache_misses", "bytes_in", "bytes_out", "cpu_seconds")
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters = dict.fromkeys(self._FIELDS, 0)
+
+    def add(self, **values) -> None:
+        with self._lock:
+            for key, value in values.items():
+                self._counters[key] += value
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            data = dict(self._counters)
+        data["bytes_saved"] = data["bytes_in"] - data["bytes_out"]
+        data["cpu_seconds"] = round(data["cpu_seconds"], 6)
+        return data
+
+
+class AdaptiveCompress(Compress):
+    """
+    Flask-Compress with a per content-type policy, a load-aware level,
+    a size floor and an LRU of compressed bodies keyed by content.
+
+    Identical pages (login, register, error pages) are compressed once per
+    process and served from the cache afterwards.
+    """
+
+    def init_app(self, app) -> None:
+        app.config.setdefault("COMPRESS_POLICY", DEFAULT_COMPRESS_POLICY)
+        app.config.setdefault("COMPRESS_HIGH_LOAD", 0.75)
+        app.config.setdefault("COMPRESS_RESPONSE_CACHE_SIZE", 256)
+        app.config.setdefault("COMPRESS_RESPONSE_CACHE_BYTES", 8 * 1024 * 1024)
+        app.config.setdefault("COMPRESS_STATS_INTERVAL", 1000)
+        super().init_app(app)
+
+        self.response_cache = _LRUCache(
+            app.config["COMPRESS_RESPONSE_CACHE_SIZE"],
+            app.config["COMPRESS_RESPONSE_CACHE_BYTES"],
+        )
+        self.stats = CompressionStats()
+        self._load_sample = (0.0, False)
+
+    def _host_is_busy(self, app) -> bool:
+        sampled_at, busy = self._load_sample
+        now = time.monotonic()
+        if now - sampled_at < _LOAD_SAMPLE_TTL:
+            return busy
+        try:
+            busy = os.getloadavg()[0] / (os.cpu_count() or 1) >= app.config["COMPRESS_HIGH_LOAD"]
+        except (AttributeError, OSError):
+            busy = False
+        self._load_sample = (now, busy)
+        return busy
+
+    def _choose_policy(self, app, mimetype: str) -> Optional[Tuple[str, int]]:
+        """Picks the preferred algorithm the client accepts and its level."""
+        policy = app.config["COMPRESS_POLICY"].get(mimetype)
+        if not policy:
+            return None
+        accepted = request.accept_encodings
+        for algorithm, (level, busy_level) in policy.items():
+            if algorithm in self.enabled_algorithms and accepted[algorithm]:
+                return algorithm, busy_level if self._host_is_busy(app) else level
+        return None
+
+    def after_request(self, response: Response) -> Response:
+        app = self.app or current_app
+
+        vary = response.headers.get("Vary")
+        if not vary:
+            response.headers["Vary"] = "Accept-Encoding"
+        elif "accept-encoding" not in vary.lower():
+            response.headers["Vary"] = f"{vary}, Accept-Encoding"
+
+        if (
+            response.mimetype not in app.config["COMPRESS_MIMETYPES"]
+            or response.status_code < 200
+            or response.status_code >= 300
+            or "Content-Encoding" in response.headers
+            or (response.is_streamed and app.config["COMPRESS_STREAMS"] is False)
+        ):
+            return response
+
+        choice = self._choose_policy(app, response.mimetype)
+        if choice is None:
+            return response
+
+        response.direct_passthrough = False
+        data = response.get_data()
+        if len(data) < app.config["COMPRESS_MIN_SIZE"]:
+            self.stats.add(skipped_small=1)
+            return response
+
+        algorithm, level = choice
+        etag, _ = response.get_etag()
+        key = (etag or hashlib.blake2b(data, digest_size=16).digest(), algorithm, level)
+        compressed = self.response_cache.get(key)
+        if compressed is None:
+            started = time.process_time()
+            compressed = self.compress_data(data, algorithm, level)
+            self.stats.add(cache_misses=1, cpu_seconds=time.process_time() - started)
+            self.response_cache.set(key, compressed)
+        else:
+            self.stats.add(cache_hits=1)
+        self.stats.add(compressed=1, bytes_in=len(data), bytes_out=len(compressed))
+
+        response.set_data(compressed)
+        response.headers["Content-Encoding"] = algorithm
+        response.headers["Content-Length"] = response.content_length
+
+        # Keep validators distinct per encoding, as Flask-Compress does
+        etag_header = response.headers.get("ETag")
+        if etag_header:
+            response.headers["ETag"] = f'{etag_header[:-1]}:{algorithm}"'
+
+        self._maybe_report(app)
+        return response
+
+    @staticmethod
+    def compress_data(data: bytes, algorithm: str, level: int) -> bytes:
+        if algorithm == "br":
+            return brotli.compress(data, quality=level)
+        if algorithm == "gzip":
+            return gzip.compress(data, compresslevel=level)
+        if algorithm == "deflate":
+            return zlib.compress(data, level)
+        if algorithm == "zstd":
+            return zstandard.ZstdCompressor(level).compress(data)
+        raise ValueError(f"Unsupported compression algorithm: {algorithm}")
+
+    def _maybe_report(self, app) -> None:
+        interval = app.config["COMPRESS_STATS_INTERVAL"]
+        stats = self.stats.snapshot()
+        if interval and stats["compressed"] % interval == 0:
+            logger.info(
+                f"Compression: {stats['compressed']} responses, {stats['bytes_saved']} bytes saved, "
+                f"{stats['cpu_seconds']}s CPU, {stats['cache_hits']} cache hits"
+            )
@@ -0,0 +1,146 @@
+import logging
+import threading
+from typing import Callable, Dict, List, Optional
+
+from flask import Flask, current_app
+from sqlalchemy import Table, insert
+from sqlalchemy.orm import Session
+
+# Logger configuration
+logger = logging.getLogger(__name__)
+
+# Called with the batch's session and the values of the rows ahead in the
+# batch, before the INSERT; may fill in values read from the database
+BeforeInsert = Callable[[Session, List[dict]], None]
+# Called with the batch's session and the new row's id before the commit
+AfterInsert = Callable[[Session, int], None]
+
+
+class _PendingRow(object):
+    __slots__ = ("values", "prepare", "then", "done", "row_id", "error")
+
+    def __init__(self, values: dict, then: Optional[AfterInsert] = None, prepare: Optional[BeforeInsert] = None):
+        self.values = values
+        self.prepare = prepare
+        self.then = then
+        self.done = threading.Event()
+        self.row_id: Optional[int] = None
+        self.error: Optional[BaseException] = None
+
+
+class _Batch(object):
+    __slots__ = ("rows", "full")
+
+    def __init__(self):
+        self.rows: List[_PendingRow] = []
+        self.full = threading.Event()
+
+
+class GroupCommitWriter(object):
+    """
+    Coalesces single-row inserts from concurrent (green) threads into one
+    multi-row INSERT and one COMMIT per database and table.
+
+    The first caller into an empty batch leads it: it waits up to `window`
+    seconds, or until `max_batch` rows have joined, then writes them all in
+    one transaction on its own session. Every caller blocks until that
+    transaction commits and gets its own primary key back, so durability
+    matches a per-row commit.
+    If the batch fails, rows are retried one by one so one bad row fails
+    only its own caller. A caller's `prepare` hook fills in values that
+    depend on what is already stored (such as a list position) inside the
+    batch's transaction, and its `then` hook writes whatever must commit
+    with its row (such as tags and an outbox event) in the same transaction.
+    """
+
+    def __init__(self, window: float, max_batch: int):
+        self.window = window
+        self.max_batch = max_batch
+        self._lock = threading.Lock()
+        self._open: Dict[tuple, _Batch] = {}
+
+    def insert(self, session: Session, table: Table, values: dict, then: Optional[AfterInsert] = None,
+               prepare: Optional[BeforeInsert] = None) -> int:
+        row = _PendingRow(values, then, prepare)
+        key = (session.get_bind(), table)
+        with self._lock:
+            batch = self._open.get(key)
+            leader = batch is None
+            if leader:
+                batch = self._open[key] = _Batch()
+            batch.rows.append(row)
+            if len(batch.rows) >= self.max_batch:
+                # Close the batch so later callers start a new one
+                del self._open[key]
+                batch.full.set()
+
+        if leader:
+            batch.full.wait(self.window)
+            with self._lock:
+                if self._open.get(key) is batch:
+                    del self._open[key]
+            self._flush(session, table, batch.rows)
+
+        row.done.wait()
+        if row.error is not None:
+            raise row.error
+        return row.row_id
+
+    @staticmethod
+    def _flush(session: Session, table: Table, rows: List[_PendingRow]) -> None:
+        # The leader writes on its own session's connection, so a burst never
+        # needs more pool connections than the requests already hold.
+        statement = insert(table).returning(table.c.id, sort_by_parameter_order=True)
+        try:
+            for index, row in enumerate(rows):
+                if row.prepare is not None:
+                    row.prepare(session, [earlier.values for earlier in rows[:index]])
+            ids = session.execute(statement, [row.values for row in rows]).scalars().all()
+            for row, row_id in zip(rows, ids):
+                row.row_id = row_id
+                if row.then is not None:
+                    row.then(session, row_id)
+            session.commit()
+        except Exception:
+            session.rollback()
+            logger.warning(f"Group commit of {len(rows)} rows into {table.name} failed; retrying rows individually.")
+            for row in rows:
+                try:
+                    # Rows retried ahead of this one are already committed
+                    if row.prepare is not None:
+                        row.prepare(session, [])
+                    row.row_id = session.execute(insert(table).returning(table.c.id), row.values).scalar_one()
+                    if row.then is not None:
+                        row.then(session, row.row_id)
+                    session.commit()
+                except Exception as exc:
+                    session.rollback()
+                    row.error = exc
+        finally:
+            for row in rows:
+                row.done.set()
+
+
+class GroupCommit(object):
+    """Flask extension holding the per-worker `GroupCommitWriter`."""
+
+    def __init__(self, app: Optional[Flask] = None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        app.config.setdefault("TASK_GROUP_COMMIT", False)
+        app.config.setdefault("TASK_GROUP_COMMIT_WINDOW_MS", 5)
+        app.config.setdefault("TASK_GROUP_COMMIT_MAX_BATCH", 100)
+        app.extensions["group_commit"] = GroupCommitWriter(
+            app.config["TASK_GROUP_COMMIT_WINDOW_MS"] / 1000.0,
+            app.config["TASK_GROUP_COMMIT_MAX_BATCH"],
+        )
+
+    @property
+    def enabled(self) -> bool:
+        return bool(current_app.config["TASK_GROUP_COMMIT"])
+
+    def insert(self, session: Session, table: Table, values: dict, then: Optional[AfterInsert] = None,
+               prepare: Optional[BeforeInsert] = None) -> int:
+        return current_app.extensions["group_commit"].insert(session, table, values, then, prepare)
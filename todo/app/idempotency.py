@@ -0,0 +1,383 @@
+import base64
+import functools
+import hashlib
+import json
+import logging
+import secrets
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from flask import Flask, Response, current_app, g, jsonify, make_response, request
+from flask_login import current_user
+from sqlalchemy import case, delete, select, update
+from sqlalchemy.exc import IntegrityError
+
+from .utils import get_redis
+
+# Logger configuration
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+
+# Response headers kept with a stored response; cookies are never replayed
+_STORED_HEADERS = ("Content-Type", "Location")
+
+# How often a request waiting on an in-flight twin checks for its result
+_POLL_INTERVAL = 0.05
+
+
+@dataclass
+class IdempotencyRecord:
+    owner: str
+    fingerprint: str
+    status_code: Optional[int] = None
+    headers: Dict[str, str] = field(default_factory=dict)
+    body: bytes = b""
+
+    @property
+    def completed(self) -> bool:
+        return self.status_code is not None
+
+
+@dataclass
+class IdempotencyClaim:
+    """The key a request holds while its view runs."""
+    store: object
+    user_id: int
+    key: str
+    owner: str
+    fingerprint: str
+    ttl: float
+    completed: bool = False
+
+
+class SQLIdempotencyStore(object):
+    """Keys in the `idempotency_keys` table of the main database."""
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    def _connect(self):
+        # Each call is one statement in its own (auto-committed) transaction,
+        # independent of the request's session
+        return self.engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+
+    @staticmethod
+    def _record(row) -> IdempotencyRecord:
+        return IdempotencyRecord(
+            owner=row.owner,
+            fingerprint=row.fingerprint,
+            status_code=row.status_code,
+            headers=json.loads(row.headers) if row.headers else {},
+            body=row.body or b"",
+        )
+
+    def claim(self, user_id: int, key: str, fingerprint: str, owner: str, lock_ttl: float) -> IdempotencyRecord:
+        """
+        Takes the key for `owner` unless someone holds it; returns the record
+        now stored either way, in one round trip on Postgres and SQLite.
+        """
+        from app.models import IdempotencyKey
+
+        table = IdempotencyKey.__table__
+        now = datetime.now()
+        values = {
+            "user_id": user_id,
+            "key": key,
+            "fingerprint": fingerprint,
+            "owner": owner,
+            "status_code": None,
+            "headers": None,
+            "body": None,
+            "expires_at": now + timedelta(seconds=lock_ttl),
+        }
+        dialect = self.engine.dialect.name
+        with self._connect() as conn:
+            if dialect in ("postgresql", "sqlite"):
+                if dialect == "postgresql":
+                    from sqlalchemy.dialects.postgresql import insert
+                else:
+                    from sqlalchemy.dialects.sqlite import insert
+                statement = insert(table).values(**values)
+                # An expired key (stale lock or old response) is taken over
+                expired = table.c.expires_at < now
+                columns = ("fingerprint", "owner", "status_code", "headers", "body", "expires_at")
+                statement = statement.on_conflict_do_update(
+                    index_elements=[table.c.user_id, table.c.key],
+                    set_={name: case((expired, statement.excluded[name]), else_=table.c[name]) for name in columns},
+                ).returning(table.c.owner, table.c.fingerprint, table.c.status_code, table.c.headers, table.c.body)
+                return self._record(conn.execute(statement).one())
+            try:
+                conn.execute(table.insert().values(**values))
+                return self._record(_Row(values))
+            except IntegrityError:
+                return self.get(user_id, key)
+
+    def get(self, user_id: int, key: str) -> Optional[IdempotencyRecord]:
+        from app.models import IdempotencyKey
+
+        table = IdempotencyKey.__table__
+        with self._connect() as conn:
+            row = conn.execute(
+                select(table).where(table.c.user_id == user_id, table.c.key == key, table.c.expires_at >= datetime.now())
+            ).first()
+        return self._record(row) if row else None
+
+    @staticmethod
+    def _complete_statement(user_id: int, key: str, owner: str, record: IdempotencyRecord, ttl: float):
+        from app.models import IdempotencyKey
+
+        table = IdempotencyKey.__table__
+        return (
+            update(table)
+            .where(table.c.user_id == user_id, table.c.key == key, table.c.owner == owner)
+            .values(
+                status_code=record.status_code,
+                headers=json.dumps(record.headers),
+                body=record.body,
+                expires_at=datetime.now() + timedelta(seconds=ttl),
+            )
+        )
+
+    def complete(self, user_id: int, key: str, owner: str, record: IdempotencyRecord, ttl: float) -> None:
+        with self._connect() as conn:
+            conn.execute(self._complete_statement(user_id, key, owner, record, ttl))
+
+    def complete_in(self, session, user_id: int, key: str, owner: str, record: IdempotencyRecord, ttl: float) -> bool:
+        """
+        Completes the key inside `session`'s transaction, so it commits or
+        rolls back with the request's own writes. False, doing nothing, when
+        the session writes to another database (a task shard).
+        """
+        from app.models import IdempotencyKey
+
+        if session.get_bind(clause=IdempotencyKey.__table__) is not self.engine:
+            return False
+        session.execute(self._complete_statement(user_id, key, owner, record, ttl))
+        return True
+
+    def release(self, user_id: int, key: str, owner: str) -> None:
+        from app.models import IdempotencyKey
+
+        table = IdempotencyKey.__table__
+        with self._connect() as conn:
+            conn.execute(delete(table).where(table.c.user_id == user_id, table.c.key == key, table.c.owner == owner))
+
+    def prune(self) -> int:
+        """Deletes expired keys; returns how many."""
+        from app.models import IdempotencyKey
+
+        table = IdempotencyKey.__table__
+        with self._connect() as conn:
+            return conn.execute(delete(table).where(table.c.expires_at < datetime.now())).rowcount
+
+
+class _Row(object):
+    def __init__(self, values: dict):
+        self.__dict__.update(values)
+
+
+_CLAIM_SCRIPT = """
+local current = redis.call('GET', KEYS[1])
+if current then return current end
+redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+return ARGV[1]
+"""
+
+_COMPLETE_SCRIPT = """
+local current = redis.call('GET', KEYS[1])
+if not current or cjson.decode(current)['owner'] ~= ARGV[1] then return 0 end
+if ARGV[2] == '' then return redis.call('DEL', KEYS[1]) end
+redis.call('SET', KEYS[1], ARGV[2], 'PX', ARGV[3])
+return 1
+"""
+
+
+class RedisIdempotencyStore(object):
+    """Keys in Redis, expiring on their own; each operation is one script call."""
+
+    def __init__(self, client, prefix: str = "idempotency:"):
+        self.client = client
+        self.prefix = prefix
+        self._claim = client.register_script(_CLAIM_SCRIPT)
+        self._complete = client.register_script(_COMPLETE_SCRIPT)
+
+    def _key(self, user_id: int, key: str) -> str:
+        return f"{self.prefix}{user_id}:{key}"
+
+    @staticmethod
+    def _dump(record: IdempotencyRecord) -> str:
+        return json.dumps({
+            "owner": record.owner,
+            "fingerprint": record.fingerprint,
+            "status_code": record.status_code,
+            "headers": record.headers,
+            "body": base64.b64encode(record.body).decode(),
+        })
+
+    @staticmethod
+    def _load(raw) -> IdempotencyRecord:
+        data = json.loads(raw)
+        data["body"] = base64.b64decode(data["body"])
+        return IdempotencyRecord(**data)
+
+    def claim(self, user_id: int, key: str, fingerprint: str, owner: str, lock_ttl: float) -> IdempotencyRecord:
+        pending = self._dump(IdempotencyRecord(owner=owner, fingerprint=fingerprint))
+        return self._load(self._claim(keys=[self._key(user_id, key)], args=[pending, int(lock_ttl * 1000)]))
+
+    def get(self, user_id: int, key: str) -> Optional[IdempotencyRecord]:
+        raw = self.client.get(self._key(user_id, key))
+        return self._load(raw) if raw else None
+
+    def complete(self, user_id: int, key: str, owner: str, record: IdempotencyRecord, ttl: float) -> None:
+        self._complete(keys=[self._key(user_id, key)], args=[owner, self._dump(record), int(ttl * 1000)])
+
+    def complete_in(self, session, user_id: int, key: str, owner: str, record: IdempotencyRecord, ttl: float) -> bool:
+        # Redis cannot take part in a database transaction
+        return False
+
+    def release(self, user_id: int, key: str, owner: str) -> None:
+        self._complete(keys=[self._key(user_id, key)], args=[owner, "", 0])
+
+    def prune(self) -> int:
+        # Redis expires keys by itself
+        return 0
+
+
+class Idempotency(object):
+    """
+    Replays the first response to POSTs retried with the same
+    `Idempotency-Key` header instead of running them again.
+
+    Keys are scoped to the logged-in user. A retry arriving while the first
+    request still runs waits for its response rather than racing it; a key
+    reused for a different request gets a 422.
+
+    A view that writes through the main database passes its response to
+    `complete_in` before committing, so the key completes in the same
+    transaction as the writes. Otherwise (Redis, task shards) the key is
+    completed after the view returns; if the process dies in between, the
+    claim lapses after IDEMPOTENCY_LOCK_TTL and a retry runs the view again.
+    """
+
+    def __init__(self, app: Optional[Flask] = None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        app.config.setdefault("IDEMPOTENCY_BACKEND", "auto")
+        app.config.setdefault("IDEMPOTENCY_TTL", 24 * 60 * 60)
+        app.config.setdefault("IDEMPOTENCY_LOCK_TTL", 30)
+        app.config.setdefault("IDEMPOTENCY_WAIT_SECONDS", 10)
+
+    @property
+    def store(self):
+        app = current_app._get_current_object()
+        if "idempotency" not in app.extensions:
+            backend = app.config["IDEMPOTENCY_BACKEND"]
+            client = get_redis(app) if backend in ("auto", "redis") else None
+            if client is not None:
+                app.extensions["idempotency"] = RedisIdempotencyStore(client)
+            else:
+                from app import db
+
+                app.extensions["idempotency"] = SQLIdempotencyStore(db.engine)
+        return app.extensions["idempotency"]
+
+    def current_claim(self) -> Optional[IdempotencyClaim]:
+        """The key the current request holds, or None."""
+        return g.get("idempotency_claim")
+
+    def complete_in(self, session, claim: Optional[IdempotencyClaim], response) -> None:
+        """
+        Stores `response` for `claim` in `session`'s pending transaction, when
+        the store can; the view must then return that same response. Safe to
+        call from another request's context, as group commit does.
+        """
+        if claim is None:
+            return
+        record = _record_of(claim.owner, claim.fingerprint, make_response(response))
+        if claim.store.complete_in(session, claim.user_id, claim.key, claim.owner, record, claim.ttl):
+            claim.completed = True
+
+    def idempotent(self, view):
+        """Makes a POST view honour `Idempotency-Key` for logged-in users."""
+
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            key = request.headers.get(IDEMPOTENCY_HEADER)
+            if request.method != "POST" or not key or not current_user.is_authenticated:
+                return view(*args, **kwargs)
+            if len(key) > 255:
+                return _error("The Idempotency-Key header must be at most 255 characters.", 400)
+            return self._run_once(current_user.id, key, lambda: view(*args, **kwargs))
+
+        return wrapper
+
+    def _run_once(self, user_id: int, key: str, call) -> Response:
+        config = current_app.config
+        store = self.store
+        fingerprint = hashlib.sha256(
+            b"\n".join([request.method.encode(), request.full_path.encode(), request.get_data()])
+        ).hexdigest()
+        owner = secrets.token_hex(16)
+
+        record = store.claim(user_id, key, fingerprint, owner, config["IDEMPOTENCY_LOCK_TTL"])
+        deadline = time.monotonic() + config["IDEMPOTENCY_WAIT_SECONDS"]
+        while record.owner != owner:
+            if record.fingerprint != fingerprint:
+                return _error("This Idempotency-Key was used for a different request.", 422)
+            if record.completed:
+                return _replay(record)
+            if time.monotonic() >= deadline:
+                return _error("A request with this Idempotency-Key is still in progress.", 409)
+            time.sleep(_POLL_INTERVAL)
+            # The holder may have finished, or failed and let the key go
+            record = store.get(user_id, key) or store.claim(
+                user_id, key, fingerprint, owner, config["IDEMPOTENCY_LOCK_TTL"]
+            )
+
+        claim = g.idempotency_claim = IdempotencyClaim(
+            store, user_id, key, owner, fingerprint, config["IDEMPOTENCY_TTL"]
+        )
+        try:
+            response = make_response(call())
+        except BaseException:
+            # A key completed with the view's writes stays, even if the view failed after committing
+            if not claim.completed:
+                store.release(user_id, key, owner)
+            raise
+        finally:
+            g.pop("idempotency_claim", None)
+        if claim.completed:
+            return response
+        if response.status_code >= 500 or response.is_streamed:
+            # Failures are not remembered, so the client can retry them
+            store.release(user_id, key, owner)
+            return response
+        store.complete(user_id, key, owner, _record_of(owner, fingerprint, response), config["IDEMPOTENCY_TTL"])
+        return response
+
+
+def _record_of(owner: str, fingerprint: str, response: Response) -> IdempotencyRecord:
+    return IdempotencyRecord(
+        owner=owner,
+        fingerprint=fingerprint,
+        status_code=response.status_code,
+        headers={name: response.headers[name] for name in _STORED_HEADERS if name in response.headers},
+        body=response.get_data(),
+    )
+
+
+def _replay(record: IdempotencyRecord) -> Response:
+    response = Response(record.body, status=record.status_code, headers=record.headers)
+    response.headers["Idempotent-Replayed"] = "true"
+    return response
+
+
+def _error(message: str, status: int) -> Response:
+    response = jsonify(error=message)
+    response.status_code = status
+    return response
@@ -1,3 +1,9 @@
+from .archives import TaskArchive
 from .enums import UserRole
+from .idempotency import IdempotencyKey
+from .outbox import OutboxCursor, OutboxEvent
+from .shards import TaskShardMove
+from .tags import TaskTag
 from .tasks import Task
+from .tokens import RevokedToken
 from .user import User
@@ -0,0 +1,28 @@
+from datetime import datetime
+
+from app import db
+
+
+class TaskArchive(db.Model):
+    """One month of tasks moved out of the `task` table into cold storage."""
+    __tablename__ = 'task_archives'
+
+    # Detached partition moved to the archive schema, or a gzipped NDJSON file
+    SCHEMA = 'schema'
+    FILE = 'file'
+
+    id = db.Column(db.Integer, primary_key=True)
+    # Bind key of the database the tasks came from; NULL means the main database
+    shard = db.Column(db.String(32), nullable=True)
+    month = db.Column(db.Date, nullable=False, index=True)
+    kind = db.Column(db.String(16), nullable=False)
+    # Schema-qualified table name, or file path
+    location = db.Column(db.String(255), nullable=False)
+    rows = db.Column(db.Integer, nullable=False, default=0)
+    archived_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
+    # A file archive's month can span several files, for tasks that arrived after the first
+    __table_args__ = (db.UniqueConstraint('location', name='uq_task_archives_location'),)
+
+    def __repr__(self):
+        return f"TaskArchive('{self.shard}', '{self.month}', '{self.kind}')"
@@ -0,0 +1,22 @@
+from app import db
+
+
+class IdempotencyKey(db.Model):
+    """The stored outcome of a request sent with an `Idempotency-Key` header."""
+    __tablename__ = 'idempotency_keys'
+
+    user_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    key = db.Column(db.String(255), primary_key=True)
+    # Hash of method, path and body; a reused key with another request is refused
+    fingerprint = db.Column(db.String(64), nullable=False)
+    # Token of the request holding the key while it runs
+    owner = db.Column(db.String(32), nullable=False)
+    # NULL until the first response is stored
+    status_code = db.Column(db.Integer, nullable=True)
+    headers = db.Column(db.Text, nullable=True)
+    body = db.Column(db.LargeBinary, nullable=True)
+    # End of the in-flight lock while running, of the stored response after
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    def __repr__(self):
+        return f"IdempotencyKey('{self.user_id}', '{self.key}', '{self.status_code}')"
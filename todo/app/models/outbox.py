@@ -0,0 +1,43 @@
+from datetime import datetime
+
+from app import db
+
+
+class OutboxEvent(db.Model):
+    """A task or account change, written in the change's own transaction and deleted once relayed."""
+    __tablename__ = 'outbox_events'
+
+    id = db.Column(db.Integer, primary_key=True)
+    # No foreign key: events outlive deleted users and also live on task shards
+    user_id = db.Column(db.Integer, nullable=False)
+    event_type = db.Column(db.String(32), nullable=False)
+    # JSON object describing the change
+    payload = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+    # Where an event carried over by a shard move was first written; consumers
+    # dedupe on these, so they stay the same wherever the event is relayed from
+    origin_source = db.Column(db.String(32), nullable=True)
+    origin_id = db.Column(db.Integer, nullable=True)
+    # Position in the user's event stream, shared by every database's outbox;
+    # NULL for events queued before streams were numbered
+    user_seq = db.Column(db.Integer, nullable=True)
+
+    __table_args__ = (
+        # The relay checks each user's oldest pending events through this
+        db.Index('ix_outbox_events_user_id', 'user_id', 'id'),
+    )
+
+    def __repr__(self):
+        return f"OutboxEvent('{self.id}', '{self.user_id}', '{self.event_type}')"
+
+
+class OutboxCursor(db.Model):
+    """How far each user's event stream has been published; main database only, whichever outbox relays them."""
+    __tablename__ = 'outbox_cursors'
+
+    # No foreign key: events outlive deleted users
+    user_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    published_seq = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f"OutboxCursor('{self.user_id}', '{self.published_seq}')"
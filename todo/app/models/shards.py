@@ -0,0 +1,20 @@
+from datetime import datetime
+
+from app import db
+
+
+class TaskShardMove(db.Model):
+    """Journal of a user's tasks moving between shards, kept until the move finishes."""
+    __tablename__ = 'task_shard_moves'
+
+    COPYING = 'copying'
+    CLEANUP = 'cleanup'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    source = db.Column(db.String(32), nullable=True)
+    target = db.Column(db.String(32), nullable=True)
+    phase = db.Column(db.String(16), nullable=False, default=COPYING)
+    started_at = db.Column(db.DateTime, nullable=False, default=datetime.now)
+
+    def __repr__(self):
+        return f"TaskShardMove('{self.user_id}', '{self.source}' -> '{self.target}', '{self.phase}')"
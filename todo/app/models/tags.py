@@ -0,0 +1,18 @@
+from app import db
+
+
+class TaskTag(db.Model):
+    """One label on one task; `user_id` is copied from the task for filtering."""
+    __tablename__ = 'task_tags'
+
+    MAX_LENGTH = 32
+
+    # The primary key doubles as the covering index for tag filters: each
+    # (user, tag) pair is one contiguous range already ordered by task id,
+    # which is exactly what keyset pagination walks.
+    user_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    tag = db.Column(db.String(MAX_LENGTH), primary_key=True)
+    task_id = db.Column(db.Integer, db.ForeignKey('task.id', ondelete='CASCADE'), primary_key=True, index=True)
+
+    def __repr__(self):
+        return f"TaskTag('{self.task_id}', '{self.tag}')"
@@ -1,13 +1,75 @@
 from datetime import datetime
 
 from app import db
+from app.prepared import PreparedQuery
+from app.ranking import DEFAULT_RANK
+
+from .tags import TaskTag
 
 
 class Task(db.Model):
+    RANK_LENGTH = 128
+
     id = db.Column(db.Integer, primary_key=True)
     content = db.Column(db.String(100), nullable=False)
-    date_posted = db.Column(db.DateTime, nullable=False, default=datetime.now())
+    date_posted = db.Column(db.DateTime, nullable=False, default=datetime.now)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    due_at = db.Column(db.DateTime, nullable=True)
+    remind_at = db.Column(db.DateTime, nullable=True)
+    reminder_sent_at = db.Column(db.DateTime, nullable=True)
+    # Set while the task is done; open tasks have none
+    completed_at = db.Column(db.DateTime, nullable=True)
+    # User-defined position, a fractional key (see app.ranking)
+    rank = db.Column(db.String(RANK_LENGTH), nullable=False, default=DEFAULT_RANK, server_default=DEFAULT_RANK)
+
+    tags = db.relationship(
+        TaskTag,
+        cascade='all, delete-orphan',
+        lazy='selectin',
+        order_by=TaskTag.tag,
+    )
+
+    __table_args__ = (
+        # Finds all of a user's tasks, open or done, for exports, moves and purges
+        db.Index('ix_task_user', 'user_id', 'id'),
+        # The open list and the done list each read their own partial index,
+        # so a long done history adds nothing to a page of open tasks. Open
+        # tasks are listed by (rank, id); id breaks ties between equal ranks.
+        db.Index(
+            'ix_task_open_rank',
+            'user_id', 'rank', 'id',
+            postgresql_where=db.text('completed_at IS NULL'),
+            sqlite_where=db.text('completed_at IS NULL'),
+        ),
+        db.Index(
+            'ix_task_done',
+            'user_id', 'completed_at', 'id',
+            postgresql_where=db.text('completed_at IS NOT NULL'),
+            sqlite_where=db.text('completed_at IS NOT NULL'),
+        ),
+        # Only reminders still waiting to go out are indexed, so the scheduler's
+        # claim query stays small however many tasks have no or old reminders.
+        db.Index(
+            'ix_task_pending_reminders',
+            'remind_at',
+            postgresql_where=db.text('reminder_sent_at IS NULL AND remind_at IS NOT NULL AND completed_at IS NULL'),
+            sqlite_where=db.text('reminder_sent_at IS NULL AND remind_at IS NOT NULL AND completed_at IS NULL'),
+        ),
+    )
+
+    @property
+    def tag_names(self):
+        return [tag.tag for tag in self.tags]
+
+    def set_tags(self, names):
+        """Replaces the task's tags, keeping rows for tags it already has."""
+        current = {tag.tag: tag for tag in self.tags}
+        self.tags = [current.get(name) or TaskTag(user_id=self.user_id, tag=name) for name in names]
 
     def __repr__(self):
-        return f"Task('{self.content}', '{self.date_posted}', '{self.user_id}')"
\ No newline at end of file
+        return f"Task('{self.content}', '{self.date_posted}', '{self.user_id}')"
+
+
+# Run as a prepared statement when PREPARED_STATEMENTS is on; bounded on
+# `date_posted`, so a partitioned table is probed only in its recent partitions
+task_by_id = PreparedQuery("task_by_id", Task, "id", at_least=("date_posted",))
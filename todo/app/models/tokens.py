@@ -0,0 +1,14 @@
+from app import db
+
+
+class RevokedToken(db.Model):
+    """The id of a single-use account token that has been used."""
+    __tablename__ = 'revoked_tokens'
+
+    # The token's `jti` claim, or a hash of its signature for tokens issued without one
+    jti = db.Column(db.String(64), primary_key=True)
+    # When the token itself expires; the row is useless after that
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    def __repr__(self):
+        return f"RevokedToken('{self.jti}', '{self.expires_at}')"
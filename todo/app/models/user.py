@@ -1,27 +1,30 @@
 from datetime import date, datetime, timedelta, timezone
 from typing import List, Optional
-import jwt
-from jwt.exceptions import ExpiredSignatureError, InvalidTokenError
-from flask import current_app
-from app import login_manager
+import secrets
+import time
+from app import login_manager, tokens
 from flask_login import  UserMixin,  AnonymousUserMixin
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import validates
 from sqlalchemy_utils import EmailType
 from werkzeug.security import check_password_hash, generate_password_hash
 from app import db
+from app.birth_dates import parse_birth_date
+from app.outbox import USER_EMAIL_CHANGED, record
+from app.prepared import PreparedQuery
+from app.tracing import traced
 from .enums import UserRole
 import logging
 
 # Logger configuration
 logger = logging.getLogger(__name__)
 
-# Algorithm for JWT
-_PASSWORD_ALGORITHM = "HS256"
-
 
 @login_manager.user_loader
 def load_user(user_id: int) -> Optional['User']:
-    """Loads the user from the database using their ID."""
-    return User.query.get(int(user_id))
+    """Loads the user from the database using their ID; users being deleted are logged out."""
+    user = user_by_id.get(db.session, int(user_id))
+    return user if user is not None and user.is_active else None
 
 class User(db.Model, UserMixin):
     __tablename__ = 'users'
@@ -29,17 +32,46 @@ class User(db.Model, UserMixin):
     id = db.Column(db.Integer, primary_key=True)
     first_name = db.Column(db.String(50), nullable=False)
     last_name = db.Column(db.String(50), nullable=False)
-    date_of_birth = db.Column(db.String(20), nullable=False)
+    # NULL only for legacy string dates `manage.py migrate-birth-dates` could not read
+    date_of_birth = db.Column(db.Date, index=True, nullable=True)
     email = db.Column(EmailType, index=True, unique=True, nullable=False)
     username = db.Column(db.String(20), unique=True, nullable=False)
     password_hash = db.Column(db.String, nullable=False)
     role = db.Column(db.Enum(UserRole), nullable=False, default=UserRole.USER)
     tasks = db.relationship('Task', backref='author', lazy=True)
     confirmed = db.Column(db.Boolean, default=False)
+    # Bind key of the shard holding this user's tasks; NULL means the main database
+    task_shard = db.Column(db.String(32), nullable=True)
+    # Set when the account is deleted; the user row goes once `app.purge` has
+    # removed everything they own
+    deleting_at = db.Column(db.DateTime, nullable=True)
+    # Last position handed out in this user's outbox event stream (`app.outbox.next_seq`)
+    event_seq = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    __table_args__ = (
+        # Only accounts waiting to be purged are indexed
+        db.Index(
+            'ix_users_deleting',
+            'deleting_at',
+            postgresql_where=db.text('deleting_at IS NOT NULL'),
+            sqlite_where=db.text('deleting_at IS NOT NULL'),
+        ),
+        # Prefix searches in the admin directory; LIKE 'abc%' needs the
+        # pattern operator class under a non-C collation
+        db.Index('ix_users_email_prefix', 'email', postgresql_ops={'email': 'varchar_pattern_ops'})
+        .ddl_if(dialect='postgresql'),
+        db.Index('ix_users_username_prefix', 'username', postgresql_ops={'username': 'varchar_pattern_ops'})
+        .ddl_if(dialect='postgresql'),
+    )
 
     def __repr__(self) -> str:
         return f"User('{self.username}')"
 
+    @property
+    def is_active(self) -> bool:
+        """Accounts being deleted are inactive, so Flask-Login will not log them in."""
+        return self.deleting_at is None
+
     @property
     def full_name(self) -> str:
         """Returns the full name of the user."""
@@ -79,19 +111,28 @@ class User(db.Model, UserMixin):
         """Generates a token for resetting the user's password."""
         return self._generate_token('reset', expiration)
 
+    @traced("user.generate_token")
     def _generate_token(self, action: str, expiration: int, **extra_payload) -> str:
         """Helper method to generate JWT tokens with additional payload."""
+        now = datetime.now(tz=timezone.utc)
         payload = {
             action: self.id,
-            "exp": datetime.now(tz=timezone.utc) + timedelta(seconds=expiration),
+            "iat": now,
+            "exp": now + timedelta(seconds=expiration),
+            # Lets the token be revoked once used
+            "jti": secrets.token_urlsafe(12),
             **extra_payload
         }
-        token = jwt.encode(payload, current_app.config["SECRET_KEY"], algorithm=_PASSWORD_ALGORITHM)
-        return token
+        return tokens.encode(payload)
 
     def confirm_account(self, token: str, expiration: int = 604800) -> bool:
         """Confirms the user's account using the provided token."""
-        return self._verify_token(token, 'confirm', expiration)
+        payload = self._verify_token(token, 'confirm', expiration, return_payload=True)
+        if not payload or not tokens.revoke(payload):
+            return False
+        self.confirmed = True
+        db.session.commit()
+        return True
 
     def change_email(self, token: str, expiration: int = 3600) -> bool:
         """Changes the user's email if the provided token is valid."""
@@ -102,30 +143,41 @@ class User(db.Model, UserMixin):
         new_email = payload.get('new_email')
         if not new_email or User.query.filter_by(email=new_email).first():
             return False
+        if not tokens.revoke(payload):
+            return False
 
+        record(db.session, self.id, USER_EMAIL_CHANGED, id=self.id, old_email=self.email, email=new_email)
         self.email = new_email
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Another account took the email since it was checked
+            db.session.rollback()
+            return False
         return True
 
     def reset_password(self, token: str, new_password: str, expiration: int = 3600) -> bool:
         """Resets the user's password if the provided token is valid."""
-        if not self._verify_token(token, 'reset', expiration):
+        payload = self._verify_token(token, 'reset', expiration, return_payload=True)
+        if not payload or not tokens.revoke(payload):
             return False
         self.password = new_password
         db.session.commit()
         return True
 
     def _verify_token(self, token: str, action: str, expiration: int, return_payload: bool = False) -> bool:
-        """Helper method to verify JWT tokens."""
-        try:
-            payload = jwt.decode(
-                token,
-                current_app.config["SECRET_KEY"],
-                leeway=timedelta(seconds=expiration),
-                algorithms=[_PASSWORD_ALGORITHM]
-            )
-        except (InvalidTokenError, ExpiredSignatureError):
-            logger.error(f"Invalid or expired token for {action}.")
+        """
+        Helper method to verify JWT tokens. `expiration` caps the token's
+        age when it records when it was issued, on top of its own expiry.
+        """
+        payload = tokens.decode(token)
+        if payload is None:
+            logger.error(f"Invalid, expired or used token for {action}.")
+            return False
+
+        issued = payload.get("iat")
+        if isinstance(issued, (int, float)) and issued + expiration < time.time():
+            logger.error(f"Expired token for {action}.")
             return False
 
         if payload.get(action) != self.id:
@@ -138,7 +190,7 @@ class User(db.Model, UserMixin):
     @staticmethod
     def generate_fake(count: int = 100, **kwargs) -> None:
         """Generates fake users for testing purposes."""
-        from random import choice, seed, randint
+        from random import choice, seed
         from faker import Faker
         from sqlalchemy.exc import IntegrityError
 
@@ -154,7 +206,7 @@ class User(db.Model, UserMixin):
                 username=fake.user_name(),
                 password="password",  # In real scenario, handle this securely
                 confirmed=True,
-                date_of_birth=f"{randint(1980, date.today().year - 18)}-{randint(1, 12)}-{randint(1, 31)}",
+                date_of_birth=fake.date_of_birth(minimum_age=18, maximum_age=date.today().year - 1980),
                 role=choice([roles.USER, roles.ADMIN]),
                 **kwargs,
             )
@@ -166,19 +218,28 @@ class User(db.Model, UserMixin):
                 db.session.rollback()
                 continue
 
+    @validates("date_of_birth")
+    def validate_date_of_birth(self, key: str, value) -> Optional[date]:
+        """Accepts dates, or the "YYYY-MM-DD" strings birth dates used to be."""
+        born = parse_birth_date(value)
+        if value is not None and born is None:
+            raise ValueError(f"Invalid date of birth: {value!r}")
+        return born
+
     @property
     def age(self) -> int:
         """Calculates the user's age from their date of birth."""
-        try:
-            dob_year, dob_month, dob_day = map(int, self.date_of_birth.split("-"))
-            birth_date = date(dob_year, dob_month, dob_day)
-            today = date.today()
-            return today.year - birth_date.year - (
-                (today.month, today.day) < (birth_date.month, birth_date.day)
-            )
-        except ValueError:
-            logger.error(f"Error calculating age for user {self.username}. Invalid date format: {self.date_of_birth}")
+        if self.date_of_birth is None:
             return 0
+        today = date.today()
+        return today.year - self.date_of_birth.year - (
+            (today.month, today.day) < (self.date_of_birth.month, self.date_of_birth.day)
+        )
+
+
+# Hot lookups, run as prepared statements when PREPARED_STATEMENTS is on
+user_by_id = PreparedQuery("user_by_id", User, "id")
+user_by_email = PreparedQuery("user_by_email", User, "email")
 
 
 class AnonymousUser(AnonymousUserMixin):
@@ -0,0 +1,241 @@
+import json
+import logging
+import time
+from contextlib import nullcontext
+from datetime import date, datetime
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.engine import Engine, Row
+from sqlalchemy.orm import Session
+
+from .warmup import warming_up
+
+# Logger configuration
+logger = logging.getLogger(__name__)
+
+# Event types
+TASK_CREATED = "task.created"
+TASK_UPDATED = "task.updated"
+TASK_DELETED = "task.deleted"
+TASK_COMPLETED = "task.completed"
+TASK_UNCOMPLETED = "task.uncompleted"
+USER_REGISTERED = "user.registered"
+USER_EMAIL_CHANGED = "user.email_changed"
+
+# Source name of the main database's events; shards go by their bind key
+MAIN_SOURCE = "main"
+
+# Publishes one database's claimed events, in order; raising leaves them queued
+Publish = Callable[[str, List[Row]], None]
+
+
+def _json_default(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def next_seq(session: Session, user_id: int) -> Optional[int]:
+    """
+    Hands out the next position in the user's event stream from
+    `users.event_seq`, in `session`'s transaction on the main database.
+
+    The UPDATE holds the user's row lock until that transaction ends, so a
+    user's positions are handed out one writer at a time, and a position is
+    only taken after the event holding the one before it has committed. The
+    first position also creates the user's relay cursor. Returns None for a
+    user that no longer exists.
+    """
+    from app.models import OutboxCursor, User
+
+    users = User.__table__
+    seq = session.execute(
+        update(users).where(users.c.id == user_id).values(event_seq=users.c.event_seq + 1).returning(users.c.event_seq)
+    ).scalar()
+    if seq == 1:
+        session.execute(insert(OutboxCursor.__table__).values(user_id=user_id, published_seq=0))
+    return seq
+
+
+def record(session: Session, user_id: int, event_type: str, user_seq: Optional[int] = None, **payload) -> None:
+    """
+    Queues an event on `session`. It is one more INSERT in the caller's
+    transaction, so the event is committed or rolled back with the change
+    it describes.
+
+    Its stream position is `user_seq`, or else taken with `next_seq` on the
+    request's main session. On a shard that main transaction must commit
+    after `session` does (`task_shards.commit`); code running outside the
+    user's own request, or without an app context, passes `user_seq`.
+    """
+    from app import db
+    from app.models import OutboxEvent
+
+    if warming_up():
+        # Consumers have no use for the warm-up's scratch user
+        return
+    if user_seq is None:
+        user_seq = next_seq(db.session, user_id)
+    session.add(OutboxEvent(
+        user_id=user_id,
+        event_type=event_type,
+        payload=json.dumps(payload, default=_json_default),
+        created_at=datetime.now(),
+        user_seq=user_seq,
+    ))
+
+
+def source_name(shard: Optional[str]) -> str:
+    """The relay source name of the database holding `shard`'s events."""
+    return MAIN_SOURCE if shard is None else shard
+
+
+def task_payload(task_id: int, content: str, due_at, remind_at, tags) -> dict:
+    return {"id": task_id, "content": content, "due_at": due_at, "remind_at": remind_at, "tags": list(tags)}
+
+
+def claim_events(conn, batch_size: int, main=None) -> List[Row]:
+    """
+    Locks up to `batch_size` of the oldest events and returns those this
+    relay may publish now, advancing their users' cursors on `main`, a
+    connection to the main database (`conn` itself by default).
+
+    Rows are locked with `FOR UPDATE SKIP LOCKED`, so concurrent relays
+    take disjoint batches, and so are cursors: a user whose cursor another
+    relay holds waits for the next batch. A user's events go out in stream
+    order, up to the first position this relay cannot see: one not yet
+    committed, held by another relay, or queued in another database's
+    outbox, which its own relay publishes first.
+    """
+    from app.models import OutboxCursor, OutboxEvent
+
+    events, cursors = OutboxEvent.__table__, OutboxCursor.__table__
+    main = conn if main is None else main
+    rows = conn.execute(
+        select(events).order_by(events.c.id).limit(batch_size).with_for_update(skip_locked=True)
+    ).all()
+    if not rows:
+        return []
+    user_ids = {row.user_id for row in rows if row.user_seq is not None}
+    published = dict(main.execute(
+        select(cursors.c.user_id, cursors.c.published_seq)
+        .where(cursors.c.user_id.in_(user_ids))
+        .with_for_update(skip_locked=True)
+    ).all())
+    # Plain reads also see the cursors other relays have locked
+    held = set(main.execute(select(cursors.c.user_id).where(cursors.c.user_id.in_(user_ids))).scalars()) \
+        - published.keys()
+    ready, advanced = in_user_order(rows, published, held)
+    for user_id, seq in advanced.items():
+        main.execute(update(cursors).where(cursors.c.user_id == user_id).values(published_seq=seq))
+    return ready
+
+
+def in_user_order(rows: List[Row], published: Dict[int, int],
+                  held: Iterable[int] = ()) -> Tuple[List[Row], Dict[int, int]]:
+    """
+    The claimed `rows` that continue their user's stream, each user's in
+    stream order, and the new cursor of each user that moved.
+
+    `published` maps users to the last position already published; a
+    user's rows stop at the first gap after it. Users in `held` (cursor
+    locked by another relay) are left for later. Positions at or before
+    the cursor were published already and go out again (at-least-once);
+    rows without a position, or of users without a cursor, go out as is.
+    """
+    held = set(held)
+    streams: Dict[int, List[Row]] = {}
+    for row in rows:
+        if row.user_id not in held:
+            streams.setdefault(row.user_id, []).append(row)
+    ready, advanced = [], {}
+    for user_id, stream in streams.items():
+        if user_id not in published:
+            ready.extend(stream)
+            continue
+        last = published[user_id]
+        for row in sorted(stream, key=lambda row: (row.user_seq or 0, row.id)):
+            if row.user_seq is not None and row.user_seq > last + 1:
+                break
+            ready.append(row)
+            last = max(last, row.user_seq or 0)
+        if last != published[user_id]:
+            advanced[user_id] = last
+    return ready, advanced
+
+
+def relay_once(engine: Engine, source: str, publish: Publish, batch_size: int = 500,
+               main: Optional[Engine] = None) -> int:
+    """
+    Publishes and deletes one batch of `engine`'s events; returns how many.
+    `main` is the main database's engine, holding the users' cursors, when
+    `engine` is a shard's.
+
+    Claim, publish and delete share a transaction (the cursors' commits
+    just before the shard's): if publishing fails the events stay queued,
+    and if the commit fails after publishing they are published again
+    (at-least-once; consumers dedupe on source and id).
+    """
+    from app.models import OutboxEvent
+
+    events = OutboxEvent.__table__
+    with engine.begin() as conn:
+        with (main.begin() if main is not None and main is not engine else nullcontext(conn)) as main_conn:
+            rows = claim_events(conn, batch_size, main_conn)
+            if rows:
+                publish(source, rows)
+        if rows:
+            conn.execute(delete(events).where(events.c.id.in_([row.id for row in rows])))
+    return len(rows)
+
+
+def run_relay(sources: Iterable[Tuple[str, Engine]], publish: Publish, batch_size: int = 500,
+              poll_interval: float = 1.0, max_idle_polls: Optional[int] = None,
+              main: Optional[Engine] = None) -> int:
+    """
+    Drains the outbox of every (name, engine) source, sleeping
+    `poll_interval` when all are empty. Stops after `max_idle_polls` idle
+    rounds, or never when it is None. Returns the number of events relayed.
+    """
+    sources = list(sources)
+    total, idle = 0, 0
+    while max_idle_polls is None or idle < max_idle_polls:
+        relayed = sum(relay_once(engine, source, publish, batch_size, main) for source, engine in sources)
+        total += relayed
+        if relayed:
+            idle = 0
+            continue
+        idle += 1
+        time.sleep(poll_interval)
+    return total
+
+
+def stream_publisher(client, stream: str, max_length: Optional[int] = None) -> Publish:
+    """
+    Appends events to the Redis stream `stream` in one pipeline per batch,
+    trimmed to about `max_length`. Events moved with a user's tasks are
+    published under the source and id they were first written with.
+    """
+
+    def publish(source: str, rows: List[Row]) -> None:
+        pipeline = client.pipeline(transaction=False)
+        for row in rows:
+            pipeline.xadd(
+                stream,
+                {
+                    "source": row.origin_source or source,
+                    "id": row.origin_id or row.id,
+                    "user_id": row.user_id,
+                    "seq": "" if row.user_seq is None else row.user_seq,
+                    "type": row.event_type,
+                    "payload": row.payload,
+                    "created_at": row.created_at.isoformat(),
+                },
+                maxlen=max_length,
+                approximate=True,
+            )
+        pipeline.execute()
+        logger.info(f"Relayed {len(rows)} events from {source} to {stream}.")
+
+    return publish
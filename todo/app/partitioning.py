@@ -0,0 +1,181 @@
+import logging
+from datetime import date, datetime, time
+from typing import List, Optional, Sequence, Tuple
+
+from sqlalchemy import text
+from sqlalchemy.engine import Connection, Engine
+
+# Logger configuration
+logger = logging.getLogger(__name__)
+
+TASK_TABLE = "task"
+PARTITION_PREFIX = "task_p"
+# Catches tasks outside every monthly partition, such as old tasks moved in
+# from another shard after their month was archived here
+DEFAULT_PARTITION = "task_default"
+
+
+def month_start(value) -> date:
+    """The first day of the month `value` (a date or datetime) falls in."""
+    return date(value.year, value.month, 1)
+
+
+def add_months(month: date, count: int) -> date:
+    index = month.year * 12 + month.month - 1 + count
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def live_since(archive_after_months: int, now: Optional[datetime] = None) -> datetime:
+    """
+    Where the hot task queries start: the first day of the month
+    `archive_after_months` back, the cutoff `manage.py archive-tasks` uses.
+    Bounding them on `date_posted` lets Postgres prune the older partitions;
+    older tasks, whether archived yet or not, are read through the archive.
+    """
+    return datetime.combine(add_months(month_start(now or datetime.now()), -archive_after_months), time())
+
+
+def partition_name(month: date) -> str:
+    """`task_p2026_10` holds the tasks posted in October 2026."""
+    return f"{PARTITION_PREFIX}{month.year:04d}_{month.month:02d}"
+
+
+def partition_month(name: str) -> Optional[date]:
+    if not name.startswith(PARTITION_PREFIX):
+        return None
+    try:
+        year, month = name[len(PARTITION_PREFIX):].split("_")
+        return date(int(year), int(month), 1)
+    except ValueError:
+        return None
+
+
+def supports_partitioning(engine: Engine) -> bool:
+    return engine.dialect.name == "postgresql"
+
+
+def is_partitioned(conn: Connection) -> bool:
+    return conn.execute(
+        text("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(:table)"), {"table": TASK_TABLE}
+    ).scalar() or False
+
+
+def partitions(conn: Connection) -> List[date]:
+    """Months with a partition attached to `task`, oldest first."""
+    names = conn.execute(
+        text(
+            "SELECT child.relname FROM pg_inherits"
+            " JOIN pg_class child ON child.oid = pg_inherits.inhrelid"
+            " WHERE pg_inherits.inhparent = to_regclass(:table)"
+        ),
+        {"table": TASK_TABLE},
+    ).scalars()
+    return sorted(month for month in map(partition_month, names) if month is not None)
+
+
+def create_partition_statement(month: date) -> str:
+    return (
+        f"CREATE TABLE IF NOT EXISTS {partition_name(month)} PARTITION OF {TASK_TABLE}"
+        f" FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+    )
+
+
+def default_partition_statement() -> str:
+    return f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF {TASK_TABLE} DEFAULT"
+
+
+def add_partition_statements(month: date) -> List[str]:
+    """
+    DDL adding `month`'s partition next to the default partition. Postgres
+    refuses a partition for rows the default partition already holds, so
+    those move into the new partition with it.
+    """
+    name = partition_name(month)
+    bounds = f"date_posted >= '{month.isoformat()}' AND date_posted < '{add_months(month, 1).isoformat()}'"
+    return [
+        f"CREATE TEMP TABLE {name}_moving ON COMMIT DROP AS SELECT * FROM {DEFAULT_PARTITION} WHERE {bounds}",
+        f"DELETE FROM {DEFAULT_PARTITION} WHERE {bounds}",
+        create_partition_statement(month),
+        f"INSERT INTO {TASK_TABLE} SELECT * FROM {name}_moving",
+    ]
+
+
+def foreign_keys(conn: Connection) -> List[Tuple[str, str]]:
+    """The (name, definition) of each foreign key `task` holds, such as `task.user_id` -> `users.id`."""
+    return [tuple(row) for row in conn.execute(
+        text("SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint"
+             " WHERE conrelid = to_regclass(:table) AND contype = 'f' ORDER BY conname"),
+        {"table": TASK_TABLE},
+    )]
+
+
+def convert_statements(sequence: str, months: List[date], keys: Sequence[Tuple[str, str]] = ()) -> List[str]:
+    """
+    DDL turning the plain `task` table into one range-partitioned by
+    `date_posted`, with a partition per month in `months` and a default
+    partition for tasks outside them.
+
+    Postgres wants the partition key in every unique constraint, so the
+    primary key becomes (id, date_posted) and the foreign key from
+    `task_tags` is dropped; the ORM still maps `id` alone and deletes tags
+    with their task. `LIKE` copies no foreign keys, so the ones `task`
+    holds (`keys`, from `foreign_keys`) are added back on the parent. The
+    id sequence moves to the new table before the old one is dropped.
+    """
+    return [
+        f"ALTER TABLE {TASK_TABLE} RENAME TO {TASK_TABLE}_unpartitioned",
+        f"CREATE TABLE {TASK_TABLE} (LIKE {TASK_TABLE}_unpartitioned INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+        f" PARTITION BY RANGE (date_posted)",
+        f"ALTER TABLE {TASK_TABLE} ADD PRIMARY KEY (id, date_posted)",
+        *[create_partition_statement(month) for month in months],
+        default_partition_statement(),
+        f"INSERT INTO {TASK_TABLE} SELECT * FROM {TASK_TABLE}_unpartitioned",
+        *[f"ALTER TABLE {TASK_TABLE} ADD CONSTRAINT {name} {definition}" for name, definition in keys],
+        f"ALTER SEQUENCE {sequence} OWNED BY {TASK_TABLE}.id",
+        f"DROP TABLE {TASK_TABLE}_unpartitioned CASCADE",
+        # Created on the parent, so every partition gets its own copy
+        f"CREATE INDEX ix_task_user ON {TASK_TABLE} (user_id, id)",
+        f"CREATE INDEX ix_task_open_rank ON {TASK_TABLE} (user_id, rank, id) WHERE completed_at IS NULL",
+        f"CREATE INDEX ix_task_done ON {TASK_TABLE} (user_id, completed_at, id) WHERE completed_at IS NOT NULL",
+        f"CREATE INDEX ix_task_pending_reminders ON {TASK_TABLE} (remind_at)"
+        f" WHERE reminder_sent_at IS NULL AND remind_at IS NOT NULL AND completed_at IS NULL",
+    ]
+
+
+def partition_tasks(engine: Engine, months_ahead: int = 3, now: Optional[datetime] = None) -> List[str]:
+    """
+    Makes `engine`'s task table partitioned by month, converting it on the
+    first run, and creates the partitions up to `months_ahead` months from
+    now and the default partition. Returns the partitions created; a no-op
+    off Postgres.
+    """
+    if not supports_partitioning(engine):
+        return []
+    current = month_start(now or datetime.now())
+    last = add_months(current, months_ahead)
+    with engine.begin() as conn:
+        if not is_partitioned(conn):
+            oldest = conn.execute(text(f"SELECT MIN(date_posted) FROM {TASK_TABLE}")).scalar()
+            first = min(month_start(oldest), current) if oldest else current
+            months = []
+            while first <= last:
+                months.append(first)
+                first = add_months(first, 1)
+            sequence = conn.execute(text(f"SELECT pg_get_serial_sequence('{TASK_TABLE}', 'id')")).scalar()
+            for statement in convert_statements(sequence, months, foreign_keys(conn)):
+                conn.execute(text(statement))
+            logger.info(f"Partitioned {TASK_TABLE} into {len(months)} monthly partitions.")
+            return [partition_name(month) for month in months]
+
+        # Tables partitioned before there was a default partition get one now
+        conn.execute(text(default_partition_statement()))
+        existing = set(partitions(conn))
+        created = []
+        month = current
+        while month <= last:
+            if month not in existing:
+                for statement in add_partition_statements(month):
+                    conn.execute(text(statement))
+                created.append(partition_name(month))
+            month = add_months(month, 1)
+        return created
@@ -0,0 +1,130 @@
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from flask import Flask
+from sqlalchemy import bindparam, event, select, text
+from sqlalchemy.dialects.postgresql import psycopg2
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.util import identity_key
+
+# Logger configuration
+logger = logging.getLogger(__name__)
+
+# Names prepared on a DBAPI connection, kept in its pool record's `info`
+_PREPARED_KEY = "prepared_statements"
+
+# Every hot lookup, by statement name
+_queries: Dict[str, "PreparedQuery"] = {}
+
+
+class PreparedQuery(object):
+    """
+    A hot single-table lookup by equality on `columns`, and optionally a
+    lower bound on each of `at_least` (passed as `min_<column>`, so a
+    partitioned table can prune on it). With prepared statements enabled it
+    runs as `EXECUTE name(...)` against a statement each Postgres connection
+    parsed and planned once; otherwise (and on connections opened before it
+    could be prepared) as the ordinary query.
+    """
+
+    def __init__(self, name: str, model, *columns: str, at_least: Tuple[str, ...] = ()):
+        self.name = name
+        self.model = model
+        self.columns = columns
+        self.at_least = at_least
+        self.statement = select(model).where(*self._criteria())
+        _queries[name] = self
+
+    @property
+    def parameters(self) -> List[str]:
+        return list(self.columns) + [f"min_{column}" for column in self.at_least]
+
+    def _criteria(self) -> list:
+        table = self.model.__table__
+        return ([table.c[column] == bindparam(column) for column in self.columns]
+                + [table.c[column] >= bindparam(f"min_{column}") for column in self.at_least])
+
+    def prepare_statement(self) -> str:
+        """The `PREPARE` for this lookup, with `$n` parameters in `parameters` order."""
+        table = self.model.__table__
+        core = select(*table.c).where(*self._criteria())
+        compiled = core.compile(dialect=psycopg2.dialect(paramstyle="numeric_dollar"))
+        assert list(compiled.positiontup) == self.parameters
+        return f"PREPARE {self.name} AS {compiled}"
+
+    def _execute_statement(self):
+        table = self.model.__table__
+        placeholders = ", ".join(f":{name}" for name in self.parameters)
+        types = [table.c[column].type for column in self.columns + self.at_least]
+        clause = text(f"EXECUTE {self.name}({placeholders})").bindparams(
+            *(bindparam(name, type_=type_) for name, type_ in zip(self.parameters, types))
+        )
+        return select(self.model).from_statement(clause.columns(*table.c))
+
+    def _is_prepared(self, session: Session) -> bool:
+        connection = session.connection(bind_arguments={"mapper": self.model})
+        return self.name in connection.connection.info.get(_PREPARED_KEY, ())
+
+    def first(self, session: Session, **params):
+        if self._is_prepared(session):
+            return session.execute(self._execute_statement(), params).scalars().first()
+        return session.execute(self.statement, params).scalars().first()
+
+    def get(self, session: Session, ident, **bounds):
+        """Like `session.get`: the identity map first, then the (prepared) lookup by primary key."""
+        instance = session.identity_map.get(identity_key(self.model, ident))
+        if instance is not None:
+            within = all(getattr(instance, column) >= bounds[f"min_{column}"] for column in self.at_least)
+            return instance if within else None
+        return self.first(session, **{self.columns[0]: ident}, **bounds)
+
+
+def _prepare_all(dbapi_connection, connection_record) -> None:
+    # A new connection prepares every lookup once, outside any request's transaction
+    prepared = set()
+    cursor = dbapi_connection.cursor()
+    try:
+        for query in _queries.values():
+            cursor.execute(query.prepare_statement())
+            prepared.add(query.name)
+        dbapi_connection.commit()
+    except Exception:
+        logger.exception("Could not prepare the hot lookups; this connection runs them unprepared.")
+        dbapi_connection.rollback()
+        prepared = set()
+    finally:
+        cursor.close()
+    connection_record.info[_PREPARED_KEY] = prepared
+
+
+class PreparedStatements(object):
+    """
+    Opt-in (`PREPARED_STATEMENTS`) server-side prepared statements for the
+    `PreparedQuery` lookups on Postgres engines. A statement prepared on a
+    server connection is gone once PgBouncer in transaction mode hands the
+    next transaction another one, so `PGBOUNCER_TRANSACTION_POOLING` turns
+    the feature off.
+    """
+
+    def __init__(self, app: Optional[Flask] = None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        from app import db
+
+        app.config.setdefault("PREPARED_STATEMENTS", False)
+        app.config.setdefault("PGBOUNCER_TRANSACTION_POOLING", False)
+
+        engines: List[Engine] = []
+        if app.config["PREPARED_STATEMENTS"]:
+            if app.config["PGBOUNCER_TRANSACTION_POOLING"]:
+                logger.warning("PREPARED_STATEMENTS is ignored behind PgBouncer transaction pooling.")
+            else:
+                with app.app_context():
+                    engines = [engine for engine in db.engines.values() if engine.dialect.name == "postgresql"]
+        for engine in engines:
+            if not event.contains(engine, "connect", _prepare_all):
+                event.listen(engine, "connect", _prepare_all)
+        app.extensions["prepared_statements"] = engines
@@ -0,0 +1,332 @@
+import heapq
+import json
+import logging
+import os
+import secrets
+import signal
+import sys
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+from eventlet.patcher import original
+from flask import Flask, abort, current_app, g, request, send_from_directory, url_for
+from flask_login import current_user
+from greenlet import getcurrent
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+# Logger configuration
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = "X-Profile-Token"
+PROFILE_QUERY_PARAM = "_profile"
+COLLAPSED, SPEEDSCOPE = "collapsed", "speedscope"
+
+_TOKEN_SALT = "request-profile"
+# The OS thread id, which monkey patching leaves alone
+_real_thread = original("_thread")
+
+
+def _frame_name(code) -> str:
+    path = code.co_filename.replace(os.sep, "/").rsplit("/", 2)
+    return f"{code.co_name} ({'/'.join(path[-2:])}:{code.co_firstlineno})"
+
+
+class StackProfile(object):
+    """Time spent per call stack, root first, in microseconds."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.stacks: Dict[Tuple[str, ...], float] = defaultdict(float)
+        self.duration = 0.0
+
+    def add(self, stack: Tuple[str, ...], microseconds: float) -> None:
+        if stack:
+            self.stacks[stack] += microseconds
+
+    def collapsed(self) -> str:
+        """Brendan Gregg's folded format, as read by flamegraph.pl, speedscope and inferno."""
+        return "".join(f"{';'.join(stack)} {round(weight)}\n" for stack, weight in sorted(self.stacks.items()))
+
+    def speedscope(self) -> str:
+        frames: Dict[str, int] = {}
+        samples, weights = [], []
+        for stack, weight in sorted(self.stacks.items()):
+            samples.append([frames.setdefault(name, len(frames)) for name in stack])
+            weights.append(round(weight))
+        return json.dumps({
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": [{"name": name} for name in frames]},
+            "profiles": [{
+                "type": "sampled",
+                "name": self.name,
+                "unit": "microseconds",
+                "startValue": 0,
+                "endValue": sum(weights),
+                "samples": samples,
+                "weights": weights,
+            }],
+            "name": self.name,
+            "exporter": "todo",
+        })
+
+    def write(self, directory: str, filename: str, fmt: str) -> str:
+        """Writes the profile as `<filename>.collapsed` or `.speedscope.json`; returns the file name."""
+        os.makedirs(directory, exist_ok=True)
+        filename += ".collapsed" if fmt == COLLAPSED else ".speedscope.json"
+        with open(os.path.join(directory, filename), "w") as out:
+            out.write(self.collapsed() if fmt == COLLAPSED else self.speedscope())
+        return filename
+
+
+# Tracers by the greenlet they follow. `sys.setprofile` has one slot per OS
+# thread, so a single hook serves every greenlet being traced.
+_tracers: Dict[object, "TracingProfiler"] = {}
+
+
+def _dispatch(frame, event, arg):
+    tracer = _tracers.get(getcurrent())
+    if tracer is not None:
+        tracer._event(frame, event, arg)
+
+
+class TracingProfiler(object):
+    """
+    Deterministic profiler for the calling greenlet: a `sys.setprofile`
+    hook charges the time between events to the stack on top, so waits on
+    the database or network show up under the call that waited.
+    """
+
+    def __init__(self, profile: StackProfile):
+        self.profile = profile
+        self._stack: List[str] = []
+        self._last = 0.0
+
+    def _event(self, frame, event, arg):
+        now = time.perf_counter()
+        self.profile.add(tuple(self._stack), (now - self._last) * 1e6)
+        self._last = now
+        if event == "call":
+            self._stack.append(_frame_name(frame.f_code))
+        elif event == "c_call":
+            self._stack.append(f"{getattr(arg, '__qualname__', repr(arg))} (builtin)")
+        elif self._stack:
+            # A return (or C return/exception) from a frame entered after start
+            self._stack.pop()
+
+    def start(self) -> None:
+        self._started = self._last = time.perf_counter()
+        _tracers[getcurrent()] = self
+        sys.setprofile(_dispatch)
+
+    def stop(self) -> StackProfile:
+        _tracers.pop(getcurrent(), None)
+        if not _tracers:
+            sys.setprofile(None)
+        self.profile.duration = time.perf_counter() - self._started
+        return self.profile
+
+
+class _Sampler(object):
+    # One SIGPROF timer per process, shared by every greenlet being sampled;
+    # each tick is charged to the profile of whichever greenlet is running
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.active: Dict[object, StackProfile] = {}
+        self._lock = threading.Lock()
+        signal.signal(signal.SIGPROF, self._handle)
+
+    def _handle(self, signum, frame):
+        profile = self.active.get(getcurrent())
+        if profile is None:
+            return
+        stack = []
+        while frame is not None:
+            stack.append(_frame_name(frame.f_code))
+            frame = frame.f_back
+        profile.add(tuple(reversed(stack)), self.interval * 1e6)
+
+    def attach(self, profile: StackProfile) -> None:
+        with self._lock:
+            self.active[getcurrent()] = profile
+            if len(self.active) == 1:
+                signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def detach(self) -> None:
+        with self._lock:
+            self.active.pop(getcurrent(), None)
+            if not self.active:
+                signal.setitimer(signal.ITIMER_PROF, 0)
+
+
+class SamplingProfiler(object):
+    """
+    Statistical profiler: SIGPROF samples the running stack every
+    `interval` seconds of CPU time. Cheap enough to leave on for a fraction
+    of traffic, but it sees CPU only, not time spent waiting.
+    """
+
+    def __init__(self, sampler: _Sampler, profile: StackProfile):
+        self.sampler = sampler
+        self.profile = profile
+
+    def start(self) -> None:
+        self._started = time.perf_counter()
+        self.sampler.attach(self.profile)
+
+    def stop(self) -> StackProfile:
+        self.sampler.detach()
+        self.profile.duration = time.perf_counter() - self._started
+        return self.profile
+
+
+def profile_token(user_id: int, secret_key: str) -> str:
+    """A signed token letting admin `user_id` profile their own requests."""
+    return URLSafeTimedSerializer(secret_key, salt=_TOKEN_SALT).dumps(user_id)
+
+
+def _token_user(token: str, secret_key: str, max_age: int) -> Optional[int]:
+    try:
+        return URLSafeTimedSerializer(secret_key, salt=_TOKEN_SALT).loads(token, max_age=max_age)
+    except BadSignature:
+        return None
+
+
+class _SlowestProfiles(object):
+    # Per endpoint, the `keep` slowest sampled profiles and their files
+    def __init__(self, keep: int):
+        self.keep = keep
+        self._heaps: Dict[str, list] = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def wants(self, endpoint: str, duration: float) -> bool:
+        """Whether a profile this slow would make the cut, checked before writing it."""
+        with self._lock:
+            heap = self._heaps[endpoint]
+            return len(heap) < self.keep or duration > heap[0][0]
+
+    def add(self, endpoint: str, duration: float, filename: str) -> Optional[str]:
+        """Keeps a profile; returns the file it displaced, if any."""
+        with self._lock:
+            heap = self._heaps[endpoint]
+            if len(heap) < self.keep:
+                heapq.heappush(heap, (duration, filename))
+                return None
+            return heapq.heappushpop(heap, (duration, filename))[1]
+
+    def snapshot(self) -> Dict[str, List[Tuple[float, str]]]:
+        with self._lock:
+            return {endpoint: sorted(heap, reverse=True) for endpoint, heap in self._heaps.items()}
+
+
+class RequestProfiler(object):
+    """
+    Profiles single requests on demand, and optionally a sample of all.
+
+    An admin sends a token from `manage.py profile-token` in the
+    `X-Profile-Token` header (or `?_profile=`); their request runs under
+    `TracingProfiler` and the response links to the profile with
+    `Link: <...>; rel="profile"`. With `PROFILE_SAMPLE_RATE` = N, every Nth
+    request per endpoint runs under `SamplingProfiler` and the
+    `PROFILE_KEEP_SLOWEST` slowest per endpoint are kept under `sampled/`.
+    """
+
+    def __init__(self, app: Optional[Flask] = None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        import tempfile
+
+        app.config.setdefault("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "todo-profiles"))
+        app.config.setdefault("PROFILE_FORMAT", COLLAPSED)
+        app.config.setdefault("PROFILE_TOKEN_MAX_AGE", 3600)
+        app.config.setdefault("PROFILE_SAMPLE_RATE", 0)
+        app.config.setdefault("PROFILE_SAMPLE_INTERVAL_MS", 5)
+        app.config.setdefault("PROFILE_KEEP_SLOWEST", 10)
+
+        state = {"counters": defaultdict(int), "slowest": _SlowestProfiles(app.config["PROFILE_KEEP_SLOWEST"]),
+                 "sampler": None}
+        if app.config["PROFILE_SAMPLE_RATE"]:
+            try:
+                state["sampler"] = _Sampler(app.config["PROFILE_SAMPLE_INTERVAL_MS"] / 1000.0)
+                state["main_thread"] = _real_thread.get_ident()
+            except (AttributeError, ValueError):
+                # No SIGPROF on this platform, or not the main thread
+                logger.warning("SIGPROF sampling unavailable; sampled requests use the tracing profiler.")
+        app.extensions["profiling"] = state
+
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.teardown_request(self._abandon)
+        app.add_url_rule("/profiles/<path:filename>", "profiles", self._serve)
+
+    @staticmethod
+    def _requested() -> bool:
+        token = request.headers.get(PROFILE_HEADER) or request.args.get(PROFILE_QUERY_PARAM)
+        if not token or not current_user.is_authenticated or not current_user.is_admin():
+            return False
+        config = current_app.config
+        return _token_user(token, config["SECRET_KEY"], config["PROFILE_TOKEN_MAX_AGE"]) == current_user.id
+
+    def _start(self) -> None:
+        if request.endpoint in (None, "static", "profiles"):
+            return
+        name = f"{request.method} {request.path}"
+        if self._requested():
+            g._profiler, g._profile_sampled = TracingProfiler(StackProfile(name)), False
+        else:
+            state = current_app.extensions["profiling"]
+            rate = current_app.config["PROFILE_SAMPLE_RATE"]
+            if not rate:
+                return
+            state["counters"][request.endpoint] += 1
+            if state["counters"][request.endpoint] % rate:
+                return
+            sampler = state["sampler"]
+            if sampler is not None and _real_thread.get_ident() == state["main_thread"]:
+                g._profiler = SamplingProfiler(sampler, StackProfile(name))
+            else:
+                g._profiler = TracingProfiler(StackProfile(name))
+            g._profile_sampled = True
+        g._profiler.start()
+
+    def _finish(self, response):
+        profiler = g.pop("_profiler", None)
+        if profiler is None:
+            return response
+        profile = profiler.stop()
+        config = current_app.config
+        filename = (f"{request.endpoint}-{time.strftime('%Y%m%d-%H%M%S')}-{secrets.token_hex(3)}"
+                    f"-{round(profile.duration * 1000)}ms")
+        if not g._profile_sampled:
+            filename = profile.write(config["PROFILE_DIR"], filename, config["PROFILE_FORMAT"])
+            response.headers.add("Link", f'<{url_for("profiles", filename=filename)}>; rel="profile"')
+            return response
+
+        slowest = current_app.extensions["profiling"]["slowest"]
+        if slowest.wants(request.endpoint, profile.duration):
+            directory = os.path.join(config["PROFILE_DIR"], "sampled")
+            filename = profile.write(directory, filename, config["PROFILE_FORMAT"])
+            evicted = slowest.add(request.endpoint, profile.duration, filename)
+            if evicted:
+                try:
+                    os.remove(os.path.join(directory, evicted))
+                except OSError:
+                    pass
+        return response
+
+    @staticmethod
+    def _abandon(_exc=None) -> None:
+        # The request failed before after_request; never leave a profiler running
+        profiler = g.pop("_profiler", None)
+        if profiler is not None:
+            profiler.stop()
+
+    @staticmethod
+    def _serve(filename: str):
+        if not current_user.is_authenticated or not current_user.is_admin():
+            abort(404)
+        mimetype = "text/plain" if filename.endswith(".collapsed") else None
+        return send_from_directory(current_app.config["PROFILE_DIR"], filename, mimetype=mimetype)
@@ -0,0 +1,131 @@
+import logging
+import threading
+import time
+from datetime import datetime
+from typing import List, Optional
+
+from flask import Flask, current_app
+from sqlalchemy import delete, select, text
+from sqlalchemy.engine import Engine
+
+# Logger configuration
+logger = logging.getLogger(__name__)
+
+
+def request_deletion(user) -> None:
+    """Marks `user` as being deleted; they can no longer log in from here on."""
+    from app import db
+
+    if user.deleting_at is None:
+        user.deleting_at = datetime.now()
+        db.session.commit()
+
+
+def replication_lag(engine: Engine) -> float:
+    """Seconds the slowest streaming replica is behind `engine`; 0 without replicas."""
+    if engine.dialect.name != "postgresql":
+        return 0.0
+    with engine.connect() as conn:
+        lag = conn.execute(
+            text("SELECT COALESCE(MAX(EXTRACT(EPOCH FROM replay_lag)), 0) FROM pg_stat_replication")
+        ).scalar()
+    return float(lag or 0)
+
+
+def _throttle(engine: Engine, elapsed: float, pause: float, max_lag: Optional[float]) -> None:
+    # Rest at least as long as the batch ran, so the purge never holds the
+    # database more than half the time, and let lagging replicas catch up
+    time.sleep(max(pause, elapsed))
+    while max_lag and replication_lag(engine) > max_lag:
+        time.sleep(max(pause, 0.5))
+
+
+def _purge_tasks(engine: Engine, tables, user_id: int, batch_size: int, pause: float,
+                 max_lag: Optional[float]) -> int:
+    task, tags = tables["task"], tables["task_tags"]
+    deleted = 0
+    while True:
+        started = time.perf_counter()
+        # One short transaction per chunk: a task and its tags go together
+        with engine.begin() as conn:
+            ids = conn.execute(
+                select(task.c.id).where(task.c.user_id == user_id).order_by(task.c.id).limit(batch_size)
+            ).scalars().all()
+            if not ids:
+                return deleted
+            conn.execute(delete(tags).where(tags.c.task_id.in_(ids)))
+            conn.execute(delete(task).where(task.c.id.in_(ids)))
+        deleted += len(ids)
+        _throttle(engine, time.perf_counter() - started, pause, max_lag)
+
+
+def purge_user(user_id: int, batch_size: Optional[int] = None, pause: Optional[float] = None,
+               max_lag: Optional[float] = None) -> int:
+    """
+    Deletes a user marked by `request_deletion` and everything they own,
+    returning the number of tasks removed.
+
+    Tasks go in chunks of `batch_size`, each in its own transaction and
+    followed by a pause, so locks stay short and replicas keep up; then
+    archived tasks are dropped and the user row goes last. Progress is simply what is left, so a crashed purge is
+    resumed by running it again.
+    """
+    from app import db, task_shards
+    from app.archive import forget_user
+    from app.models import IdempotencyKey, TaskShardMove, User
+
+    config = current_app.config
+    batch_size = batch_size or config["USER_PURGE_BATCH_SIZE"]
+    pause = config["USER_PURGE_PAUSE"] if pause is None else pause
+    max_lag = config["USER_PURGE_MAX_REPLICATION_LAG"] if max_lag is None else max_lag
+
+    user = db.session.get(User, user_id)
+    if user is None:
+        return 0
+    if user.deleting_at is None:
+        raise ValueError(f"User {user_id} has not been marked for deletion.")
+
+    # Tasks halfway through a shard move may sit on both ends
+    shards = {user.task_shard}
+    move = db.session.get(TaskShardMove, user_id)
+    if move is not None:
+        shards.update((move.source, move.target))
+    tables = task_shards.shard_metadata().tables
+    deleted = 0
+    for shard in shards:
+        deleted += _purge_tasks(task_shards.engine(shard), tables, user_id, batch_size, pause, max_lag)
+
+    forget_user(user_id)
+    for model in (IdempotencyKey, TaskShardMove):
+        db.session.execute(delete(model.__table__).where(model.__table__.c.user_id == user_id))
+    # A plain DELETE: going through the ORM would load `User.tasks` first
+    db.session.execute(delete(User.__table__).where(User.__table__.c.id == user_id))
+    db.session.commit()
+    db.session.expunge(user)
+    logger.info(f"Purged user {user_id} and {deleted} tasks.")
+    return deleted
+
+
+def pending_deletions() -> List[int]:
+    """Ids of users marked for deletion whose purge has not finished."""
+    from app import db
+    from app.models import User
+
+    return db.session.execute(
+        select(User.id).where(User.deleting_at.isnot(None)).order_by(User.deleting_at)
+    ).scalars().all()
+
+
+def purge_in_background(app: Flask, user_id: int) -> threading.Thread:
+    """Purges one user off the request path; `manage.py purge-user` finishes it if this dies."""
+
+    def run():
+        with app.app_context():
+            try:
+                purge_user(user_id)
+            except Exception:
+                logger.exception(f"Purge of user {user_id} failed; it will resume on the next run.")
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,170 @@
+import logging
+import threading
+from typing import List, Optional
+
+from flask import Flask
+from sqlalchemy import bindparam, func, select, update
+from sqlalchemy.orm import Session
+
+# Logger configuration
+logger = logging.getLogger(__name__)
+
+# Lowercase base 36 sorts the same under byte order and the usual collations
+DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+_BASE = len(DIGITS)
+
+# A key is an integer part followed by an optional fraction. The integer's
+# first letter sets its sign and digit count: "a" (13 digits) up to "m"
+# (1 digit) are negative, "n" (1 digit) up to "z" (13 digits) positive, so
+# "mz" < "n0" < "nz" < "o00". Appending past the last key or before the
+# first just steps the integer, so keys grow logarithmically instead of by
+# one digit every few moves.
+_ZERO = "n"
+
+# Rank given to rows created without one; ties fall back to task id order
+DEFAULT_RANK = "n0"
+
+
+def _integer_length(head: str) -> int:
+    if not "a" <= head <= "z":
+        raise ValueError(f"Invalid rank head: {head!r}")
+    return ord(head) - ord(_ZERO) + 1 if head >= _ZERO else ord(_ZERO) - ord(head)
+
+
+def _integer_part(key: str) -> str:
+    return key[:_integer_length(key[0]) + 1]
+
+
+def _increment(integer: str) -> Optional[str]:
+    head, digits = integer[0], list(integer[1:])
+    for position in reversed(range(len(digits))):
+        digit = DIGITS.index(digits[position]) + 1
+        if digit < _BASE:
+            digits[position] = DIGITS[digit]
+            return head + "".join(digits)
+        digits[position] = DIGITS[0]
+    if head == "z":
+        return None
+    head = chr(ord(head) + 1)
+    return head + DIGITS[0] * _integer_length(head)
+
+
+def _decrement(integer: str) -> Optional[str]:
+    head, digits = integer[0], list(integer[1:])
+    for position in reversed(range(len(digits))):
+        digit = DIGITS.index(digits[position]) - 1
+        if digit >= 0:
+            digits[position] = DIGITS[digit]
+            return head + "".join(digits)
+        digits[position] = DIGITS[-1]
+    if head == "a":
+        return None
+    head = chr(ord(head) - 1)
+    return head + DIGITS[-1] * _integer_length(head)
+
+
+def _midpoint(low: str, high: Optional[str]) -> str:
+    # Fractions are base-36 digit strings read as 0.low and 0.high; None is 1.0
+    if high is not None:
+        common = 0
+        while common < len(high) and (low[common] if common < len(low) else "0") == high[common]:
+            common += 1
+        if common:
+            return high[:common] + _midpoint(low[common:], high[common:])
+    low_digit = DIGITS.index(low[0]) if low else 0
+    high_digit = DIGITS.index(high[0]) if high is not None else _BASE
+    if high_digit - low_digit > 1:
+        return DIGITS[(low_digit + high_digit) // 2]
+    if high is not None and len(high) > 1:
+        return high[:1]
+    return DIGITS[low_digit] + _midpoint(low[1:], None)
+
+
+def rank_between(before: Optional[str], after: Optional[str]) -> str:
+    """
+    A key sorting strictly between `before` and `after`; either may be None
+    for the start or end of the list.
+    """
+    if before is None and after is None:
+        return DEFAULT_RANK
+    if before is None:
+        integer = _integer_part(after)
+        if integer < after:
+            return integer
+        previous = _decrement(integer)
+        return previous if previous is not None else integer + _midpoint("", after[len(integer):])
+    if after is not None and before >= after:
+        raise ValueError(f"No rank between {before!r} and {after!r}.")
+    integer = _integer_part(before)
+    fraction = before[len(integer):]
+    if after is not None and integer == _integer_part(after):
+        return integer + _midpoint(fraction, after[len(integer):])
+    following = _increment(integer)
+    if following is not None and (after is None or following < after):
+        return following
+    return integer + _midpoint(fraction, None)
+
+
+def sequential_ranks(count: int) -> List[str]:
+    """`count` ascending keys, the shortest available, starting at DEFAULT_RANK."""
+    ranks, rank = [], DEFAULT_RANK
+    for _ in range(count):
+        ranks.append(rank)
+        rank = _increment(rank)
+    return ranks
+
+
+def rebalance_user(session: Session, user_id: int) -> int:
+    """
+    Rewrites a user's ranks to consecutive short keys, keeping their order,
+    in one transaction, and expires the session's loaded rows. Returns how
+    many rows changed.
+    """
+    from app.models import Task
+
+    rows = session.execute(
+        select(Task.id, Task.rank).where(Task.user_id == user_id).order_by(Task.rank, Task.id)
+    ).all()
+    changes = [
+        {"task_id": row.id, "new_rank": rank}
+        for row, rank in zip(rows, sequential_ranks(len(rows)))
+        if row.rank != rank
+    ]
+    if changes:
+        table = Task.__table__
+        session.execute(
+            update(table).where(table.c.id == bindparam("task_id")).values(rank=bindparam("new_rank")),
+            changes,
+        )
+    session.commit()
+    session.expire_all()
+    return len(changes)
+
+
+def rebalance_in_background(app: Flask, shard: Optional[str], user_id: int) -> threading.Thread:
+    """Rebalances one user's ranks off the request path."""
+    from app import task_shards
+
+    def run():
+        with app.app_context():
+            try:
+                changed = rebalance_user(task_shards.session(shard), user_id)
+                logger.info(f"Rebalanced {changed} task ranks for user {user_id}.")
+            except Exception:
+                logger.exception(f"Rank rebalance for user {user_id} failed.")
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+
+def rebalance_long_ranks(session: Session, max_length: int) -> List[int]:
+    """Rebalances every user owning a rank longer than `max_length`; returns their ids."""
+    from app.models import Task
+
+    user_ids = session.execute(
+        select(Task.user_id).where(func.length(Task.rank) > max_length).distinct()
+    ).scalars().all()
+    for user_id in user_ids:
+        rebalance_user(session, user_id)
+    return user_ids
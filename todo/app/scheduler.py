@@ -0,0 +1,117 @@
+import logging
+import time
+from datetime import datetime
+from typing import Callable, Iterable, List, Optional
+
+from flask import Flask, render_template
+from sqlalchemy import select, update
+from sqlalchemy.engine import Engine, Row
+
+from app.partitioning import live_since
+from app.utils import SendEmailClient
+
+# Logger configuration
+logger = logging.getLogger(__name__)
+
+# Email client
+send_email = SendEmailClient()
+
+Dispatch = Callable[[List[Row]], None]
+
+
+def claim_due_reminders(conn, now: datetime, batch_size: int, since: Optional[datetime] = None) -> List[Row]:
+    """
+    Marks up to `batch_size` due reminders of open tasks posted since
+    `since` as sent and returns them.
+
+    Candidates come from the partial `ix_task_pending_reminders` index and
+    are locked with `FOR UPDATE SKIP LOCKED`, so concurrent schedulers each
+    claim a disjoint batch instead of queueing behind one another.
+    """
+    from app.models import Task
+
+    task = Task.__table__
+    live = [] if since is None else [task.c.date_posted >= since]
+    due = (
+        select(task.c.id)
+        .where(task.c.reminder_sent_at.is_(None), task.c.completed_at.is_(None), task.c.remind_at <= now, *live)
+        .order_by(task.c.remind_at)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    )
+    claim = (
+        update(task)
+        .where(task.c.id.in_(due.scalar_subquery()), *live)
+        .values(reminder_sent_at=now)
+        .returning(task.c.id, task.c.user_id, task.c.content, task.c.due_at, task.c.remind_at)
+    )
+    return conn.execute(claim).all()
+
+
+def run_once(engine: Engine, dispatch: Dispatch, batch_size: int = 100, now: Optional[datetime] = None,
+             since: Optional[datetime] = None) -> int:
+    """
+    Claims and dispatches one batch; returns how many reminders it handled.
+    Tasks posted before `since` are skipped, so a partitioned table is only
+    scanned in its recent partitions.
+
+    Claim and dispatch share a transaction: if dispatching fails the claim
+    rolls back and the reminders are picked up again (at-least-once).
+    """
+    with engine.begin() as conn:
+        rows = claim_due_reminders(conn, now or datetime.now(), batch_size, since)
+        if rows:
+            dispatch(rows)
+    return len(rows)
+
+
+def run_scheduler(engines: Iterable[Engine], dispatch: Dispatch, batch_size: int = 100,
+                  poll_interval: float = 5.0, max_idle_polls: Optional[int] = None,
+                  archive_after_months: Optional[int] = None) -> int:
+    """
+    Drains due reminders from every engine, sleeping `poll_interval` when
+    there is nothing to send. Stops after `max_idle_polls` idle rounds, or
+    never when it is None. Returns the number of reminders dispatched.
+
+    With `archive_after_months`, tasks older than the archive cutoff are
+    left alone, like the task list does.
+    """
+    engines = list(engines)
+    total, idle = 0, 0
+    while max_idle_polls is None or idle < max_idle_polls:
+        since = None if archive_after_months is None else live_since(archive_after_months)
+        handled = sum(run_once(engine, dispatch, batch_size, since=since) for engine in engines)
+        total += handled
+        if handled:
+            idle = 0
+            continue
+        idle += 1
+        time.sleep(poll_interval)
+    return total
+
+
+def email_dispatcher(app: Flask) -> Dispatch:
+    """Renders reminder emails for claimed rows and hands them to the email client."""
+    from app import db
+    from app.models import User
+
+    def dispatch(rows: List[Row]) -> None:
+        with app.app_context():
+            users = {
+                user.id: user
+                for user in db.session.execute(
+                    select(User).where(User.id.in_({row.user_id for row in rows}))
+                ).scalars()
+            }
+            for row in rows:
+                user = users.get(row.user_id)
+                if user is None:
+                    continue
+                send_email.delay(
+                    recipient=user.email,
+                    subject="Task Reminder",
+                    template=render_template("reminder.html", user=user, task=row),
+                )
+        logger.info(f"Dispatched {len(rows)} task reminders.")
+
+    return dispatch
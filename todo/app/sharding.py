@@ -0,0 +1,397 @@
+import bisect
+import hashlib
+import logging
+import time
+from typing import Iterable, List, Optional
+
+from flask import Flask, current_app, g
+from sqlalchemy import Column, ForeignKey, Index, MetaData, Table, delete, insert, select, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+# Logger configuration
+logger = logging.getLogger(__name__)
+
+# SQLAlchemy bind keys starting with this prefix are task shards (see `Config`)
+SHARD_BIND_PREFIX = "tasks_shard_"
+
+# Tables stored on the shard owning a user's tasks, parents first
+_SHARDED_TABLES = ("task", "task_tags", "outbox_events")
+
+# Task ids are 32-bit on Postgres, so every id block must start below this
+_MAX_TASK_ID = 2 ** 31 - 1
+
+
+class HashRing(object):
+    """A consistent-hash ring; adding a shard relocates only ~1/N of the keys."""
+
+    def __init__(self, nodes: Iterable[str], replicas: int = 64):
+        self.nodes = sorted(nodes)
+        self._ring = sorted(
+            (self._hash(f"{node}#{replica}"), node)
+            for node in self.nodes
+            for replica in range(replicas)
+        )
+        self._points = [point for point, _ in self._ring]
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+    def node_for(self, key) -> str:
+        if not self._ring:
+            raise LookupError("The hash ring has no nodes.")
+        index = bisect.bisect(self._points, self._hash(str(key))) % len(self._ring)
+        return self._ring[index][1]
+
+
+class ShardMoveInProgress(Exception):
+    """Raised when writing tasks for a user whose tasks are being moved."""
+
+
+class TaskShardRouter(object):
+    """
+    Routes `Task` reads and writes to the database owning a user's tasks.
+
+    Users stay on the main database. Each user's tasks live on the shard
+    named by `User.task_shard`, which new users get from a consistent hash
+    of their id; users without one keep their tasks on the main database
+    until `manage.py rebalance-shards` moves them. With no shard binds
+    configured every call resolves to `db.session`.
+
+    Tasks keep their ids when they move, so each shard hands out new ids
+    from its own block of TASK_SHARD_ID_BLOCK ids (the main database uses
+    the first) and ids stay unique across shards.
+    """
+
+    def __init__(self, app: Optional[Flask] = None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        app.config.setdefault("TASK_SHARD_ID_BLOCK", 100000000)
+        shards = [key for key in (app.config.get("SQLALCHEMY_BINDS") or {}) if key.startswith(SHARD_BIND_PREFIX)]
+        app.extensions["task_shards"] = HashRing(shards) if shards else None
+        app.teardown_appcontext(self._remove_sessions)
+
+    @property
+    def ring(self) -> Optional[HashRing]:
+        return current_app.extensions["task_shards"]
+
+    @property
+    def enabled(self) -> bool:
+        return self.ring is not None
+
+    def home_shard(self, user_id: int) -> Optional[str]:
+        """Shard a user's tasks belong on according to the current ring."""
+        return self.ring.node_for(user_id) if self.enabled else None
+
+    def engine(self, shard: Optional[str]) -> Engine:
+        from app import db
+
+        return db.engine if shard is None else db.engines[shard]
+
+    def session(self, shard: Optional[str]) -> Session:
+        """Request-scoped session for one shard; the main session for None."""
+        from app import db
+
+        if shard is None:
+            return db.session
+        sessions = g.setdefault("_task_shard_sessions", {})
+        if shard not in sessions:
+            sessions[shard] = Session(bind=self.engine(shard), expire_on_commit=False)
+        return sessions[shard]
+
+    def session_for(self, user) -> Session:
+        return self.session(user.task_shard)
+
+    def writable_session_for(self, user) -> Session:
+        """
+        Like `session_for`, but refuses while the user's tasks are being moved.
+
+        The user's row stays locked FOR NO KEY UPDATE until the request's
+        main transaction ends, and `move_user` locks it FOR UPDATE before
+        journalling a move, so no move starts under a write in flight and
+        no write lands on a shard a move is copying from or cleaning up.
+        The lock is the one `app.outbox.next_seq` needs, so a user's writes
+        take turns; commit them with `commit`.
+        """
+        from app import db
+        from app.models import TaskShardMove, User
+
+        if self.enabled:
+            shard, moving = db.session.execute(
+                select(User.task_shard, TaskShardMove.user_id)
+                .outerjoin(TaskShardMove, TaskShardMove.user_id == User.id)
+                .where(User.id == user.id)
+                .with_for_update(key_share=True, of=User.__table__)
+            ).one()
+            # A placement changed since the user was loaded means a move just finished
+            if moving is not None or shard != user.task_shard:
+                raise ShardMoveInProgress(user.id)
+        return self.session_for(user)
+
+    @staticmethod
+    def commit(session: Session) -> None:
+        """
+        Commits a write on `session`, then the request's main transaction,
+        which ends the user's row lock and keeps the event positions it
+        handed out; the events are committed by then, so a relay never
+        finds a later position before an earlier one.
+        """
+        from app import db
+
+        session.commit()
+        if session is not db.session:
+            db.session.commit()
+
+    @staticmethod
+    def _remove_sessions(_exc=None) -> None:
+        for session in g.pop("_task_shard_sessions", {}).values():
+            session.close()
+
+    # Schema and data movement ------------------------------------------------
+
+    @staticmethod
+    def _copy_table(source: Table, metadata: MetaData) -> Table:
+        # Foreign keys survive only between tables that live on the shard
+        table = Table(
+            source.name,
+            metadata,
+            *[
+                Column(
+                    column.name,
+                    column.type,
+                    *[
+                        ForeignKey(fk.target_fullname, ondelete=fk.ondelete)
+                        for fk in column.foreign_keys
+                        if fk.column.table.name in _SHARDED_TABLES
+                    ],
+                    primary_key=column.primary_key,
+                    nullable=column.nullable,
+                    index=column.index,
+                    autoincrement=column.autoincrement,
+                    default=column.default,
+                    server_default=column.server_default,
+                )
+                for column in source.columns
+            ],
+            # SQLite then keeps the id high-water mark in sqlite_sequence,
+            # which is where a shard's id block is set
+            sqlite_autoincrement=source.name == "task",
+        )
+        for index in source.indexes:
+            names = {existing.name for existing in table.indexes}
+            if all(isinstance(expr, Column) for expr in index.expressions) and index.name not in names:
+                Index(
+                    index.name,
+                    *[table.c[column.name] for column in index.columns],
+                    unique=index.unique,
+                    **index.dialect_kwargs,
+                )
+        return table
+
+    @classmethod
+    def shard_metadata(cls) -> MetaData:
+        """The task tables without their cross-database foreign keys to users."""
+        from app import db
+
+        metadata = MetaData()
+        for name in _SHARDED_TABLES:
+            cls._copy_table(db.metadata.tables[name], metadata)
+        return metadata
+
+    def id_block_start(self, shard: Optional[str]) -> int:
+        """The id just before the first task id `shard` hands out."""
+        if shard is None:
+            return 0
+        block = current_app.config["TASK_SHARD_ID_BLOCK"]
+        start = (int(shard[len(SHARD_BIND_PREFIX):]) + 1) * block
+        if start + block > _MAX_TASK_ID + 1:
+            raise ValueError(f"No room for {shard}'s task ids; lower TASK_SHARD_ID_BLOCK.")
+        return start
+
+    @staticmethod
+    def _start_ids_at(engine: Engine, start: int) -> None:
+        # Only ever raises the counter, so rerunning create_all is harmless
+        with engine.begin() as conn:
+            if conn.dialect.name == "postgresql":
+                sequence = conn.execute(text("SELECT pg_get_serial_sequence('task', 'id')")).scalar()
+                conn.execute(
+                    text(
+                        "SELECT setval(CAST(:sequence AS regclass), :start) FROM pg_sequences "
+                        "WHERE schemaname || '.' || sequencename = :sequence AND COALESCE(last_value, 0) < :start"
+                    ),
+                    {"sequence": sequence, "start": start},
+                )
+            elif conn.dialect.name == "sqlite":
+                conn.execute(
+                    text("UPDATE sqlite_sequence SET seq = :start WHERE name = 'task' AND seq < :start"),
+                    {"start": start},
+                )
+                conn.execute(
+                    text(
+                        "INSERT INTO sqlite_sequence (name, seq) SELECT 'task', :start "
+                        "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'task')"
+                    ),
+                    {"start": start},
+                )
+
+    def create_all(self) -> None:
+        """Creates the task tables on every shard and points each at its id block."""
+        if not self.enabled:
+            return
+        metadata = self.shard_metadata()
+        for shard in self.ring.nodes:
+            metadata.create_all(self.engine(shard))
+            self._start_ids_at(self.engine(shard), self.id_block_start(shard))
+
+    def drop_all(self) -> None:
+        if not self.enabled:
+            return
+        metadata = self.shard_metadata()
+        for shard in self.ring.nodes:
+            metadata.drop_all(self.engine(shard))
+
+    def move_user(self, user, target: Optional[str], batch_size: int = 500, pause: float = 0.0) -> int:
+        """
+        Moves a user's tasks to `target` in batches and returns the number moved.
+
+        The move is journalled in `task_shard_moves`, so rerunning after a
+        crash resumes it. Writes are refused until the journal row is gone;
+        reads keep hitting the source until the placement flips. Tasks keep
+        their ids on the target.
+        """
+        from app import db
+        from app.models import TaskShardMove, User
+
+        move = db.session.get(TaskShardMove, user.id)
+        if move is None:
+            # Waits for writes in flight, which hold the row FOR SHARE
+            source = db.session.execute(
+                select(User.task_shard).where(User.id == user.id).with_for_update()
+            ).scalar_one()
+            move = TaskShardMove(user_id=user.id, source=source, target=target)
+            db.session.add(move)
+            db.session.commit()
+
+        tables = self.shard_metadata().tables
+        moved = 0
+        if move.phase == TaskShardMove.COPYING:
+            moved = self._copy_tasks(tables, user.id, move.source, move.target, batch_size, pause)
+            user.task_shard = move.target
+            move.phase = TaskShardMove.CLEANUP
+            db.session.commit()
+
+        # No events are written while the journal row exists, so this carries all of them
+        self._carry_events(tables, user.id, move.source, move.target)
+        self._delete_tasks(tables, user.id, move.source, batch_size, pause)
+        db.session.delete(move)
+        db.session.commit()
+        logger.info(f"Moved {moved} tasks of user {user.id} from {move.source} to {move.target}.")
+        return moved
+
+    def _copy_tasks(self, tables, user_id: int, source: Optional[str], target: Optional[str],
+                    batch_size: int, pause: float) -> int:
+        # Leftovers from an interrupted copy are not visible to anyone yet
+        self._delete_tasks(tables, user_id, target, batch_size, pause)
+        table, tags = tables["task"], tables["task_tags"]
+        copied, last_id = 0, 0
+        with self.engine(source).connect() as src, self.engine(target).connect() as dst:
+            while True:
+                rows = src.execute(
+                    select(table)
+                    .where(table.c.user_id == user_id, table.c.id > last_id)
+                    .order_by(table.c.id)
+                    .limit(batch_size)
+                ).all()
+                if not rows:
+                    break
+                last_id = rows[-1].id
+                # Ids are unique across shards (see `id_block_start`), so they are kept
+                dst.execute(insert(table), [dict(row._mapping) for row in rows])
+                tag_rows = src.execute(
+                    select(tags).where(tags.c.user_id == user_id, tags.c.task_id.in_([row.id for row in rows]))
+                ).all()
+                if tag_rows:
+                    dst.execute(insert(tags), [dict(row._mapping) for row in tag_rows])
+                dst.commit()
+                copied += len(rows)
+                if pause:
+                    time.sleep(pause)
+        return copied
+
+    def _carry_events(self, tables, user_id: int, source: Optional[str], target: Optional[str]) -> None:
+        """
+        Moves the user's unrelayed events to `target`, ahead of any written
+        after the move. Each keeps the database and id it was first written
+        with as `origin_source` and `origin_id`, which the relay publishes,
+        so an event published from both ends is deduplicated by consumers.
+        Rerunning after a crash skips events the target already has.
+        """
+        from app.outbox import source_name
+
+        events = tables["outbox_events"]
+        # Locked rows are skipped by relays, and rows a relay holds are waited for
+        with self.engine(source).begin() as src:
+            pending = src.execute(
+                select(events).where(events.c.user_id == user_id).order_by(events.c.id).with_for_update()
+            ).all()
+            if not pending:
+                return
+            with self.engine(target).begin() as dst:
+                carried = set(dst.execute(
+                    select(events.c.origin_source, events.c.origin_id)
+                    .where(events.c.user_id == user_id, events.c.origin_id.is_not(None))
+                ).all())
+                rows = []
+                for row in pending:
+                    origin = (row.origin_source or source_name(source), row.origin_id or row.id)
+                    if origin not in carried:
+                        fields = {c.name: row._mapping[c.name] for c in events.columns if c.name != "id"}
+                        rows.append({**fields, "origin_source": origin[0], "origin_id": origin[1]})
+                if rows:
+                    dst.execute(insert(events), rows)
+            src.execute(delete(events).where(events.c.id.in_([row.id for row in pending])))
+
+    def _delete_tasks(self, tables, user_id: int, shard: Optional[str], batch_size: int, pause: float) -> None:
+        engine = self.engine(shard)
+        # Tags go first so no batch ever leaves a tag pointing at a deleted task.
+        # Outbox events are never deleted here; `_carry_events` moves them.
+        for table in (tables["task_tags"], tables["task"]):
+            key = table.c.task_id if table.name == "task_tags" else table.c.id
+            while True:
+                with engine.begin() as conn:
+                    ids = conn.execute(
+                        select(key).where(table.c.user_id == user_id).limit(batch_size)
+                    ).scalars().all()
+                    if not ids:
+                        break
+                    conn.execute(delete(table).where(table.c.user_id == user_id, key.in_(ids)))
+                if pause:
+                    time.sleep(pause)
+
+    def rebalance(self, batch_size: int = 500, pause: float = 0.0) -> List[int]:
+        """Moves every user whose tasks are not on their ring shard; returns their ids."""
+        from app import db
+        from app.models import TaskShardMove, User
+
+        if not self.enabled:
+            return []
+        moved = []
+        # Finish interrupted moves before planning new ones
+        for move in TaskShardMove.query.all():
+            self.move_user(db.session.get(User, move.user_id), move.target, batch_size, pause)
+            moved.append(move.user_id)
+
+        last_id = 0
+        while True:
+            users = User.query.filter(User.id > last_id).order_by(User.id).limit(batch_size).all()
+            if not users:
+                return moved
+            last_id = users[-1].id
+            for user in users:
+                home = self.home_shard(user.id)
+                if user.task_shard != home:
+                    self.move_user(user, home, batch_size, pause)
+                    moved.append(user.id)
@@ -0,0 +1,145 @@
+import logging
+import re
+import secrets
+import struct
+import zlib
+from functools import wraps
+from typing import Dict, List, Optional, Type
+
+from flask import Flask, Response, current_app, get_flashed_messages, render_template, request
+from flask_login import current_user
+from flask_wtf import FlaskForm
+from flask_wtf.csrf import generate_csrf
+from markupsafe import Markup
+
+# Logger configuration
+logger = logging.getLogger(__name__)
+
+# Shell pages extend the layout, so a change to either renders them again
+_LAYOUT = "layout.html"
+
+# gzip member header: magic, deflate, no flags, no mtime, no extra flags, unknown OS
+_GZIP_HEADER = b"\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff"
+
+
+def deflate_segment(data: bytes, level: int, final: bool = False) -> bytes:
+    """
+    Raw deflate blocks for `data` that start and end on a byte boundary
+    with nothing carried over, so independently compressed segments can be
+    concatenated into one stream; only the last one is `final`.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if final else zlib.Z_FULL_FLUSH)
+
+
+class PageShell(object):
+    """A rendered page cut at its per-request slots, with each static part precompressed."""
+
+    __slots__ = ("templates", "parts", "slots", "deflated")
+
+    def __init__(self, templates: list, parts: List[bytes], slots: List[str], level: int):
+        self.templates = templates
+        self.parts = parts
+        self.slots = slots
+        self.deflated = [deflate_segment(part, level, final=i == len(parts) - 1) for i, part in enumerate(parts)]
+
+    def is_current(self, env) -> bool:
+        # Jinja hands back a new Template object once the source changes
+        return all(env.get_template(template.name) is template for template in self.templates)
+
+    def body(self, values: Dict[str, bytes]) -> bytes:
+        pieces = [self.parts[0]]
+        for slot, part in zip(self.slots, self.parts[1:]):
+            pieces += [values[slot], part]
+        return b"".join(pieces)
+
+    def gzipped(self, values: Dict[str, bytes]) -> bytes:
+        """The page as one gzip member; only the slot values are compressed here."""
+        pieces, crc, size = [_GZIP_HEADER, self.deflated[0]], zlib.crc32(self.parts[0]), len(self.parts[0])
+        for slot, part, deflated in zip(self.slots, self.parts[1:], self.deflated[1:]):
+            value = values[slot]
+            pieces += [deflate_segment(value, 1), deflated]
+            crc = zlib.crc32(part, zlib.crc32(value, crc))
+            size += len(value) + len(part)
+        pieces.append(struct.pack("<II", crc, size & 0xFFFFFFFF))
+        return b"".join(pieces)
+
+
+class PageShells(object):
+    """
+    Serves anonymous GETs of form pages (login, register, ...) from a shell
+    rendered once per template version. The CSRF token and the flashed
+    messages are the only per-visitor parts of those pages: the shell is
+    rendered with markers in their place, cut there, and the pieces spliced
+    back together per request. Clients accepting gzip get a body built from
+    deflate segments compressed when the shell was made, so the page costs
+    neither a render nor a compression pass.
+    """
+
+    def __init__(self, app: Optional[Flask] = None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        app.config.setdefault("PAGE_SHELLS", True)
+        app.config.setdefault("PAGE_SHELL_COMPRESS_LEVEL", 6)
+        app.extensions["page_shells"] = {}
+        # Random per process, so page content can never forge a slot
+        self._markers = {slot: f"page-shell-{slot}-{secrets.token_hex(8)}" for slot in ("csrf", "flashes")}
+        self._split = re.compile("|".join(map(re.escape, self._markers.values())).encode())
+
+    def anonymous(self, template: str, form_class: Type[FlaskForm]):
+        """Serves the view's anonymous GETs from the shell of `template` rendered with an empty `form_class`."""
+
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if (
+                    request.method != "GET"
+                    or current_user.is_authenticated
+                    or not current_app.config["PAGE_SHELLS"]
+                ):
+                    return view(*args, **kwargs)
+                return self.serve(template, form_class)
+
+            return wrapper
+
+        return decorator
+
+    def shell(self, template: str, form_class: Type[FlaskForm]) -> PageShell:
+        app = current_app._get_current_object()
+        shells: Dict[str, PageShell] = app.extensions["page_shells"]
+        shell = shells.get(template)
+        if shell is None or not shell.is_current(app.jinja_env):
+            shell = shells[template] = self._render(app, template, form_class)
+            logger.info(f"Rendered the page shell for {template}.")
+        return shell
+
+    def _render(self, app: Flask, template: str, form_class: Type[FlaskForm]) -> PageShell:
+        form = form_class()
+        if "csrf_token" in form:
+            form.csrf_token.current_token = self._markers["csrf"]
+        html = render_template(template, form=form, flash_slot=Markup(self._markers["flashes"])).encode()
+        slot_of = {marker.encode(): slot for slot, marker in self._markers.items()}
+        slots = [slot_of[marker] for marker in self._split.findall(html)]
+        parts = self._split.split(html)
+        templates = [app.jinja_env.get_template(name) for name in (template, _LAYOUT)]
+        return PageShell(templates, parts, slots, app.config["PAGE_SHELL_COMPRESS_LEVEL"])
+
+    def serve(self, template: str, form_class: Type[FlaskForm]) -> Response:
+        shell = self.shell(template, form_class)
+        values = {}
+        if "csrf" in shell.slots:
+            values["csrf"] = generate_csrf().encode()
+        if "flashes" in shell.slots:
+            flashed = get_flashed_messages(with_categories=True)
+            values["flashes"] = render_template("flashes.html").encode() if flashed else b""
+
+        response = Response(mimetype="text/html")
+        if request.accept_encodings["gzip"]:
+            response.set_data(shell.gzipped(values))
+            response.headers["Content-Encoding"] = "gzip"
+        else:
+            response.set_data(shell.body(values))
+        response.vary.add("Accept-Encoding")
+        return response
@@ -0,0 +1,43 @@
+// Live availability hints for the username and email fields. Lookups are
+// debounced, and the server answers most of them without the database.
+(function () {
+    var form = document.querySelector("form[data-availability-url]");
+    if (!form) {
+        return;
+    }
+    var url = form.getAttribute("data-availability-url");
+
+    ["username", "email"].forEach(function (name) {
+        var field = form.elements[name];
+        if (!field) {
+            return;
+        }
+        var hint = document.createElement("small");
+        hint.className = "form-text";
+        field.parentNode.appendChild(hint);
+        var timer = null;
+        var latest = 0;
+
+        field.addEventListener("input", function () {
+            clearTimeout(timer);
+            hint.textContent = "";
+            var value = field.value.trim();
+            if (!value) {
+                return;
+            }
+            timer = setTimeout(function () {
+                var sent = ++latest;
+                fetch(url + "?" + name + "=" + encodeURIComponent(value), {credentials: "same-origin"})
+                    .then(function (response) { return response.json(); })
+                    .then(function (result) {
+                        // A slower answer for older input must not overwrite a newer one
+                        if (sent !== latest || result.available === undefined) {
+                            return;
+                        }
+                        hint.textContent = result.available ? "Available" : "Already taken";
+                        hint.className = "form-text " + (result.available ? "text-success" : "text-danger");
+                    });
+            }, 250);
+        });
+    });
+})();
@@ -0,0 +1,51 @@
+// Drag-to-reorder for the task list. A drop posts the dragged task's new
+// neighbour to the server, which rewrites only that task's rank.
+(function () {
+    var list = document.getElementById("task-list");
+    if (!list) {
+        return;
+    }
+    var dragged = null;
+
+    list.addEventListener("dragstart", function (event) {
+        dragged = event.target.closest("tr[data-task-id]");
+        event.dataTransfer.effectAllowed = "move";
+    });
+
+    list.addEventListener("dragover", function (event) {
+        var row = event.target.closest("tr[data-task-id]");
+        if (!dragged || !row || row === dragged) {
+            return;
+        }
+        event.preventDefault();
+        var box = row.getBoundingClientRect();
+        var below = event.clientY > box.top + box.height / 2;
+        list.insertBefore(dragged, below ? row.nextSibling : row);
+    });
+
+    list.addEventListener("drop", function (event) {
+        event.preventDefault();
+    });
+
+    list.addEventListener("dragend", function () {
+        if (!dragged) {
+            return;
+        }
+        var body = new FormData();
+        var previous = dragged.previousElementSibling;
+        var next = dragged.nextElementSibling;
+        if (previous) {
+            body.append("before_id", previous.dataset.taskId);
+        } else if (next) {
+            body.append("after_id", next.dataset.taskId);
+        }
+        body.append("csrf_token", list.dataset.csrfToken);
+        fetch(dragged.dataset.moveUrl, { method: "POST", body: body, credentials: "same-origin" })
+            .then(function (response) {
+                if (!response.ok) {
+                    window.location.reload();
+                }
+            });
+        dragged = null;
+    });
+})();
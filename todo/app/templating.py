@@ -0,0 +1,99 @@
+import logging
+import os
+from typing import Optional
+
+from flask import Flask
+from jinja2 import BytecodeCache, FileSystemBytecodeCache, MemcachedBytecodeCache, nodes
+from jinja2.ext import Extension
+
+from .utils import TTLCache, get_redis
+
+# Logger configuration
+logger = logging.getLogger(__name__)
+
+
+class _RedisMemcacheAdapter(object):
+    """Gives a Redis client the get/set(timeout) interface Jinja expects."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.client.get(key)
+
+    def set(self, key: str, value: bytes, timeout: Optional[int] = None) -> None:
+        self.client.set(key, value, ex=timeout or None)
+
+
+def make_bytecode_cache(app: Flask) -> Optional[BytecodeCache]:
+    """Builds the bytecode cache selected by `JINJA_BYTECODE_CACHE`."""
+    backend = app.config.get("JINJA_BYTECODE_CACHE")
+    if backend == "filesystem":
+        directory = app.config["JINJA_BYTECODE_CACHE_DIR"]
+        os.makedirs(directory, exist_ok=True)
+        return FileSystemBytecodeCache(directory)
+    if backend == "redis":
+        client = get_redis(app)
+        if client is None:
+            logger.warning("JINJA_BYTECODE_CACHE is 'redis' but REDIS_URL is not set; templates compile per worker.")
+            return None
+        return MemcachedBytecodeCache(_RedisMemcacheAdapter(client), prefix="jinja2/bytecode/")
+    return None
+
+
+class FragmentCacheExtension(Extension):
+    """
+    Adds a ``{% cache key, ttl %}...{% endcache %}`` tag that stores the
+    rendered block in the environment's bounded fragment cache.
+
+    Keys are namespaced by template name and line, so the same key in two
+    blocks never collides. A cache size of 0 renders every time.
+    """
+
+    tags = {"cache"}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=None)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        key = parser.parse_expression()
+        parser.stream.expect("comma")
+        ttl = parser.parse_expression()
+        body = parser.parse_statements(("name:endcache",), drop_needle=True)
+        namespace = nodes.Const(f"{parser.name}:{lineno}")
+        call = self.call_method("_cached_fragment", [namespace, key, ttl])
+        return nodes.CallBlock(call, [], [], body).set_lineno(lineno)
+
+    def _cached_fragment(self, namespace: str, key, ttl: int, caller) -> str:
+        cache: Optional[TTLCache] = self.environment.fragment_cache
+        if cache is None:
+            return caller()
+        cache_key = f"{namespace}:{key}"
+        rendered = cache.get(cache_key)
+        if rendered is None:
+            rendered = caller()
+            cache.set(cache_key, rendered, ttl)
+        return rendered
+
+
+def init_templating(app: Flask) -> None:
+    """Attaches the bytecode cache and fragment caching to the app's Jinja env."""
+    env = app.jinja_env
+    env.bytecode_cache = make_bytecode_cache(app)
+    env.add_extension(FragmentCacheExtension)
+    size = app.config.get("JINJA_FRAGMENT_CACHE_SIZE", 0)
+    env.fragment_cache = TTLCache(size) if size else None
+
+
+def precompile_templates(app: Flask) -> int:
+    """Compiles every template once so the bytecode cache starts warm."""
+    env = app.jinja_env
+    if env.bytecode_cache is None:
+        logger.warning("No Jinja bytecode cache configured; nothing to precompile.")
+        return 0
+    names = env.list_templates(extensions=("html", "txt"))
+    for name in names:
+        env.get_template(name)
+    return len(names)
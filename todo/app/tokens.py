@@ -0,0 +1,242 @@
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple, Union
+
+import jwt
+from flask import Flask, current_app
+from sqlalchemy import exists, select
+from sqlalchemy.exc import IntegrityError
+
+from .utils import TTLCache, get_redis
+
+# Logger configuration
+logger = logging.getLogger(__name__)
+
+TOKEN_ALGORITHM = "HS256"
+
+# Distinct JWT headers remembered per keyring; real tokens only ever carry one per key
+_MAX_HEADERS = 64
+
+
+def key_id(secret: str) -> str:
+    """A stable, non-secret id for `secret`, used when TOKEN_KEYS does not name one."""
+    return hashlib.sha256(secret.encode()).hexdigest()[:8]
+
+
+def parse_keys(spec: str) -> List[Tuple[str, str]]:
+    """Reads TOKEN_KEYS, "kid:secret,kid:secret", newest first."""
+    keys = []
+    for entry in filter(None, (part.strip() for part in spec.split(","))):
+        kid, sep, secret = entry.partition(":")
+        if not sep or not kid or not secret:
+            raise ValueError("TOKEN_KEYS entries must look like kid:secret.")
+        keys.append((kid, secret))
+    return keys
+
+
+def _b64decode(segment: str) -> bytes:
+    return base64.urlsafe_b64decode(segment + "=" * (-len(segment) % 4))
+
+
+class TokenKeyring(object):
+    """
+    HS256 signing keys by `kid`. The first key signs; every key verifies,
+    so a key is rotated out by adding a new one in front and dropping the
+    old one once the tokens it signed have expired.
+
+    Verification parses nothing it has seen before: each distinct token
+    header maps, through one dict lookup, to an HMAC object already keyed
+    with its secret, which is copied and fed the signing input.
+    """
+
+    def __init__(self, keys: List[Tuple[str, str]], legacy_secret: Optional[str] = None):
+        if not keys:
+            raise ValueError("A token keyring needs at least one key.")
+        self.signing_kid, self._signing_secret = keys[0]
+        self._macs: Dict[Optional[str], "hmac.HMAC"] = {
+            kid: hmac.new(secret.encode(), digestmod=hashlib.sha256) for kid, secret in keys
+        }
+        if legacy_secret is not None:
+            # Tokens issued before kid headers were signed with SECRET_KEY
+            self._macs.setdefault(None, hmac.new(legacy_secret.encode(), digestmod=hashlib.sha256))
+        self._headers: Dict[str, Union["hmac.HMAC", bool]] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def kids(self) -> List[str]:
+        return [kid for kid in self._macs if kid is not None]
+
+    def encode(self, payload: dict) -> str:
+        return jwt.encode(payload, self._signing_secret, algorithm=TOKEN_ALGORITHM, headers={"kid": self.signing_kid})
+
+    def _mac_for(self, header: str) -> Union["hmac.HMAC", bool]:
+        # Cold path: the first token with this exact header
+        try:
+            fields = json.loads(_b64decode(header))
+        except (binascii.Error, ValueError):
+            return False
+        if not isinstance(fields, dict) or fields.get("alg") != TOKEN_ALGORITHM:
+            return False
+        mac = self._macs.get(fields.get("kid"), False)
+        if mac is not False:
+            with self._lock:
+                if len(self._headers) < _MAX_HEADERS:
+                    self._headers[header] = mac
+        return mac
+
+    def decode(self, token: str, now: Optional[float] = None) -> Optional[dict]:
+        """
+        The claims of a well-signed, unexpired token, or None. Tokens
+        without a `jti` get a hash of their signature as one, so every token
+        can be revoked.
+        """
+        try:
+            header, payload, signature = token.split(".")
+        except (AttributeError, ValueError):
+            return None
+        mac = self._headers.get(header) or self._mac_for(header)
+        if mac is False:
+            return None
+        digest = mac.copy()
+        digest.update(f"{header}.{payload}".encode())
+        try:
+            signed = _b64decode(signature)
+            if not hmac.compare_digest(digest.digest(), signed):
+                return None
+            claims = json.loads(_b64decode(payload))
+        except (binascii.Error, ValueError):
+            return None
+        if not isinstance(claims, dict):
+            return None
+        expires = claims.get("exp")
+        if not isinstance(expires, (int, float)) or expires <= (time.time() if now is None else now):
+            return None
+        # From the decoded bytes: base64 text has several spellings of one signature
+        claims.setdefault("jti", hashlib.sha256(signed).hexdigest())
+        return claims
+
+
+class SQLRevocationStore(object):
+    """Revoked token ids in the `revoked_tokens` table of the main database."""
+
+    def __init__(self, engine):
+        self.engine = engine
+
+    def _connect(self):
+        # Each call is one statement in its own (auto-committed) transaction,
+        # independent of the request's session
+        return self.engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+
+    def revoke(self, jti: str, ttl: float) -> bool:
+        from app.models import RevokedToken
+
+        table = RevokedToken.__table__
+        try:
+            with self._connect() as conn:
+                conn.execute(table.insert().values(jti=jti, expires_at=datetime.now() + timedelta(seconds=ttl)))
+        except IntegrityError:
+            return False
+        return True
+
+    def is_revoked(self, jti: str) -> bool:
+        from app.models import RevokedToken
+
+        table = RevokedToken.__table__
+        with self._connect() as conn:
+            return conn.execute(select(exists().where(table.c.jti == jti))).scalar()
+
+    def prune(self) -> int:
+        """Deletes ids whose tokens have expired anyway; returns how many."""
+        from app.models import RevokedToken
+
+        table = RevokedToken.__table__
+        with self._connect() as conn:
+            return conn.execute(table.delete().where(table.c.expires_at < datetime.now())).rowcount
+
+
+class RedisRevocationStore(object):
+    """Revoked token ids as Redis keys that expire with their tokens."""
+
+    def __init__(self, client, prefix: str = "revoked-token:"):
+        self.client = client
+        self.prefix = prefix
+
+    def revoke(self, jti: str, ttl: float) -> bool:
+        return bool(self.client.set(f"{self.prefix}{jti}", 1, nx=True, px=max(int(ttl * 1000), 1)))
+
+    def is_revoked(self, jti: str) -> bool:
+        return bool(self.client.exists(f"{self.prefix}{jti}"))
+
+    def prune(self) -> int:
+        # Redis expires keys by itself
+        return 0
+
+
+class SignedTokens(object):
+    """
+    Signs and verifies the account tokens (confirm, reset, email change)
+    with a `TokenKeyring` built once per app, and makes them single-use.
+
+    A used token's id goes into a revocation set until the token expires:
+    Redis when REDIS_URL is set, else the database. Ids known revoked are
+    also kept in a per-process cache, so a replayed token is refused
+    without a round trip. Claiming an id is atomic, so of two concurrent
+    uses of one token only one succeeds.
+    """
+
+    def __init__(self, app: Optional[Flask] = None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        app.config.setdefault("TOKEN_KEYS", "")
+        app.config.setdefault("TOKEN_REVOCATION_BACKEND", "auto")
+        app.config.setdefault("TOKEN_REVOCATION_CACHE_SIZE", 10000)
+        secret = app.config["SECRET_KEY"]
+        keys = parse_keys(app.config["TOKEN_KEYS"]) or [(key_id(secret), secret)]
+        app.extensions["token_keyring"] = TokenKeyring(keys, legacy_secret=secret)
+        app.extensions["token_revocations"] = TTLCache(app.config["TOKEN_REVOCATION_CACHE_SIZE"])
+
+    @property
+    def keyring(self) -> TokenKeyring:
+        return current_app.extensions["token_keyring"]
+
+    @property
+    def store(self):
+        app = current_app._get_current_object()
+        if "token_revocation_store" not in app.extensions:
+            backend = app.config["TOKEN_REVOCATION_BACKEND"]
+            client = get_redis(app) if backend in ("auto", "redis") else None
+            if client is not None:
+                app.extensions["token_revocation_store"] = RedisRevocationStore(client)
+            else:
+                from app import db
+
+                app.extensions["token_revocation_store"] = SQLRevocationStore(db.engine)
+        return app.extensions["token_revocation_store"]
+
+    def encode(self, payload: dict) -> str:
+        return self.keyring.encode(payload)
+
+    def decode(self, token: str) -> Optional[dict]:
+        """Claims of a valid token not known to this process as used, or None."""
+        claims = self.keyring.decode(token)
+        if claims is None or current_app.extensions["token_revocations"].get(claims["jti"]):
+            return None
+        return claims
+
+    def revoke(self, claims: dict) -> bool:
+        """Marks a decoded token used; False if it already was, here or in another process."""
+        ttl = max(claims["exp"] - time.time(), 0) + 1
+        revoked = self.store.revoke(claims["jti"], ttl)
+        current_app.extensions["token_revocations"].set(claims["jti"], True, ttl)
+        if not revoked:
+            logger.warning("Refused a token that was already used.")
+        return revoked
@@ -0,0 +1,393 @@
+import contextlib
+import functools
+import ipaddress
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+import urllib.request
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+from flask import Flask, before_render_template, current_app, g, request, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Logger configuration
+logger = logging.getLogger(__name__)
+
+TRACE_HEADER = "X-Trace-Id"
+TRACEPARENT_HEADER = "traceparent"
+
+# Longest SQL statement text kept on a span
+_MAX_STATEMENT = 500
+
+# The span new spans nest under, per greenlet; None when the work in hand is
+# not being traced
+_current: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+# The trace id of the request in hand, sampled or not, for log correlation
+_trace_id: ContextVar[Optional[str]] = ContextVar("trace_id", default=None)
+
+
+class Span(object):
+    __slots__ = ("trace", "span_id", "parent_id", "name", "start_ns", "end_ns", "attributes", "error", "_token")
+
+    def __init__(self, trace: "Trace", name: str, parent_id: Optional[str], attributes: Dict):
+        self.trace = trace
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes = attributes
+        self.error: Optional[str] = None
+
+    def set(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    def end(self) -> None:
+        self.end_ns = time.time_ns()
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_ns": self.start_ns,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class Trace(object):
+    """The finished spans of one sampled request, exported together."""
+
+    def __init__(self, trace_id: str, parent_id: Optional[str] = None):
+        self.trace_id = trace_id
+        self.parent_id = parent_id
+        self.spans: List[Span] = []
+
+
+def current_trace_id() -> Optional[str]:
+    return _trace_id.get()
+
+
+@contextlib.contextmanager
+def span(name: str, **attributes):
+    """Times the block as a child of the current span. A no-op unless the request is sampled."""
+    parent = _current.get()
+    if parent is None:
+        yield None
+        return
+    child = Span(parent.trace, name, parent.span_id, attributes)
+    token = _current.set(child)
+    try:
+        yield child
+    except BaseException as exc:
+        child.error = repr(exc)
+        raise
+    finally:
+        _current.reset(token)
+        child.end()
+        child.trace.spans.append(child)
+
+
+def traced(name: str):
+    """Decorator form of `span`."""
+
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if _current.get() is None:
+                return function(*args, **kwargs)
+            with span(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+# Exporters ---------------------------------------------------------------------
+
+
+class JsonLinesExporter(object):
+    """Appends one JSON object per span to a local file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def export(self, spans: List[Span]) -> None:
+        lines = "".join(json.dumps(span.to_dict(), default=str) + "\n" for span in spans)
+        with self._lock, open(self.path, "a") as out:
+            out.write(lines)
+
+
+def otlp_payload(spans: List[Span], service_name: str) -> dict:
+    """Spans as an OTLP/HTTP JSON `ExportTraceServiceRequest`."""
+
+    def value(raw):
+        if isinstance(raw, bool):
+            return {"boolValue": raw}
+        if isinstance(raw, int):
+            return {"intValue": str(raw)}
+        if isinstance(raw, float):
+            return {"doubleValue": raw}
+        return {"stringValue": str(raw)}
+
+    return {"resourceSpans": [{
+        "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": service_name}}]},
+        "scopeSpans": [{
+            "scope": {"name": "todo.tracing"},
+            "spans": [{
+                "traceId": span.trace.trace_id,
+                "spanId": span.span_id,
+                "parentSpanId": span.parent_id or "",
+                "name": span.name,
+                "kind": 2 if span.parent_id is None or span.parent_id == span.trace.parent_id else 1,
+                "startTimeUnixNano": str(span.start_ns),
+                "endTimeUnixNano": str(span.end_ns),
+                "attributes": [{"key": key, "value": value(raw)} for key, raw in span.attributes.items()],
+                "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+            } for span in spans],
+        }],
+    }]}
+
+
+class OtlpHttpExporter(object):
+    """
+    Posts spans as OTLP/HTTP JSON to a local collector from a background
+    thread; requests never wait on the collector, and spans are dropped
+    when the queue is full or the collector is down.
+    """
+
+    def __init__(self, endpoint: str, service_name: str = "todo", max_queue: int = 1000, timeout: float = 2.0):
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.timeout = timeout
+        self._queue: "queue.Queue[List[Span]]" = queue.Queue(max_queue)
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def export(self, spans: List[Span]) -> None:
+        try:
+            self._queue.put_nowait(spans)
+        except queue.Full:
+            logger.warning("Trace export queue full; dropping a trace.")
+
+    def _run(self) -> None:
+        while True:
+            batch = self._queue.get()
+            body = json.dumps(otlp_payload(batch, self.service_name), default=str).encode()
+            post = urllib.request.Request(self.endpoint, data=body, headers={"Content-Type": "application/json"})
+            try:
+                urllib.request.urlopen(post, timeout=self.timeout).close()
+            except OSError as exc:
+                logger.warning(f"Trace export to {self.endpoint} failed: {exc}")
+
+
+# Instrumentation ---------------------------------------------------------------
+
+
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    parent = _current.get()
+    if parent is None:
+        return
+    context._trace_span = Span(parent.trace, "sql", parent.span_id, {
+        "db.system": conn.dialect.name,
+        "db.statement": statement[:_MAX_STATEMENT],
+        "db.executemany": executemany,
+    })
+
+
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    child = getattr(context, "_trace_span", None)
+    if child is None:
+        return
+    child.end()
+    if cursor.rowcount is not None and cursor.rowcount >= 0:
+        child.attributes["db.rowcount"] = cursor.rowcount
+    child.trace.spans.append(child)
+
+
+def _on_sql_error(exception_context):
+    child = getattr(exception_context.execution_context, "_trace_span", None)
+    if child is not None:
+        child.end()
+        child.error = repr(exception_context.original_exception)
+        child.trace.spans.append(child)
+
+
+def _before_render(app, template, context, **extra):
+    parent = _current.get()
+    if parent is None:
+        return
+    child = Span(parent.trace, "render", parent.span_id, {"template": template.name})
+    child._token = _current.set(child)
+
+
+def _after_render(app, template, context, **extra):
+    # Spans opened during the render have closed, so the render's is current
+    child = _current.get()
+    if child is None or child.name != "render" or child.attributes["template"] != template.name:
+        return
+    _current.reset(child._token)
+    child.end()
+    child.trace.spans.append(child)
+
+
+_instrumented = False
+
+
+def _instrument() -> None:
+    # Process-wide hooks; each returns at once unless a sampled trace is active
+    global _instrumented
+    if _instrumented:
+        return
+    event.listen(Engine, "before_cursor_execute", _before_execute)
+    event.listen(Engine, "after_cursor_execute", _after_execute)
+    event.listen(Engine, "handle_error", _on_sql_error)
+    before_render_template.connect(_before_render)
+    template_rendered.connect(_after_render)
+    _instrumented = True
+
+
+def _parse_traceparent(header: Optional[str]):
+    # W3C trace context: version-traceid-parentid-flags
+    try:
+        version, trace_id, parent_id, flags = header.split("-")
+        if len(trace_id) != 32 or len(parent_id) != 16 or not int(trace_id, 16) or not int(parent_id, 16):
+            return None
+        return trace_id, parent_id, bool(int(flags, 16) & 1)
+    except (AttributeError, ValueError):
+        return None
+
+
+@functools.lru_cache(maxsize=8)
+def parse_upstreams(spec: str) -> Tuple:
+    """Reads TRACING_TRUSTED_UPSTREAMS, "address,network/bits,...", as IP networks."""
+    return tuple(ipaddress.ip_network(entry, strict=False)
+                 for entry in filter(None, (part.strip() for part in spec.split(","))))
+
+
+def _is_trusted(remote_addr: Optional[str]) -> bool:
+    upstreams = parse_upstreams(current_app.config["TRACING_TRUSTED_UPSTREAMS"])
+    if not upstreams or not remote_addr:
+        return False
+    try:
+        address = ipaddress.ip_address(remote_addr)
+    except ValueError:
+        return False
+    return any(address in network for network in upstreams)
+
+
+class _TraceIdRecordFactory(object):
+    # Adds `trace_id` to every log record, so formats can use %(trace_id)s
+    def __init__(self, factory):
+        self.factory = factory
+
+    def __call__(self, *args, **kwargs):
+        record = self.factory(*args, **kwargs)
+        record.trace_id = _trace_id.get() or "-"
+        return record
+
+
+class Tracing(object):
+    """
+    Request tracing: every request gets a trace id (`X-Trace-Id`, and
+    `%(trace_id)s` in log records). With `TRACING_EXPORTER` set, a
+    `TRACING_SAMPLE_RATE` fraction of requests, plus those arriving with a
+    sampled W3C `traceparent` from one of `TRACING_TRUSTED_UPSTREAMS`, also
+    record nested spans for SQL executes, template renders and the calls
+    wrapped with `traced`, exported per request to a JSON-lines file
+    ("jsonl") or an OTLP/HTTP collector ("otlp"). Without an exporter no
+    hooks are installed at all.
+    """
+
+    def __init__(self, app: Optional[Flask] = None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app: Flask) -> None:
+        app.config.setdefault("TRACING_EXPORTER", None)
+        app.config.setdefault("TRACING_SAMPLE_RATE", 0.01)
+        app.config.setdefault("TRACING_FILE", "traces.jsonl")
+        app.config.setdefault("TRACING_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+        app.config.setdefault("TRACING_TRUSTED_UPSTREAMS", "")
+        # Fail at startup, not on the first traced request
+        parse_upstreams(app.config["TRACING_TRUSTED_UPSTREAMS"])
+
+        if not isinstance(logging.getLogRecordFactory(), _TraceIdRecordFactory):
+            logging.setLogRecordFactory(_TraceIdRecordFactory(logging.getLogRecordFactory()))
+        exporter = app.config["TRACING_EXPORTER"]
+        if exporter == "otlp":
+            app.extensions["tracing"] = OtlpHttpExporter(app.config["TRACING_OTLP_ENDPOINT"], app.name)
+        elif exporter == "jsonl":
+            app.extensions["tracing"] = JsonLinesExporter(app.config["TRACING_FILE"])
+        elif not exporter:
+            app.extensions["tracing"] = None
+        else:
+            raise ValueError(f"Unknown TRACING_EXPORTER {exporter!r}")
+        if app.extensions["tracing"] is not None:
+            _instrument()
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.teardown_request(self._export)
+
+    @staticmethod
+    def _start() -> None:
+        parent = _parse_traceparent(request.headers.get(TRACEPARENT_HEADER))
+        trace_id = parent[0] if parent else os.urandom(16).hex()
+        g._trace_id_token = _trace_id.set(trace_id)
+        exporter = current_app.extensions["tracing"]
+        if exporter is None:
+            return
+        if parent and parent[2] and _is_trusted(request.remote_addr):
+            sampled = True
+        else:
+            # Anyone else's sampled flag would let them bypass the sample rate
+            sampled = random.random() < current_app.config["TRACING_SAMPLE_RATE"]
+        if not sampled:
+            return
+        trace = Trace(trace_id, parent[1] if parent else None)
+        root = Span(trace, f"{request.method} {request.url_rule or request.path}", trace.parent_id, {
+            "http.method": request.method,
+            "http.target": request.path,
+            "endpoint": request.endpoint or "",
+        })
+        g._trace_root, g._trace_token = root, _current.set(root)
+
+    @staticmethod
+    def _finish(response):
+        trace_id = _trace_id.get()
+        if trace_id is not None:
+            response.headers[TRACE_HEADER] = trace_id
+        root = g.get("_trace_root")
+        if root is not None:
+            root.attributes["http.status_code"] = response.status_code
+        return response
+
+    @staticmethod
+    def _export(exc=None) -> None:
+        root = g.pop("_trace_root", None)
+        if root is not None:
+            _current.reset(g.pop("_trace_token"))
+            if exc is not None:
+                root.error = repr(exc)
+            root.end()
+            root.trace.spans.append(root)
+            try:
+                current_app.extensions["tracing"].export(root.trace.spans)
+            except OSError:
+                logger.exception("Could not export a trace.")
+        token = g.pop("_trace_id_token", None)
+        if token is not None:
+            _trace_id.reset(token)
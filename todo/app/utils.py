@@ -1,4 +1,13 @@
 import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+from flask import Flask, current_app
+
+from .tracing import traced
+
 
 class SendEmailClient(object):
     """ A dummy class to perform background tasks,
@@ -6,5 +15,64 @@ class SendEmailClient(object):
       asynchronous task handler like (celery, rq, rabbitMQ etc)
     """
     
+    @traced("email.dispatch")
     def delay(self, *args, **kwargs):
-        logging.info(f"Sending email with: {args, kwargs}")
\ No newline at end of file
+        logging.info(f"Sending email with: {args, kwargs}")
+
+
+class TTLCache(object):
+    """A bounded, thread-safe in-process LRU whose entries expire after a TTL."""
+
+    def __init__(self, max_entries: int = 1024, default_ttl: Optional[float] = None):
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            value, expires_at = item
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        if self.max_entries <= 0:
+            return
+        ttl = self.default_ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key: Hashable) -> None:
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+def get_redis(app: Optional[Flask] = None):
+    """Returns the app's shared Redis client, or None when REDIS_URL is unset."""
+    app = app or current_app
+    if "redis" not in app.extensions:
+        url = app.config.get("REDIS_URL")
+        if url:
+            import redis
+
+            app.extensions["redis"] = redis.Redis.from_url(url)
+        else:
+            app.extensions["redis"] = None
+    return app.extensions["redis"]
@@ -0,0 +1,188 @@
+import logging
+import math
+import secrets
+import time
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass
+from datetime import date
+from typing import Dict, List, Optional
+
+from flask import Flask
+from flask_login import FlaskLoginClient
+from sqlalchemy import delete
+
+# Logger configuration
+logger = logging.getLogger(__name__)
+
+# Requests replayed per warm-up round. "anonymous" requests are sent without
+# the scratch user's session, like a visitor who has not logged in.
+DEFAULT_WARMUP_REQUESTS: List[dict] = [
+    {"method": "GET", "path": "/user/login", "anonymous": True},
+    {"method": "GET", "path": "/user/register", "anonymous": True},
+    {"method": "GET", "path": "/tasks/all_tasks"},
+    {"method": "GET", "path": "/tasks/add_task"},
+    {"method": "POST", "path": "/tasks/add_task", "data": {"task_name": "warm-up task", "tags": "warmup"}},
+    {"method": "GET", "path": "/tasks/all_tasks?tags=warmup"},
+    {"method": "GET", "path": "/tasks/api/tasks"},
+]
+
+# Latency is compared over this many requests at each end of the warm-up
+_SAMPLE_SIZE = 100
+
+# Set while a warm-up replays its requests, all of them as or about the scratch user
+_warming_up: ContextVar[bool] = ContextVar("warming_up", default=False)
+
+
+def warming_up() -> bool:
+    """True inside a warm-up: the availability filter and event outbox leave the scratch user out."""
+    return _warming_up.get()
+
+
+@dataclass
+class WarmupReport:
+    rounds: int
+    requests: int
+    errors: int
+    seconds: float
+    before: Dict[str, float]
+    after: Dict[str, float]
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def _latency_summary(samples: List[float]) -> Dict[str, float]:
+    ordered = sorted(samples)
+    if not ordered:
+        return {"p50_ms": 0.0, "p99_ms": 0.0}
+
+    def rank(pct: float) -> float:
+        return ordered[min(max(math.ceil(pct / 100.0 * len(ordered)) - 1, 0), len(ordered) - 1)]
+
+    return {"p50_ms": round(rank(50) * 1000, 3), "p99_ms": round(rank(99) * 1000, 3)}
+
+
+def _create_scratch_user(app: Flask):
+    from app import db, task_shards
+    from app.models import User
+
+    token = secrets.token_hex(6)
+    user = User(
+        first_name="Warm",
+        last_name="Up",
+        email=f"warmup-{token}@example.com",
+        username=f"warmup-{token}",
+        password=secrets.token_urlsafe(16),
+        date_of_birth=date(2000, 1, 1),
+        confirmed=True,
+    )
+    db.session.add(user)
+    db.session.flush()
+    user.task_shard = task_shards.home_shard(user.id)
+    db.session.commit()
+    return user
+
+
+def _delete_scratch_user(user_id: int, shard: Optional[str]) -> None:
+    from app import db, task_shards
+    from app.models import Task, TaskTag, User
+
+    with task_shards.engine(shard).begin() as conn:
+        conn.execute(delete(TaskTag.__table__).where(TaskTag.__table__.c.user_id == user_id))
+        conn.execute(delete(Task.__table__).where(Task.__table__.c.user_id == user_id))
+    db.session.execute(delete(User).where(User.id == user_id))
+    db.session.commit()
+
+
+def run_warmup(app: Flask, rounds: Optional[int] = None, max_seconds: Optional[float] = None,
+               requests: Optional[List[dict]] = None) -> WarmupReport:
+    """
+    Replays representative requests through the test client against a
+    throwaway user so a fresh worker has JIT-compiled its hot paths, filled
+    its template and SQL caches and opened its pool before real traffic.
+
+    Stops after `rounds` rounds or `max_seconds`, whichever comes first,
+    then deletes the user and everything it created. The scratch user never
+    reaches the availability filter or the event outbox.
+    """
+    rounds = app.config["WARMUP_ROUNDS"] if rounds is None else rounds
+    max_seconds = app.config["WARMUP_MAX_SECONDS"] if max_seconds is None else max_seconds
+    requests = requests or app.config["WARMUP_REQUESTS"]
+    headers = {"Accept-Encoding": "br, gzip"}
+
+    # CSRF tokens cannot be threaded through replayed form posts
+    csrf_enabled = app.config.get("WTF_CSRF_ENABLED", True)
+    app.config["WTF_CSRF_ENABLED"] = False
+    warming = _warming_up.set(True)
+    latencies: List[float] = []
+    errors, completed = 0, 0
+    started = time.perf_counter()
+    try:
+        with app.app_context():
+            user = _create_scratch_user(app)
+            user_id, shard = user.id, user.task_shard
+            clients = {
+                True: app.test_client(),
+                False: FlaskLoginClient(app, app.response_class, use_cookies=True, user=user),
+            }
+        try:
+            for completed in range(1, rounds + 1):
+                for spec in requests:
+                    client = clients[bool(spec.get("anonymous"))]
+                    sent = time.perf_counter()
+                    response = client.open(spec["path"], method=spec["method"], data=spec.get("data"),
+                                           headers=headers)
+                    latencies.append(time.perf_counter() - sent)
+                    if response.status_code >= 400:
+                        errors += 1
+                    response.close()
+                if time.perf_counter() - started >= max_seconds:
+                    break
+        finally:
+            with app.app_context():
+                _delete_scratch_user(user_id, shard)
+    finally:
+        _warming_up.reset(warming)
+        app.config["WTF_CSRF_ENABLED"] = csrf_enabled
+
+    sample = min(_SAMPLE_SIZE, max(len(latencies) // 4, 1))
+    report = WarmupReport(
+        rounds=completed,
+        requests=len(latencies),
+        errors=errors,
+        seconds=round(time.perf_counter() - started, 3),
+        before=_latency_summary(latencies[:sample]),
+        after=_latency_summary(latencies[-sample:]),
+    )
+    app.extensions["warmup"] = report
+    logger.info(
+        f"Warm-up replayed {report.requests} requests in {report.seconds}s ({report.errors} errors); "
+        f"p50 {report.before['p50_ms']}ms -> {report.after['p50_ms']}ms, "
+        f"p99 {report.before['p99_ms']}ms -> {report.after['p99_ms']}ms"
+    )
+    return report
+
+
+def init_warmup(app: Flask) -> None:
+    """Sets the warm-up defaults; the app factory itself never warms up."""
+    app.config.setdefault("WARMUP_ENABLED", False)
+    app.config.setdefault("WARMUP_ROUNDS", 300)
+    app.config.setdefault("WARMUP_MAX_SECONDS", 30.0)
+    app.config.setdefault("WARMUP_REQUESTS", DEFAULT_WARMUP_REQUESTS)
+
+
+def warm_up(app: Flask, force: bool = False) -> Optional[WarmupReport]:
+    """
+    Warms the app up when `WARMUP_ENABLED` is set (or `force`). Only the
+    serving entry points call this, `manage.py runserver` and `asgi.py`,
+    so other manage.py commands never write to the database, which may not
+    be migrated yet, and a failure only means a cold start.
+    """
+    if not (force or app.config["WARMUP_ENABLED"]):
+        return None
+    try:
+        return run_warmup(app)
+    except Exception:
+        # A cold worker is slower, not broken; serve anyway
+        logger.exception("Warm-up failed; starting cold.")
+        return None
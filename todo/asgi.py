@@ -0,0 +1,17 @@
+import os
+
+# The async API runs on asyncio; eventlet's monkey patching would fight the event loop
+os.environ.setdefault("EVENTLET_MONKEY_PATCH", "False")
+
+from app import create_app  # noqa: E402
+from app.async_api import AsyncTaskAPI  # noqa: E402
+from app.warmup import warm_up  # noqa: E402
+from uvicorn.middleware.wsgi import WSGIMiddleware  # noqa: E402
+
+flask_app = create_app(os.getenv("FLASK_CONFIG", "default"))
+# With WARMUP=True, before the server takes traffic
+warm_up(flask_app)
+
+# Serve with `uvicorn asgi:app`: the task API under ASYNC_API_PREFIX runs on
+# the event loop, every other path goes to the Flask app on a thread pool.
+app = AsyncTaskAPI(flask_app, fallback=WSGIMiddleware(flask_app))
@@ -0,0 +1,14 @@
+"""HTTP load benchmarks for the account and tasks flows.
+
+Run through ``python manage.py bench``; see :mod:`benchmarks.runner`.
+``python manage.py bench-reads`` compares the task read paths in-process;
+see :mod:`benchmarks.reads`. ``python manage.py bench-prepared`` times the
+hot lookups with and without prepared statements; see :mod:`benchmarks.prepared`.
+``python manage.py bench-async`` compares the eventlet and asyncio task APIs
+at thousands of concurrent connections; see :mod:`benchmarks.concurrency`.
+"""
+
+from .concurrency import ConcurrencySettings, compare_concurrency  # noqa
+from .prepared import compare_prepared  # noqa
+from .reads import compare_read_paths  # noqa
+from .runner import BenchSettings, compare_results, run_benchmarks  # noqa
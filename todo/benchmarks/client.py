@@ -0,0 +1,63 @@
+import http.client
+from http.cookies import SimpleCookie
+from typing import Dict, Optional, Tuple
+from urllib.parse import urlencode
+
+
+class BenchClient(object):
+    """A minimal keep-alive HTTP client that tracks cookies like a browser.
+
+    Redirects are never followed so every call measures exactly one request.
+    """
+
+    def __init__(self, host: str, port: int, timeout: float = 30.0):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.cookies: Dict[str, str] = {}
+        self._conn: Optional[http.client.HTTPConnection] = None
+
+    def _connection(self) -> http.client.HTTPConnection:
+        if self._conn is None:
+            self._conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        return self._conn
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def request(self, method: str, path: str, form: Optional[dict] = None) -> Tuple[int, bytes]:
+        headers = {"Accept-Encoding": "identity"}
+        body = None
+        if form is not None:
+            body = urlencode(form)
+            headers["Content-Type"] = "application/x-www-form-urlencoded"
+        if self.cookies:
+            headers["Cookie"] = "; ".join(f"{k}={v}" for k, v in self.cookies.items())
+
+        conn = self._connection()
+        try:
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            payload = response.read()
+        except (ConnectionError, http.client.HTTPException):
+            # The server dropped the keep-alive connection; retry once on a fresh one.
+            self.close()
+            conn = self._connection()
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            payload = response.read()
+
+        for header in response.headers.get_all("Set-Cookie") or []:
+            cookie = SimpleCookie()
+            cookie.load(header)
+            for key, morsel in cookie.items():
+                self.cookies[key] = morsel.value
+        return response.status, payload
+
+    def get(self, path: str) -> Tuple[int, bytes]:
+        return self.request("GET", path)
+
+    def post(self, path: str, form: dict) -> Tuple[int, bytes]:
+        return self.request("POST", path, form)
@@ -0,0 +1,186 @@
+import asyncio
+import logging
+import os
+import socket
+import subprocess
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List
+
+from flask import Flask
+
+from .runner import seed_dataset, summarize
+
+# Logger configuration
+logger = logging.getLogger(__name__)
+
+# The eventlet path serves the Flask JSON API, the asyncio path the same API on AsyncTaskAPI
+SERVERS = ("eventlet", "asyncio")
+SCENARIOS = ("list", "create")
+
+_TODO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@dataclass
+class ConcurrencySettings:
+    """Knobs for one concurrency run; recorded alongside the results."""
+
+    users: int = 100
+    tasks_per_user: int = 50
+    connections: int = 2000
+    requests: int = 20000
+    host: str = "127.0.0.1"
+    servers: List[str] = field(default_factory=lambda: list(SERVERS))
+    scenarios: List[str] = field(default_factory=lambda: list(SCENARIOS))
+
+
+def session_cookies(app: Flask, user_ids: List[int]) -> List[str]:
+    """Signed Flask session cookies for the users, as if each had logged in."""
+    serializer = app.session_interface.get_signing_serializer(app)
+    name = app.config["SESSION_COOKIE_NAME"]
+    return [f"{name}={serializer.dumps({'_user_id': str(user_id), '_fresh': True})}" for user_id in user_ids]
+
+
+def _request(server: str, scenario: str, prefix: str, cookie: str, host: str, number: int) -> bytes:
+    path = f"{prefix}/api/tasks" if server == "asyncio" else "/tasks/api/tasks"
+    headers = f"Host: {host}\r\nCookie: {cookie}\r\n"
+    if scenario == "list":
+        return f"GET {path} HTTP/1.1\r\n{headers}\r\n".encode()
+    body = f'{{"task_name": "bench task {number}"}}'.encode()
+    return (
+        f"POST {path} HTTP/1.1\r\n{headers}Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n"
+    ).encode() + body
+
+
+async def _read_response(reader: asyncio.StreamReader) -> int:
+    """Reads one Content-Length framed response; returns its status."""
+    head = await reader.readuntil(b"\r\n\r\n")
+    lines = head.decode("latin-1").split("\r\n")
+    status = int(lines[0].split(" ", 2)[1])
+    length = 0
+    for line in lines[1:]:
+        name, _, value = line.partition(":")
+        if name.strip().lower() == "content-length":
+            length = int(value)
+    if length:
+        await reader.readexactly(length)
+    return status
+
+
+async def drive(server: str, scenario: str, port: int, cookies: List[str], settings: ConcurrencySettings,
+                prefix: str) -> dict:
+    """
+    Opens `connections` keep-alive connections at once and has them share
+    `requests` requests. A refused or dropped connection counts as one
+    error and leaves its share to the others.
+    """
+    latencies: List[float] = []
+    errors = [0]
+    remaining = [settings.requests]
+    ok = 201 if scenario == "create" else 200
+
+    async def connection(index: int) -> None:
+        cookie = cookies[index % len(cookies)]
+        try:
+            reader, writer = await asyncio.open_connection(settings.host, port)
+        except OSError:
+            errors[0] += 1
+            return
+        try:
+            while remaining[0] > 0:
+                remaining[0] -= 1
+                started = time.perf_counter()
+                writer.write(_request(server, scenario, prefix, cookie, settings.host, remaining[0]))
+                try:
+                    status = await _read_response(reader)
+                except (OSError, asyncio.IncompleteReadError):
+                    errors[0] += 1
+                    return
+                if status == ok:
+                    latencies.append(time.perf_counter() - started)
+                else:
+                    errors[0] += 1
+        finally:
+            writer.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*[connection(index) for index in range(settings.connections)])
+    return summarize(latencies, errors[0], time.perf_counter() - started)
+
+
+def _free_port(host: str) -> int:
+    with socket.socket() as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+def _start(server: str, host: str, port: int, backlog: int, env: Dict[str, str]) -> subprocess.Popen:
+    if server == "asyncio":
+        command = [sys.executable, "-m", "uvicorn", "asgi:app", "--host", host, "--port", str(port),
+                   "--backlog", str(backlog), "--no-access-log", "--log-level", "warning"]
+    else:
+        # config monkey patches on import, which must come before anything else loads
+        command = [sys.executable, "-c", "import config; from benchmarks.concurrency import serve_eventlet; "
+                                         f"serve_eventlet({host!r}, {port}, {backlog})"]
+    process = subprocess.Popen(command, cwd=_TODO_DIR, env=env)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"The {server} server exited with code {process.returncode}.")
+        try:
+            socket.create_connection((host, port), timeout=0.5).close()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"The {server} server did not start listening on {host}:{port}.")
+
+
+def serve_eventlet(host: str, port: int, backlog: int) -> None:
+    """Serves the benchmark app on eventlet's WSGI server with a green thread per connection."""
+    import eventlet
+    import eventlet.wsgi
+    from app import create_app
+
+    app = create_app("benchmark")
+    sock = eventlet.listen((host, port), backlog=backlog)
+    eventlet.wsgi.server(sock, app, max_size=backlog, log_output=False)
+
+
+def compare_concurrency(app: Flask, settings: ConcurrencySettings) -> Dict[str, Dict[str, dict]]:
+    """
+    Seeds the benchmark database, then for each server starts it in its own
+    process and drives every scenario with `connections` concurrent
+    keep-alive connections. Returns the stats per server and scenario.
+    """
+    unknown = (set(settings.servers) - set(SERVERS)) | (set(settings.scenarios) - set(SCENARIOS))
+    if unknown:
+        raise ValueError(f"Unknown servers or scenarios: {', '.join(sorted(unknown))}")
+    users = seed_dataset(app, settings.users, settings.tasks_per_user)
+    if not users:
+        raise ValueError("At least one benchmark user is required.")
+
+    from app import db
+    from app.models import User
+    with app.app_context():
+        user_ids = db.session.execute(db.select(User.id).order_by(User.id)).scalars().all()
+    cookies = session_cookies(app, user_ids)
+    env = dict(os.environ, FLASK_CONFIG="benchmark", BENCH_DATABASE_URL=app.config["SQLALCHEMY_DATABASE_URI"])
+
+    results: Dict[str, Dict[str, dict]] = {}
+    for server in settings.servers:
+        port = _free_port(settings.host)
+        process = _start(server, settings.host, port, settings.connections,
+                         dict(env, EVENTLET_MONKEY_PATCH=str(server == "eventlet")))
+        try:
+            results[server] = {}
+            for scenario in settings.scenarios:
+                results[server][scenario] = asyncio.run(
+                    drive(server, scenario, port, cookies, settings, app.config["ASYNC_API_PREFIX"])
+                )
+                logger.info(f"{server} {scenario}: {results[server][scenario]}")
+        finally:
+            process.terminate()
+            process.wait()
+    return results
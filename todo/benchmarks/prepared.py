@@ -0,0 +1,66 @@
+import time
+from typing import Dict, List, Tuple
+
+from flask import Flask
+
+from .runner import percentile, seed_dataset
+from .scenarios import VirtualUser
+
+
+def _lookups(session, user: VirtualUser) -> Dict[str, Tuple[object, dict]]:
+    from app.models import User
+    from app.models.tasks import task_by_id
+    from app.models.user import user_by_email, user_by_id
+
+    user_id = session.query(User.id).filter_by(email=user.email).scalar()
+    return {
+        "user_by_email": (user_by_email, {"email": user.email}),
+        "user_by_id": (user_by_id, {"id": user_id}),
+        "task_by_id": (task_by_id, {"id": user.task_ids[len(user.task_ids) // 2]}),
+    }
+
+
+def _time(session, statement, params: dict, repeat: int) -> List[float]:
+    latencies = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        session.execute(statement, params).scalars().first()
+        latencies.append(time.perf_counter() - started)
+        # Nothing stays in the identity map to short-cut the next round
+        session.expunge_all()
+    return sorted(latencies)
+
+
+def compare_prepared(app: Flask, repeat: int = 2000) -> Dict[str, dict]:
+    """
+    Times each hot lookup run as the ordinary query and as `EXECUTE` of the
+    statement the connection prepared, on one Postgres connection, and
+    reports the median and p95 latency of both and the median saved.
+    """
+    from app import db
+
+    if not app.config["PREPARED_STATEMENTS"] or not app.extensions["prepared_statements"]:
+        raise RuntimeError("Prepared statements need a Postgres benchmark database and PREPARED_STATEMENTS=True.")
+    users = seed_dataset(app, 1, 1000)
+    results = {}
+    with app.app_context():
+        # Connections opened before the tables were recreated prepared nothing
+        db.engine.dispose()
+        lookups = _lookups(db.session, users[0])
+        for name, (query, params) in lookups.items():
+            if not query._is_prepared(db.session):
+                raise RuntimeError(f"{name} was not prepared on the benchmark connection.")
+            plain, prepared = query.statement, query._execute_statement()
+            # One unmeasured pass each so neither pays for compiling its SQL
+            _time(db.session, plain, params, 10)
+            _time(db.session, prepared, params, 10)
+            timings = {"plain": _time(db.session, plain, params, repeat),
+                       "prepared": _time(db.session, prepared, params, repeat)}
+            results[name] = {
+                f"{path}_{pct}_us": round(percentile(latencies, pct) * 1e6, 1)
+                for path, latencies in timings.items()
+                for pct in (50, 95)
+            }
+            results[name]["saved_us"] = round(results[name]["plain_50_us"] - results[name]["prepared_50_us"], 1)
+        db.session.remove()
+    return results
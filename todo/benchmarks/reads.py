@@ -0,0 +1,79 @@
+import gc
+import time
+import tracemalloc
+from typing import Callable, Dict
+
+from flask import Flask
+from sqlalchemy import select
+
+from .runner import seed_dataset
+
+
+def _orm_read(session, user_id: int) -> list:
+    # What the list view did before projections: full entities plus their tags
+    from app.models import Task
+
+    tasks = session.execute(
+        select(Task).where(Task.user_id == user_id, Task.completed_at.is_(None)).order_by(Task.rank, Task.id)
+    ).scalars().all()
+    for task in tasks:
+        task.tag_names
+    return tasks
+
+
+def _projection_read(session, user_id: int) -> list:
+    from app.blueprints.tasks.projections import load_task_rows, task_columns
+    from app.models import Task
+
+    query = task_columns().where(Task.user_id == user_id, Task.completed_at.is_(None)).order_by(Task.rank, Task.id)
+    return load_task_rows(session, user_id, query)
+
+
+READ_PATHS: Dict[str, Callable] = {"orm": _orm_read, "projection": _projection_read}
+
+
+def _measure(app: Flask, read: Callable, user_id: int, repeat: int) -> dict:
+    from app import db
+
+    def run(traced: bool):
+        with app.app_context():
+            gc.collect()
+            if traced:
+                tracemalloc.start()
+            started = time.perf_counter()
+            result = read(db.session, user_id)
+            elapsed = time.perf_counter() - started
+            # Peak while the result (and any session tracking it) is alive
+            peak = tracemalloc.get_traced_memory()[1] if traced else 0
+            if traced:
+                tracemalloc.stop()
+            rows = len(result)
+            del result
+            db.session.remove()
+        return elapsed, peak, rows
+
+    # Tracing slows allocation down, so time and memory come from separate runs
+    best = min(run(traced=False)[0] for _ in range(repeat))
+    _, peak, rows = run(traced=True)
+    return {
+        "rows": rows,
+        "rows_per_sec": round(rows / best) if best else 0,
+        "best_ms": round(best * 1000, 3),
+        "peak_kib_per_10k": round(peak / 1024 * 10000 / rows, 1) if rows else 0.0,
+    }
+
+
+def compare_read_paths(app: Flask, tasks: int = 10000, repeat: int = 5) -> Dict[str, dict]:
+    """
+    Seeds one user with `tasks` tagged tasks and times loading them through
+    each read path, reporting rows/sec and peak allocations per 10k rows.
+    """
+    users = seed_dataset(app, 1, tasks)
+    from app.models import User
+
+    with app.app_context():
+        user_id = User.query.filter_by(email=users[0].email).one().id
+    # One unmeasured pass each so neither path pays for compiling its SQL
+    for read in READ_PATHS.values():
+        _measure(app, read, user_id, 1)
+    return {name: _measure(app, read, user_id, repeat) for name, read in READ_PATHS.items()}
@@ -0,0 +1,204 @@
+import json
+import math
+import logging
+import platform
+import time
+from dataclasses import asdict, dataclass, field
+from datetime import date, datetime, timezone
+from typing import Dict, List, Optional
+
+import eventlet
+import eventlet.wsgi
+from flask import Flask
+from sqlalchemy import insert, select
+from werkzeug.security import generate_password_hash
+
+from .client import BenchClient
+from .scenarios import BENCH_PASSWORD, BENCH_TAGS, SCENARIOS, Scenario, VirtualUser
+
+# Logger configuration
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class BenchSettings:
+    """Knobs for one benchmark run; recorded alongside the results."""
+
+    users: int = 20
+    tasks_per_user: int = 50
+    requests: int = 300
+    concurrency: int = 16
+    host: str = "127.0.0.1"
+    scenarios: List[str] = field(default_factory=lambda: list(SCENARIOS))
+
+
+def seed_dataset(app: Flask, users: int, tasks_per_user: int) -> List[VirtualUser]:
+    """Recreates the benchmark schema and fills it with users and tasks."""
+    from app import db
+    from app.models import Task, TaskTag, User
+
+    password_hash = generate_password_hash(BENCH_PASSWORD)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        accounts = [
+            User(
+                first_name="Bench",
+                last_name=str(i),
+                email=f"bench{i}@example.com",
+                username=f"bench{i}",
+                password_hash=password_hash,
+                date_of_birth=date(1990, 1, 1),
+                confirmed=True,
+            )
+            for i in range(users)
+        ]
+        db.session.add_all(accounts)
+        db.session.flush()
+        rows = [
+            {"content": f"task {n} of {account.username}", "user_id": account.id, "date_posted": datetime.now()}
+            for account in accounts
+            for n in range(tasks_per_user)
+        ]
+        if rows:
+            db.session.execute(insert(Task), rows)
+        db.session.commit()
+
+        task_ids: Dict[int, List[int]] = {account.id: [] for account in accounts}
+        for task_id, user_id in db.session.execute(select(Task.id, Task.user_id).order_by(Task.id)):
+            task_ids[user_id].append(task_id)
+        tags = [
+            {"user_id": user_id, "tag": tag, "task_id": task_id}
+            for user_id, ids in task_ids.items()
+            for n, task_id in enumerate(ids)
+            for tag in BENCH_TAGS[n % len(BENCH_TAGS):][:2]
+        ]
+        if tags:
+            db.session.execute(insert(TaskTag), tags)
+        db.session.commit()
+        return [VirtualUser(account.email, task_ids[account.id]) for account in accounts]
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(pct / 100.0 * len(sorted_values)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> dict:
+    """Reduces raw latencies (seconds) to the reported statistics."""
+    ordered = sorted(latencies)
+    completed = len(ordered)
+    return {
+        "requests": completed + errors,
+        "errors": errors,
+        "rps": round(completed / elapsed, 2) if elapsed > 0 else 0.0,
+        "mean_ms": round(sum(ordered) / completed * 1000, 3) if completed else 0.0,
+        "p50_ms": round(percentile(ordered, 50) * 1000, 3),
+        "p95_ms": round(percentile(ordered, 95) * 1000, 3),
+        "p99_ms": round(percentile(ordered, 99) * 1000, 3),
+    }
+
+
+def run_scenario(scenario: Scenario, users: List[VirtualUser], settings: BenchSettings, port: int) -> dict:
+    """Drives one scenario with `concurrency` green-thread clients."""
+    latencies: List[float] = []
+    errors = [0]
+    remaining = [settings.requests]
+
+    def worker(index: int) -> None:
+        user = users[index % len(users)]
+        client = BenchClient(settings.host, port)
+        try:
+            if scenario.needs_login:
+                SCENARIOS["login"].run(client, user)
+            while remaining[0] > 0:
+                remaining[0] -= 1
+                started = time.perf_counter()
+                try:
+                    ok = scenario.run(client, user)
+                except Exception:
+                    logger.exception(f"Scenario {scenario.name} raised.")
+                    ok = False
+                if ok:
+                    latencies.append(time.perf_counter() - started)
+                else:
+                    errors[0] += 1
+        finally:
+            client.close()
+
+    pool = eventlet.GreenPool(settings.concurrency)
+    started = time.perf_counter()
+    for index in range(settings.concurrency):
+        pool.spawn_n(worker, index)
+    pool.waitall()
+    return summarize(latencies, errors[0], time.perf_counter() - started)
+
+
+def run_benchmarks(app: Flask, settings: BenchSettings) -> dict:
+    """Seeds the dataset, serves `app` locally and runs every scenario."""
+    unknown = set(settings.scenarios) - set(SCENARIOS)
+    if unknown:
+        raise ValueError(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    users = seed_dataset(app, settings.users, settings.tasks_per_user)
+    if not users:
+        raise ValueError("At least one benchmark user is required.")
+
+    sock = eventlet.listen((settings.host, 0))
+    port = sock.getsockname()[1]
+    server = eventlet.spawn(eventlet.wsgi.server, sock, app, log_output=False)
+    logger.info(f"Benchmark server listening on {settings.host}:{port}")
+
+    results = {}
+    try:
+        for name in settings.scenarios:
+            results[name] = run_scenario(SCENARIOS[name], users, settings, port)
+            logger.info(f"{name}: {results[name]}")
+    finally:
+        server.kill()
+        sock.close()
+
+    from app import db
+    with app.app_context():
+        dialect = db.engine.dialect.name
+
+    return {
+        "meta": {
+            "created_at": datetime.now(tz=timezone.utc).isoformat(),
+            "python": f"{platform.python_implementation()} {platform.python_version()}",
+            "database": dialect,
+            "group_commit": bool(app.config.get("TASK_GROUP_COMMIT")),
+            "settings": asdict(settings),
+        },
+        "scenarios": results,
+    }
+
+
+def compare_results(current: dict, baseline: dict, threshold: float) -> List[str]:
+    """Lists scenarios whose p95 latency or throughput regressed past `threshold`."""
+    regressions = []
+    for name, base in baseline.get("scenarios", {}).items():
+        now = current.get("scenarios", {}).get(name)
+        if now is None:
+            continue
+        if base["p95_ms"] and now["p95_ms"] > base["p95_ms"] * (1 + threshold):
+            regressions.append(f"{name}: p95 {now['p95_ms']}ms > baseline {base['p95_ms']}ms")
+        if base["rps"] and now["rps"] < base["rps"] * (1 - threshold):
+            regressions.append(f"{name}: {now['rps']} req/s < baseline {base['rps']} req/s")
+    return regressions
+
+
+def save_results(results: dict, path: str) -> None:
+    with open(path, "w") as fh:
+        json.dump(results, fh, indent=2)
+
+
+def load_results(path: str) -> Optional[dict]:
+    try:
+        with open(path) as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        return None
@@ -0,0 +1,97 @@
+import itertools
+from typing import Callable, Dict, List, Optional
+
+from .client import BenchClient
+
+# Password every seeded benchmark account is created with.
+BENCH_PASSWORD = "bench-password"
+
+# Tags spread over seeded tasks, two per task, for the tag filter scenario.
+BENCH_TAGS = ["work", "home", "urgent", "later"]
+
+_REDIRECT = 302
+_OK = 200
+
+_update_counter = itertools.count()
+
+
+class VirtualUser(object):
+    """A seeded account together with the task ids it owns."""
+
+    def __init__(self, email: str, task_ids: List[int]):
+        self.email = email
+        self.task_ids = task_ids
+        self._cursor = itertools.count()
+
+    def next_task_id(self) -> Optional[int]:
+        """Cycles through the user's tasks, used by read/update scenarios."""
+        if not self.task_ids:
+            return None
+        return self.task_ids[next(self._cursor) % len(self.task_ids)]
+
+    def pop_task_id(self) -> Optional[int]:
+        """Removes a task id so it is never deleted twice."""
+        return self.task_ids.pop() if self.task_ids else None
+
+
+def login(client: BenchClient, user: VirtualUser) -> bool:
+    client.cookies.clear()
+    status, _ = client.post(
+        "/user/login", {"email": user.email, "password": BENCH_PASSWORD}
+    )
+    return status == _REDIRECT
+
+
+def list_tasks(client: BenchClient, user: VirtualUser) -> bool:
+    status, _ = client.get("/tasks/all_tasks")
+    return status == _OK
+
+
+def filter_tasks(client: BenchClient, user: VirtualUser) -> bool:
+    status, _ = client.get("/tasks/all_tasks?tags=work,home&match=all")
+    return status == _OK
+
+
+def add_task(client: BenchClient, user: VirtualUser) -> bool:
+    status, _ = client.post("/tasks/add_task", {"task_name": "benchmark task"})
+    return status == _REDIRECT
+
+
+def update_task(client: BenchClient, user: VirtualUser) -> bool:
+    task_id = user.next_task_id()
+    if task_id is None:
+        return False
+    status, _ = client.post(
+        f"/tasks/all_tasks/{task_id}/update_task",
+        {"task_name": f"updated {next(_update_counter)}"},
+    )
+    return status == _REDIRECT
+
+
+def delete_task(client: BenchClient, user: VirtualUser) -> bool:
+    task_id = user.pop_task_id()
+    if task_id is None:
+        return False
+    status, _ = client.get(f"/tasks/all_tasks/{task_id}/delete_task")
+    return status == _REDIRECT
+
+
+class Scenario(object):
+    def __init__(self, name: str, run: Callable[[BenchClient, VirtualUser], bool], needs_login: bool = True):
+        self.name = name
+        self.run = run
+        self.needs_login = needs_login
+
+
+# Ordered so destructive scenarios run last against the seeded dataset.
+SCENARIOS: Dict[str, Scenario] = {
+    scenario.name: scenario
+    for scenario in (
+        Scenario("login", login, needs_login=False),
+        Scenario("list_tasks", list_tasks),
+        Scenario("filter_tasks", filter_tasks),
+        Scenario("add_task", add_task),
+        Scenario("update_task", update_task),
+        Scenario("delete_task", delete_task),
+    )
+}
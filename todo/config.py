@@ -1,13 +1,15 @@
 import logging
 import os
 import sys
+import tempfile
 
 import eventlet
 from dotenv import load_dotenv
 from eventlet.green import urllib
 
-# Apply eventlet monkey patch
-eventlet.monkey_patch()
+# Apply eventlet monkey patch; the asyncio entry point (asgi.py) runs without it
+if os.environ.get("EVENTLET_MONKEY_PATCH", "True") == "True":
+    eventlet.monkey_patch()
 
 # Load environment variables from .env file
 load_dotenv()
@@ -76,14 +78,169 @@ class Config:
     
     # SQLAlchemy settings
     SQLALCHEMY_TRACK_MODIFICATIONS = True
+
+    # Task sharding: comma separated database URLs; users stay on the main
+    # database while their tasks are spread over these by user id
+    TASK_SHARD_URLS = [url for url in get_env_variable("TASK_SHARD_URLS", "").split(",") if url]
+    SQLALCHEMY_BINDS = {f"tasks_shard_{index}": url for index, url in enumerate(TASK_SHARD_URLS)}
+    # Task ids each shard hands out, so tasks keep their ids when they move;
+    # shard N starts at (N + 1) * TASK_SHARD_ID_BLOCK
+    TASK_SHARD_ID_BLOCK = get_env_variable("TASK_SHARD_ID_BLOCK", 100000000, int)
+
+    # Group commit: task inserts arriving within the window (or until the
+    # batch is full) share one multi-row INSERT and one COMMIT per worker
+    TASK_GROUP_COMMIT = get_env_variable("TASK_GROUP_COMMIT", "False") == "True"
+    TASK_GROUP_COMMIT_WINDOW_MS = get_env_variable("TASK_GROUP_COMMIT_WINDOW_MS", 5, float)
+    TASK_GROUP_COMMIT_MAX_BATCH = get_env_variable("TASK_GROUP_COMMIT_MAX_BATCH", 100, int)
+
+    # Tasks listed per page; pages are keyed by the last task id shown
+    TASKS_PER_PAGE = get_env_variable("TASKS_PER_PAGE", 50, int)
+
+    # Users listed per page of the admin directory, keyed by the last user id shown
+    ADMIN_USERS_PER_PAGE = get_env_variable("ADMIN_USERS_PER_PAGE", 50, int)
+
+    # Rank keys longer than this after a drag get the user's list renumbered
+    # in the background
+    TASK_RANK_MAX_LENGTH = get_env_variable("TASK_RANK_MAX_LENGTH", 32, int)
+
+    # Warm-up: replay representative requests against a scratch user when
+    # the server starts (runserver, asgi.py), so fresh (PyPy) workers are
+    # JIT-warm before serving
+    WARMUP_ENABLED = get_env_variable("WARMUP", "False") == "True"
+    WARMUP_ROUNDS = get_env_variable("WARMUP_ROUNDS", 300, int)
+    WARMUP_MAX_SECONDS = get_env_variable("WARMUP_MAX_SECONDS", 30, float)
+
+    # Admission control: per worker, at most ADMISSION_MAX_IN_FLIGHT requests
+    # run (half as many while pool checkouts average more than
+    # ADMISSION_MAX_POOL_WAIT_MS) and ADMISSION_QUEUE_SIZE wait; the rest get
+    # a 503 with Retry-After
+    ADMISSION_CONTROL = get_env_variable("ADMISSION_CONTROL", "False") == "True"
+    ADMISSION_MAX_IN_FLIGHT = get_env_variable("ADMISSION_MAX_IN_FLIGHT", 64, int)
+    ADMISSION_QUEUE_SIZE = get_env_variable("ADMISSION_QUEUE_SIZE", 128, int)
+    ADMISSION_MAX_POOL_WAIT_MS = get_env_variable("ADMISSION_MAX_POOL_WAIT_MS", 100, float)
+    ADMISSION_RETRY_AFTER = get_env_variable("ADMISSION_RETRY_AFTER", 1, int)
+
+    # Task partitions and archive: on Postgres `manage.py partition-tasks` keeps
+    # monthly partitions of `task` ready TASK_PARTITION_MONTHS_AHEAD months out;
+    # `manage.py archive-tasks` moves months older than TASK_ARCHIVE_AFTER_MONTHS
+    # into gzipped NDJSON under TASK_ARCHIVE_DIR ("file") or the `archive`
+    # schema ("schema"). Task reads and writes only look at tasks posted since
+    # that cutoff, so they touch the recent partitions; older tasks are read-only
+    # under /tasks/archive, archived yet or not
+    TASK_PARTITION_MONTHS_AHEAD = get_env_variable("TASK_PARTITION_MONTHS_AHEAD", 3, int)
+    TASK_ARCHIVE_AFTER_MONTHS = get_env_variable("TASK_ARCHIVE_AFTER_MONTHS", 12, int)
+    TASK_ARCHIVE_MODE = get_env_variable("TASK_ARCHIVE_MODE", "file")
+    TASK_ARCHIVE_DIR = get_env_variable("TASK_ARCHIVE_DIR", os.path.join(basedir, "archive"))
+
+    # Account deletion: tasks are purged USER_PURGE_BATCH_SIZE at a time, resting
+    # at least USER_PURGE_PAUSE seconds (and as long as the batch took) between
+    # batches, and waiting while Postgres replicas lag more than
+    # USER_PURGE_MAX_REPLICATION_LAG seconds. Without the background purge,
+    # `manage.py purge-user` finishes pending deletions
+    USER_PURGE_IN_BACKGROUND = get_env_variable("USER_PURGE_IN_BACKGROUND", "True") == "True"
+    USER_PURGE_BATCH_SIZE = get_env_variable("USER_PURGE_BATCH_SIZE", 1000, int)
+    USER_PURGE_PAUSE = get_env_variable("USER_PURGE_PAUSE", 0.05, float)
+    USER_PURGE_MAX_REPLICATION_LAG = get_env_variable("USER_PURGE_MAX_REPLICATION_LAG", 5, float)
+
+    # Idempotency keys: task-creating POSTs retried with the same
+    # Idempotency-Key replay the stored response for IDEMPOTENCY_TTL seconds.
+    # Kept in Redis when REDIS_URL is set ("auto"), else in the database
+    IDEMPOTENCY_BACKEND = get_env_variable("IDEMPOTENCY_BACKEND", "auto")
+    IDEMPOTENCY_TTL = get_env_variable("IDEMPOTENCY_TTL", 24 * 60 * 60, int)
+    IDEMPOTENCY_LOCK_TTL = get_env_variable("IDEMPOTENCY_LOCK_TTL", 30, int)
+    IDEMPOTENCY_WAIT_SECONDS = get_env_variable("IDEMPOTENCY_WAIT_SECONDS", 10, float)
     
     
+    # Request profiling: admins profile one request with a token from
+    # `manage.py profile-token`; with PROFILE_SAMPLE_RATE = N, 1 in N requests
+    # per endpoint is sampled and the PROFILE_KEEP_SLOWEST slowest are kept.
+    # Profiles go to PROFILE_DIR as "collapsed" stacks or "speedscope" JSON
+    PROFILE_DIR = get_env_variable("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "todo-profiles"))
+    PROFILE_FORMAT = get_env_variable("PROFILE_FORMAT", "collapsed")
+    PROFILE_TOKEN_MAX_AGE = get_env_variable("PROFILE_TOKEN_MAX_AGE", 3600, int)
+    PROFILE_SAMPLE_RATE = get_env_variable("PROFILE_SAMPLE_RATE", 0, int)
+    PROFILE_SAMPLE_INTERVAL_MS = get_env_variable("PROFILE_SAMPLE_INTERVAL_MS", 5, float)
+    PROFILE_KEEP_SLOWEST = get_env_variable("PROFILE_KEEP_SLOWEST", 10, int)
+
+    # Prepared statements: on Postgres, each connection prepares the hot user and
+    # task lookups once and runs them with EXECUTE. Statements do not survive
+    # PgBouncer transaction pooling, so PGBOUNCER_TRANSACTION_POOLING turns
+    # them off
+    PREPARED_STATEMENTS = get_env_variable("PREPARED_STATEMENTS", "False") == "True"
+    PGBOUNCER_TRANSACTION_POOLING = get_env_variable("PGBOUNCER_TRANSACTION_POOLING", "False") == "True"
+
+    # Availability filter: a Bloom filter of taken usernames and emails, in
+    # Redis when REDIS_URL is set ("auto") or else in shared memory, lets the
+    # registration forms and /user/availability skip the database for values
+    # that are certainly free. Sized for AVAILABILITY_FILTER_CAPACITY values at
+    # AVAILABILITY_FILTER_ERROR_RATE false positives; built by
+    # `manage.py rebuild-availability-filter`
+    AVAILABILITY_FILTER_BACKEND = get_env_variable("AVAILABILITY_FILTER_BACKEND", "auto")
+    AVAILABILITY_FILTER_KEY = get_env_variable("AVAILABILITY_FILTER_KEY", "todo-availability")
+    AVAILABILITY_FILTER_CAPACITY = get_env_variable("AVAILABILITY_FILTER_CAPACITY", 1000000, int)
+    AVAILABILITY_FILTER_ERROR_RATE = get_env_variable("AVAILABILITY_FILTER_ERROR_RATE", 0.001, float)
+
+    # Tracing: every request gets an X-Trace-Id; with TRACING_EXPORTER set to
+    # "jsonl" (spans appended to TRACING_FILE) or "otlp" (OTLP/HTTP JSON posted
+    # to TRACING_OTLP_ENDPOINT), a TRACING_SAMPLE_RATE fraction of requests
+    # also records spans for SQL, template renders, tokens and email dispatch.
+    # A sampled traceparent header is honoured only from the addresses or
+    # networks in TRACING_TRUSTED_UPSTREAMS (comma separated)
+    TRACING_EXPORTER = get_env_variable("TRACING_EXPORTER", None)
+    TRACING_SAMPLE_RATE = get_env_variable("TRACING_SAMPLE_RATE", 0.01, float)
+    TRACING_FILE = get_env_variable("TRACING_FILE", "traces.jsonl")
+    TRACING_OTLP_ENDPOINT = get_env_variable("TRACING_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+    TRACING_TRUSTED_UPSTREAMS = get_env_variable("TRACING_TRUSTED_UPSTREAMS", "")
+
+    # Page shells: anonymous GETs of the login, register and password reset
+    # pages are rendered once per template version and served with the CSRF
+    # token and flashed messages spliced in; gzip bodies are precompressed
+    PAGE_SHELLS = get_env_variable("PAGE_SHELLS", "True") == "True"
+    PAGE_SHELL_COMPRESS_LEVEL = get_env_variable("PAGE_SHELL_COMPRESS_LEVEL", 6, int)
+
+    # Outbox: task and account changes queue an event in `outbox_events` in
+    # their own transaction; `manage.py outbox-relay` appends them to the
+    # OUTBOX_STREAM Redis stream, trimmed to about OUTBOX_STREAM_MAX_LENGTH
+    OUTBOX_STREAM = get_env_variable("OUTBOX_STREAM", "todo:events")
+    OUTBOX_STREAM_MAX_LENGTH = get_env_variable("OUTBOX_STREAM_MAX_LENGTH", 1000000, int)
+
+    # Async task API (asgi.py): served under ASYNC_API_PREFIX on SQLAlchemy's
+    # asyncio engine; ASYNC_DATABASE_URL defaults to the app's database
+    # through aiosqlite or asyncpg
+    ASYNC_API_PREFIX = get_env_variable("ASYNC_API_PREFIX", "/async")
+    ASYNC_DATABASE_URL = get_env_variable("ASYNC_DATABASE_URL")
+
+    # Account tokens: TOKEN_KEYS is "kid:secret,kid:secret", newest (signing)
+    # key first; empty signs with SECRET_KEY. Used tokens are revoked in Redis
+    # ("auto" with REDIS_URL) or the database until they expire
+    TOKEN_KEYS = get_env_variable("TOKEN_KEYS", "")
+    TOKEN_REVOCATION_BACKEND = get_env_variable("TOKEN_REVOCATION_BACKEND", "auto")
+    TOKEN_REVOCATION_CACHE_SIZE = get_env_variable("TOKEN_REVOCATION_CACHE_SIZE", 10000, int)
+
     # CORS allowed domains
     ALLOWED_ORIGINS = [
         r".*\.gitpod\.io$",
         "http://localhost:5000",
     ]
     
+    # Response compression: bodies under the size floor go out uncompressed and
+    # levels drop while the 1-minute load average per CPU exceeds the threshold
+    COMPRESS_MIN_SIZE = get_env_variable("COMPRESS_MIN_SIZE", 1024, int)
+    COMPRESS_HIGH_LOAD = get_env_variable("COMPRESS_HIGH_LOAD", 0.75, float)
+    COMPRESS_RESPONSE_CACHE_SIZE = get_env_variable("COMPRESS_RESPONSE_CACHE_SIZE", 256, int)
+
+    # Jinja caching: compiled templates are shared through "filesystem" or
+    # "redis" (empty disables), rendered `{% cache %}` fragments stay in-process
+    JINJA_BYTECODE_CACHE = get_env_variable("JINJA_BYTECODE_CACHE", "filesystem")
+    JINJA_BYTECODE_CACHE_DIR = get_env_variable(
+        "JINJA_BYTECODE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "todo-jinja-cache")
+    )
+    JINJA_FRAGMENT_CACHE_SIZE = get_env_variable("JINJA_FRAGMENT_CACHE_SIZE", 512, int)
+
+    # Static assets built by `manage.py build-assets`
+    ASSETS_BUILD_DIR = "build"
+    ASSETS_MAX_AGE = get_env_variable("ASSETS_MAX_AGE", 31536000, int)
+
     # Upload paths
     UPLOADED_IMAGES_DEST = "/tmp/uploads"
     
@@ -100,6 +257,7 @@ class DevelopmentConfig(Config):
     ASSETS_DEBUG = True
     TESTING = False
     TEMPLATES_AUTO_RELOAD = True
+    JINJA_FRAGMENT_CACHE_SIZE = 0
     SQLALCHEMY_DATABASE_URI = get_env_variable("DEV_DATABASE_URL")
     
     @classmethod
@@ -112,11 +270,37 @@ class TestingConfig(Config):
     TESTING = True
     SQLALCHEMY_DATABASE_URI = get_env_variable("TEST_DATABASE_URL")
     WTF_CSRF_ENABLED = False
+    AVAILABILITY_FILTER_KEY = f"todo-availability-test-{os.getpid()}"
+    AVAILABILITY_FILTER_CAPACITY = 1000
     
     @classmethod
     def init_app(cls, app):
         logging.info("THIS APP IS IN TESTING MODE. YOU SHOULD NOT SEE THIS IN PRODUCTION.")
 
+class ShardedTestingConfig(TestingConfig):
+    """Testing configuration with tasks spread over three in-memory SQLite shards."""
+
+    SQLALCHEMY_BINDS = {f"tasks_shard_{index}": "sqlite://" for index in range(3)}
+
+class BenchmarkConfig(Config):
+    """Configuration used by the HTTP load-benchmark suite."""
+
+    DEBUG = False
+    TESTING = False
+    WTF_CSRF_ENABLED = False
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    @classmethod
+    def init_app(cls, app):
+        # Resolved at app creation so `manage.py bench --database-url` can
+        # point a fresh app at SQLite or a local Postgres.
+        app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get(
+            "BENCH_DATABASE_URL",
+            f"sqlite:///{os.path.join(basedir, 'bench.sqlite')}",
+        )
+        app.config["TASK_GROUP_COMMIT"] = os.environ.get("TASK_GROUP_COMMIT", "False") == "True"
+        app.config["PREPARED_STATEMENTS"] = os.environ.get("PREPARED_STATEMENTS", "False") == "True"
+
 class ProductionConfig(Config):
     """Production-specific configuration."""
     
@@ -158,6 +342,8 @@ class StagingConfig(ProductionConfig):
 config = {
     "development": DevelopmentConfig,
     "testing": TestingConfig,
+    "testing-sharded": ShardedTestingConfig,
+    "benchmark": BenchmarkConfig,
     "production": ProductionConfig,
     "default": DevelopmentConfig,
     "heroku": HerokuConfig,
@@ -4,9 +4,11 @@ import logging
 import os
 import subprocess
 import unittest
+from datetime import date
+from typing import List, Optional
 
 import typer
-from app import create_app, db
+from app import create_app, db, task_shards
 from app.models import User, UserRole
 from config import Config, config
 from flask import Flask
@@ -44,16 +46,65 @@ def recreate_db() -> None:
     logging.info("Recreating the database...")
     with app.app_context():
         db.drop_all()
+        task_shards.drop_all()
         db.create_all()
+        task_shards.create_all()
         db.session.commit()
         logging.info("Database recreated successfully.")
 
 @manager.command()
-def runserver(host: str = "0.0.0.0", port: int = 5000) -> None:
-    """Run the Flask development server."""
+def runserver(host: str = "0.0.0.0", port: int = 5000, warmup: bool = False) -> None:
+    """Run the Flask development server, warming it up first with --warmup or WARMUP=True."""
+    from app.warmup import warm_up
+
+    warm_up(app, force=warmup)
     logging.info(f"Starting server on {host}:{port}...")
     app.run(host, port)
 
+@manager.command()
+def warmup(rounds: int = 300, max_seconds: float = 30.0) -> None:
+    """Replay the warm-up requests and report how long they took and how latency changed."""
+    from app.warmup import run_warmup
+
+    report = run_warmup(app, rounds=rounds, max_seconds=max_seconds)
+    typer.echo(f"{report.requests} requests in {report.rounds} rounds, {report.seconds}s, {report.errors} errors")
+    typer.echo(f"{'':<8}{'p50 ms':>10}{'p99 ms':>10}")
+    for label, stats in (("before", report.before), ("after", report.after)):
+        typer.echo(f"{label:<8}{stats['p50_ms']:>10}{stats['p99_ms']:>10}")
+
+@manager.command()
+def profile_token(email: str) -> None:
+    """Print a token an admin sends as X-Profile-Token (or ?_profile=) to profile their own requests."""
+    from app.profiling import profile_token as make_token
+
+    with app.app_context():
+        user = User.query.filter_by(email=email).first()
+        if user is None or not user.is_admin():
+            logging.error(f"{email} is not an administrator.")
+            raise typer.Exit(code=1)
+        typer.echo(make_token(user.id, app.config["SECRET_KEY"]))
+
+@manager.command()
+def build_assets() -> None:
+    """
+    Fingerprints the static files and writes Brotli/gzip variants
+    and the manifest used by `url_for("static", ...)`.
+    """
+    from app.assets import build_assets as build
+
+    output_dir = os.path.join(app.static_folder, app.config["ASSETS_BUILD_DIR"])
+    manifest = build(app.static_folder, output_dir)
+    logging.info(f"Built {len(manifest)} assets into {output_dir}.")
+
+@manager.command()
+def compile_templates() -> None:
+    """Compiles every template into the Jinja bytecode cache so new workers start warm."""
+    from app.templating import precompile_templates
+
+    with app.app_context():
+        count = precompile_templates(app)
+    logging.info(f"Compiled {count} templates.")
+
 @manager.command()
 def create_tables() -> None:
     """
@@ -62,9 +113,186 @@ def create_tables() -> None:
     logging.info("Creating database tables...")
     with app.app_context():
         db.create_all()
+        task_shards.create_all()
         db.session.commit()
         logging.info("Database tables created successfully.")
 
+@manager.command()
+def migrate_birth_dates(batch_size: int = 5000) -> None:
+    """
+    Converts users.date_of_birth from strings to an indexed DATE, a batch at
+    a time, and adds the admin directory's prefix indexes. Safe to rerun.
+    """
+    from app.birth_dates import create_directory_indexes, migrate_birth_dates as migrate
+
+    with app.app_context():
+        converted = migrate(db.engine, batch_size=batch_size)
+        create_directory_indexes(db.engine)
+    logging.info(f"Converted the birth dates of {converted} users.")
+
+@manager.command()
+def rebalance_shards(batch_size: int = 500, pause: float = 0.05) -> None:
+    """
+    Moves users' tasks onto the shard the hash ring assigns them, in batches
+    with a pause between them. Safe to rerun; interrupted moves are resumed.
+    """
+    with app.app_context():
+        if not task_shards.enabled:
+            logging.warning("No task shards configured (TASK_SHARD_URLS); nothing to rebalance.")
+            return
+        task_shards.create_all()
+        moved = task_shards.rebalance(batch_size=batch_size, pause=pause)
+        logging.info(f"Rebalanced tasks of {len(moved)} users.")
+
+@manager.command()
+def rebalance_ranks(max_length: Optional[int] = None) -> None:
+    """
+    Renumbers the task order of every user holding a rank key longer than
+    `max_length` (TASK_RANK_MAX_LENGTH by default), on every database.
+    """
+    from app.ranking import rebalance_long_ranks
+
+    with app.app_context():
+        limit = max_length or app.config["TASK_RANK_MAX_LENGTH"]
+        shards = [None] + (task_shards.ring.nodes if task_shards.enabled else [])
+        for shard in shards:
+            users = rebalance_long_ranks(task_shards.session(shard), limit)
+            logging.info(f"Rebalanced task ranks of {len(users)} users on {shard or 'the main database'}.")
+
+@manager.command()
+def partition_tasks(months_ahead: Optional[int] = None) -> None:
+    """
+    Partitions the task table by month on every Postgres database, converting
+    it on the first run, and creates the partitions for the coming months.
+    Run it at least monthly (e.g. from cron); tasks past the last partition
+    land in the default partition until their month's partition is created.
+    """
+    from app.partitioning import partition_tasks as partition, supports_partitioning
+
+    with app.app_context():
+        ahead = app.config["TASK_PARTITION_MONTHS_AHEAD"] if months_ahead is None else months_ahead
+        for shard in [None] + (task_shards.ring.nodes if task_shards.enabled else []):
+            engine = task_shards.engine(shard)
+            if not supports_partitioning(engine):
+                logging.warning(f"{shard or 'The main database'} is not Postgres; not partitioned.")
+                continue
+            created = partition(engine, ahead)
+            logging.info(f"Created {len(created)} task partitions on {shard or 'the main database'}.")
+
+@manager.command()
+def archive_tasks(
+    older_than_months: Optional[int] = None,
+    mode: Optional[str] = typer.Option(None, help='"file" (gzipped NDJSON) or "schema" (Postgres archive schema).'),
+    directory: Optional[str] = None,
+    batch_size: int = 1000,
+) -> None:
+    """
+    Moves tasks posted before the cutoff month out of the task table, a month
+    at a time; users can still read them from the archive. Safe to rerun.
+    """
+    from datetime import datetime
+
+    from app.archive import archive_tasks as archive
+    from app.partitioning import add_months, month_start
+
+    with app.app_context():
+        months = app.config["TASK_ARCHIVE_AFTER_MONTHS"] if older_than_months is None else older_than_months
+        cutoff = add_months(month_start(datetime.now()), -months)
+        archived = archive(
+            cutoff, mode or app.config["TASK_ARCHIVE_MODE"], directory or app.config["TASK_ARCHIVE_DIR"], batch_size
+        )
+        for record in archived:
+            logging.info(f"Archived {record.rows} tasks of {record.month:%Y-%m} to {record.location}.")
+
+@manager.command()
+def scheduler(batch_size: int = 100, poll_interval: float = 5.0) -> None:
+    """
+    Sends due task reminders. Any number of replicas can run side by side;
+    each claims its own batches with SELECT ... FOR UPDATE SKIP LOCKED.
+    """
+    from app.scheduler import email_dispatcher, run_scheduler
+
+    with app.app_context():
+        engines = [task_shards.engine(None)]
+        if task_shards.enabled:
+            engines += [task_shards.engine(shard) for shard in task_shards.ring.nodes]
+    logging.info(f"Scheduler polling {len(engines)} databases every {poll_interval}s.")
+    run_scheduler(engines, email_dispatcher(app), batch_size=batch_size, poll_interval=poll_interval,
+                  archive_after_months=app.config['TASK_ARCHIVE_AFTER_MONTHS'])
+
+@manager.command()
+def outbox_relay(batch_size: int = 500, poll_interval: float = 1.0) -> None:
+    """
+    Publishes queued task and account events to the OUTBOX_STREAM Redis
+    stream. Replicas can run side by side: batches are claimed with
+    SELECT ... FOR UPDATE SKIP LOCKED and each user's events go out in the
+    order they were numbered, across the main database and the shards.
+    """
+    from app.outbox import run_relay, source_name, stream_publisher
+    from app.utils import get_redis
+
+    with app.app_context():
+        client = get_redis(app)
+        if client is None:
+            logging.error("REDIS_URL is not set; there is nowhere to relay events to.")
+            raise typer.Exit(code=1)
+        shards = [None] + (task_shards.ring.nodes if task_shards.enabled else [])
+        sources = [(source_name(shard), task_shards.engine(shard)) for shard in shards]
+        main = task_shards.engine(None)
+    publish = stream_publisher(client, app.config["OUTBOX_STREAM"], app.config["OUTBOX_STREAM_MAX_LENGTH"])
+    logging.info(f"Relaying events from {len(sources)} databases to {app.config['OUTBOX_STREAM']}.")
+    run_relay(sources, publish, batch_size=batch_size, poll_interval=poll_interval, main=main)
+
+@manager.command()
+def purge_user(
+    user_id: Optional[int] = typer.Argument(None, help="User to delete; omit to finish every pending deletion."),
+    batch_size: Optional[int] = None,
+    pause: Optional[float] = None,
+) -> None:
+    """
+    Deletes a user and their tasks in throttled batches. Interrupted purges
+    resume where they stopped when the command is rerun.
+    """
+    from app.purge import pending_deletions, purge_user as purge, request_deletion
+
+    with app.app_context():
+        if user_id is not None:
+            user = db.session.get(User, user_id)
+            if user is None:
+                logging.warning(f"No user with id {user_id}.")
+                return
+            request_deletion(user)
+        for pending in [user_id] if user_id is not None else pending_deletions():
+            deleted = purge(pending, batch_size=batch_size, pause=pause)
+            logging.info(f"Purged user {pending} and {deleted} tasks.")
+
+@manager.command()
+def prune_idempotency_keys() -> None:
+    """Deletes expired Idempotency-Key records from the database (Redis expires its own)."""
+    from app import idempotency
+
+    with app.app_context():
+        count = idempotency.store.prune()
+    logging.info(f"Pruned {count} expired idempotency keys.")
+
+@manager.command()
+def prune_revoked_tokens() -> None:
+    """Deletes used-token records whose tokens have expired (Redis expires its own)."""
+    from app import tokens
+
+    with app.app_context():
+        count = tokens.store.prune()
+    logging.info(f"Pruned {count} revoked account tokens.")
+
+@manager.command()
+def rebuild_availability_filter(batch_size: int = 10000) -> None:
+    """Rebuilds the username/email availability filter from the users table."""
+    from app import availability
+
+    with app.app_context():
+        count = availability.rebuild(batch_size=batch_size)
+    logging.info(f"Availability filter rebuilt from {count} users.")
+
 @manager.command()
 def setup_dev() -> None:
     """Setup the application for local development."""
@@ -90,7 +318,7 @@ def setup_general() -> None:
                 username="Admin",
                 email=Config.ADMIN_EMAIL,
                 role=UserRole.ADMIN,
-                date_of_birth="2000-01-01"
+                date_of_birth=date(2000, 1, 1)
             )
             db.session.add(user)
             db.session.commit()
@@ -98,6 +326,144 @@ def setup_general() -> None:
         else:
             logging.info("Administrator role already exists or no admin role found.")
 
+@manager.command()
+def bench(
+    users: int = 20,
+    tasks_per_user: int = 50,
+    requests: int = 300,
+    concurrency: int = 16,
+    scenario: Optional[List[str]] = typer.Option(None, help="Scenario to run; repeat for several. Defaults to all."),
+    database_url: Optional[str] = typer.Option(None, help="Benchmark database; defaults to a local SQLite file."),
+    output: str = "bench_results.json",
+    baseline: str = "benchmarks/baseline.json",
+    threshold: float = 0.15,
+    save_baseline: bool = False,
+    group_commit: bool = typer.Option(False, help="Enable TASK_GROUP_COMMIT for the benchmarked app."),
+) -> None:
+    """
+    Run the HTTP load benchmarks against a locally started server.
+    The benchmark database is dropped and reseeded on every run.
+    """
+    from benchmarks import BenchSettings, compare_results, run_benchmarks
+    from benchmarks.runner import load_results, save_results
+
+    # Per-request CORS debug logging would dominate the measurements.
+    logging.getLogger("flask_cors").setLevel(logging.WARNING)
+    if database_url:
+        os.environ["BENCH_DATABASE_URL"] = database_url
+    os.environ["TASK_GROUP_COMMIT"] = str(group_commit)
+    settings = BenchSettings(users=users, tasks_per_user=tasks_per_user, requests=requests, concurrency=concurrency)
+    if scenario:
+        settings.scenarios = list(scenario)
+
+    results = run_benchmarks(create_app("benchmark"), settings)
+    save_results(results, output)
+    typer.echo(f"{'scenario':<14}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for name, stats in results["scenarios"].items():
+        typer.echo(
+            f"{name:<14}{stats['rps']:>10}{stats['p50_ms']:>10}{stats['p95_ms']:>10}{stats['p99_ms']:>10}{stats['errors']:>8}"
+        )
+    typer.echo(f"Results written to {output}")
+
+    if save_baseline:
+        save_results(results, baseline)
+        typer.echo(f"Baseline saved to {baseline}")
+        return
+
+    previous = load_results(baseline)
+    if previous is None:
+        typer.echo(f"No baseline at {baseline}; rerun with --save-baseline to record one.")
+        return
+    regressions = compare_results(results, previous, threshold)
+    for regression in regressions:
+        typer.echo(f"REGRESSION {regression}", err=True)
+    if regressions:
+        raise typer.Exit(code=1)
+
+@manager.command()
+def bench_reads(
+    tasks: int = 10000,
+    repeat: int = 5,
+    database_url: Optional[str] = typer.Option(None, help="Benchmark database; defaults to a local SQLite file."),
+) -> None:
+    """
+    Compare loading a user's tasks as ORM entities against column projections:
+    rows/sec and peak memory per 10k tasks. Reseeds the benchmark database.
+    """
+    from benchmarks import compare_read_paths
+
+    if database_url:
+        os.environ["BENCH_DATABASE_URL"] = database_url
+    results = compare_read_paths(create_app("benchmark"), tasks=tasks, repeat=repeat)
+    typer.echo(f"{'path':<12}{'rows':>8}{'rows/s':>12}{'best ms':>10}{'KiB/10k':>10}")
+    for name, stats in results.items():
+        typer.echo(
+            f"{name:<12}{stats['rows']:>8}{stats['rows_per_sec']:>12}{stats['best_ms']:>10}{stats['peak_kib_per_10k']:>10}"
+        )
+
+@manager.command()
+def bench_prepared(
+    database_url: str = typer.Option(..., help="Postgres benchmark database; it is dropped and reseeded."),
+    repeat: int = 2000,
+) -> None:
+    """
+    Time the hot user and task lookups as ordinary queries and as prepared
+    statements: median and p95 latency per query, and the median saved.
+    """
+    from benchmarks import compare_prepared
+
+    os.environ["BENCH_DATABASE_URL"] = database_url
+    os.environ["PREPARED_STATEMENTS"] = "True"
+    try:
+        results = compare_prepared(create_app("benchmark"), repeat=repeat)
+    except RuntimeError as exc:
+        typer.echo(str(exc), err=True)
+        raise typer.Exit(code=1)
+    typer.echo(f"{'lookup':<16}{'plain p50':>11}{'p95':>9}{'prepared p50':>14}{'p95':>9}{'saved us':>10}")
+    for name, stats in results.items():
+        typer.echo(
+            f"{name:<16}{stats['plain_50_us']:>11}{stats['plain_95_us']:>9}"
+            f"{stats['prepared_50_us']:>14}{stats['prepared_95_us']:>9}{stats['saved_us']:>10}"
+        )
+
+@manager.command()
+def bench_async(
+    users: int = 100,
+    tasks_per_user: int = 50,
+    connections: int = 2000,
+    requests: int = 20000,
+    server: Optional[List[str]] = typer.Option(None, help="eventlet or asyncio; repeat for both. Defaults to both."),
+    scenario: Optional[List[str]] = typer.Option(None, help="list or create; repeat for both. Defaults to both."),
+    database_url: Optional[str] = typer.Option(None, help="Benchmark database; defaults to a local SQLite file."),
+) -> None:
+    """
+    Compare the task API on eventlet with the asyncio one (asgi.py) under
+    thousands of concurrent keep-alive connections. Reseeds the benchmark database.
+    """
+    from benchmarks import ConcurrencySettings, compare_concurrency
+
+    logging.getLogger("flask_cors").setLevel(logging.WARNING)
+    if database_url:
+        os.environ["BENCH_DATABASE_URL"] = database_url
+    settings = ConcurrencySettings(users=users, tasks_per_user=tasks_per_user, connections=connections,
+                                   requests=requests)
+    if server:
+        settings.servers = list(server)
+    if scenario:
+        settings.scenarios = list(scenario)
+    try:
+        results = compare_concurrency(create_app("benchmark"), settings)
+    except (RuntimeError, ValueError) as exc:
+        typer.echo(str(exc), err=True)
+        raise typer.Exit(code=1)
+    typer.echo(f"{'server':<10}{'scenario':<10}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for name, scenarios in results.items():
+        for scenario_name, stats in scenarios.items():
+            typer.echo(
+                f"{name:<10}{scenario_name:<10}{stats['rps']:>10}{stats['p50_ms']:>10}{stats['p95_ms']:>10}"
+                f"{stats['p99_ms']:>10}{stats['errors']:>8}"
+            )
+
 @manager.command()
 def format_code() -> None:
     """Run the code formatters (isort and yapf) over the project files."""
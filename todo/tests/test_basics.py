@@ -1,6 +1,7 @@
 import unittest
 
 from app import create_app, db
+from app.availability import SharedBitmap
 from app.models import User
 from flask import current_app
 from flask.testing import FlaskClient
@@ -8,8 +9,10 @@ from flask_login import FlaskLoginClient
 
 
 class BasicsTestCase(unittest.TestCase):
+    config_name = "testing"
+
     def setUp(self):
-        self.app = create_app("testing")
+        self.app = create_app(self.config_name)
         self.app_context = self.app.app_context()
         self.app_context.push()
         self.base_url = "http://localhost:5000"
@@ -21,6 +24,10 @@ class BasicsTestCase(unittest.TestCase):
     def tearDown(self):
         db.session.remove()
         db.drop_all()
+        # Shared-memory availability filters would outlive the test run
+        bitmap = self.app.extensions.pop("availability", None)
+        if isinstance(bitmap, SharedBitmap):
+            bitmap.unlink()
         self.app_context.pop()
 
     def test_app_exists(self):
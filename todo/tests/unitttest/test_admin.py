@@ -0,0 +1,122 @@
+from datetime import date
+from unittest import mock
+
+from app import db
+from app.birth_dates import migrate_birth_dates, needs_migration, parse_birth_date
+from app.blueprints.admin.utils import DirectoryFilters, user_page, years_before
+from app.models import User, UserRole
+from flask import g
+from sqlalchemy import create_engine, inspect, text
+from tests.fixtures.user import SAMPLE_USER_DATA
+
+from tests.test_basics import BasicsTestCase
+
+
+class UserDirectoryTestCase(BasicsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.admin = self.create_user(**SAMPLE_USER_DATA, role=UserRole.ADMIN)
+        people = [
+            ("alice", "alice@example.com", date(1990, 5, 1), True, UserRole.USER),
+            ("alex", "alex@sample.org", date(2008, 2, 29), False, UserRole.USER),
+            ("bob", "bob@example.com", date(1970, 1, 1), True, UserRole.ADMIN),
+            ("al_x", "al_x@example.com", date(2001, 1, 1), True, UserRole.USER),
+        ]
+        for username, email, born, confirmed, role in people:
+            self.create_user(first_name=username, last_name="Test", username=username, email=email,
+                             date_of_birth=born, confirmed=confirmed, role=role, password="Password")
+
+    def usernames(self, **args):
+        users, _ = user_page(db.session, DirectoryFilters.from_args(args), today=date(2026, 2, 28))
+        return [user.username for user in users]
+
+    def test_filters_run_in_sql(self):
+        self.assertEqual(self.usernames(username="al"), ["alice", "alex", "al_x"])
+        # Wildcards in a prefix are literal
+        self.assertEqual(self.usernames(username="al_"), ["al_x"])
+        self.assertEqual(self.usernames(email="ALEX@"), ["alex"])
+        self.assertEqual(self.usernames(role="admin"), [SAMPLE_USER_DATA["username"], "bob"])
+        self.assertEqual(self.usernames(confirmed="no"), ["alex"])
+        self.assertEqual(self.usernames(min_age="25", max_age="40", username="al"), ["alice", "al_x"])
+        # Born on 29 February: still 17 on the 28th
+        self.assertEqual(self.usernames(max_age="17"), ["alex"])
+        self.assertEqual(self.usernames(min_age="18", max_age="18"), [])
+        with self.assertRaises(ValueError):
+            DirectoryFilters.from_args({"role": "owner"})
+
+    def test_pages_follow_the_id_cursor(self):
+        self.app.config["ADMIN_USERS_PER_PAGE"] = 2
+        client = self.app.test_client(user=self.admin)
+        first = client.get("/admin/api/users").get_json()
+        self.assertEqual([user["username"] for user in first["users"]], [SAMPLE_USER_DATA["username"], "alice"])
+        second = client.get(f"/admin/api/users?after={first['next']}").get_json()
+        self.assertEqual([user["username"] for user in second["users"]], ["alex", "bob"])
+        third = client.get(f"/admin/api/users?after={second['next']}").get_json()
+        self.assertEqual(([user["username"] for user in third["users"]], third["next"]), (["al_x"], None))
+
+        page = client.get("/admin/users?role=user&after=abc")
+        self.assertEqual(page.status_code, 400)
+        page = client.get("/admin/users?username=al&confirmed=yes").get_data(as_text=True)
+        self.assertIn("al_x@example.com", page)
+        self.assertNotIn("alex@sample.org", page)
+
+    def test_only_admins_see_the_directory(self):
+        g.pop("_login_user", None)
+        user = self.app.test_client(user=self.create_user(
+            first_name="Plain", last_name="User", username="plain", email="plain@example.com",
+            date_of_birth="2000-01-01", password="Password",
+        ))
+        self.assertEqual(user.get("/admin/users").status_code, 403)
+        g.pop("_login_user", None)
+        self.assertEqual(self.client.get("/admin/api/users").status_code, 302)
+
+
+class BirthDateMigrationTestCase(BasicsTestCase):
+    def test_parse_legacy_strings(self):
+        self.assertEqual(parse_birth_date("1985-2-31"), date(1985, 2, 28))
+        self.assertEqual(parse_birth_date("2001-12-05"), date(2001, 12, 5))
+        self.assertIsNone(parse_birth_date("yesterday"))
+        self.assertIsNone(parse_birth_date("2001-13-05"))
+        self.assertEqual(years_before(date(2024, 2, 29), 1), date(2023, 2, 28))
+
+    def test_string_column_is_converted_in_batches(self):
+        engine = create_engine("sqlite://")
+        with engine.begin() as conn:
+            conn.execute(text("CREATE TABLE users (id INTEGER PRIMARY KEY, username VARCHAR(20), "
+                              "date_of_birth VARCHAR(20) NOT NULL)"))
+            conn.execute(text("INSERT INTO users (id, username, date_of_birth) VALUES (:id, :name, :born)"), [
+                {"id": 1, "name": "a", "born": "1990-1-1"},
+                {"id": 2, "name": "b", "born": "1985-2-31"},
+                {"id": 3, "name": "c", "born": "unknown"},
+                {"id": 4, "name": "d", "born": "2000-07-04"},
+            ])
+        self.assertTrue(needs_migration(engine))
+        self.assertEqual(migrate_birth_dates(engine, batch_size=2), 4)
+        self.assertFalse(needs_migration(engine))
+        with engine.connect() as conn:
+            rows = conn.execute(text("SELECT id, date_of_birth FROM users ORDER BY id")).all()
+        self.assertEqual(rows, [(1, "1990-01-01"), (2, "1985-02-28"), (3, None), (4, "2000-07-04")])
+        self.assertIn("ix_users_date_of_birth", [index["name"] for index in inspect(engine).get_indexes("users")])
+        # Rerunning is a no-op
+        self.assertEqual(migrate_birth_dates(engine), 0)
+
+    def test_edits_during_the_backfill_are_not_lost(self):
+        engine = create_engine("sqlite://")
+        with engine.begin() as conn:
+            conn.execute(text("CREATE TABLE users (id INTEGER PRIMARY KEY, date_of_birth VARCHAR(20) NOT NULL)"))
+            conn.execute(text("INSERT INTO users (id, date_of_birth) VALUES (1, '1990-1-1'), (2, '1985-5-5')"))
+        # Stopped just before the swap, after every batch was copied
+        with mock.patch("app.birth_dates._drop_trigger_statements", side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                migrate_birth_dates(engine)
+        with engine.begin() as conn:
+            conn.execute(text("UPDATE users SET date_of_birth = '1991-2-2' WHERE id = 1"))
+
+        self.assertEqual(migrate_birth_dates(engine), 1)
+        with engine.connect() as conn:
+            rows = conn.execute(text("SELECT id, date_of_birth FROM users ORDER BY id")).all()
+        self.assertEqual(rows, [(1, "1991-02-02"), (2, "1985-05-05")])
+
+    def test_directory_prefix_indexes_are_declared_on_the_model(self):
+        names = {index.name for index in User.__table__.indexes}
+        self.assertTrue({"ix_users_email_prefix", "ix_users_username_prefix"} <= names)
@@ -0,0 +1,122 @@
+import time
+
+import eventlet
+from app.admission import (HIGH, LOW, NORMAL, AdmissionControl, AdmissionController, Overloaded,
+                           PoolWaitTracker, track_pool_waits)
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import QueuePool
+
+from tests.test_basics import BasicsTestCase
+
+# Work done by the slow endpoint while holding one of the simulated connections
+_SERVICE_TIME = 0.02
+_CONNECTIONS = 4
+
+
+class AdmissionControllerTestCase(BasicsTestCase):
+    def test_queue_prefers_higher_priorities_and_sheds_lower(self):
+        controller = AdmissionController(max_in_flight=1, queue_size=1, max_pool_wait=0)
+        controller.acquire(NORMAL, 0)
+        outcome = {}
+
+        def wait(name, priority):
+            try:
+                controller.acquire(priority, 1.0)
+                outcome[name] = "admitted"
+            except Overloaded:
+                outcome[name] = "refused"
+
+        low = eventlet.spawn(wait, "low", LOW)
+        eventlet.sleep(0)
+        high = eventlet.spawn(wait, "high", HIGH)
+        eventlet.sleep(0)
+        # The queue is full of equal or better waiters, so this one bounces at once
+        with self.assertRaises(Overloaded):
+            controller.acquire(NORMAL, 1.0)
+
+        controller.release()
+        low.wait()
+        high.wait()
+        self.assertEqual(outcome, {"low": "refused", "high": "admitted"})
+        self.assertEqual(controller.snapshot()["shed"], 1)
+
+    def test_slow_pool_lowers_the_cap(self):
+        waits = PoolWaitTracker(window=60)
+        controller = AdmissionController(max_in_flight=10, queue_size=0, max_pool_wait=0.05, pool_waits=waits)
+        self.assertEqual(controller.limit, 10)
+        waits.record(0.2)
+        self.assertEqual(controller.limit, 5)
+
+    def test_pool_checkout_waits_are_tracked(self):
+        engine = create_engine("sqlite:///:memory:", poolclass=QueuePool)
+        waits = PoolWaitTracker()
+        self.assertTrue(track_pool_waits(engine, waits))
+        self.assertFalse(track_pool_waits(engine, waits))
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+        self.assertEqual(len(waits._samples), 1)
+        engine.dispose()
+
+
+class AdmissionOverloadTestCase(BasicsTestCase):
+    def setUp(self):
+        super().setUp()
+        connections = eventlet.semaphore.Semaphore(_CONNECTIONS)
+
+        # A stand-in for a database whose pool has a few connections
+        @self.app.route("/slow")
+        def slow():
+            with connections:
+                eventlet.sleep(_SERVICE_TIME)
+            return "done"
+
+    def flood(self, clients):
+        def call(_):
+            started = time.perf_counter()
+            response = self.app.test_client().get("/slow")
+            response.close()
+            return response.status_code, time.perf_counter() - started, response.headers.get("Retry-After")
+
+        return list(eventlet.GreenPool(clients).imap(call, range(clients)))
+
+    def test_admitted_latency_stays_bounded_under_overload(self):
+        clients = 80
+        unprotected = self.flood(clients)
+        self.assertTrue(all(status == 200 for status, _, _ in unprotected))
+        worst_unprotected = max(elapsed for _, elapsed, _ in unprotected)
+
+        self.app.config.update(
+            ADMISSION_CONTROL=True,
+            ADMISSION_MAX_IN_FLIGHT=_CONNECTIONS,
+            ADMISSION_QUEUE_SIZE=2 * _CONNECTIONS,
+            ADMISSION_QUEUE_TIMEOUTS_MS={NORMAL: 100},
+        )
+        AdmissionControl(self.app)
+        protected = self.flood(clients)
+        admitted = [elapsed for status, elapsed, _ in protected if status == 200]
+        refused = [(elapsed, retry) for status, elapsed, retry in protected if status == 503]
+
+        # Without admission control the last caller queues behind everyone
+        self.assertGreater(worst_unprotected, clients / _CONNECTIONS * _SERVICE_TIME * 0.8)
+        # With it, admitted requests wait for at most a queue's worth of work
+        self.assertTrue(admitted and refused)
+        self.assertLess(max(admitted), worst_unprotected / 2)
+        self.assertLess(max(admitted), 3 * _CONNECTIONS * _SERVICE_TIME + 0.1)
+        self.assertTrue(all(retry == "1" for _, retry in refused))
+        self.assertEqual(self.app.extensions["admission"].snapshot()["in_flight"], 0)
+
+    def test_health_checks_are_answered_while_requests_are_shed(self):
+        self.app.config.update(
+            ADMISSION_CONTROL=True,
+            ADMISSION_MAX_IN_FLIGHT=_CONNECTIONS,
+            ADMISSION_QUEUE_SIZE=_CONNECTIONS,
+            ADMISSION_QUEUE_TIMEOUTS_MS={NORMAL: 100},
+        )
+        AdmissionControl(self.app)
+        pool = eventlet.GreenPool(40)
+        flood = [pool.spawn(self.app.test_client().get, "/slow") for _ in range(40)]
+        # Let the flood fill every slot and the queue first
+        eventlet.sleep(0)
+        health = self.app.test_client().get("/healthz")
+        self.assertEqual((health.status_code, health.get_data(as_text=True)), (200, "ok\n"))
+        self.assertIn(503, [thread.wait().status_code for thread in flood])
@@ -0,0 +1,175 @@
+import shutil
+import tempfile
+from datetime import date, datetime
+from unittest import mock
+
+from app import db
+from app.archive import archive_page, archive_tasks, archivable_months, load_archived_tasks
+from app.models import Task, TaskArchive
+from app.partitioning import (add_months, add_partition_statements, convert_statements, create_partition_statement,
+                              month_start, partition_month, partition_name, partition_tasks)
+from app.purge import purge_user, request_deletion
+from tests.fixtures.user import SAMPLE_USER_DATA, SAMPLE_USER_DATA_2
+
+from tests.test_basics import BasicsTestCase
+
+
+class PartitioningTestCase(BasicsTestCase):
+    def test_month_arithmetic_and_names(self):
+        self.assertEqual(month_start(datetime(2026, 10, 19, 8, 30)), date(2026, 10, 1))
+        self.assertEqual(add_months(date(2026, 11, 1), 3), date(2027, 2, 1))
+        self.assertEqual(add_months(date(2026, 1, 1), -1), date(2025, 12, 1))
+        self.assertEqual(partition_name(date(2026, 3, 1)), "task_p2026_03")
+        self.assertEqual(partition_month("task_p2026_03"), date(2026, 3, 1))
+        self.assertIsNone(partition_month("task_tags"))
+
+    def test_conversion_keeps_the_sequence_and_partitions_by_month(self):
+        statements = convert_statements("public.task_id_seq", [date(2026, 12, 1)])
+        self.assertIn("PARTITION BY RANGE (date_posted)", statements[1])
+        self.assertIn("ADD PRIMARY KEY (id, date_posted)", statements[2])
+        self.assertEqual(
+            statements[3],
+            "CREATE TABLE IF NOT EXISTS task_p2026_12 PARTITION OF task"
+            " FOR VALUES FROM ('2026-12-01') TO ('2027-01-01')",
+        )
+        # The sequence must change hands before the old table is dropped with it
+        owned = next(i for i, sql in enumerate(statements) if "OWNED BY" in sql)
+        dropped = next(i for i, sql in enumerate(statements) if sql.startswith("DROP TABLE"))
+        self.assertLess(owned, dropped)
+        self.assertEqual(create_partition_statement(date(2026, 12, 1)), statements[3])
+        self.assertEqual(statements[4], "CREATE TABLE IF NOT EXISTS task_default PARTITION OF task DEFAULT")
+
+    def test_conversion_restores_the_foreign_keys(self):
+        keys = [("task_user_id_fkey", "FOREIGN KEY (user_id) REFERENCES users(id)")]
+        statements = convert_statements("public.task_id_seq", [date(2026, 12, 1)], keys)
+        restored = statements.index("ALTER TABLE task ADD CONSTRAINT task_user_id_fkey"
+                                    " FOREIGN KEY (user_id) REFERENCES users(id)")
+        # After the copy, so the rows are checked once rather than per insert
+        self.assertGreater(restored, next(i for i, sql in enumerate(statements) if sql.startswith("INSERT")))
+
+    def test_new_partitions_take_their_rows_from_the_default_partition(self):
+        statements = add_partition_statements(date(2026, 12, 1))
+        bounds = "date_posted >= '2026-12-01' AND date_posted < '2027-01-01'"
+        self.assertEqual(statements, [
+            f"CREATE TEMP TABLE task_p2026_12_moving ON COMMIT DROP AS SELECT * FROM task_default WHERE {bounds}",
+            f"DELETE FROM task_default WHERE {bounds}",
+            create_partition_statement(date(2026, 12, 1)),
+            "INSERT INTO task SELECT * FROM task_p2026_12_moving",
+        ])
+
+    def test_partitioning_is_skipped_off_postgres(self):
+        self.assertEqual(partition_tasks(db.engine), [])
+
+
+class TaskArchiveTestCase(BasicsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.user = self.create_user(**SAMPLE_USER_DATA)
+        self.user_id = self.user.id
+        self.other = self.create_user(**SAMPLE_USER_DATA_2)
+        self.add_task(self.user, "january", datetime(2025, 1, 10), ["work"])
+        self.add_task(self.user, "january again", datetime(2025, 1, 20), [])
+        self.add_task(self.user, "march", datetime(2025, 3, 5), ["home", "work"])
+        self.add_task(self.other, "other january", datetime(2025, 1, 15), [])
+        self.add_task(self.user, "recent", datetime(2026, 10, 1), ["work"])
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        super().tearDown()
+
+    def add_task(self, user, content, posted, tags):
+        task = Task(content=content, user_id=user.id, date_posted=posted)
+        task.set_tags(tags)
+        db.session.add(task)
+        db.session.commit()
+
+    def archive(self):
+        return archive_tasks(date(2026, 1, 1), TaskArchive.FILE, self.directory, batch_size=2)
+
+    def test_old_months_move_to_the_archive(self):
+        self.assertEqual(archivable_months(db.engine, date(2026, 1, 1)), [date(2025, 1, 1), date(2025, 3, 1)])
+        archived = self.archive()
+        self.assertEqual([(record.month, record.rows) for record in archived], [(date(2025, 1, 1), 3), (date(2025, 3, 1), 1)])
+        self.assertEqual([task.content for task in Task.query.all()], ["recent"])
+        self.assertEqual(db.session.execute(db.text("SELECT COUNT(*) FROM task_tags")).scalar(), 1)
+        # Nothing is left to archive on a second run
+        self.assertEqual(self.archive(), [])
+
+    def test_archived_tasks_are_read_back_per_user(self):
+        self.archive()
+        rows = load_archived_tasks(self.user_id, date(2025, 1, 1))
+        self.assertEqual([(row[1], row[-1]) for row in rows], [("january", ["work"]), ("january again", [])])
+        self.assertEqual(rows[0][2], datetime(2025, 1, 10))
+        self.assertEqual([row[1] for row in load_archived_tasks(self.other.id, date(2025, 1, 1))], ["other january"])
+
+    def test_scrolling_back_skips_months_without_the_users_tasks(self):
+        self.archive()
+        month, rows, older = archive_page(self.user_id)
+        self.assertEqual((month, [row[1] for row in rows], older), (date(2025, 3, 1), ["march"], date(2025, 3, 1)))
+        month, rows, older = archive_page(self.user_id, before=older)
+        self.assertEqual((month, len(rows), older), (date(2025, 1, 1), 2, None))
+        self.assertEqual(archive_page(self.other.id, before=date(2025, 1, 1)), (None, [], None))
+
+        page = self.app.test_client(user=self.user).get("/tasks/archive?before=2025-03")
+        self.assertEqual(page.status_code, 200)
+        self.assertIn("january again", page.get_data(as_text=True))
+
+    def test_tasks_past_the_cutoff_are_read_only_until_archived(self):
+        client = self.app.test_client(user=self.user)
+        old = Task.query.filter_by(content="march").one()
+        with mock.patch("app.partitioning.datetime") as clock:
+            clock.now.return_value = datetime(2026, 10, 19)
+            clock.combine = datetime.combine
+            self.assertEqual([task["content"] for task in client.get("/tasks/api/tasks").get_json()["tasks"]],
+                             ["recent"])
+            self.assertEqual(client.get("/tasks/api/tasks?tags=work").get_json()["tasks"][0]["content"], "recent")
+            self.assertEqual(client.get(f"/tasks/all_tasks/{old.id}/delete_task").status_code, 404)
+
+            # Not archived yet, but already listed with the archived months
+            page = client.get("/tasks/archive").get_data(as_text=True)
+            self.assertIn("march", page)
+            page = client.get("/tasks/archive?before=2025-03").get_data(as_text=True)
+            self.assertIn("january again", page)
+
+            # Half archived: a month reads the same from either side
+            with mock.patch("app.archive._remove_month", return_value=True):
+                self.archive()
+            page = client.get("/tasks/archive?before=2025-03").get_data(as_text=True)
+            self.assertEqual(page.count("january again"), 1)
+
+    def test_interrupted_archive_finishes_on_rerun(self):
+        with mock.patch("app.archive._remove_month", side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                self.archive()
+        self.assertEqual(TaskArchive.query.count(), 1)
+        self.assertEqual(Task.query.count(), 5)
+
+        self.archive()
+        self.assertEqual(Task.query.count(), 1)
+        self.assertEqual(len(load_archived_tasks(self.user_id, date(2025, 1, 1))), 2)
+
+    def test_rerun_keeps_tasks_that_arrived_after_the_archive(self):
+        with mock.patch("app.archive._remove_month", side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                self.archive()
+        # Say a shard move brought in an older task before the rerun
+        self.add_task(self.user, "late january", datetime(2025, 1, 25), ["late"])
+
+        self.archive()
+        self.assertEqual([task.content for task in Task.query.all()], ["recent"])
+        self.assertEqual(TaskArchive.query.filter_by(month=date(2025, 1, 1)).count(), 2)
+        rows = load_archived_tasks(self.user_id, date(2025, 1, 1))
+        self.assertEqual([(row[1], row[-1]) for row in rows],
+                         [("january", ["work"]), ("january again", []), ("late january", ["late"])])
+
+    def test_schema_archives_need_postgres_partitions(self):
+        with self.assertRaises(ValueError):
+            archive_tasks(date(2026, 1, 1), TaskArchive.SCHEMA, self.directory)
+
+    def test_purged_users_are_dropped_from_archives(self):
+        self.archive()
+        request_deletion(self.user)
+        purge_user(self.user_id, pause=0)
+        self.assertEqual(load_archived_tasks(self.user_id, date(2025, 1, 1)), [])
+        self.assertEqual([row[1] for row in load_archived_tasks(self.other.id, date(2025, 1, 1))], ["other january"])
@@ -0,0 +1,57 @@
+import gzip
+import os
+import shutil
+import tempfile
+
+import brotli
+from app import assets
+from app.assets import build_assets
+from flask import url_for
+
+from tests.test_basics import BasicsTestCase
+
+_CSS = b"body { margin: 0; padding: 0; }\n" * 200
+
+
+class StaticAssetsTestCase(BasicsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.static_dir = tempfile.mkdtemp()
+        with open(os.path.join(self.static_dir, "main.css"), "wb") as fh:
+            fh.write(_CSS)
+        self.original_static = self.app.static_folder
+        self.app.static_folder = self.static_dir
+        build_assets(self.static_dir, os.path.join(self.static_dir, "build"))
+        assets.load_manifest(self.app)
+
+    def tearDown(self):
+        self.app.static_folder = self.original_static
+        shutil.rmtree(self.static_dir)
+        super().tearDown()
+
+    def test_url_for_resolves_fingerprinted_name(self):
+        with self.app.test_request_context():
+            url = url_for("static", filename="main.css")
+        self.assertRegex(url, r"^/static/build/main\.[0-9a-f]{12}\.css$")
+
+    def test_serves_brotli_variant_with_immutable_caching(self):
+        with self.app.test_request_context():
+            url = url_for("static", filename="main.css")
+        response = self.client.get(url, headers={"Accept-Encoding": "gzip, br"})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["Content-Encoding"], "br")
+        self.assertIn("immutable", response.headers["Cache-Control"])
+        self.assertEqual(brotli.decompress(response.get_data()), _CSS)
+        response.close()
+
+    def test_serves_gzip_variant_when_brotli_not_accepted(self):
+        with self.app.test_request_context():
+            url = url_for("static", filename="main.css")
+        response = self.client.get(url, headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(response.get_data()), _CSS)
+        response.close()
+
+    def test_unknown_files_fall_back_to_plain_static(self):
+        response = self.client.get("/static/missing.css")
+        self.assertEqual(response.status_code, 404)
@@ -0,0 +1,166 @@
+import asyncio
+import json
+import os
+import tempfile
+
+from app import db
+from app.async_api import AsyncTaskAPI, async_database_url
+from app.models import OutboxEvent, Task, User
+from itsdangerous import URLSafeTimedSerializer
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+from tests.fixtures.user import SAMPLE_USER_DATA
+
+from tests.test_basics import BasicsTestCase
+
+
+class AsyncTaskAPITestCase(BasicsTestCase):
+    def setUp(self):
+        super().setUp()
+        # In-memory SQLite is private to a connection, so both engines share a file
+        handle, self.path = tempfile.mkstemp(suffix=".sqlite")
+        os.close(handle)
+        self.engine = create_engine(f"sqlite:///{self.path}")
+        db.metadata.create_all(self.engine)
+        with Session(self.engine) as session:
+            self.user_id = self.add_user(session, SAMPLE_USER_DATA)
+            self.other_id = self.add_user(session, dict(SAMPLE_USER_DATA, username="other", email="other@example.com"))
+        self.api = self.make_api()
+
+    def tearDown(self):
+        asyncio.run(self.api.dispose())
+        self.engine.dispose()
+        os.unlink(self.path)
+        super().tearDown()
+
+    @staticmethod
+    def add_user(session, data):
+        user = User(**data)
+        session.add(user)
+        session.commit()
+        return user.id
+
+    def make_api(self, **options):
+        return AsyncTaskAPI(self.app, database_url=f"sqlite+aiosqlite:///{self.path}", **options)
+
+    def cookie(self, user_id, **session):
+        serializer = self.app.session_interface.get_signing_serializer(self.app)
+        value = serializer.dumps({"_user_id": str(user_id), "_fresh": True, **session})
+        return f"{self.app.config['SESSION_COOKIE_NAME']}={value}"
+
+    def call(self, method, path, body=None, user_id=None, headers=(), api=None):
+        """Runs one request through the ASGI app; returns the status and decoded JSON body."""
+        headers = list(headers)
+        if user_id is not None:
+            headers.append(("cookie", self.cookie(user_id)))
+        path, _, query = path.partition("?")
+        scope = {
+            "type": "http",
+            "method": method,
+            "path": path,
+            "query_string": query.encode(),
+            "headers": [(name.encode(), value.encode()) for name, value in headers],
+            "client": ("127.0.0.1", 50000),
+        }
+        messages = [{"type": "http.request", "body": json.dumps(body).encode() if body is not None else b""}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        asyncio.run((api or self.api)(scope, receive, send))
+        payload = sent[1]["body"]
+        return sent[0]["status"], json.loads(payload) if payload else None
+
+    def task_count(self):
+        with Session(self.engine) as session:
+            return len(session.execute(select(Task.id)).all())
+
+    def test_async_database_url_swaps_in_the_asyncio_driver(self):
+        self.assertEqual(async_database_url("sqlite:////tmp/todo.sqlite"), "sqlite+aiosqlite:////tmp/todo.sqlite")
+        self.assertEqual(async_database_url("postgresql+psycopg2cffi://u:p@db/todo"), "postgresql+asyncpg://u:p@db/todo")
+        with self.assertRaises(ValueError):
+            async_database_url("mysql://db/todo")
+
+    def test_tasks_round_trip(self):
+        status, created = self.call("POST", "/async/api/tasks", {"task_name": "Write report", "tags": "Work, home"},
+                                    user_id=self.user_id)
+        self.assertEqual(status, 201)
+        self.assertEqual(created["tags"], ["work", "home"])
+
+        status, page = self.call("GET", "/async/api/tasks?tags=work", user_id=self.user_id)
+        self.assertEqual(status, 200)
+        self.assertEqual([task["id"] for task in page["tasks"]], [created["id"]])
+        self.assertIsNone(page["next"])
+
+        status, updated = self.call("PATCH", f"/async/api/tasks/{created['id']}",
+                                    {"due_at": "2030-01-02T09:00:00", "tags": []}, user_id=self.user_id)
+        self.assertEqual((status, updated["content"], updated["due_at"], updated["tags"]),
+                         (200, "Write report", "2030-01-02T09:00:00", []))
+
+        self.assertEqual(self.call("DELETE", f"/async/api/tasks/{created['id']}", user_id=self.user_id), (204, None))
+        self.assertEqual(self.task_count(), 0)
+        with Session(self.engine) as session:
+            events = session.execute(select(OutboxEvent.event_type).order_by(OutboxEvent.id)).scalars().all()
+        self.assertEqual(events, ["task.created", "task.updated", "task.deleted"])
+
+    def test_other_users_tasks_are_not_found(self):
+        _, created = self.call("POST", "/async/api/tasks", {"task_name": "Private"}, user_id=self.user_id)
+        for method in ("GET", "PATCH", "DELETE"):
+            self.assertEqual(self.call(method, f"/async/api/tasks/{created['id']}", {}, user_id=self.other_id)[0], 404)
+        self.assertEqual(self.call("GET", "/async/api/tasks", user_id=self.other_id)[1]["tasks"], [])
+
+    def test_requests_need_a_signed_session(self):
+        self.assertEqual(self.call("GET", "/async/api/tasks")[0], 401)
+        forged = ("cookie", f"{self.app.config['SESSION_COOKIE_NAME']}=forged")
+        self.assertEqual(self.call("GET", "/async/api/tasks", headers=[forged])[0], 401)
+        with Session(self.engine) as session:
+            session.get(User, self.user_id).deleting_at = db.func.now()
+            session.commit()
+        self.assertEqual(self.call("GET", "/async/api/tasks", user_id=self.user_id)[0], 401)
+
+    def test_invalid_bodies_are_rejected(self):
+        status, body = self.call("POST", "/async/api/tasks",
+                                 {"task_name": "", "due_at": "2030-01-01T00:00:00", "remind_at": "soon"},
+                                 user_id=self.user_id)
+        self.assertEqual((status, sorted(body["errors"])), (400, ["remind_at", "task_name"]))
+        status, body = self.call("POST", "/async/api/tasks",
+                                 {"task_name": "Late", "due_at": "2030-01-01T00:00:00",
+                                  "remind_at": "2030-01-02T00:00:00"}, user_id=self.user_id)
+        self.assertEqual((status, list(body["errors"])), (400, ["remind_at"]))
+        self.assertEqual(self.call("PUT", "/async/api/tasks", {}, user_id=self.user_id)[0], 405)
+        self.assertEqual(self.task_count(), 0)
+
+    def test_writes_need_the_csrf_header_when_enabled(self):
+        self.app.config["WTF_CSRF_ENABLED"] = True
+        api = self.make_api()
+        try:
+            cookie = ("cookie", self.cookie(self.user_id, csrf_token="raw-token"))
+            signed = URLSafeTimedSerializer(self.app.secret_key, salt="wtf-csrf-token").dumps("raw-token")
+            body = {"task_name": "Guarded"}
+            self.assertEqual(self.call("POST", "/async/api/tasks", body, headers=[cookie], api=api)[0], 400)
+            self.assertEqual(self.call("GET", "/async/api/tasks", headers=[cookie], api=api)[0], 200)
+            status, _ = self.call("POST", "/async/api/tasks", body, headers=[cookie, ("x-csrftoken", signed)], api=api)
+            self.assertEqual(status, 201)
+        finally:
+            asyncio.run(api.dispose())
+
+    def test_other_paths_go_to_the_fallback(self):
+        seen = []
+
+        async def fallback(scope, receive, send):
+            seen.append(scope["path"])
+            await send({"type": "http.response.start", "status": 200, "headers": []})
+            await send({"type": "http.response.body", "body": b""})
+
+        api = self.make_api(fallback=fallback)
+        try:
+            self.assertEqual(self.call("GET", "/tasks/all_tasks", api=api), (200, None))
+            self.assertEqual(self.call("GET", "/asyncish", api=api), (200, None))
+            self.assertEqual(seen, ["/tasks/all_tasks", "/asyncish"])
+            self.assertEqual(self.call("GET", "/tasks/all_tasks")[0], 404)
+        finally:
+            asyncio.run(api.dispose())
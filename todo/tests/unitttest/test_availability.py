@@ -0,0 +1,120 @@
+from unittest import mock
+
+from app import availability, db
+from app.availability import RedisBitmap, bit_positions, build_bitmap, filter_item, filter_parameters
+from app.blueprints.account.forms import RegistrationForm
+from app.models import User
+from tests.fixtures.user import SAMPLE_USER_DATA, SAMPLE_USER_DATA_2
+
+from tests.test_basics import BasicsTestCase
+
+
+class AvailabilityFilterTestCase(BasicsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user(**SAMPLE_USER_DATA)
+
+    def check(self, **params):
+        return self.client.get("/user/availability", query_string=params).get_json()
+
+    def test_unbuilt_filter_asks_the_database(self):
+        self.assertEqual(availability.is_available("username", "nobody"), (True, True))
+        self.assertEqual(availability.is_available("username", SAMPLE_USER_DATA["username"]), (False, True))
+
+    def test_free_values_skip_the_database_once_built(self):
+        self.assertEqual(availability.rebuild(), 1)
+        with mock.patch.object(db.session, "execute", wraps=db.session.execute) as execute:
+            result = self.check(username="nobody")
+            execute.assert_not_called()
+        self.assertEqual(result, {"field": "username", "value": "nobody", "available": True, "checked_database": False})
+
+        # Possible hits are settled by the database
+        result = self.check(email=SAMPLE_USER_DATA["email"].upper())
+        self.assertEqual((result["available"], result["checked_database"]), (False, True))
+        self.assertEqual(self.client.get("/user/availability").status_code, 400)
+
+    def test_new_and_changed_values_are_added_before_commit(self):
+        availability.rebuild()
+        other = self.create_user(**SAMPLE_USER_DATA_2)
+        self.assertTrue(availability.might_be_taken("username", SAMPLE_USER_DATA_2["username"]))
+        other.username, other.email = "renamed", "renamed@example.com"
+        db.session.commit()
+        self.assertTrue(availability.might_be_taken("username", "renamed"))
+        self.assertTrue(availability.might_be_taken("email", "renamed@example.com"))
+
+        # The old username is only forgotten by a rebuild
+        self.assertTrue(availability.might_be_taken("username", SAMPLE_USER_DATA_2["username"]))
+        self.assertEqual(availability.rebuild(), 2)
+        self.assertFalse(availability.might_be_taken("username", SAMPLE_USER_DATA_2["username"]))
+
+    def test_registration_rejects_taken_values(self):
+        availability.rebuild()
+        data = dict(SAMPLE_USER_DATA, password2=SAMPLE_USER_DATA["password"], sex="Male")
+        page = self.client.post("/user/register", data=data).get_data(as_text=True)
+        self.assertIn("Username not available", page)
+        self.assertIn("Email already registered", page)
+        self.assertEqual(User.query.count(), 1)
+
+    def test_submits_ask_the_database_when_a_filter_write_was_lost(self):
+        availability.rebuild()
+        data = dict(SAMPLE_USER_DATA_2, password2=SAMPLE_USER_DATA_2["password"], sex="Male")
+        with mock.patch.object(availability, "add", side_effect=RuntimeError("redis down")):
+            self.create_user(**SAMPLE_USER_DATA_2)
+        self.assertFalse(availability.might_be_taken("username", SAMPLE_USER_DATA_2["username"]))
+
+        page = self.client.post("/user/register", data=data).get_data(as_text=True)
+        self.assertIn("Username not available", page)
+        self.assertEqual(User.query.count(), 2)
+
+    def test_registration_raced_to_a_taken_value_gets_a_form_error(self):
+        data = dict(SAMPLE_USER_DATA, password2=SAMPLE_USER_DATA["password"], sex="Male")
+        original = RegistrationForm.validate_username
+        calls = []
+
+        def passes_once(form, field):
+            # The first check runs before the rival registration commits
+            calls.append(field.data)
+            if len(calls) > 1:
+                original(form, field)
+
+        with mock.patch.object(RegistrationForm, "validate_username", passes_once), \
+                mock.patch.object(RegistrationForm, "validate_email", lambda form, field: None):
+            response = self.client.post("/user/register", data=data)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("Username not available", response.get_data(as_text=True))
+        self.assertEqual(User.query.count(), 1)
+
+    def test_values_written_during_a_rebuild_survive_the_swap(self):
+        availability.rebuild()
+        real_rebuild = availability._rebuild
+
+        def rebuild_while_renaming(*args):
+            # Another worker renames a user while the table is scanned
+            availability.add("username", "renamed-mid-rebuild")
+            return real_rebuild(*args)
+
+        with mock.patch.object(availability, "_rebuild", rebuild_while_renaming):
+            availability.rebuild()
+        self.assertTrue(availability.might_be_taken("username", "renamed-mid-rebuild"))
+
+        # The journal is off again once the rebuild is done
+        availability.rebuild()
+        self.assertFalse(availability.might_be_taken("username", "renamed-mid-rebuild"))
+
+    def test_redis_bitmap_matches_the_local_layout(self):
+        bits, hashes = filter_parameters(100, 0.01)
+        self.assertEqual((bits, hashes), (960, 7))
+        bitmap = build_bitmap([filter_item("username", "Alice")], bits, hashes)
+        client = mock.Mock()
+        redis_bitmap = RedisBitmap(client, "key")
+        redis_bitmap.replace(bitmap)
+        client.set.assert_called_once_with("key:building", bytes(bitmap))
+        client.rename.assert_called_once_with("key:building", "key")
+
+        positions = bit_positions(filter_item("username", "alice "), bits, hashes)
+        # SETBIT numbering: bit n is 0x80 >> (n % 8) of byte n // 8
+        self.assertTrue(all(bitmap[n // 8] & (0x80 >> (n % 8)) for n in positions))
+        client.pipeline.return_value.execute.return_value = [1] + [1] * hashes
+        self.assertTrue(redis_bitmap.test(positions))
+        client.pipeline.return_value.execute.return_value = [0] + [1] * hashes
+        self.assertIsNone(redis_bitmap.test(positions))
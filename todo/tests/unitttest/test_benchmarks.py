@@ -0,0 +1,25 @@
+import unittest
+
+from benchmarks.runner import compare_results, percentile, summarize
+
+
+class BenchmarkStatsTestCase(unittest.TestCase):
+    def test_percentile_nearest_rank(self):
+        values = [float(i) for i in range(1, 101)]
+        self.assertEqual(percentile(values, 50), 50.0)
+        self.assertEqual(percentile(values, 95), 95.0)
+        self.assertEqual(percentile(values, 99), 99.0)
+        self.assertEqual(percentile([], 99), 0.0)
+
+    def test_summarize_counts_errors(self):
+        stats = summarize([0.01, 0.02], errors=1, elapsed=1.0)
+        self.assertEqual(stats["requests"], 3)
+        self.assertEqual(stats["errors"], 1)
+        self.assertEqual(stats["rps"], 2.0)
+
+    def test_compare_flags_regressions_past_threshold(self):
+        baseline = {"scenarios": {"login": {"p95_ms": 100.0, "rps": 50.0}}}
+        within = {"scenarios": {"login": {"p95_ms": 105.0, "rps": 48.0}}}
+        slower = {"scenarios": {"login": {"p95_ms": 130.0, "rps": 30.0}}}
+        self.assertEqual(compare_results(within, baseline, 0.1), [])
+        self.assertEqual(len(compare_results(slower, baseline, 0.1)), 2)
@@ -0,0 +1,94 @@
+import json
+
+from app import db
+from app.blueprints.tasks.projections import iter_task_rows
+from app.blueprints.tasks.utils import done_page, task_page
+from app.models import OutboxEvent, Task
+from sqlalchemy import text
+from tests.fixtures.user import SAMPLE_USER_DATA
+
+from tests.test_basics import BasicsTestCase
+
+
+class TaskCompletionTestCase(BasicsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user(**SAMPLE_USER_DATA)
+        self.client = self.app.test_client(user=self.user)
+        self.tasks = [Task(content=f"task {i}", user_id=self.user.id, rank=f"n{i}") for i in range(4)]
+        db.session.add_all(self.tasks)
+        db.session.commit()
+        self.ids = [task.id for task in self.tasks]
+
+    def open_contents(self):
+        return [task["content"] for task in self.client.get("/tasks/api/tasks").get_json()["tasks"]]
+
+    def test_completing_moves_a_task_to_the_done_list_and_back(self):
+        response = self.client.post(f"/tasks/all_tasks/{self.ids[1]}/complete")
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.open_contents(), ["task 0", "task 2", "task 3"])
+        done = self.client.get("/tasks/done").get_data(as_text=True)
+        self.assertIn("task 1", done)
+        self.assertNotIn("task 2", done)
+
+        self.client.post(f"/tasks/all_tasks/{self.ids[1]}/uncomplete")
+        # Reopened tasks keep their rank, so they return to their old place
+        self.assertEqual(self.open_contents(), ["task 0", "task 1", "task 2", "task 3"])
+        events = [(event.event_type, json.loads(event.payload)["id"]) for event in OutboxEvent.query.order_by(OutboxEvent.id)]
+        self.assertEqual(events, [("task.completed", self.ids[1]), ("task.uncompleted", self.ids[1])])
+
+    def test_bulk_actions_skip_foreign_and_unchanged_tasks(self):
+        other = self.create_user(**dict(SAMPLE_USER_DATA, username="other", email="other@example.com"))
+        foreign = Task(content="not mine", user_id=other.id)
+        db.session.add(foreign)
+        db.session.commit()
+
+        response = self.client.post("/tasks/complete", json={"ids": [self.ids[0], self.ids[2], foreign.id]})
+        self.assertEqual(sorted(response.get_json()["ids"]), [self.ids[0], self.ids[2]])
+        response = self.client.post("/tasks/complete", json={"ids": [self.ids[0], self.ids[3]]})
+        self.assertEqual(response.get_json()["ids"], [self.ids[3]])
+        self.assertIsNone(db.session.get(Task, foreign.id).completed_at)
+
+        self.client.post("/tasks/uncomplete", data={"task_ids": [self.ids[0], self.ids[3]]})
+        self.assertEqual(self.open_contents(), ["task 0", "task 1", "task 3"])
+        self.assertEqual(self.client.post("/tasks/complete", json={"ids": "all"}).status_code, 400)
+
+    def test_done_tasks_page_newest_first(self):
+        self.app.config["TASKS_PER_PAGE"] = 2
+        for task_id in self.ids:
+            self.client.post(f"/tasks/all_tasks/{task_id}/complete")
+        first, cursor = done_page(db.session, self.user.id, per_page=2)
+        second, last = done_page(db.session, self.user.id, cursor, per_page=2)
+        self.assertEqual([task.id for task in first + second], self.ids[::-1])
+        self.assertIsNone(last)
+        self.assertIn("Next Page", self.client.get("/tasks/done").get_data(as_text=True))
+        self.assertEqual(self.client.get("/tasks/done?before=junk").status_code, 400)
+        self.assertEqual(task_page(db.session, self.user.id), ([], None))
+
+    def test_export_walks_open_then_done_tasks(self):
+        for task_id in (self.ids[2], self.ids[0]):
+            self.client.post(f"/tasks/all_tasks/{task_id}/complete")
+        contents = [task.content for task in iter_task_rows(db.session, self.user.id, batch_size=1)]
+        self.assertEqual(contents, ["task 1", "task 3", "task 0", "task 2"])
+
+    def test_tag_filters_still_find_done_tasks(self):
+        self.tasks[0].set_tags(["work"])
+        db.session.commit()
+        self.client.post(f"/tasks/all_tasks/{self.ids[0]}/complete")
+        tasks = self.client.get("/tasks/api/tasks?tags=work").get_json()["tasks"]
+        self.assertEqual([task["id"] for task in tasks], [self.ids[0]])
+        self.assertIsNotNone(tasks[0]["completed_at"])
+
+    def test_open_and_done_lists_read_their_partial_indexes(self):
+        if db.engine.dialect.name != "sqlite":
+            self.skipTest("Reads SQLite query plans.")
+        plans = {}
+        for name, sql in {
+            "open": "SELECT id FROM task WHERE user_id = 1 AND completed_at IS NULL ORDER BY rank, id LIMIT 51",
+            "done": "SELECT id FROM task WHERE user_id = 1 AND completed_at IS NOT NULL"
+                    " ORDER BY completed_at DESC, id DESC LIMIT 51",
+        }.items():
+            plans[name] = " ".join(row[-1] for row in db.session.execute(text(f"EXPLAIN QUERY PLAN {sql}")))
+        self.assertIn("ix_task_open_rank", plans["open"])
+        self.assertIn("ix_task_done", plans["done"])
+        self.assertNotIn("TEMP B-TREE", plans["open"] + plans["done"])
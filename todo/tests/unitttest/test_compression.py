@@ -0,0 +1,39 @@
+import brotli
+from app import compress
+from flask import redirect
+
+from tests.test_basics import BasicsTestCase
+
+_PAGE = "<html><body>" + "<p>Task Manager</p>" * 500 + "</body></html>"
+
+
+class AdaptiveCompressTestCase(BasicsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.app.add_url_rule("/_page", "_page", lambda: _PAGE)
+        self.app.add_url_rule("/_small", "_small", lambda: "<p>tiny</p>")
+        self.app.add_url_rule("/_redirect", "_redirect", lambda: redirect("/_page"))
+        compress.response_cache.clear()
+        compress.stats.reset()
+
+    def test_large_html_is_compressed_and_cached(self):
+        first = self.client.get("/_page", headers={"Accept-Encoding": "br, gzip"})
+        second = self.client.get("/_page", headers={"Accept-Encoding": "br, gzip"})
+        self.assertEqual(first.headers["Content-Encoding"], "br")
+        self.assertEqual(brotli.decompress(second.get_data()).decode(), _PAGE)
+
+        stats = compress.stats.snapshot()
+        self.assertEqual(stats["cache_misses"], 1)
+        self.assertEqual(stats["cache_hits"], 1)
+        self.assertGreater(stats["bytes_saved"], 0)
+
+    def test_algorithm_follows_client_support(self):
+        response = self.client.get("/_page", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.headers["Content-Encoding"], "gzip")
+
+    def test_small_bodies_and_redirects_are_not_compressed(self):
+        small = self.client.get("/_small", headers={"Accept-Encoding": "br"})
+        moved = self.client.get("/_redirect", headers={"Accept-Encoding": "br"})
+        self.assertNotIn("Content-Encoding", small.headers)
+        self.assertNotIn("Content-Encoding", moved.headers)
+        self.assertEqual(compress.stats.snapshot()["compressed"], 0)
@@ -0,0 +1,115 @@
+import eventlet
+from app import db
+from app.group_commit import GroupCommitWriter
+from app.blueprints.tasks.utils import last_rank
+from app.models import Task, TaskTag, User
+from app.ranking import rank_between
+from sqlalchemy import event
+from tests.fixtures.user import SAMPLE_USER_DATA
+
+from tests.test_basics import BasicsTestCase
+
+
+class GroupCommitTestCase(BasicsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user(**SAMPLE_USER_DATA)
+        self.commits = []
+        event.listen(db.engine, "commit", self.on_commit)
+
+    def tearDown(self):
+        event.remove(db.engine, "commit", self.on_commit)
+        super().tearDown()
+
+    def on_commit(self, connection):
+        self.commits.append(connection)
+
+    def insert_concurrently(self, writer, contents, **hooks):
+        # Green threads do not inherit the app context, so hand them the session itself
+        session = db.session()
+
+        def insert(content):
+            with self.app.app_context():
+                try:
+                    return writer.insert(session, Task.__table__, {"content": content, "user_id": self.user.id},
+                                         **hooks)
+                except Exception as exc:
+                    return exc
+
+        pool = eventlet.GreenPool(len(contents))
+        return list(pool.imap(insert, contents))
+
+    def test_concurrent_inserts_share_one_commit(self):
+        writer = GroupCommitWriter(window=0.05, max_batch=100)
+        ids = self.insert_concurrently(writer, [f"task {i}" for i in range(20)])
+
+        self.assertEqual(len(set(ids)), 20)
+        self.assertEqual(len(self.commits), 1)
+        for task_id, content in zip(ids, [f"task {i}" for i in range(20)]):
+            self.assertEqual(db.session.get(Task, task_id).content, content)
+
+    def test_full_batches_flush_without_waiting_for_the_window(self):
+        writer = GroupCommitWriter(window=5, max_batch=5)
+        ids = self.insert_concurrently(writer, [f"task {i}" for i in range(10)])
+        self.assertEqual(len(set(ids)), 10)
+        self.assertEqual(len(self.commits), 2)
+
+    def test_a_failing_row_only_fails_its_caller(self):
+        writer = GroupCommitWriter(window=0.05, max_batch=100)
+        results = self.insert_concurrently(writer, ["ok 1", None, "ok 2"])
+
+        self.assertIsInstance(results[0], int)
+        self.assertIsInstance(results[1], Exception)
+        self.assertIsInstance(results[2], int)
+        self.assertEqual(Task.query.filter_by(user_id=self.user.id).count(), 2)
+
+    def test_prepare_sees_the_rows_ahead_in_the_batch(self):
+        writer = GroupCommitWriter(window=0.05, max_batch=100)
+        db.session.add(Task(content="existing", user_id=self.user.id, rank="m"))
+        db.session.commit()
+
+        def place_last(session, earlier, values):
+            ranks = [row["rank"] for row in earlier]
+            values["rank"] = rank_between(ranks[-1] if ranks else last_rank(session, self.user.id), None)
+
+        session = db.session()
+        pool = eventlet.GreenPool(5)
+
+        def insert(content):
+            with self.app.app_context():
+                values = {"content": content, "user_id": self.user.id}
+                return writer.insert(session, Task.__table__, values,
+                                     prepare=lambda batch_session, earlier: place_last(batch_session, earlier, values))
+
+        ids = list(pool.imap(insert, [f"task {i}" for i in range(5)]))
+        ranks = [db.session.get(Task, task_id).rank for task_id in ids]
+        self.assertEqual(len(set(ranks)), 5)
+        self.assertEqual(sorted(ranks), ranks)
+        self.assertLess("m", ranks[0])
+
+    def test_a_failing_then_hook_leaves_no_row_behind(self):
+        writer = GroupCommitWriter(window=0.05, max_batch=100)
+
+        def add_tag_then_fail(session, task_id):
+            session.execute(TaskTag.__table__.insert(), {"user_id": self.user.id, "tag": "lost", "task_id": task_id})
+            raise RuntimeError("event not recorded")
+
+        results = self.insert_concurrently(writer, ["doomed"], then=add_tag_then_fail)
+        self.assertIsInstance(results[0], RuntimeError)
+        self.assertEqual(Task.query.filter_by(user_id=self.user.id).count(), 0)
+        self.assertEqual(TaskTag.query.count(), 0)
+
+    def test_add_task_view_commits_tags_with_the_task(self):
+        self.app.config["TASK_GROUP_COMMIT"] = True
+        client = self.app.test_client(user=db.session.get(User, self.user.id))
+        client.post("/tasks/add_task", data={"task_name": "tagged", "tags": "work, home"})
+        task = Task.query.filter_by(content="tagged").one()
+        self.assertEqual(task.tag_names, ["home", "work"])
+        self.assertIsNotNone(task.rank)
+
+    def test_add_task_view_uses_group_commit_when_enabled(self):
+        self.app.config["TASK_GROUP_COMMIT"] = True
+        client = self.app.test_client(user=db.session.get(User, self.user.id))
+        response = client.post("/tasks/add_task", data={"task_name": "grouped"})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Task.query.filter_by(content="grouped").count(), 1)
@@ -0,0 +1,129 @@
+import json
+
+import eventlet
+from app import db, idempotency
+from app.idempotency import IdempotencyRecord, SQLIdempotencyStore
+from app.models import IdempotencyKey, Task
+from tests.fixtures.user import SAMPLE_USER_DATA
+
+from tests.test_basics import BasicsTestCase
+
+
+class IdempotencyTestCase(BasicsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user(**SAMPLE_USER_DATA)
+        self.user_id = self.user.id
+        self.store = idempotency.store
+
+    def post(self, key, content="Write the report", client=None):
+        client = client or self.app.test_client(user=self.user)
+        return client.post(
+            "/tasks/api/tasks",
+            data=json.dumps({"task_name": content}),
+            headers={"Content-Type": "application/json", "Idempotency-Key": key},
+        )
+
+    def test_database_store_is_used_without_redis(self):
+        self.assertIsInstance(self.store, SQLIdempotencyStore)
+
+    def test_retry_replays_the_first_response(self):
+        first = self.post("key-1")
+        self.assertEqual(first.status_code, 201)
+        retry = self.post("key-1")
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry.get_json(), first.get_json())
+        self.assertEqual(retry.headers["Location"], first.headers["Location"])
+        self.assertEqual(retry.headers["Idempotent-Replayed"], "true")
+        self.assertEqual(Task.query.count(), 1)
+
+        self.assertEqual(self.post("key-2").status_code, 201)
+        self.assertEqual(Task.query.count(), 2)
+
+    def test_json_posts_need_no_csrf_token(self):
+        self.app.config["WTF_CSRF_ENABLED"] = True
+        self.assertEqual(self.post("key-1").status_code, 201)
+        # Form bodies can be posted cross-site, so they still need the token
+        client = self.app.test_client(user=self.user)
+        self.assertEqual(client.post("/tasks/api/tasks", data={"task_name": "Forged"}).status_code, 400)
+        self.assertEqual(Task.query.count(), 1)
+
+    def test_key_completes_in_the_same_transaction_as_the_task(self):
+        def crash(*args, **kwargs):
+            raise AssertionError("completed after the task was committed")
+
+        self.store.complete = crash
+        for group_commit in (False, True):
+            self.app.config["TASK_GROUP_COMMIT"] = group_commit
+            key = f"key-{group_commit}"
+            first = self.post(key)
+            self.assertEqual(first.status_code, 201)
+            self.assertEqual(self.store.get(self.user_id, key).status_code, 201)
+            retry = self.post(key)
+            self.assertEqual(retry.headers["Idempotent-Replayed"], "true")
+            self.assertEqual(retry.get_json(), first.get_json())
+        self.assertEqual(Task.query.count(), 2)
+
+    def test_reusing_a_key_for_another_request_is_refused(self):
+        self.post("key-1")
+        response = self.post("key-1", content="Something else")
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Task.query.count(), 1)
+
+    def test_retry_waits_for_the_request_in_flight(self):
+        # Make the key look held by a twin request another worker is still running
+        self.post("key-1")
+        db.session.query(IdempotencyKey).update({"owner": "other", "status_code": None, "body": None})
+        db.session.commit()
+        fingerprint = self.store.get(self.user_id, "key-1").fingerprint
+
+        def finish():
+            eventlet.sleep(0.1)
+            stored = IdempotencyRecord("other", fingerprint, 201, {"Content-Type": "application/json"}, b'{"id": 42}')
+            self.store.complete(self.user_id, "key-1", "other", stored, ttl=60)
+
+        finisher = eventlet.spawn(finish)
+        response = self.post("key-1")
+        finisher.wait()
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.get_json(), {"id": 42})
+        self.assertEqual(Task.query.count(), 1)
+
+    def test_request_in_flight_too_long_gets_a_conflict(self):
+        self.app.config["IDEMPOTENCY_WAIT_SECONDS"] = 0.1
+        first = self.post("key-1")
+        db.session.query(IdempotencyKey).update({"owner": "other", "status_code": None})
+        db.session.commit()
+        self.assertEqual(self.post("key-1").status_code, 409)
+        self.assertEqual(first.status_code, 201)
+
+    def test_server_errors_release_the_key(self):
+        def fail(*args, **kwargs):
+            raise RuntimeError("database went away")
+
+        self.app.config["PROPAGATE_EXCEPTIONS"] = False
+        original = self.app.view_functions["tasks.api_create_task"]
+        self.app.view_functions["tasks.api_create_task"] = idempotency.idempotent(fail)
+        self.assertEqual(self.post("key-1").status_code, 500)
+        self.assertIsNone(self.store.get(self.user_id, "key-1"))
+
+        self.app.view_functions["tasks.api_create_task"] = original
+        self.assertEqual(self.post("key-1").status_code, 201)
+        self.assertEqual(Task.query.count(), 1)
+
+    def test_expired_keys_are_taken_over_and_pruned(self):
+        self.store.claim(self.user_id, "stale", "old", "crashed", lock_ttl=-1)
+        record = self.store.claim(self.user_id, "stale", "new", "me", lock_ttl=30)
+        self.assertEqual((record.owner, record.fingerprint), ("me", "new"))
+
+        self.store.claim(self.user_id, "gone", "old", "crashed", lock_ttl=-1)
+        self.assertEqual(self.store.prune(), 1)
+        self.assertEqual(IdempotencyKey.query.count(), 1)
+
+    def test_requests_without_a_key_are_not_deduplicated(self):
+        client = self.app.test_client(user=self.user)
+        for _ in range(2):
+            response = client.post("/tasks/add_task", data={"task_name": "Plain form post"})
+            self.assertEqual(response.status_code, 302)
+        self.assertEqual(Task.query.count(), 2)
+        self.assertEqual(IdempotencyKey.query.count(), 0)
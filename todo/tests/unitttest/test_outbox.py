@@ -0,0 +1,150 @@
+import json
+from collections import namedtuple
+from unittest import mock
+
+from app import db
+from app.models import OutboxCursor, OutboxEvent, Task, User
+from app.outbox import TASK_CREATED, in_user_order, next_seq, record, relay_once, stream_publisher
+from tests.fixtures.user import SAMPLE_USER_DATA
+
+from tests.test_basics import BasicsTestCase
+
+Event = namedtuple("Event", "id user_id user_seq")
+
+
+class OutboxTestCase(BasicsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user(**SAMPLE_USER_DATA)
+        self.client = self.app.test_client(user=self.user)
+
+    def events(self):
+        db.session.expire_all()
+        return [(event.event_type, json.loads(event.payload))
+                for event in OutboxEvent.query.order_by(OutboxEvent.id)]
+
+    def test_task_changes_queue_events_with_them(self):
+        self.client.post("/tasks/add_task", data={"task_name": "Write report", "tags": "work"})
+        task = Task.query.one()
+        self.client.post(f"/tasks/all_tasks/{task.id}/update_task", data={"task_name": "Write summary", "tags": ""})
+        self.client.get(f"/tasks/all_tasks/{task.id}/delete_task")
+
+        self.assertEqual(self.events(), [
+            ("task.created", {"id": task.id, "content": "Write report", "due_at": None, "remind_at": None,
+                              "tags": ["work"]}),
+            ("task.updated", {"id": task.id, "content": "Write summary", "due_at": None, "remind_at": None,
+                              "tags": []}),
+            ("task.deleted", {"id": task.id}),
+        ])
+        self.assertEqual({event.user_id for event in OutboxEvent.query}, {self.user.id})
+
+    def test_group_committed_tasks_queue_their_event_in_the_batch(self):
+        self.app.config["TASK_GROUP_COMMIT"] = True
+        response = self.client.post("/tasks/api/tasks", json={"task_name": "Batched"})
+        self.assertEqual(self.events(), [
+            ("task.created", {"id": response.get_json()["id"], "content": "Batched", "due_at": None,
+                              "remind_at": None, "tags": []}),
+        ])
+
+    def test_account_changes_queue_events(self):
+        token = self.user.generate_email_change_token("new@example.com")
+        self.assertTrue(self.user.change_email(token))
+        self.assertEqual(self.events(), [
+            ("user.email_changed", {"id": self.user.id, "old_email": SAMPLE_USER_DATA["email"],
+                                    "email": "new@example.com"}),
+        ])
+
+    def test_rolled_back_changes_leave_no_event(self):
+        record(db.session, self.user.id, TASK_CREATED, id=1)
+        db.session.rollback()
+        self.assertEqual(self.events(), [])
+
+    def test_relay_publishes_in_order_and_prunes(self):
+        for number in range(3):
+            record(db.session, self.user.id, TASK_CREATED, id=number)
+        db.session.commit()
+
+        def fail(source, rows):
+            raise ConnectionError("redis down")
+
+        with self.assertRaises(ConnectionError):
+            relay_once(db.engine, "main", fail)
+        self.assertEqual(len(self.events()), 3)
+
+        published = []
+        self.assertEqual(relay_once(db.engine, "main", lambda source, rows: published.extend(rows), batch_size=2), 2)
+        self.assertEqual(relay_once(db.engine, "main", lambda source, rows: published.extend(rows)), 1)
+        self.assertEqual([json.loads(row.payload)["id"] for row in published], [0, 1, 2])
+        self.assertEqual(self.events(), [])
+
+    def test_events_are_numbered_per_user(self):
+        for number in range(2):
+            record(db.session, self.user.id, TASK_CREATED, id=number)
+        db.session.commit()
+        self.assertEqual([event.user_seq for event in OutboxEvent.query.order_by(OutboxEvent.id)], [1, 2])
+        cursor = db.session.get(OutboxCursor, self.user.id)
+        self.assertEqual(cursor.published_seq, 0)
+
+        relay_once(db.engine, "main", lambda source, rows: None)
+        db.session.refresh(cursor)
+        self.assertEqual(cursor.published_seq, 2)
+
+    def test_relay_stops_a_users_stream_at_a_gap(self):
+        record(db.session, self.user.id, TASK_CREATED, id=1)
+        # Position 2 is taken by a write that has not committed its event yet
+        second = next_seq(db.session, self.user.id)
+        record(db.session, self.user.id, TASK_CREATED, id=3)
+        db.session.commit()
+
+        published = []
+        relay = lambda source, rows: published.extend(json.loads(row.payload)["id"] for row in rows)
+        self.assertEqual(relay_once(db.engine, "main", relay), 1)
+        self.assertEqual(published, [1])
+
+        record(db.session, self.user.id, TASK_CREATED, user_seq=second, id=2)
+        db.session.commit()
+        self.assertEqual(relay_once(db.engine, "main", relay), 2)
+        self.assertEqual(published, [1, 2, 3])
+
+    def test_streams_continue_from_the_shared_cursor(self):
+        claimed = [Event(1, 10, 1), Event(2, 20, 5), Event(3, 10, 3), Event(4, 10, 2), Event(5, 30, None),
+                   Event(6, 40, 1), Event(7, 20, 3)]
+        # User 20 is past position 3 and waits for 4; another relay holds user 40's cursor;
+        # user 30's event predates numbering
+        ready, advanced = in_user_order(claimed, {10: 0, 20: 3, 40: 0}, held={40})
+        self.assertEqual([row.id for row in ready], [1, 4, 3, 7, 5])
+        self.assertEqual(advanced, {10: 3})
+
+    def test_stream_publisher_pipelines_one_batch(self):
+        record(db.session, self.user.id, TASK_CREATED, id=1)
+        db.session.commit()
+        client = mock.Mock()
+        relay_once(db.engine, "tasks_shard_0", stream_publisher(client, "todo:events", 1000))
+
+        client.pipeline.assert_called_once_with(transaction=False)
+        (stream, fields), options = client.pipeline.return_value.xadd.call_args
+        self.assertEqual(stream, "todo:events")
+        self.assertEqual((fields["source"], fields["user_id"], fields["type"]),
+                         ("tasks_shard_0", self.user.id, "task.created"))
+        self.assertEqual(options, {"maxlen": 1000, "approximate": True})
+        client.pipeline.return_value.execute.assert_called_once_with()
+
+    def test_carried_events_are_published_under_their_origin(self):
+        db.session.add(OutboxEvent(user_id=self.user.id, event_type=TASK_CREATED, payload="{}",
+                                   origin_source="tasks_shard_1", origin_id=42))
+        db.session.commit()
+        client = mock.Mock()
+        relay_once(db.engine, "tasks_shard_0", stream_publisher(client, "todo:events"))
+
+        (_, fields), _ = client.pipeline.return_value.xadd.call_args
+        self.assertEqual((fields["source"], fields["id"]), ("tasks_shard_1", 42))
+
+
+class RegistrationEventTestCase(BasicsTestCase):
+    def test_registration_queues_an_event(self):
+        data = dict(SAMPLE_USER_DATA, password2=SAMPLE_USER_DATA["password"], sex="Male")
+        self.client.post("/user/register", data=data)
+        user = User.query.one()
+        event = OutboxEvent.query.one()
+        self.assertEqual((event.user_id, event.event_type), (user.id, "user.registered"))
+        self.assertEqual(json.loads(event.payload)["username"], SAMPLE_USER_DATA["username"])
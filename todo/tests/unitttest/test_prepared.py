@@ -0,0 +1,64 @@
+from unittest import mock
+
+from app import db
+from app.models.tasks import task_by_id
+from app.models.user import user_by_email, user_by_id
+from app.prepared import PreparedStatements, _prepare_all, _queries
+from sqlalchemy.dialects.postgresql import psycopg2
+from tests.fixtures.user import SAMPLE_USER_DATA
+
+from tests.test_basics import BasicsTestCase
+
+
+class PreparedQueryTestCase(BasicsTestCase):
+    def test_prepare_statement_uses_positional_parameters(self):
+        sql = user_by_email.prepare_statement()
+        self.assertTrue(sql.startswith("PREPARE user_by_email AS SELECT users.id, "))
+        self.assertTrue(sql.endswith("WHERE users.email = lower($1)"))
+        # The date bound lets a partitioned task table prune to recent partitions
+        self.assertTrue(task_by_id.prepare_statement().endswith("WHERE task.id = $1 AND task.date_posted >= $2"))
+
+        execute = str(user_by_email._execute_statement().compile(dialect=psycopg2.dialect()))
+        self.assertEqual(execute, "EXECUTE user_by_email(%(email)s)")
+        execute = str(task_by_id._execute_statement().compile(dialect=psycopg2.dialect()))
+        self.assertEqual(execute, "EXECUTE task_by_id(%(id)s, %(min_date_posted)s)")
+
+    def test_lookups_fall_back_to_the_ordinary_query(self):
+        user = self.create_user(**SAMPLE_USER_DATA)
+        user_id = user.id
+        self.assertIs(user_by_id.get(db.session, user_id), user)
+        db.session.expunge_all()
+        self.assertEqual(user_by_email.first(db.session, email=SAMPLE_USER_DATA["email"]).id, user_id)
+        self.assertIsNone(user_by_id.get(db.session, user_id + 1))
+
+    def test_new_connections_prepare_every_lookup(self):
+        connection, record = mock.Mock(), mock.Mock(info={})
+        _prepare_all(connection, record)
+        executed = [call.args[0] for call in connection.cursor.return_value.execute.call_args_list]
+        self.assertEqual([sql.split()[1] for sql in executed], list(_queries))
+        connection.commit.assert_called_once_with()
+        self.assertEqual(record.info["prepared_statements"], set(_queries))
+
+        # A failed PREPARE leaves the connection running everything unprepared
+        connection.cursor.return_value.execute.side_effect = RuntimeError("relation does not exist")
+        _prepare_all(connection, record)
+        connection.rollback.assert_called_once_with()
+        self.assertEqual(record.info["prepared_statements"], set())
+
+    def test_only_postgres_engines_outside_transaction_pooling_are_prepared(self):
+        self.app.config["PREPARED_STATEMENTS"] = True
+        PreparedStatements(self.app)
+        self.assertEqual(self.app.extensions["prepared_statements"], [])
+
+        postgres = mock.Mock()
+        postgres.dialect.name = "postgresql"
+        with mock.patch("app.prepared.event") as event, \
+                mock.patch.object(type(db), "engines", new_callable=mock.PropertyMock, return_value={None: postgres}):
+            event.contains.return_value = False
+            PreparedStatements(self.app)
+            event.listen.assert_called_once_with(postgres, "connect", _prepare_all)
+
+            event.listen.reset_mock()
+            self.app.config["PGBOUNCER_TRANSACTION_POOLING"] = True
+            PreparedStatements(self.app)
+            event.listen.assert_not_called()
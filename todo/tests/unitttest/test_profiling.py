@@ -0,0 +1,117 @@
+import json
+import os
+import shutil
+import tempfile
+
+from app.models import UserRole
+from app.profiling import (PROFILE_HEADER, SamplingProfiler, StackProfile, TracingProfiler, _Sampler,
+                           _SlowestProfiles, _real_thread, profile_token)
+from flask import g
+from tests.fixtures.user import SAMPLE_USER_DATA, SAMPLE_USER_DATA_2
+
+from tests.test_basics import BasicsTestCase
+
+
+def _burn(seconds):
+    # CPU work the profilers should see by name
+    import time
+
+    end = time.process_time() + seconds
+    total = 0
+    while time.process_time() < end:
+        total += sum(range(200))
+    return total
+
+
+class RequestProfilingTestCase(BasicsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.app.config["PROFILE_DIR"] = self.directory
+        self.admin = self.create_user(**SAMPLE_USER_DATA, role=UserRole.ADMIN)
+        self.user = self.create_user(**SAMPLE_USER_DATA_2)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        super().tearDown()
+
+    def token(self, user):
+        return profile_token(user.id, self.app.config["SECRET_KEY"])
+
+    def test_admin_token_profiles_the_request_and_links_the_file(self):
+        client = self.app.test_client(user=self.admin)
+        response = client.get("/tasks/all_tasks", headers={PROFILE_HEADER: self.token(self.admin)})
+        self.assertEqual(response.status_code, 200)
+        link = response.headers["Link"]
+        self.assertTrue(link.endswith('>; rel="profile"'))
+        url = link[1:link.index(">")]
+
+        profile = client.get(url)
+        self.assertEqual(profile.status_code, 200)
+        lines = profile.get_data(as_text=True).splitlines()
+        self.assertTrue(any("all_tasks (tasks/views.py:" in line for line in lines))
+        # Every line is "frame;frame;... weight"
+        for line in lines:
+            stack, weight = line.rsplit(" ", 1)
+            self.assertTrue(stack and int(weight) >= 0)
+
+        # Other users cannot fetch profiles (the test's shared app context
+        # would otherwise keep the admin cached as the current user)
+        g.pop("_login_user", None)
+        self.assertEqual(self.app.test_client(user=self.user).get(url).status_code, 404)
+
+    def test_query_parameter_and_speedscope_output(self):
+        self.app.config["PROFILE_FORMAT"] = "speedscope"
+        client = self.app.test_client(user=self.admin)
+        response = client.get(f"/tasks/api/tasks?_profile={self.token(self.admin)}")
+        filename = os.path.basename(response.headers["Link"].split(">")[0])
+        with open(os.path.join(self.directory, filename)) as profile:
+            data = json.load(profile)
+        self.assertEqual(data["profiles"][0]["type"], "sampled")
+        self.assertEqual(len(data["profiles"][0]["samples"]), len(data["profiles"][0]["weights"]))
+
+    def test_tokens_only_work_for_their_admin(self):
+        for user, token in ((self.user, self.token(self.user)), (self.admin, self.token(self.user)),
+                            (self.admin, self.token(self.admin) + "x")):
+            response = self.app.test_client(user=user).get("/tasks/all_tasks", headers={PROFILE_HEADER: token})
+            self.assertNotIn("Link", response.headers)
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_sampling_keeps_the_slowest_profiles_per_endpoint(self):
+        self.app.config.update(PROFILE_SAMPLE_RATE=2, PROFILE_KEEP_SLOWEST=1)
+        state = self.app.extensions["profiling"]
+        state["slowest"] = _SlowestProfiles(1)
+        state["sampler"], state["main_thread"] = _Sampler(0.001), _real_thread.get_ident()
+        client = self.app.test_client(user=self.user)
+        for _ in range(6):
+            self.assertNotIn("Link", client.get("/tasks/all_tasks").headers)
+
+        kept = state["slowest"].snapshot()
+        self.assertEqual(list(kept), ["tasks.all_tasks"])
+        self.assertEqual(os.listdir(os.path.join(self.directory, "sampled")), [kept["tasks.all_tasks"][0][1]])
+
+
+class ProfilerTestCase(BasicsTestCase):
+    def test_tracing_profiler_charges_time_to_the_calling_stack(self):
+        profiler = TracingProfiler(StackProfile("burn"))
+        profiler.start()
+        _burn(0.02)
+        profile = profiler.stop()
+        burn = sum(weight for stack, weight in profile.stacks.items() if "_burn" in stack[0])
+        self.assertGreater(burn, 10000)
+
+    def test_sampling_profiler_sees_cpu_work(self):
+        profiler = SamplingProfiler(_Sampler(0.001), StackProfile("burn"))
+        profiler.start()
+        _burn(0.05)
+        profile = profiler.stop()
+        self.assertTrue(any(stack[-1].startswith("_burn") for stack in profile.stacks))
+
+    def test_slowest_profiles_evict_the_fastest(self):
+        slowest = _SlowestProfiles(2)
+        self.assertIsNone(slowest.add("a", 0.3, "three"))
+        self.assertIsNone(slowest.add("a", 0.1, "one"))
+        self.assertFalse(slowest.wants("a", 0.05))
+        self.assertTrue(slowest.wants("a", 0.2))
+        self.assertEqual(slowest.add("a", 0.2, "two"), "one")
+        self.assertEqual(slowest.snapshot()["a"], [(0.3, "three"), (0.2, "two")])
@@ -0,0 +1,53 @@
+import csv
+import io
+
+from app import db
+from app.blueprints.tasks.projections import TaskRow, iter_task_rows
+from app.blueprints.tasks.utils import task_page
+from app.models import Task
+from benchmarks.reads import READ_PATHS
+from tests.fixtures.user import SAMPLE_USER_DATA
+
+from tests.test_basics import BasicsTestCase
+
+
+class TaskProjectionTestCase(BasicsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user(**SAMPLE_USER_DATA)
+        for i in range(5):
+            task = Task(content=f"task {i}", user_id=self.user.id, rank=f"n{i}")
+            task.set_tags(["even"] if i % 2 == 0 else [])
+            db.session.add(task)
+        db.session.commit()
+        self.user_id = self.user.id
+
+    def test_pages_are_untracked_rows(self):
+        db.session.expunge_all()
+        tasks, _ = task_page(db.session, self.user_id)
+        self.assertTrue(all(isinstance(task, TaskRow) for task in tasks))
+        self.assertEqual(len(db.session.identity_map), 0)
+        self.assertEqual(tasks[0].tag_names, ["even"])
+        self.assertFalse(hasattr(tasks[0], "__dict__"))
+
+    def test_iter_task_rows_walks_every_batch(self):
+        contents = [task.content for task in iter_task_rows(db.session, self.user_id, batch_size=2)]
+        self.assertEqual(contents, [f"task {i}" for i in range(5)])
+
+    def test_api_and_export(self):
+        client = self.app.test_client(user=self.user)
+        data = client.get("/tasks/api/tasks?tags=even").get_json()
+        self.assertEqual([task["content"] for task in data["tasks"]], ["task 0", "task 2", "task 4"])
+        self.assertIsNone(data["next"])
+
+        response = client.get("/tasks/export")
+        rows = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+        self.assertEqual(rows[0][:2], ["id", "content"])
+        self.assertEqual([row[1] for row in rows[1:]], [f"task {i}" for i in range(5)])
+
+    def test_read_paths_return_the_same_tasks(self):
+        results = {name: read(db.session, self.user_id) for name, read in READ_PATHS.items()}
+        self.assertEqual(
+            [(task.id, task.tag_names) for task in results["orm"]],
+            [(task.id, task.tag_names) for task in results["projection"]],
+        )
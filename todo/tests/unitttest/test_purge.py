@@ -0,0 +1,79 @@
+from unittest import mock
+
+from app import db
+from app.models import Task, User
+from app.purge import pending_deletions, purge_user, request_deletion
+from tests.fixtures.user import SAMPLE_USER_DATA, SAMPLE_USER_DATA_2
+
+from tests.test_basics import BasicsTestCase
+
+
+class UserPurgeTestCase(BasicsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.app.config["USER_PURGE_IN_BACKGROUND"] = False
+        self.app.config["USER_PURGE_PAUSE"] = 0
+        self.user = self.create_user(**SAMPLE_USER_DATA)
+        self.user_id = self.user.id
+        self.other = self.create_user(**SAMPLE_USER_DATA_2)
+        self.add_tasks(self.user, 10)
+        self.add_tasks(self.other, 2)
+
+    def add_tasks(self, user, count):
+        for i in range(count):
+            task = Task(content=f"task {i}", user_id=user.id)
+            task.set_tags(["work"] if i % 2 else [])
+            db.session.add(task)
+        db.session.commit()
+
+    def task_count(self, user_id):
+        return Task.query.filter_by(user_id=user_id).count()
+
+    def test_deleting_the_account_logs_out_and_marks_the_user(self):
+        client = self.app.test_client(user=self.user)
+        response = client.post("/user/manage/delete-account", data={"password": "Password"})
+        self.assertEqual(response.status_code, 302)
+        self.assertIsNotNone(db.session.get(User, self.user_id).deleting_at)
+        self.assertEqual(pending_deletions(), [self.user_id])
+
+        # The session no longer loads the user, and logging in again fails
+        self.assertEqual(client.get("/tasks/all_tasks").status_code, 302)
+        login = self.app.test_client().post(
+            "/user/login", data={"email": SAMPLE_USER_DATA["email"], "password": "Password"}
+        )
+        self.assertNotIn("_user_id", login.headers.get("Set-Cookie", ""))
+        self.assertEqual(self.task_count(self.user_id), 10)
+
+    def test_wrong_password_keeps_the_account(self):
+        client = self.app.test_client(user=self.user)
+        client.post("/user/manage/delete-account", data={"password": "wrong"})
+        self.assertIsNone(db.session.get(User, self.user_id).deleting_at)
+
+    def test_purge_deletes_in_chunks_and_spares_other_users(self):
+        request_deletion(self.user)
+        with mock.patch("app.purge._throttle") as throttle:
+            self.assertEqual(purge_user(self.user_id, batch_size=3), 10)
+        self.assertEqual(throttle.call_count, 4)
+
+        self.assertIsNone(db.session.get(User, self.user_id))
+        self.assertEqual(self.task_count(self.user_id), 0)
+        self.assertEqual(self.task_count(self.other.id), 2)
+        self.assertEqual(db.session.execute(db.text("SELECT COUNT(*) FROM task_tags")).scalar(), 1)
+        self.assertEqual(pending_deletions(), [])
+
+    def test_interrupted_purge_resumes(self):
+        request_deletion(self.user)
+        with mock.patch("app.purge._throttle", side_effect=KeyboardInterrupt):
+            with self.assertRaises(KeyboardInterrupt):
+                purge_user(self.user_id, batch_size=4)
+        # The first chunk is gone and the user is still waiting to be purged
+        self.assertEqual(self.task_count(self.user_id), 6)
+        self.assertEqual(pending_deletions(), [self.user_id])
+
+        self.assertEqual(purge_user(self.user_id, batch_size=4), 6)
+        self.assertIsNone(db.session.get(User, self.user_id))
+
+    def test_unmarked_users_are_not_purged(self):
+        with self.assertRaises(ValueError):
+            purge_user(self.user_id)
+        self.assertEqual(self.task_count(self.user_id), 10)
@@ -0,0 +1,126 @@
+import random
+from unittest import mock
+
+from app import db
+from app.models import Task
+from app.ranking import DEFAULT_RANK, rank_between, rebalance_long_ranks, rebalance_user, sequential_ranks
+from sqlalchemy import event
+from tests.fixtures.user import SAMPLE_USER_DATA
+
+from tests.test_basics import BasicsTestCase
+
+
+class RankKeysTestCase(BasicsTestCase):
+    def test_random_moves_keep_keys_ordered_and_short(self):
+        rng = random.Random(7)
+        ranks = [DEFAULT_RANK]
+        for _ in range(3000):
+            position = rng.randint(0, len(ranks))
+            before = ranks[position - 1] if position else None
+            after = ranks[position] if position < len(ranks) else None
+            rank = rank_between(before, after)
+            self.assertTrue((before is None or before < rank) and (after is None or rank < after))
+            ranks.insert(position, rank)
+        self.assertEqual(ranks, sorted(ranks))
+        self.assertLess(max(map(len, ranks)), 12)
+
+    def test_appending_and_prepending_grow_logarithmically(self):
+        ranks = [DEFAULT_RANK]
+        for _ in range(2000):
+            ranks.append(rank_between(ranks[-1], None))
+            ranks.insert(0, rank_between(None, ranks[0]))
+        self.assertEqual(ranks, sorted(ranks))
+        self.assertLessEqual(max(map(len, ranks)), 4)
+
+    def test_rejects_unordered_bounds(self):
+        with self.assertRaises(ValueError):
+            rank_between("n1", "n1")
+
+    def test_sequential_ranks(self):
+        ranks = sequential_ranks(2000)
+        self.assertEqual(ranks[0], DEFAULT_RANK)
+        self.assertEqual(ranks, sorted(set(ranks)))
+
+
+class TaskReorderTestCase(BasicsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user(**SAMPLE_USER_DATA)
+        self.client = self.app.test_client(user=self.user)
+
+    def add_tasks(self, count):
+        for i in range(count):
+            self.client.post("/tasks/add_task", data={"task_name": f"task {i}"})
+        return Task.query.order_by(Task.id).all()
+
+    def listed(self):
+        return [task.content for task in Task.query.order_by(Task.rank, Task.id)]
+
+    def move(self, task, **neighbours):
+        data = {key: neighbour.id for key, neighbour in neighbours.items()}
+        return self.client.post(f"/tasks/all_tasks/{task.id}/move", data=data)
+
+    def test_moving_a_task_updates_only_that_row(self):
+        first, second, third, fourth = self.add_tasks(4)
+        updates = []
+
+        def count(conn, cursor, statement, *args):
+            if statement.startswith("UPDATE"):
+                updates.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", count)
+        try:
+            response = self.move(fourth, before_id=first)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", count)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(updates), 1)
+        self.assertEqual(self.listed(), ["task 0", "task 3", "task 1", "task 2"])
+
+        self.move(first, after_id=fourth)
+        self.move(second)
+        self.assertEqual(self.listed(), ["task 1", "task 0", "task 3", "task 2"])
+
+    def test_listing_follows_rank_order_across_pages(self):
+        self.app.config["TASKS_PER_PAGE"] = 2
+        tasks = self.add_tasks(5)
+        self.move(tasks[4])
+        page = self.client.get("/tasks/all_tasks").get_data(as_text=True)
+        self.assertLess(page.index("task 4"), page.index("task 0"))
+        self.assertNotIn("task 1", page)
+
+        cursor = f"{db.session.get(Task, tasks[0].id).rank}.{tasks[0].id}"
+        page = self.client.get(f"/tasks/all_tasks?after={cursor}").get_data(as_text=True)
+        self.assertIn("task 1", page)
+        self.assertIn("task 2", page)
+        self.assertNotIn("task 3", page)
+
+    def test_equal_ranks_are_renumbered_before_a_move(self):
+        rows = [Task(content=f"legacy {i}", user_id=self.user.id) for i in range(3)]
+        db.session.add_all(rows)
+        db.session.commit()
+        self.move(rows[2], before_id=rows[0])
+        self.assertEqual(self.listed(), ["legacy 0", "legacy 2", "legacy 1"])
+
+    def test_rebalance_shortens_keys_and_keeps_order(self):
+        tasks = self.add_tasks(3)
+        # Always dropping right below the top task keeps halving one gap
+        for _ in range(60):
+            last = Task.query.order_by(Task.rank.desc(), Task.id.desc()).first()
+            self.move(last, before_id=tasks[0])
+        order = self.listed()
+        self.assertGreater(max(len(task.rank) for task in Task.query), 8)
+
+        self.assertEqual(rebalance_long_ranks(db.session, 8), [self.user.id])
+        self.assertEqual(self.listed(), order)
+        self.assertEqual(rebalance_user(db.session, self.user.id), 0)
+
+    def test_long_keys_schedule_a_background_rebalance(self):
+        self.app.config["TASK_RANK_MAX_LENGTH"] = 3
+        tasks = self.add_tasks(3)
+        with mock.patch("app.blueprints.tasks.views.rebalance_in_background") as rebalance:
+            for _ in range(10):
+                last = Task.query.order_by(Task.rank.desc(), Task.id.desc()).first()
+                self.move(last, before_id=tasks[0])
+        rebalance.assert_called_with(self.app, None, self.user.id)
@@ -0,0 +1,123 @@
+import os
+import shutil
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from app import db
+from app.models import Task
+from app.scheduler import claim_due_reminders, run_once
+from sqlalchemy import create_engine, insert, select, text
+from tests.fixtures.user import SAMPLE_USER_DATA
+
+from tests.test_basics import BasicsTestCase
+
+
+class SchedulerTestCase(BasicsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user(**SAMPLE_USER_DATA)
+        self.now = datetime(2024, 1, 1, 12, 0)
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        super().tearDown()
+
+    def add_task(self, content, remind_at, **kwargs):
+        task = Task(content=content, user_id=self.user.id, remind_at=remind_at, **kwargs)
+        db.session.add(task)
+        db.session.commit()
+        return task
+
+    def test_run_once_claims_only_due_reminders(self):
+        due = self.add_task("due", self.now - timedelta(minutes=1))
+        self.add_task("later", self.now + timedelta(hours=1))
+        self.add_task("no reminder", None)
+        self.add_task("already sent", self.now - timedelta(hours=1), reminder_sent_at=self.now - timedelta(hours=1))
+        self.add_task("done", self.now - timedelta(minutes=5), completed_at=self.now - timedelta(minutes=10))
+
+        dispatched = []
+        self.assertEqual(run_once(db.engine, dispatched.extend, now=self.now), 1)
+        self.assertEqual([row.id for row in dispatched], [due.id])
+
+        # A claimed reminder is never sent twice
+        self.assertEqual(run_once(db.engine, dispatched.extend, now=self.now), 0)
+        db.session.expire_all()
+        self.assertEqual(db.session.get(Task, due.id).reminder_sent_at, self.now)
+
+    def test_failed_dispatch_releases_claim(self):
+        task = self.add_task("due", self.now - timedelta(minutes=1))
+
+        def fail(rows):
+            raise RuntimeError("mail server down")
+
+        with self.assertRaises(RuntimeError):
+            run_once(db.engine, fail, now=self.now)
+        db.session.expire_all()
+        self.assertIsNone(db.session.get(Task, task.id).reminder_sent_at)
+        self.assertEqual(run_once(db.engine, lambda rows: None, now=self.now), 1)
+
+    def test_concurrent_claims_skip_locked_reminders(self):
+        if db.engine.dialect.name != "postgresql":
+            self.skipTest("SQLite compiles FOR UPDATE SKIP LOCKED away.")
+        expected = {self.add_task(f"due {i}", self.now - timedelta(minutes=i)).id for i in range(10)}
+
+        # The first scheduler holds its claim open while the second one runs
+        with db.engine.connect() as first_conn, first_conn.begin():
+            first = {row.id for row in claim_due_reminders(first_conn, self.now, batch_size=4)}
+            with db.engine.begin() as second_conn:
+                # Waiting on the first claim's row locks would fail instead of hanging
+                second_conn.execute(text("SET LOCAL lock_timeout = '2s'"))
+                second = {row.id for row in claim_due_reminders(second_conn, self.now, batch_size=100)}
+
+        self.assertEqual(len(first), 4)
+        self.assertEqual(first & second, set())
+        self.assertEqual(first | second, expected)
+        self.assertEqual(run_once(db.engine, lambda rows: None, now=self.now), 0)
+
+    def test_concurrent_schedulers_split_the_work(self):
+        workers, reminders = 4, 200
+        directory = self.directory
+        url = f"sqlite:///{os.path.join(directory, 'scheduler.sqlite')}"
+        engine = create_engine(url)
+        db.metadata.create_all(engine, tables=[Task.__table__])
+        with engine.begin() as conn:
+            conn.execute(
+                insert(Task.__table__),
+                [{"content": f"task {i}", "user_id": 1, "remind_at": self.now} for i in range(reminders)],
+            )
+            expected = set(conn.execute(select(Task.id)).scalars())
+        engine.dispose()
+
+        pids = []
+        for worker in range(workers):
+            pid = os.fork()
+            if pid == 0:
+                # Each process is an independent scheduler replica
+                claimed = []
+                child_engine = create_engine(url, connect_args={"timeout": 30})
+
+                def dispatch(rows):
+                    claimed.extend(row.id for row in rows)
+                    time.sleep(0.01)
+
+                try:
+                    while run_once(child_engine, dispatch, batch_size=10, now=self.now):
+                        pass
+                    with open(os.path.join(directory, f"claimed-{worker}"), "w") as output:
+                        output.write("\n".join(map(str, claimed)))
+                finally:
+                    os._exit(0)
+            pids.append(pid)
+        for pid in pids:
+            os.waitpid(pid, 0)
+
+        claimed = {}
+        for worker in range(workers):
+            with open(os.path.join(directory, f"claimed-{worker}")) as source:
+                claimed[worker] = [int(line) for line in source.read().split()]
+        every_claim = [task_id for ids in claimed.values() for task_id in ids]
+        self.assertEqual(len(every_claim), len(set(every_claim)))
+        self.assertEqual(set(every_claim), expected)
+        self.assertGreater(sum(1 for ids in claimed.values() if ids), 1)
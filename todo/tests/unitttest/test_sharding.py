@@ -0,0 +1,208 @@
+from app import db, task_shards
+from app.models import OutboxEvent, Task, TaskShardMove, TaskTag, User
+from app.sharding import HashRing, ShardMoveInProgress
+from sqlalchemy import func, select
+from tests.fixtures.user import SAMPLE_USER_DATA
+
+from tests.test_basics import BasicsTestCase
+
+
+class HashRingTestCase(BasicsTestCase):
+    def test_ring_is_stable_and_spreads_keys(self):
+        ring = HashRing(["a", "b", "c"])
+        placements = [ring.node_for(user_id) for user_id in range(300)]
+        self.assertEqual(placements, [HashRing(["c", "b", "a"]).node_for(i) for i in range(300)])
+        self.assertEqual(set(placements), {"a", "b", "c"})
+
+    def test_adding_a_node_moves_a_minority_of_keys(self):
+        before = HashRing(["a", "b", "c"])
+        after = HashRing(["a", "b", "c", "d"])
+        moved = sum(before.node_for(i) != after.node_for(i) for i in range(1000))
+        self.assertLess(moved, 450)
+
+
+class TaskShardingTestCase(BasicsTestCase):
+    config_name = "testing-sharded"
+
+    def setUp(self):
+        super().setUp()
+        task_shards.create_all()
+
+    def tearDown(self):
+        super().tearDown()
+        # Flask-SQLAlchemy registers an (empty) metadata per bind key on the shared
+        # `db`; drop them so apps created later without shard binds still work.
+        for bind_key in [key for key in db.metadatas if key is not None]:
+            del db.metadatas[bind_key]
+
+    def create_sharded_user(self, **overrides):
+        user = self.create_user(**{**SAMPLE_USER_DATA, **overrides})
+        user.task_shard = task_shards.home_shard(user.id)
+        db.session.commit()
+        return user
+
+    def count_tasks(self, shard, user_id):
+        with task_shards.engine(shard).connect() as conn:
+            return conn.execute(
+                select(func.count()).select_from(Task.__table__).where(Task.__table__.c.user_id == user_id)
+            ).scalar()
+
+    def add_tasks(self, user, count):
+        session = task_shards.session_for(user)
+        session.add_all([Task(content=f"task {i}", user_id=user.id) for i in range(count)])
+        session.commit()
+
+    def test_tasks_are_written_to_the_users_shard(self):
+        user = self.create_sharded_user()
+        client = self.app.test_client(user=user)
+        client.post("/tasks/add_task", data={"task_name": "sharded"})
+
+        self.assertIsNotNone(user.task_shard)
+        self.assertEqual(self.count_tasks(user.task_shard, user.id), 1)
+        self.assertEqual(self.count_tasks(None, user.id), 0)
+
+    def test_listing_reads_only_from_the_users_shard(self):
+        user = self.create_sharded_user()
+        self.add_tasks(user, 3)
+        page = self.app.test_client(user=user).get("/tasks/all_tasks").get_data(as_text=True)
+        self.assertEqual(page.count("/update_task"), 3)
+
+    def test_move_user_relocates_tasks(self):
+        user = self.create_sharded_user()
+        self.add_tasks(user, 7)
+        source = user.task_shard
+        target = next(shard for shard in task_shards.ring.nodes if shard != source)
+
+        self.assertEqual(task_shards.move_user(user, target, batch_size=3), 7)
+        self.assertEqual(user.task_shard, target)
+        self.assertEqual(self.count_tasks(target, user.id), 7)
+        self.assertEqual(self.count_tasks(source, user.id), 0)
+        self.assertIsNone(db.session.get(TaskShardMove, user.id))
+
+    def test_rebalance_moves_legacy_users_off_the_main_database(self):
+        user = self.create_user(**SAMPLE_USER_DATA)
+        db.session.add_all([Task(content=f"legacy {i}", user_id=user.id) for i in range(4)])
+        db.session.commit()
+
+        self.assertEqual(task_shards.rebalance(batch_size=2), [user.id])
+        self.assertEqual(user.task_shard, task_shards.home_shard(user.id))
+        self.assertEqual(self.count_tasks(user.task_shard, user.id), 4)
+        self.assertEqual(self.count_tasks(None, user.id), 0)
+
+    def test_writes_are_refused_until_a_move_finishes(self):
+        user = self.create_sharded_user()
+        move = TaskShardMove(user_id=user.id, source=user.task_shard, target=None)
+        db.session.add(move)
+        db.session.commit()
+        with self.assertRaises(ShardMoveInProgress):
+            task_shards.writable_session_for(user)
+        move.phase = TaskShardMove.CLEANUP
+        db.session.commit()
+        with self.assertRaises(ShardMoveInProgress):
+            task_shards.writable_session_for(user)
+
+    def test_writes_are_refused_when_the_placement_changed_after_loading(self):
+        user = self.create_sharded_user()
+        stale = User(id=user.id, task_shard=None)
+        with self.assertRaises(ShardMoveInProgress):
+            task_shards.writable_session_for(stale)
+        self.assertIs(task_shards.writable_session_for(user), task_shards.session_for(user))
+
+    def test_each_shard_hands_out_ids_from_its_own_block(self):
+        block = self.app.config["TASK_SHARD_ID_BLOCK"]
+        for index, shard in enumerate(task_shards.ring.nodes):
+            user = self.create_sharded_user(username=f"user{index}", email=f"user{index}@example.com")
+            self.add_tasks(User(id=user.id, task_shard=shard), 1)
+            task_id = task_shards.session(shard).query(Task.id).filter_by(user_id=user.id).scalar()
+            self.assertEqual(task_id, task_shards.id_block_start(shard) + 1)
+            self.assertLess(task_id, task_shards.id_block_start(shard) + block)
+
+    def test_rebalance_resumes_an_interrupted_move(self):
+        user = self.create_user(**SAMPLE_USER_DATA)
+        home = task_shards.home_shard(user.id)
+        source = next(shard for shard in task_shards.ring.nodes if shard != home)
+        user.task_shard = source
+        db.session.commit()
+        self.add_tasks(user, 5)
+
+        # A crash after the placement flipped but before the source was cleaned
+        task_shards.move_user(user, home)
+        self.add_tasks(User(id=user.id, task_shard=source), 2)
+        db.session.add(TaskShardMove(user_id=user.id, source=source, target=home, phase=TaskShardMove.CLEANUP))
+        db.session.commit()
+
+        self.assertEqual(task_shards.rebalance(), [user.id])
+        self.assertEqual(self.count_tasks(source, user.id), 0)
+        self.assertEqual(self.count_tasks(home, user.id), 5)
+
+    def test_moved_tasks_keep_their_ids_and_tags(self):
+        user = self.create_sharded_user()
+        session = task_shards.session_for(user)
+        task = Task(content="tagged", user_id=user.id)
+        task.set_tags(["work", "home"])
+        session.add(task)
+        session.commit()
+        target = next(shard for shard in task_shards.ring.nodes if shard != user.task_shard)
+
+        task_shards.move_user(user, target)
+        moved = task_shards.session(target).query(Task).filter_by(user_id=user.id).one()
+        self.assertEqual((moved.id, moved.tag_names), (task.id, ["home", "work"]))
+        with task_shards.engine(user.task_shard).connect() as conn:
+            self.assertEqual(conn.execute(select(func.count()).select_from(TaskTag.__table__)).scalar(), 2)
+
+    def test_move_user_carries_unrelayed_events_under_their_origin(self):
+        user = self.create_sharded_user()
+        source = user.task_shard
+        self.app.test_client(user=user).post("/tasks/add_task", data={"task_name": "queued"})
+        target = next(shard for shard in task_shards.ring.nodes if shard != source)
+        events = OutboxEvent.__table__
+        with task_shards.engine(source).connect() as conn:
+            event_id = conn.execute(select(events.c.id)).scalar_one()
+
+        task_shards.move_user(user, target)
+        with task_shards.engine(source).connect() as conn:
+            self.assertEqual(conn.execute(select(events.c.event_type)).scalars().all(), [])
+        with task_shards.engine(target).connect() as conn:
+            self.assertEqual(conn.execute(select(events.c.event_type, events.c.origin_source, events.c.origin_id)).all(),
+                             [("task.created", source, event_id)])
+
+    def test_resumed_cleanup_does_not_carry_events_twice(self):
+        user = self.create_sharded_user()
+        source = user.task_shard
+        self.app.test_client(user=user).post("/tasks/add_task", data={"task_name": "queued"})
+        target = next(shard for shard in task_shards.ring.nodes if shard != source)
+        events = OutboxEvent.__table__
+        with task_shards.engine(source).connect() as conn:
+            event = conn.execute(select(events)).one()
+        # A crash after the events reached the target but before the source let go of them
+        with task_shards.engine(target).begin() as conn:
+            conn.execute(events.insert().values(
+                user_id=user.id, event_type=event.event_type, payload=event.payload, created_at=event.created_at,
+                origin_source=source, origin_id=event.id,
+            ))
+
+        task_shards.move_user(user, target)
+        with task_shards.engine(target).connect() as conn:
+            self.assertEqual(conn.execute(select(func.count()).select_from(events)).scalar(), 1)
+        with task_shards.engine(source).connect() as conn:
+            self.assertEqual(conn.execute(select(func.count()).select_from(events)).scalar(), 0)
+
+    def test_purge_clears_both_ends_of_an_unfinished_move(self):
+        from app.purge import purge_user, request_deletion
+
+        user = self.create_sharded_user()
+        self.add_tasks(user, 4)
+        source = user.task_shard
+        target = next(shard for shard in task_shards.ring.nodes if shard != source)
+        # Copied halfway when the user deleted their account
+        self.add_tasks(User(id=user.id, task_shard=target), 2)
+        db.session.add(TaskShardMove(user_id=user.id, source=source, target=target))
+        db.session.commit()
+
+        user_id = user.id
+        request_deletion(user)
+        self.assertEqual(purge_user(user_id, batch_size=3, pause=0), 6)
+        self.assertEqual(self.count_tasks(source, user_id), 0)
+        self.assertEqual(self.count_tasks(target, user_id), 0)
+        self.assertIsNone(db.session.get(TaskShardMove, user_id))
+        self.assertIsNone(db.session.get(User, user_id))
@@ -0,0 +1,67 @@
+import gzip
+import re
+
+from app.models import User
+from flask import g, template_rendered
+from tests.fixtures.user import SAMPLE_USER_DATA
+
+from tests.test_basics import BasicsTestCase
+
+_CSRF = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+
+
+class PageShellTestCase(BasicsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.app.config["WTF_CSRF_ENABLED"] = True
+        self.rendered = []
+        template_rendered.connect(self.record, self.app)
+
+    def tearDown(self):
+        template_rendered.disconnect(self.record, self.app)
+        super().tearDown()
+
+    def record(self, sender, template, context, **extra):
+        self.rendered.append(template.name)
+
+    def test_anonymous_pages_are_rendered_once(self):
+        first = self.client.get("/user/login", headers={"Accept-Encoding": "gzip"})
+        second = self.client.get("/user/login")
+        self.assertEqual(self.rendered, ["login.html"])
+        self.assertEqual(first.headers["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", first.headers["Vary"])
+        self.assertEqual(gzip.decompress(first.data), second.data)
+
+        # The spliced token is this visitor's, so the form still posts
+        token = _CSRF.search(second.get_data(as_text=True)).group(1)
+        data = {"email": SAMPLE_USER_DATA["email"], "password": "wrong", "csrf_token": token}
+        self.assertIn("Invalid email or password.", self.client.post("/user/login", data=data).get_data(as_text=True))
+        self.assertEqual(self.client.post("/user/login", data=dict(data, csrf_token="forged")).status_code, 400)
+
+    def test_flashed_messages_are_spliced_in(self):
+        with self.client.session_transaction() as session:
+            session["_flashes"] = [("info", "You have been logged out.")]
+        page = gzip.decompress(self.client.get("/user/register", headers={"Accept-Encoding": "gzip"}).data).decode()
+        self.assertIn('<div class="alert alert-info', page)
+        self.assertIn("You have been logged out.", page)
+        self.assertNotIn("logged out", self.client.get("/user/register").get_data(as_text=True))
+        self.assertEqual(self.rendered, ["register.html", "flashes.html"])
+
+    def test_changed_templates_render_a_new_shell(self):
+        self.client.get("/user/reset-password")
+        self.client.get("/user/reset-password")
+        self.app.jinja_env.cache.clear()
+        self.client.get("/user/reset-password")
+        self.assertEqual(self.rendered, ["reset_password_request.html"] * 2)
+
+    def test_signed_in_users_and_posts_skip_the_shell(self):
+        user: User = self.create_user(**SAMPLE_USER_DATA)
+        g.pop("_login_user", None)
+        response = self.app.test_client(user=user).get("/user/login")
+        self.assertEqual(response.status_code, 302)
+        g.pop("_login_user", None)
+
+        self.app.config["WTF_CSRF_ENABLED"] = False
+        self.client.post("/user/reset-password", data={"email": "nobody"})
+        self.assertEqual(self.rendered, ["reset_password_request.html"])
+        self.assertNotIn("page-shell", self.client.get("/user/reset-password").get_data(as_text=True))
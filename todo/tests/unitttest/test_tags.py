@@ -0,0 +1,78 @@
+from app import db
+from app.blueprints.tasks.utils import MATCH_ALL, MATCH_ANY, parse_tags, tagged_task_ids, task_page
+from app.models import Task, TaskTag
+from sqlalchemy import text
+from tests.fixtures.user import SAMPLE_USER_DATA, SAMPLE_USER_DATA_2
+
+from tests.test_basics import BasicsTestCase
+
+
+class TaskTagsTestCase(BasicsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.create_user(**SAMPLE_USER_DATA)
+
+    def add_task(self, content, tags, user=None):
+        user = user or self.user
+        task = Task(content=content, user_id=user.id)
+        task.set_tags(tags)
+        db.session.add(task)
+        db.session.commit()
+        return task
+
+    def page_ids(self, tags, match=MATCH_ALL, after=0, per_page=50):
+        tasks, next_after = task_page(db.session, self.user.id, tags, match, after, per_page)
+        return [task.content for task in tasks], next_after
+
+    def test_parse_tags_normalises_and_dedupes(self):
+        self.assertEqual(parse_tags(" Work, home ,work,, "), ["work", "home"])
+        self.assertEqual(parse_tags(None), [])
+
+    def test_all_and_any_filters(self):
+        self.add_task("both", ["work", "urgent"])
+        self.add_task("work", ["work"])
+        self.add_task("urgent", ["urgent"])
+        self.add_task("none", [])
+        self.add_task("other user", ["work", "urgent"], user=self.create_user(**SAMPLE_USER_DATA_2))
+
+        self.assertEqual(self.page_ids(["work", "urgent"], MATCH_ALL), (["both"], None))
+        self.assertEqual(self.page_ids(["work", "urgent"], MATCH_ANY), (["both", "work", "urgent"], None))
+        self.assertEqual(self.page_ids([]), (["both", "work", "urgent", "none"], None))
+
+    def test_keyset_pagination_walks_every_match_once(self):
+        for i in range(7):
+            self.add_task(f"task {i}", ["work"] if i % 2 else ["home"])
+
+        for match in (MATCH_ALL, MATCH_ANY):
+            seen, after = [], 0
+            tags = ["work"] if match == MATCH_ALL else ["work", "home"]
+            while after is not None:
+                contents, after = self.page_ids(tags, match, after, per_page=2)
+                seen.extend(contents)
+            expected = [f"task {i}" for i in range(7) if match == MATCH_ANY or i % 2]
+            self.assertEqual(seen, expected)
+
+    def test_tag_filters_use_the_covering_key(self):
+        statement = tagged_task_ids(self.user.id, ["work", "urgent"], MATCH_ALL, 0, 50)
+        compiled = statement.compile(db.engine, compile_kwargs={"literal_binds": True})
+        plan = " ".join(row[-1] for row in db.session.execute(text(f"EXPLAIN QUERY PLAN {compiled}")))
+        self.assertIn("COVERING INDEX", plan)
+        self.assertNotIn("SCAN", plan.replace("SCAN CONSTANT ROW", ""))
+
+    def test_views_create_filter_and_replace_tags(self):
+        client = self.app.test_client(user=self.user)
+        client.post("/tasks/add_task", data={"task_name": "tagged", "tags": "Work, urgent"})
+        task = Task.query.filter_by(content="tagged").one()
+        self.assertEqual(task.tag_names, ["urgent", "work"])
+
+        page = client.get("/tasks/all_tasks?tags=work,urgent&match=all").get_data(as_text=True)
+        self.assertIn("tagged", page)
+        page = client.get("/tasks/all_tasks?tags=home").get_data(as_text=True)
+        self.assertIn("No Tasks Match These Tags", page)
+
+        client.post(f"/tasks/all_tasks/{task.id}/update_task", data={"task_name": "tagged", "tags": "home"})
+        db.session.expire_all()
+        self.assertEqual(db.session.get(Task, task.id).tag_names, ["home"])
+
+        client.get(f"/tasks/all_tasks/{task.id}/delete_task")
+        self.assertEqual(TaskTag.query.count(), 0)
@@ -0,0 +1,58 @@
+from app import db
+from app.models import User, UserRole
+from app.templating import precompile_templates
+from flask import render_template_string
+from tests.fixtures.user import SAMPLE_USER_DATA
+
+from tests.test_basics import BasicsTestCase
+
+
+class FragmentCacheTestCase(BasicsTestCase):
+    def render(self, counter):
+        source = "{% cache 'k', 60 %}{{ counter.bump() }}{% endcache %}"
+        with self.app.test_request_context():
+            return render_template_string(source, counter=counter)
+
+    def test_fragment_is_rendered_once(self):
+        class Counter:
+            calls = 0
+
+            def bump(self):
+                self.calls += 1
+                return self.calls
+
+        counter = Counter()
+        self.assertEqual(self.render(counter), "1")
+        self.assertEqual(self.render(counter), "1")
+        self.assertEqual(counter.calls, 1)
+
+    def test_authenticated_nav_is_cached_per_user(self):
+        user = User(**SAMPLE_USER_DATA)
+        db.session.add(user)
+        db.session.commit()
+        other = User(**{**SAMPLE_USER_DATA, "username": "jane doe", "email": "jane@test.com"})
+        db.session.add(other)
+        db.session.commit()
+
+        for account in (user, other):
+            client = self.app.test_client(user=account)
+            # A fresh app context so flask_login does not reuse the previous `g` user
+            with self.app.app_context():
+                page = client.get("/tasks/all_tasks").get_data(as_text=True)
+            self.assertIn(f"Welcome {account.username}!", page)
+
+    def test_cached_nav_follows_role_changes(self):
+        user = User(**SAMPLE_USER_DATA)
+        db.session.add(user)
+        db.session.commit()
+
+        pages = []
+        for role in (UserRole.USER, UserRole.ADMIN, UserRole.USER):
+            user.role = role
+            db.session.commit()
+            with self.app.app_context():
+                pages.append(self.app.test_client(user=user).get("/tasks/all_tasks").get_data(as_text=True))
+        self.assertEqual(["User Directory" in page for page in pages], [False, True, False])
+
+    def test_precompile_fills_bytecode_cache(self):
+        self.assertGreater(precompile_templates(self.app), 0)
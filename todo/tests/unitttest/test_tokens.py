@@ -0,0 +1,113 @@
+import time
+from datetime import datetime, timedelta
+
+import jwt
+from app import db, tokens
+from app.models import RevokedToken, User
+from app.tokens import SQLRevocationStore, TokenKeyring, key_id, parse_keys
+from tests.fixtures.user import SAMPLE_USER_DATA
+
+from tests.test_basics import BasicsTestCase
+
+
+class TokenKeyringTestCase(BasicsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.keyring = TokenKeyring([("new", "new-secret"), ("old", "old-secret")], legacy_secret="legacy-secret")
+        self.exp = int(time.time()) + 60
+
+    def test_parse_keys(self):
+        self.assertEqual(parse_keys(" a:one, b:two:three ,"), [("a", "one"), ("b", "two:three")])
+        self.assertEqual(parse_keys(""), [])
+        with self.assertRaises(ValueError):
+            parse_keys("no-secret")
+        self.assertEqual(key_id("secret"), key_id("secret"))
+        self.assertNotEqual(key_id("secret"), key_id("other"))
+
+    def test_newest_key_signs_and_every_key_verifies(self):
+        token = self.keyring.encode({"reset": 1, "exp": self.exp})
+        self.assertEqual(jwt.get_unverified_header(token)["kid"], "new")
+        self.assertEqual(self.keyring.decode(token)["reset"], 1)
+        old = jwt.encode({"reset": 2, "exp": self.exp}, "old-secret", headers={"kid": "old"})
+        self.assertEqual(self.keyring.decode(old)["reset"], 2)
+        legacy = jwt.encode({"reset": 3, "exp": self.exp}, "legacy-secret")
+        self.assertEqual(self.keyring.decode(legacy)["reset"], 3)
+
+    def test_tokens_without_a_jti_are_identified_by_their_signature(self):
+        legacy = jwt.encode({"reset": 3, "exp": self.exp}, "legacy-secret")
+        jti = self.keyring.decode(legacy)["jti"]
+        self.assertEqual(len(jti), 64)
+        # The last character of a 43 character signature carries 2 unused bits
+        alphabet = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_"
+        last = alphabet.index(legacy[-1]) & ~3
+        respelled = [legacy[:-1] + alphabet[last + bits] for bits in range(4)]
+        self.assertIn(legacy, respelled)
+        self.assertEqual({self.keyring.decode(token)["jti"] for token in respelled}, {jti})
+
+    def test_bad_tokens_are_refused(self):
+        token = self.keyring.encode({"reset": 1, "exp": self.exp})
+        header, payload, signature = token.split(".")
+        forged = jwt.encode({"reset": 1, "exp": self.exp}, "guess", headers={"kid": "new"})
+        retired = jwt.encode({"reset": 1, "exp": self.exp}, "gone", headers={"kid": "gone"})
+        unsigned = jwt.encode({"reset": 1, "exp": self.exp}, None, algorithm="none")
+        other_payload = self.keyring.encode({"reset": 2, "exp": self.exp}).split(".")[1]
+        for bad in (forged, retired, unsigned, f"{header}.{other_payload}.{signature}", "not.a.token", "", None):
+            self.assertIsNone(self.keyring.decode(bad), bad)
+        self.assertIsNone(self.keyring.decode(token, now=self.exp))
+        self.assertIsNone(self.keyring.decode(self.keyring.encode({"reset": 1})))
+
+
+class SingleUseTokenTestCase(BasicsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User(**SAMPLE_USER_DATA)
+        db.session.add(self.user)
+        db.session.commit()
+
+    def test_database_store_is_used_without_redis(self):
+        self.assertIsInstance(tokens.store, SQLRevocationStore)
+
+    def test_reset_token_works_once(self):
+        token = self.user.generate_password_reset_token()
+        self.assertTrue(self.user.reset_password(token, "first-password"))
+        self.assertFalse(self.user.reset_password(token, "second-password"))
+        self.assertTrue(self.user.verify_password("first-password"))
+        self.assertEqual(RevokedToken.query.count(), 1)
+
+    def test_tokens_used_in_another_process_are_refused(self):
+        token = self.user.generate_password_reset_token()
+        self.assertTrue(tokens.revoke(tokens.decode(token)))
+        # Another worker has not seen the token, but claiming it fails
+        self.app.extensions["token_revocations"].clear()
+        self.assertFalse(self.user.reset_password(token, "new-password"))
+
+    def test_confirm_account_marks_the_user_confirmed(self):
+        token = self.user.generate_confirmation_token()
+        self.assertTrue(self.user.confirm_account(token))
+        self.assertTrue(db.session.get(User, self.user.id).confirmed)
+        self.assertFalse(self.user.confirm_account(token))
+
+    def test_refused_email_change_leaves_the_token_usable(self):
+        other = User(**dict(SAMPLE_USER_DATA, username="other", email="taken@example.com"))
+        db.session.add(other)
+        db.session.commit()
+        taken = self.user.generate_email_change_token("taken@example.com")
+        self.assertFalse(self.user.change_email(taken))
+        self.assertEqual(RevokedToken.query.count(), 0)
+        token = self.user.generate_email_change_token("fresh@example.com")
+        self.assertTrue(self.user.change_email(token))
+        self.assertFalse(self.user.change_email(token))
+
+    def test_expiration_caps_the_token_age(self):
+        token = self.user.generate_password_reset_token()
+        self.assertFalse(self.user.reset_password(token, "new-password", expiration=-1))
+        self.assertTrue(self.user.reset_password(token, "new-password"))
+
+    def test_prune_removes_ids_of_expired_tokens(self):
+        db.session.add_all([
+            RevokedToken(jti="expired", expires_at=datetime.now() - timedelta(minutes=1)),
+            RevokedToken(jti="live", expires_at=datetime.now() + timedelta(minutes=1)),
+        ])
+        db.session.commit()
+        self.assertEqual(tokens.store.prune(), 1)
+        self.assertEqual([row.jti for row in RevokedToken.query], ["live"])
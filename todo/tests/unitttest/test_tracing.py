@@ -0,0 +1,131 @@
+import json
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from app.tracing import (TRACE_HEADER, JsonLinesExporter, Span, Trace, _instrument, otlp_payload, span,
+                         traced)
+from flask import g
+from tests.fixtures.user import SAMPLE_USER_DATA
+
+from tests.test_basics import BasicsTestCase
+
+
+class RequestTracingTestCase(BasicsTestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "traces.jsonl")
+        self.app.extensions["tracing"] = JsonLinesExporter(self.path)
+        self.app.config["TRACING_SAMPLE_RATE"] = 1.0
+        _instrument()
+        self.user = self.create_user(**SAMPLE_USER_DATA)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        super().tearDown()
+
+    def spans(self):
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path) as lines:
+            return [json.loads(line) for line in lines]
+
+    def test_confirmation_request_records_nested_spans(self):
+        client = self.app.test_client(user=self.user)
+        response = client.get("/user/confirm-account")
+        self.assertEqual(response.status_code, 302)
+        spans = {span["span_id"]: span for span in self.spans()}
+        root = next(span for span in spans.values() if span["parent_id"] is None)
+        self.assertEqual(root["trace_id"], response.headers[TRACE_HEADER])
+        self.assertEqual(root["name"], "GET /user/confirm-account")
+        self.assertEqual(root["attributes"]["http.status_code"], 302)
+        self.assertEqual({span["trace_id"] for span in spans.values()}, {root["trace_id"]})
+
+        names = [span["name"] for span in spans.values()]
+        self.assertIn("user.generate_token", names)
+        self.assertIn("email.dispatch", names)
+        # The email body is rendered inside the request span
+        render = next(span for span in spans.values() if span["name"] == "render")
+        self.assertEqual(render["attributes"]["template"], "confirm.html")
+        self.assertEqual(render["parent_id"], root["span_id"])
+        for child in spans.values():
+            self.assertTrue(child["parent_id"] is None or child["parent_id"] in spans)
+            self.assertGreaterEqual(child["duration_ms"], 0)
+
+        client.get("/tasks/all_tasks")
+        sql = [span for span in self.spans() if span["name"] == "sql"]
+        self.assertTrue(any("FROM task" in span["attributes"]["db.statement"] for span in sql))
+        self.assertEqual(sql[0]["attributes"]["db.system"], "sqlite")
+
+    def test_unsampled_requests_still_get_a_trace_id(self):
+        self.app.config["TRACING_SAMPLE_RATE"] = 0.0
+        response = self.client.get("/user/login")
+        self.assertEqual(len(response.headers[TRACE_HEADER]), 32)
+        self.assertEqual(self.spans(), [])
+        self.assertNotIn("_trace_root", g)
+
+    def test_traceparent_continues_the_callers_trace(self):
+        self.app.config["TRACING_SAMPLE_RATE"] = 0.0
+        self.app.config["TRACING_TRUSTED_UPSTREAMS"] = "10.0.0.0/8, 127.0.0.1"
+        trace_id, parent_id = "4bf92f3577b34da6a3ce929d0e0e4736", "00f067aa0ba902b7"
+        response = self.client.get("/user/login", headers={"traceparent": f"00-{trace_id}-{parent_id}-01"})
+        self.assertEqual(response.headers[TRACE_HEADER], trace_id)
+        root = next(span for span in self.spans() if span["parent_id"] == parent_id)
+        self.assertEqual(root["trace_id"], trace_id)
+
+        # An unsampled caller, or a malformed header, is not traced
+        self.client.get("/user/login", headers={"traceparent": f"00-{trace_id}-{parent_id}-00"})
+        response = self.client.get("/user/login", headers={"traceparent": "00-zz-00f067aa0ba902b7-01"})
+        self.assertNotEqual(response.headers[TRACE_HEADER], trace_id)
+        self.assertEqual(len({span["span_id"] for span in self.spans() if span["parent_id"] == parent_id}), 1)
+
+    def test_untrusted_callers_cannot_force_sampling(self):
+        self.app.config["TRACING_SAMPLE_RATE"] = 0.0
+        self.app.config["TRACING_TRUSTED_UPSTREAMS"] = "10.0.0.0/8"
+        trace_id, parent_id = "4bf92f3577b34da6a3ce929d0e0e4736", "00f067aa0ba902b7"
+        response = self.client.get("/user/login", headers={"traceparent": f"00-{trace_id}-{parent_id}-01"})
+        # The trace id is still carried for correlation
+        self.assertEqual(response.headers[TRACE_HEADER], trace_id)
+        self.assertEqual(self.spans(), [])
+
+        self.client.get("/user/login", headers={"traceparent": f"00-{trace_id}-{parent_id}-01"},
+                        environ_base={"REMOTE_ADDR": "10.1.2.3"})
+        self.assertEqual({span["parent_id"] for span in self.spans() if span["trace_id"] == trace_id} & {parent_id},
+                         {parent_id})
+
+
+class SpanTestCase(BasicsTestCase):
+    def test_spans_are_no_ops_outside_a_trace(self):
+        with span("idle") as current:
+            self.assertIsNone(current)
+        self.assertEqual(traced("idle")(lambda: 3)(), 3)
+
+    def test_errors_are_recorded_and_reraised(self):
+        trace = Trace("a" * 32)
+        root = Span(trace, "root", None, {})
+        with mock.patch("app.tracing._current") as current:
+            current.get.return_value = root
+            with self.assertRaises(KeyError):
+                with span("lookup", key="x"):
+                    raise KeyError("x")
+        self.assertEqual(trace.spans[0].name, "lookup")
+        self.assertEqual(trace.spans[0].parent_id, root.span_id)
+        self.assertIn("KeyError", trace.spans[0].error)
+
+    def test_otlp_payload_shape(self):
+        trace = Trace("a" * 32)
+        root = Span(trace, "GET /", None, {"http.status_code": 200, "ok": True})
+        child = Span(trace, "sql", root.span_id, {"db.statement": "SELECT 1"})
+        child.error = "boom"
+        for each in (child, root):
+            each.end()
+        spans = otlp_payload([child, root], "todo")["resourceSpans"][0]["scopeSpans"][0]["spans"]
+        self.assertEqual([each["kind"] for each in spans], [1, 2])
+        self.assertEqual(spans[0]["parentSpanId"], root.span_id)
+        self.assertEqual(spans[0]["status"], {"code": 2, "message": "boom"})
+        self.assertEqual(spans[1]["attributes"], [
+            {"key": "http.status_code", "value": {"intValue": "200"}},
+            {"key": "ok", "value": {"boolValue": True}},
+        ])
@@ -0,0 +1,51 @@
+from unittest import mock
+
+import config
+from app import availability, create_app, db
+from app.models import OutboxEvent, Task, TaskTag, User
+from app.warmup import run_warmup, warm_up
+
+from tests.test_basics import BasicsTestCase
+
+
+class WarmupTestCase(BasicsTestCase):
+    def test_warmup_replays_requests_and_cleans_up(self):
+        self.app.config["WTF_CSRF_ENABLED"] = True
+        report = run_warmup(self.app, rounds=3, max_seconds=30)
+
+        self.assertEqual(report.rounds, 3)
+        self.assertEqual(report.requests, 3 * len(self.app.config["WARMUP_REQUESTS"]))
+        self.assertEqual(report.errors, 0)
+        self.assertIn("p99_ms", report.after)
+        self.assertIs(self.app.extensions["warmup"], report)
+        self.assertTrue(self.app.config["WTF_CSRF_ENABLED"])
+        self.assertEqual(User.query.count(), 0)
+        self.assertEqual(Task.query.count(), 0)
+        self.assertEqual(TaskTag.query.count(), 0)
+
+    def test_scratch_user_stays_out_of_the_filter_and_outbox(self):
+        availability.rebuild()
+        with mock.patch("app.warmup.secrets.token_hex", return_value="scratch"):
+            report = run_warmup(self.app, rounds=1, max_seconds=30)
+        self.assertEqual(report.errors, 0)
+        self.assertFalse(availability.might_be_taken("username", "warmup-scratch"))
+        # Nothing was queued, so nothing can have been relayed before the clean-up
+        self.assertEqual(OutboxEvent.query.count(), 0)
+
+    def test_only_the_serving_entry_points_warm_up(self):
+        with mock.patch.object(config.TestingConfig, "WARMUP_ENABLED", True), \
+                mock.patch("app.warmup.run_warmup") as run:
+            app = create_app("testing")
+            run.assert_not_called()
+            warm_up(app)
+            run.assert_called_once_with(app)
+
+    def test_failed_warmup_does_not_stop_the_app(self):
+        self.app.config["WARMUP_ENABLED"] = True
+        self.app.config["WARMUP_REQUESTS"] = [{"method": "GET", "path": "/tasks/all_tasks"}]
+        self.app.config["WARMUP_ROUNDS"] = 1
+        # Without tables the scratch user cannot be created
+        db.drop_all()
+        with self.assertLogs("app.warmup", level="ERROR"):
+            self.assertIsNone(warm_up(self.app))
+        self.assertNotIn("warmup", self.app.extensions)